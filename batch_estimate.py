@@ -0,0 +1,240 @@
+from typing import Any, Callable, Dict, List, Mapping, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from beam_rate import estimate_plan_seconds, estimate_sweep_plan_seconds, get_beam_schedule
+from cost_model import CostModel
+from scan_plan import OPTIMISED, RASTER, ScanPlanBatch, chunk_points, round_trip_batch
+from script_utilities import ScanBatch, count_steps_batch, get_steps_batch, global_param
+
+# The order the parameters of the loop definitions are passed to get_scan_plan (and
+# get_sweep_plan) in
+_scan_parameters = (
+    "start_temperature",
+    "stop_temperature",
+    "step_temperature",
+    "start_field",
+    "stop_field",
+    "step_field",
+    "mevents",
+)
+
+
+class TableEstimate(NamedTuple):
+    """
+    The seconds each row of a script is estimated to take. Rows that cannot be estimated (e.g.
+    their parameters cannot be cast, as estimate_time would report) are NaN.
+    """
+
+    rows: np.ndarray
+
+    @property
+    def total(self) -> float:
+        """
+        Returns:
+          float: The seconds the rows that can be estimated take in total.
+        """
+        return float(np.nansum(self.rows))
+
+
+def cast_column(
+    rows: Sequence[Mapping[str, Any]], name: str, caster: Callable[[Any], Any]
+) -> Tuple[List[Any], np.ndarray]:
+    """
+    Cast one parameter of every row of a script, casting each distinct raw value only once (most
+    rows of a script repeat the values of the rows around them).
+
+    Parameters:
+      rows (Sequence[Mapping[str, Any]]): the raw parameters of each row
+      name (str): the parameter to cast
+      caster (function): casts a raw value, raising ValueError if it cannot
+
+    Returns:
+      Tuple[List[Any], np.ndarray]: The cast value of each row (None where it cannot be cast) and
+        whether each row could be cast.
+    """
+    casts: Dict[Any, Tuple[Any, bool]] = {}
+    values = []
+    cast = np.ones(len(rows), dtype=bool)
+    for index, row in enumerate(rows):
+        raw = row.get(name)
+        if raw not in casts:
+            try:
+                casts[raw] = (caster(raw), raw is not None)
+            except (ValueError, TypeError, AttributeError):
+                casts[raw] = (None, False)
+        value, cast[index] = casts[raw]
+        values.append(value)
+    return values, cast
+
+
+def _floats(values: List[Any]) -> np.ndarray:
+    return np.array([np.nan if value is None else value for value in values], dtype=float)
+
+
+def axis_batch(
+    starts: np.ndarray, stops: np.ndarray, steps: np.ndarray, valid: np.ndarray
+) -> ScanBatch:
+    """
+    The equivalent of the get_scan_axis of the loop definitions for many rows at once.
+
+    Parameters:
+      starts (np.ndarray): the value to start each scan with or set once, NaN if kept
+      stops (np.ndarray): the value to end each scan with, NaN if kept
+      steps (np.ndarray): the size of the steps of each scan, must not be zero where scanning
+      valid (np.ndarray): which rows can be estimated, the others get an axis of [NaN]
+
+    Returns:
+      ScanBatch: The values of the axis of each row, [NaN] where it is kept.
+    """
+    kept = np.isnan(starts) | np.isnan(stops) | ~valid
+    scanning = ~kept & (starts != stops)
+    scans = get_steps_batch(starts[scanning], steps[scanning], stops[scanning])
+    counts = np.ones(len(starts), dtype=np.intp)
+    counts[scanning] = scans.counts
+    offsets = np.zeros(len(starts) + 1, dtype=np.intp)
+    np.cumsum(counts, out=offsets[1:])
+    values = np.where(kept, np.nan, starts)[np.repeat(np.arange(len(starts)), counts)]
+    scan_points = np.repeat(offsets[:-1][scanning] - scans.offsets[:-1], scans.counts)
+    values[scan_points + np.arange(len(scans.values))] = scans.values
+    return ScanBatch(values, offsets)
+
+
+def count_axis_points(
+    starts: np.ndarray, stops: np.ndarray, steps: np.ndarray, valid: np.ndarray
+) -> np.ndarray:
+    """
+    Count the values axis_batch gives each row without generating them.
+
+    Parameters:
+      See axis_batch.
+
+    Returns:
+      np.ndarray: The number of values of the axis of each row.
+    """
+    kept = np.isnan(starts) | np.isnan(stops) | ~valid
+    scanning = ~kept & (starts != stops)
+    counts = np.ones(len(starts), dtype=np.intp)
+    counts[scanning] = count_steps_batch(starts[scanning], steps[scanning], stops[scanning])
+    return counts
+
+
+def _round_trip_counts(counts: np.ndarray, cycles: int, rows: np.ndarray) -> np.ndarray:
+    """
+    Returns:
+      np.ndarray: The number of values round_trip_batch gives each axis of counts values.
+    """
+    return np.where(rows & (counts >= 2), 1 + 2 * cycles * (counts - 1), counts)
+
+
+def estimate_scan_seconds(script_definition: Any, cost_model: CostModel, *parameters: Any) -> float:
+    """
+    Estimate one row of a temperature and field loop definition (emuloop or emulooptime) from its
+    cast parameters, in closed form from the sweeps of its scans unless its points are reordered
+    by optimise_plan, so that the row is only compiled when it has to be.
+
+    Parameters:
+      script_definition (ScriptDefinition): the definition, for its global parameters,
+        get_sweep_plan and get_scan_plan
+      cost_model (CostModel): the model to estimate with
+      parameters (Any): the cast parameters of the row, in the order of _scan_parameters
+
+    Returns:
+      float: The seconds the row is estimated to take.
+    """
+    sweep_plan = script_definition.get_sweep_plan(*parameters)
+    if sweep_plan is None:
+        return estimate_plan_seconds(cost_model, script_definition.get_scan_plan(*parameters))
+    return estimate_sweep_plan_seconds(cost_model, sweep_plan)
+
+
+def estimate_scan_table(
+    script_definition: Any,
+    rows: Sequence[Mapping[str, Any]],
+    casters: Mapping[str, Callable[[Any], Any]],
+    cost_model: CostModel,
+) -> TableEstimate:
+    """
+    Estimate every row of a script for a temperature and field loop definition (emuloop or
+    emulooptime) in one pass, giving the same estimates as its estimate_time does for each row.
+    Each column is cast once and the scans of every row are generated and costed together, except
+    with OPTIMISED ordering and for rows of more than chunk_points points, which are estimated on
+    their own (see estimate_scan_seconds).
+
+    Parameters:
+      script_definition (ScriptDefinition): the definition, for its global parameters,
+        get_sweep_plan and get_scan_plan
+      rows (Sequence[Mapping[str, Any]]): the raw parameters of each row
+      casters (Mapping[str, function]): the caster of each parameter, as given to
+        cast_parameters_to
+      cost_model (CostModel): the model to estimate with
+
+    Returns:
+      TableEstimate: The seconds each row is estimated to take.
+    """
+    valid = np.ones(len(rows), dtype=bool)
+    columns = {}
+    for name, caster in casters.items():
+        values, cast = cast_column(rows, name, caster)
+        columns[name] = values
+        valid &= cast
+    (
+        start_temperatures,
+        stop_temperatures,
+        step_temperatures,
+        start_fields,
+        stop_fields,
+        step_fields,
+        mevents,
+    ) = (_floats(columns[name]) for name in _scan_parameters)
+    scanning_temperature = (
+        ~np.isnan(start_temperatures)
+        & ~np.isnan(stop_temperatures)
+        & (start_temperatures != stop_temperatures)
+    )
+    scanning_field = (
+        ~np.isnan(start_fields) & ~np.isnan(stop_fields) & (start_fields != stop_fields)
+    )
+    # estimate_time raises for these rather than giving an estimate
+    valid &= ~(scanning_temperature & (step_temperatures == 0))
+    valid &= ~(scanning_field & (step_fields == 0))
+    estimates = np.full(len(rows), np.nan)
+    cycles = global_param(script_definition, "Round trip cycles")
+    ordering = RASTER if cycles > 0 else global_param(script_definition, "Field ordering")
+    if ordering == OPTIMISED:
+        for index in np.flatnonzero(valid):
+            estimates[index] = estimate_scan_seconds(
+                script_definition, cost_model, *(columns[name][index] for name in _scan_parameters)
+            )
+        return TableEstimate(estimates)
+    temperature_points = count_axis_points(
+        start_temperatures, stop_temperatures, step_temperatures, valid
+    )
+    field_points = count_axis_points(start_fields, stop_fields, step_fields, valid)
+    if cycles > 0:
+        field_points = _round_trip_counts(field_points, cycles, scanning_field)
+        temperature_points = _round_trip_counts(
+            temperature_points, cycles, scanning_temperature & ~scanning_field
+        )
+    # Generating the points of a huge row would take more memory than costing it in closed form
+    huge = valid & (temperature_points * field_points > chunk_points)
+    for index in np.flatnonzero(huge):
+        estimates[index] = estimate_scan_seconds(
+            script_definition, cost_model, *(columns[name][index] for name in _scan_parameters)
+        )
+    valid &= ~huge
+    temperatures = axis_batch(start_temperatures, stop_temperatures, step_temperatures, valid)
+    fields = axis_batch(start_fields, stop_fields, step_fields, valid)
+    if cycles > 0:
+        fields = round_trip_batch(fields, cycles, scanning_field)
+        temperatures = round_trip_batch(
+            temperatures, cycles, scanning_temperature & ~scanning_field
+        )
+    plans = ScanPlanBatch.from_axes(temperatures, fields, np.where(valid, mevents, 0.0), ordering)
+    if get_beam_schedule() is not None:
+        # Counts take as long as the beam current at the time they count allows, one plan at a time
+        for index in np.flatnonzero(valid):
+            estimates[index] = estimate_plan_seconds(cost_model, plans.plan(index))
+        return TableEstimate(estimates)
+    estimates[valid] = cost_model.estimate_batch(plans)[valid]
+    return TableEstimate(estimates)
@@ -0,0 +1,324 @@
+import csv
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, Optional, Set, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from cost_model import CostModel
+from scan_plan import ScanAction, ScanPlan, SweepPlan
+
+# Set this environment variable to the path of a beam schedule file (see BeamSchedule.from_file)
+# to estimate counts from the beam current over time rather than at a constant event rate.
+BEAM_SCHEDULE_VARIABLE = "EMU_BEAM_SCHEDULE"
+
+logger = logging.getLogger(__name__)
+
+# The beam current (uA) the event rates of the cost models are counted at
+nominal_current = 160.0
+
+# Estimates made from a beam schedule start from now, so are remade this often (s)
+estimate_refresh_interval = 600
+
+
+class BeamSchedule:
+    """
+    The beam current over time, e.g. the current delivered so far in an ISIS cycle followed by the
+    current scheduled for the rest of it with zero for beam off periods and machine development
+    days. The current of each time holds until the next time. Before the first time and after the
+    last the current is default_current.
+
+    The cumulative charge delivered at each time is precomputed, so how long it takes to count any
+    number of events from any time is found with a binary search.
+    """
+
+    def __init__(
+        self,
+        times: npt.ArrayLike,
+        currents: npt.ArrayLike,
+        default_current: float = nominal_current,
+    ) -> None:
+        """
+        Parameters:
+          times (npt.ArrayLike): the times the current changes at (seconds since the epoch)
+          currents (npt.ArrayLike): the current from each time to the next (uA)
+          default_current (float): the current outside of the schedule (uA), must be more than 0
+
+        Raises:
+          ValueError: If there are no times, or times and currents have different lengths, or a
+            current is negative or default_current is not positive.
+        """
+        times, currents = np.asarray(times, dtype=float), np.asarray(currents, dtype=float)
+        if not len(times) or times.shape != currents.shape:
+            raise ValueError("A beam schedule needs a current for each of one or more times")
+        if np.any(currents < 0) or default_current <= 0:
+            raise ValueError("Beam currents cannot be negative and the default must be positive")
+        order = np.argsort(times, kind="stable")
+        self.times = times[order]
+        # The current of each segment from times[i] to times[i + 1], the last segment never ends
+        self.currents = currents[order]
+        self.currents[-1] = default_current
+        self.default_current = default_current
+        # The charge delivered from the first time to each time (uA s)
+        self.charges = np.concatenate(([0.0], np.cumsum(np.diff(self.times) * self.currents[:-1])))
+
+    @classmethod
+    def from_file(cls, path: str, default_current: float = nominal_current) -> "BeamSchedule":
+        """
+        Load a schedule from a CSV file of time,current rows. A time is either seconds since the
+        epoch or an ISO 8601 date and time, a current is in uA. Rows that are not a time and a
+        current (e.g. a header) are skipped.
+
+        Parameters:
+          path (str): the path of the file
+          default_current (float): the current outside of the schedule (uA)
+
+        Returns:
+          BeamSchedule: The schedule.
+
+        Raises:
+          ValueError: If the file has no times and currents.
+        """
+        times, currents = [], []
+        with open(path, newline="") as schedule_file:
+            for row in csv.reader(schedule_file):
+                if len(row) < 2:
+                    continue
+                try:
+                    times.append(_parse_time(row[0]))
+                    currents.append(float(row[1]))
+                except ValueError:
+                    del times[len(currents) :]
+        return cls(times, currents, default_current)
+
+    def charge_at(self, times: npt.ArrayLike) -> np.ndarray:
+        """
+        Parameters:
+          times (npt.ArrayLike): times (seconds since the epoch)
+
+        Returns:
+          np.ndarray: The charge delivered from the first time of the schedule to each time (uA s,
+            negative before it).
+        """
+        times = np.asarray(times, dtype=float)
+        segments = np.maximum(np.searchsorted(self.times, times, side="right") - 1, 0)
+        currents = np.where(times < self.times[0], self.default_current, self.currents[segments])
+        return self.charges[segments] + (times - self.times[segments]) * currents
+
+    def time_at_charge(self, charges: npt.ArrayLike) -> np.ndarray:
+        """
+        The inverse of charge_at.
+
+        Parameters:
+          charges (npt.ArrayLike): charges delivered from the first time of the schedule (uA s)
+
+        Returns:
+          np.ndarray: The first time each charge has been delivered by (seconds since the epoch).
+        """
+        charges = np.asarray(charges, dtype=float)
+        # The segment a charge is reached in ends at the first time with at least that charge
+        ends = np.searchsorted(self.charges, charges, side="left")
+        segments = np.maximum(ends - 1, 0)
+        # A charge is reached before the schedule starts or in the last segment at the default
+        # current, otherwise in a segment with a current (the charge rises across it)
+        currents = np.where(
+            (ends == 0) | (ends == len(self.times)), self.default_current, self.currents[segments]
+        )
+        starts = np.where(ends == 0, 0, segments)
+        return self.times[starts] + (charges - self.charges[starts]) / currents
+
+    def count_end(
+        self, start: npt.ArrayLike, mevents: npt.ArrayLike, event_rate: float
+    ) -> np.ndarray:
+        """
+        Parameters:
+          start (npt.ArrayLike): the times counts start at (seconds since the epoch)
+          mevents (npt.ArrayLike): the millions of events of each count
+          event_rate (float): the rate events are counted at at the nominal current (Mev/s)
+
+        Returns:
+          np.ndarray: The times the counts end at (seconds since the epoch).
+        """
+        mevents_per_charge = event_rate / nominal_current
+        return self.time_at_charge(self.charge_at(start) + np.divide(mevents, mevents_per_charge))
+
+
+def _parse_time(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value.strip()).timestamp()
+
+
+# The schedule loaded from each path and modification time, None if it could not be loaded
+_schedules: Dict[Tuple[str, float], Optional[BeamSchedule]] = {}
+
+# The paths and problems already warned about, so that each is only warned about once
+_warned: Set[Tuple[str, str]] = set()
+
+
+def _warn_once(path: str, error: Exception) -> None:
+    """
+    Warn that the beam schedule cannot be used, once for each path and problem.
+    """
+    if (path, str(error)) not in _warned:
+        _warned.add((path, str(error)))
+        logger.warning(
+            "Cannot use the beam schedule %s, counting at a constant event rate: %s", path, error
+        )
+
+
+def _schedule_modified(path: str) -> Optional[float]:
+    """
+    Returns:
+      float: The modification time of the beam schedule, or None if it cannot be read.
+    """
+    try:
+        return os.path.getmtime(path)
+    except OSError as error:
+        _warn_once(path, error)
+        return None
+
+
+def get_beam_schedule() -> Optional[BeamSchedule]:
+    """
+    Returns:
+      BeamSchedule: The schedule in the file named by the EMU_BEAM_SCHEDULE environment variable,
+        loaded again if the file has changed, or None if it is not set or the file cannot be read
+        or parsed (which is warned about once), to count at a constant event rate.
+    """
+    path = os.environ.get(BEAM_SCHEDULE_VARIABLE)
+    if not path:
+        return None
+    modified = _schedule_modified(path)
+    if modified is None:
+        return None
+    key = (path, modified)
+    if key not in _schedules:
+        _schedules.clear()
+        try:
+            _schedules[key] = BeamSchedule.from_file(path)
+        except (OSError, ValueError, csv.Error) as error:
+            _warn_once(path, error)
+            _schedules[key] = None
+    return _schedules[key]
+
+
+def beam_schedule_version() -> Optional[Tuple[str, float, int]]:
+    """
+    Returns:
+      Tuple[str, float, int]: The path and modification time of the beam schedule and the current
+        estimate_refresh_interval, which change whenever estimates made from it would, or None if
+        there is no beam schedule or it cannot be read.
+    """
+    path = os.environ.get(BEAM_SCHEDULE_VARIABLE)
+    if not path:
+        return None
+    modified = _schedule_modified(path)
+    if modified is None:
+        return None
+    return path, modified, int(time.time() // estimate_refresh_interval)
+
+
+def estimate_with_beam(
+    cost_model: CostModel,
+    plan: ScanPlan,
+    schedule: BeamSchedule,
+    start: float,
+    magnet_switches: int = 0,
+) -> float:
+    """
+    Estimate the seconds a plan takes if it starts at a given time, counting each run at the
+    event rate of the cost model scaled by the beam current while it counts.
+
+    Parameters:
+      cost_model (CostModel): the model of the time taken by everything but counting
+      plan (ScanPlan): the plan to estimate
+      schedule (BeamSchedule): the beam current over time
+      start (float): the time the plan starts (seconds since the epoch)
+      magnet_switches (int): the number of times a different magnet device is selected
+
+    Returns:
+      float: The seconds the plan is estimated to take.
+    """
+    now = start + magnet_switches * cost_model.magnet_switch
+    return _end_with_beam(cost_model, plan, schedule, now) - start
+
+
+def _end_with_beam(
+    cost_model: CostModel, plan: ScanPlan, schedule: BeamSchedule, now: float, first: int = 0
+) -> float:
+    """
+    Returns:
+      float: The time the points of a plan from first on end at if they begin at now, counting
+        with the beam current of the schedule.
+    """
+    times = cost_model.point_times(plan)[first:]
+    not_counting = times["ramp"] + times["settle"] + times["overhead"]
+    counting = ((plan.actions & ScanAction.COUNT) != 0)[first:]
+    for seconds, counts, mevents in zip(not_counting, counting, plan.mevents[first:]):
+        now += seconds
+        if counts:
+            now = float(schedule.count_end(now, mevents, cost_model.event_rate))
+    return now
+
+
+def estimate_plan_seconds(
+    cost_model: CostModel,
+    plan: ScanPlan,
+    magnet_switches: int = 0,
+    count_seconds: Optional[float] = None,
+) -> float:
+    """
+    Estimate the seconds a plan takes, from the beam schedule if there is one (starting now) and
+    its runs count events, otherwise with cost_model.estimate.
+
+    Parameters:
+      cost_model (CostModel): the model to estimate with
+      plan (ScanPlan): the plan to estimate
+      magnet_switches (int): the number of times a different magnet device is selected
+      count_seconds (float): the seconds each count takes if counting for a time rather than for
+        the mevents of the plan
+
+    Returns:
+      float: The seconds the plan is estimated to take.
+    """
+    schedule = get_beam_schedule()
+    if schedule is None or count_seconds is not None:
+        return cost_model.estimate(plan, magnet_switches, count_seconds).total
+    return estimate_with_beam(cost_model, plan, schedule, time.time(), magnet_switches)
+
+
+def estimate_sweep_plan_seconds(
+    cost_model: CostModel,
+    plan: SweepPlan,
+    magnet_switches: int = 0,
+    count_seconds: Optional[float] = None,
+) -> float:
+    """
+    Estimate the seconds a sweep plan takes as estimate_plan_seconds does for the plan it compiles
+    to: in closed form with cost_model.estimate_sweep_plan, or if there is a beam schedule (starting
+    now) and its runs count events, compiling the plan a chunk at a time.
+
+    Parameters:
+      cost_model (CostModel): the model to estimate with
+      plan (SweepPlan): the plan to estimate
+      magnet_switches (int): the number of times a different magnet device is selected
+      count_seconds (float): the seconds each count takes if counting for a time rather than for
+        the mevents of the plan
+
+    Returns:
+      float: The seconds the plan is estimated to take.
+    """
+    schedule = get_beam_schedule()
+    if schedule is None or count_seconds is not None:
+        return cost_model.estimate_sweep_plan(plan, magnet_switches, count_seconds).total
+    start = time.time()
+    now = start + magnet_switches * cost_model.magnet_switch
+    for index, chunk in enumerate(plan.chunks()):
+        # Each chunk after the first begins with the last point of the chunk before it
+        now = _end_with_beam(cost_model, chunk, schedule, now, first=1 if index else 0)
+    return now - start
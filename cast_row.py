@@ -0,0 +1,217 @@
+from functools import partial, wraps
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Mapping, NoReturn, Optional, Tuple
+
+from script_utilities import LRUCache
+
+# What cast_parameters_to gives when a row is missing parameters
+missing_parameters_reason = (
+    "Keyword argument casters contains keys that are not present in keyword arguments"
+)
+
+# Up to 10000 distinct rows of any script definition, cast
+cast_cache = LRUCache(max_weight=10000)
+
+
+def cast_value(caster: Callable[[Any], Any], value: Any) -> Tuple[Any, Optional[str]]:
+    """
+    Cast a parameter as cast_parameters_to does.
+
+    Returns:
+      Tuple[Any, Optional[str]]: The cast value, and the reason it could not be cast or None.
+    """
+    try:
+        return caster(value), None
+    except ValueError as error:
+        if str(error) != "":
+            return None, f"{error}\n"
+        return None, f"Cannot convert {value} from string to {caster.__name__}\n"
+
+
+class CastRow:
+    """
+    The parameters of a row cast once, to be passed to each method of a script definition taking
+    the row (run, estimate_time, parameters_valid, ...) instead of the raw parameters. Rows with the
+    same raw parameters cast by the same casters are equal and hash the same, so a CastRow can be
+    part of the key of memoise_row. Make them with cast_row, which casts each distinct row once.
+
+    The cast values are kept by name rather than as typed attributes, as each definition has its
+    own parameters and they are only read by passing them as keyword arguments to the methods of
+    the definition, whose signatures give their types.
+    """
+
+    # Thousands may be cached, so a row holds as few objects as it can for the garbage collector to
+    # track: its dictionaries of strings and numbers are not tracked at all
+    __slots__ = ("casters", "reason", "_row", "_parameters", "_cast_errors", "_hash")
+
+    casters: Mapping[str, Callable[[Any], Any]]  # the caster of each parameter
+    reason: Optional[str]  # as cast_parameters_to gives if the row cannot be cast, else None
+
+    def __init__(self, casters: Mapping[str, Callable[[Any], Any]], row: Mapping[str, Any]) -> None:
+        """
+        Parameters:
+          casters (Mapping[str, Callable[[Any], Any]]): the caster of each parameter of the row
+          row (Mapping[str, Any]): the raw parameters of the row
+
+        Raises:
+          KeyError: If the row has a parameter without a caster, as cast_parameters_to does.
+        """
+        parameters: Dict[str, Any] = {}
+        cast_errors: Dict[str, str] = {}
+        reason = None
+        if not casters.keys() <= row.keys():
+            reason = missing_parameters_reason
+        else:
+            for name, value in row.items():
+                cast, error = cast_value(casters[name], value)
+                if error is None:
+                    parameters[name] = cast
+                else:
+                    cast_errors[name] = error
+            if cast_errors:
+                reason = "".join(cast_errors.values())
+        try:
+            row_hash: Optional[int] = hash((*row, *row.values()))
+        except TypeError:
+            # e.g. a parameter that is not a string, which cannot be a key
+            row_hash = None
+        for name, value in (
+            ("casters", casters),
+            ("reason", reason),
+            ("_row", dict(row)),
+            ("_parameters", parameters),
+            ("_cast_errors", cast_errors),
+            ("_hash", row_hash),
+        ):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name: str, value: Any) -> NoReturn:
+        raise AttributeError(f"CastRow is immutable, cannot set {name}")
+
+    def __delattr__(self, name: str) -> NoReturn:
+        raise AttributeError(f"CastRow is immutable, cannot delete {name}")
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, CastRow):
+            return NotImplemented
+        return (
+            self._hash == other._hash
+            and list(self._row.items()) == list(other._row.items())
+            and self.cast_by(other.casters)
+        )
+
+    def __hash__(self) -> int:
+        if self._hash is None:
+            raise TypeError(f"unhashable parameters in {self!r}")
+        return self._hash
+
+    def __repr__(self) -> str:
+        return f"CastRow({self._row!r})"
+
+    @property
+    def raw(self) -> Mapping[str, Any]:
+        """
+        Returns:
+          Mapping[str, Any]: The raw parameters, in the order of the row, read only.
+        """
+        return MappingProxyType(self._row)
+
+    @property
+    def parameters(self) -> Mapping[str, Any]:
+        """
+        Returns:
+          Mapping[str, Any]: The parameters that could be cast, read only.
+        """
+        return MappingProxyType(self._parameters)
+
+    @property
+    def cast_errors(self) -> Mapping[str, str]:
+        """
+        Returns:
+          Mapping[str, str]: Why each parameter that could not be cast could not be, read only.
+        """
+        return MappingProxyType(self._cast_errors)
+
+    @property
+    def valid(self) -> bool:
+        """
+        Returns:
+          bool: Whether every parameter of the row could be cast.
+        """
+        return self.reason is None
+
+    def cast_by(self, casters: Mapping[str, Callable[[Any], Any]]) -> bool:
+        """
+        Returns:
+          bool: Whether the row was cast by casters (the same casters for the same parameters).
+        """
+        return self.casters is casters or self.casters == casters
+
+
+def cast_row(casters: Mapping[str, Callable[[Any], Any]], row: Mapping[str, Any]) -> CastRow:
+    """
+    Cast the parameters of a row, casting each distinct row once however many times and by however
+    many methods it is cast.
+
+    Parameters:
+      casters (Mapping[str, Callable[[Any], Any]]): the caster of each parameter of the row
+      row (Mapping[str, Any]): the raw parameters of the row
+
+    Returns:
+      CastRow: The cast row.
+
+    Raises:
+      KeyError: If the row has a parameter without a caster, as cast_parameters_to does.
+    """
+    # The casters of a definition live as long as it, so are keyed by identity. A flat key of the
+    # names then the values of the row is one object rather than one for each parameter.
+    key = (id(casters), *row, *row.values())
+    try:
+        hash(key)
+    except TypeError:
+        # e.g. a parameter that is not a string, which cannot be a key
+        return CastRow(casters, row)
+    cast = cast_cache.get_or_compute(key, partial(CastRow, casters, row))
+    if not cast.cast_by(casters):
+        # Other casters that have since taken the identity of those cached
+        cast = CastRow(casters, row)
+        cast_cache.put(key, cast)
+    return cast
+
+
+def cast_row_parameters(
+    casters: Mapping[str, Callable[[Any], Any]],
+) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    A decorator casting the parameters of a method of a script definition as cast_parameters_to
+    does, giving the same reason if they cannot be cast. The method can be called with the raw
+    parameters of a row as keyword arguments, or with a CastRow alone, and either way each distinct
+    row is only cast once (see cast_row).
+
+    Parameters:
+      casters (Mapping[str, Callable[[Any], Any]]): the caster of each parameter, the same mapping
+        for every method of the definition so that they share the rows they cast
+
+    Returns:
+      The decorator.
+    """
+
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        @wraps(func)
+        def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+            if args:
+                row = args[0]
+                if len(args) > 1 or kwargs or not isinstance(row, CastRow):
+                    raise TypeError(f"{func.__name__} takes a CastRow or keyword arguments")
+                # A row cast for another definition is cast again
+                if not row.cast_by(casters):
+                    row = cast_row(casters, row._row)
+            else:
+                row = cast_row(casters, kwargs)
+            if row.reason is not None:
+                return row.reason
+            return func(self, **row._parameters)
+
+        return wrapper
+
+    return decorator
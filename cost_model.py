@@ -0,0 +1,203 @@
+import math
+from typing import Dict, NamedTuple, Optional
+
+import numpy as np
+
+from plan_optimiser import TransitionCosts, emu_transition_costs
+from scan_plan import ScanAction, ScanPlan, ScanPlanBatch, SweepPlan
+
+# The seconds spent on each part of each point of a scan plan
+point_time_dtype = np.dtype(
+    [("ramp", np.float64), ("settle", np.float64), ("count", np.float64), ("overhead", np.float64)]
+)
+
+
+class TimeEstimate(NamedTuple):
+    """
+    The seconds a scan is estimated to spend on each part of it.
+    """
+
+    ramp: float
+    settle: float
+    counting: float  # not count, which would hide tuple.count
+    overhead: float
+    magnet_switch: float = 0.0
+
+    @property
+    def total(self) -> float:
+        return self.ramp + self.settle + self.counting + self.overhead + self.magnet_switch
+
+
+class CostModel(NamedTuple):
+    """
+    How long an instrument takes to do each part of a scan: ramping and settling the temperature
+    and field (see TransitionCosts), counting, beginning and ending runs and selecting a different
+    magnet device.
+    """
+
+    transitions: TransitionCosts
+    event_rate: float  # Mev/s
+    run_overhead: float = 0.0  # s to begin and end a run
+    magnet_switch: float = 0.0  # s to select a different magnet device
+
+    def with_event_rate(self, mevents_per_hour: float) -> "CostModel":
+        """
+        Parameters:
+          mevents_per_hour (float): the rate events are counted at (e.g. a Rate (Mev/hr) global)
+
+        Returns:
+          CostModel: This model counting at the given rate.
+        """
+        return self._replace(event_rate=mevents_per_hour / 3600.0)
+
+    def point_times(self, plan: ScanPlan, count_seconds: Optional[float] = None) -> np.ndarray:
+        """
+        Get the seconds spent on each part of each point of a plan. The temperature and field are
+        ramped and settled to each point from the point before it. Where they start from is not
+        known, so for the first point only settling them is counted.
+
+        Parameters:
+          plan (ScanPlan): the plan to estimate
+          count_seconds (float): the seconds each count takes if counting for a time rather than
+            for the mevents of the plan
+
+        Returns:
+          np.ndarray: The seconds spent on each point with dtype point_time_dtype.
+        """
+        times = np.zeros(len(plan), dtype=point_time_dtype)
+        if not len(plan):
+            return times
+        temperatures, fields = plan.temperatures, plan.fields
+        moves = (temperatures[:-1], fields[:-1], temperatures[1:], fields[1:])
+        times["ramp"][1:] = self.transitions.ramp(*moves)
+        times["settle"][1:] = self.transitions.settle(*moves)
+        times["settle"][0] = self.transitions.temperature_settle * (
+            not np.isnan(temperatures[0])
+        ) + self.transitions.field_settle * (not np.isnan(fields[0]))
+        counting = (plan.actions & ScanAction.COUNT) != 0
+        if count_seconds is None:
+            times["count"][counting] = plan.mevents[counting] / self.event_rate
+        else:
+            times["count"][counting] = count_seconds
+        times["overhead"][counting] = self.run_overhead
+        return times
+
+    def estimate(
+        self, plan: ScanPlan, magnet_switches: int = 0, count_seconds: Optional[float] = None
+    ) -> TimeEstimate:
+        """
+        Parameters:
+          plan (ScanPlan): the plan to estimate
+          magnet_switches (int): the number of times a different magnet device is selected
+          count_seconds (float): the seconds each count takes if counting for a time rather than
+            for the mevents of the plan
+
+        Returns:
+          TimeEstimate: The seconds the plan is estimated to spend on each part of it.
+        """
+        times = self.point_times(plan, count_seconds)
+        return TimeEstimate(
+            ramp=float(times["ramp"].sum()),
+            settle=float(times["settle"].sum()),
+            counting=float(times["count"].sum()),
+            overhead=float(times["overhead"].sum()),
+            magnet_switch=magnet_switches * self.magnet_switch,
+        )
+
+    def estimate_sweep_plan(
+        self, plan: SweepPlan, magnet_switches: int = 0, count_seconds: Optional[float] = None
+    ) -> TimeEstimate:
+        """
+        Estimate a plan in closed form from the sweeps of its temperature and field, the same (to
+        rounding) as estimate of the plan it compiles to but taking the same time however many
+        points it has.
+
+        Parameters:
+          plan (SweepPlan): the plan to estimate
+          magnet_switches (int): the number of times a different magnet device is selected
+          count_seconds (float): the seconds each count takes if counting for a time rather than
+            for the mevents of the plan
+
+        Returns:
+          TimeEstimate: The seconds the plan is estimated to spend on each part of it.
+        """
+        if not plan.points:
+            return TimeEstimate(0.0, 0.0, 0.0, 0.0, magnet_switches * self.magnet_switch)
+        ramp, settle = self.transitions.sweep_moves(plan)
+        # Where the temperature and field start from is not known, so for the first point only
+        # settling them is counted
+        settle += self.transitions.temperature_settle * (
+            not math.isnan(plan.temperatures.first)
+        ) + self.transitions.field_settle * (not math.isnan(plan.fields.first))
+        runs = plan.points if plan.mevents > 0 else 0
+        if count_seconds is None:
+            count_seconds = plan.mevents / self.event_rate
+        return TimeEstimate(
+            ramp=float(ramp),
+            settle=float(settle),
+            counting=runs * count_seconds,
+            overhead=runs * self.run_overhead,
+            magnet_switch=magnet_switches * self.magnet_switch,
+        )
+
+    def estimate_batch(self, plans: ScanPlanBatch) -> np.ndarray:
+        """
+        Estimate the total seconds of many plans at once, the same as estimate(plan).total for
+        each of them.
+
+        Parameters:
+          plans (ScanPlanBatch): the plans to estimate
+
+        Returns:
+          np.ndarray: The seconds each plan is estimated to take.
+        """
+        counts = plans.counts
+        totals = np.zeros(len(counts))
+        temperatures, fields = plans.temperatures, plans.fields
+        if len(temperatures):
+            moves = self.transitions.transition(
+                temperatures[:-1], fields[:-1], temperatures[1:], fields[1:]
+            )
+            # Moving from the last point of one plan to the first point of the next is in neither
+            plan_of_point = np.repeat(np.arange(len(counts)), counts)
+            within_plan = plan_of_point[1:] == plan_of_point[:-1]
+            totals += np.bincount(
+                plan_of_point[1:][within_plan], weights=moves[within_plan], minlength=len(counts)
+            )
+        not_empty = counts > 0
+        firsts = plans.offsets[:-1][not_empty]
+        totals[not_empty] += self.transitions.temperature_settle * ~np.isnan(
+            temperatures[firsts]
+        ) + self.transitions.field_settle * ~np.isnan(fields[firsts])
+        counting = plans.mevents > 0
+        totals[counting] += counts[counting] * (
+            plans.mevents[counting] / self.event_rate + self.run_overhead
+        )
+        return totals
+
+
+# The cost models of each instrument. These are rough figures, the event rate of EMU is overridden
+# by the Rate (Mev/hr) global parameter where a script definition has one and all of them are
+# calibrated from the estimate history where there is one (see estimate_history).
+cost_models: Dict[str, CostModel] = {
+    "EMU": CostModel(
+        transitions=emu_transition_costs,
+        event_rate=110.0 / 3600.0,
+        run_overhead=15.0,
+        magnet_switch=120.0,
+    ),
+}
+
+
+def get_cost_model(instrument: str = "EMU") -> CostModel:
+    """
+    Parameters:
+      instrument (str): the name of the instrument
+
+    Returns:
+      CostModel: The cost model of the instrument.
+
+    Raises:
+      KeyError: If there is no cost model for the instrument.
+    """
+    return cost_models[instrument.upper()]
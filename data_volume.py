@@ -0,0 +1,176 @@
+from typing import Dict, NamedTuple, Optional
+
+import numpy as np
+import numpy.typing as npt
+
+from cost_model import CostModel
+from scan_plan import ScanAction, ScanPlan
+
+
+class DataVolumeModel(NamedTuple):
+    """
+    How much data each run writes: a histogram for each detector whatever the run counts, plus
+    the events it counts.
+    """
+
+    detectors: int
+    bytes_per_detector: float  # the histogram of one detector in one run
+    bytes_per_mevent: float
+
+    def run_volumes(self, mevents: npt.ArrayLike) -> np.ndarray:
+        """
+        Parameters:
+          mevents (npt.ArrayLike): the millions of events each run counts
+
+        Returns:
+          np.ndarray: The bytes each run writes.
+        """
+        return self.detectors * self.bytes_per_detector + np.multiply(
+            mevents, self.bytes_per_mevent
+        )
+
+
+class DataBudget(NamedTuple):
+    """
+    How fast an instrument can write data to disk and copy it to the archive without a backlog
+    building up.
+    """
+
+    write_rate: float  # bytes/s
+
+
+# Rough figures for EMU's 96 detectors, histogramming 2048 time bins of 4 bytes each, and recording
+# each event in 4 bytes
+data_volume_models: Dict[str, DataVolumeModel] = {
+    "EMU": DataVolumeModel(detectors=96, bytes_per_detector=2048 * 4, bytes_per_mevent=4e6),
+}
+
+
+# Rough figures for EMU's disk and the copying of its data files to the archive
+data_budgets: Dict[str, DataBudget] = {
+    "EMU": DataBudget(write_rate=0.5e6),
+}
+
+
+def get_data_volume_model(instrument: str = "EMU") -> DataVolumeModel:
+    """
+    Parameters:
+      instrument (str): the name of the instrument
+
+    Returns:
+      DataVolumeModel: The data volume model of the instrument.
+
+    Raises:
+      KeyError: If there is no data volume model for the instrument.
+    """
+    return data_volume_models[instrument.upper()]
+
+
+def get_data_budget(instrument: str = "EMU") -> DataBudget:
+    """
+    Parameters:
+      instrument (str): the name of the instrument
+
+    Returns:
+      DataBudget: The data budget of the instrument.
+
+    Raises:
+      KeyError: If there is no data budget for the instrument.
+    """
+    return data_budgets[instrument.upper()]
+
+
+def run_write_rates(
+    plan: ScanPlan,
+    cost_model: CostModel,
+    data_volume_model: DataVolumeModel,
+    count_seconds: Optional[float] = None,
+) -> np.ndarray:
+    """
+    Get the rate each run of a plan writes data at: the bytes it writes over the seconds from the
+    end of the run before it (or the start of the plan) to its own end, which is how long the disk
+    and archive copying have to take its data file before the next one is written.
+
+    Parameters:
+      plan (ScanPlan): the plan to get the write rates of
+      cost_model (CostModel): the model of how long each part of the plan takes
+      data_volume_model (DataVolumeModel): the model of how much data each run writes
+      count_seconds (float): the seconds each count takes if counting for a time rather than for
+        the mevents of the plan, the mevents are then those counted at the event rate of the cost
+        model
+
+    Returns:
+      np.ndarray: The bytes/s each run writes at.
+    """
+    times = cost_model.point_times(plan, count_seconds)
+    counting = (plan.actions & ScanAction.COUNT) != 0
+    if count_seconds is None:
+        mevents = plan.mevents[counting]
+    else:
+        mevents = np.full(np.count_nonzero(counting), count_seconds * cost_model.event_rate)
+    run_ends = np.cumsum(times["ramp"] + times["settle"] + times["count"] + times["overhead"])
+    seconds = np.diff(run_ends[counting], prepend=0.0)
+    return data_volume_model.run_volumes(mevents) / np.maximum(seconds, 1e-9)
+
+
+def check_data_budget(
+    plan: ScanPlan,
+    cost_model: CostModel,
+    instrument: str = "EMU",
+    count_seconds: Optional[float] = None,
+) -> str:
+    """
+    Check that the runs of a plan do not write data faster than the instrument can take it.
+
+    Parameters:
+      plan (ScanPlan): the plan to check
+      cost_model (CostModel): the model of how long each part of the plan takes
+      instrument (str): the instrument the plan is run on
+      count_seconds (float): the seconds each count takes if counting for a time rather than for
+        the mevents of the plan
+
+    Returns:
+      str: An empty string if the plan is within the data budget of the instrument, or a string
+        containing a reason why it is not.
+    """
+    rates = run_write_rates(plan, cost_model, get_data_volume_model(instrument), count_seconds)
+    budget = get_data_budget(instrument)
+    if not len(rates) or rates.max() <= budget.write_rate:
+        return ""
+    return (
+        f"Runs are predicted to write up to {rates.max() / 1e6:.2f} MB/s, more than the "
+        f"{budget.write_rate / 1e6:.2f} MB/s {instrument.upper()} can write and archive. Count "
+        f"for longer in each run or scan fewer points.\n"
+    )
+
+
+def may_exceed_data_budget(
+    mevents: float,
+    cost_model: CostModel,
+    instrument: str = "EMU",
+    count_seconds: Optional[float] = None,
+) -> bool:
+    """
+    Check, without building a plan, whether runs counting mevents could write data faster than the
+    instrument can take it. Each run has at least its count and run overhead to write its data
+    in, so if that is enough no plan of such runs needs checking with check_data_budget.
+
+    Parameters:
+      mevents (float): the millions of events each run counts
+      cost_model (CostModel): the model of how long each part of a plan takes
+      instrument (str): the instrument the runs are on
+      count_seconds (float): the seconds each count takes if counting for a time rather than for
+        mevents
+
+    Returns:
+      bool: False if the runs are within the data budget of the instrument whatever the plan.
+    """
+    if cost_model.event_rate <= 0:
+        return True
+    if count_seconds is not None:
+        mevents = count_seconds * cost_model.event_rate
+    else:
+        count_seconds = mevents / cost_model.event_rate
+    seconds = count_seconds + cost_model.run_overhead
+    volume = float(get_data_volume_model(instrument).run_volumes(mevents))
+    return seconds <= 0 or volume / seconds > get_data_budget(instrument).write_rate
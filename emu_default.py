@@ -1,9 +1,35 @@
-from genie_python.genie_script_generator import ScriptDefinition, cast_parameters_to
+from genie_python.genie_script_generator import ScriptDefinition
 from genie_python import genie as g
 import numpy as np
 from enum import Enum
 from collections import OrderedDict
 
+from beam_rate import beam_schedule_version, estimate_sweep_plan_seconds
+from cast_row import cast_row_parameters
+from data_volume import check_data_budget, may_exceed_data_budget
+from estimate_history import (
+    BEGIN,
+    COUNT,
+    END,
+    SWITCH,
+    calibrate_for_run,
+    calibrated_cost_model,
+    history_version,
+    timed_phase,
+)
+from scan_plan import ScanPlan, Sweep, SweepPlan
+from script_analysis import analyse_script
+from script_utilities import (
+    count_arange_steps,
+    decimal_places,
+    global_param,
+    last_arange_step,
+    memoise_row,
+)
+from table_validation import validate_rows
+from timeline import RowPlan
+from validation_rules import emu_rules, magnet_selection_codes
+
 
 class SetDefinition(Enum):
     """
@@ -103,7 +129,7 @@ def inclusive_float_range_with_step_flip(start, stop, step):
 #    stop = stop + step **** This original code can cause the scan to extend beyond the given range
     vstop = stop + step     # note 'arange' doesn't include last point
 # number of decimal places determined by required user entry
-    dec_places = max([len(str(start).split(".")[1]), len(str(stop).split(".")[1]), len(str(step).split(".")[1])])
+    dec_places = decimal_places(start, stop, step)
     for i in np.arange(start, vstop, step):
         p = round(i,dec_places)
         if ((p >= start) and (p <= stop)) or ((p >= stop) and (p <= start)):    # Check inserted here to ensure scan remains within defined range
@@ -114,10 +140,22 @@ def inclusive_float_range_with_step_flip(start, stop, step):
 #            yield i
 
 
+parameter_casters = {
+    "start_temperature": float_or_keep, "stop_temperature": float_or_keep, "step_temperature": float,
+    "start_field": float_or_keep, "stop_field": float_or_keep, "step_field": float,
+    "custom": cast_custom_expression, "mevents": float, "magnet_device": magnet_device_type,
+}
+
+
 class DoRun(ScriptDefinition):
 
     active_zf = "Active ZF"
     possible_magnet_devices = [active_zf, "Danfysik", "T20 Coils"]
+    rules = emu_rules(magnet_devices, active_zf, magnet_not_applicable)
+    parameter_casters = parameter_casters
+    # The parameters check_row_data_budget reads
+    data_budget_parameters = ("start_temperature", "stop_temperature", "step_temperature",
+                              "start_field", "stop_field", "step_field", "mevents")
     
     global_params_definition = OrderedDict({"Rate (Mev/hr)": ("110", int)})
     
@@ -129,41 +167,42 @@ If the field is zero magnet device must be ZF.\n
 
         """.format(list(magnet_devices.keys()))
 
-    @cast_parameters_to(
-         start_temperature=float_or_keep, stop_temperature=float_or_keep, step_temperature=float,
-         start_field=float_or_keep, stop_field=float_or_keep, step_field=float, 
-         custom=cast_custom_expression, mevents=float, magnet_device=magnet_device_type)	
+    @memoise_row(history_version, beam_schedule_version)
+    @cast_row_parameters(parameter_casters)
     def estimate_time(self,
             start_temperature="keep", stop_temperature="keep", step_temperature=0,
             start_field="keep", stop_field="keep", step_field=0,
             custom="None", mevents=10, magnet_device="N/A"):
-        # Scan if start and stop are different, set once if they are equal or do not set if they are None
-        temp_set_definition = self.check_set_definition(start_temperature, stop_temperature)
-        field_set_definition = self.check_set_definition(start_field, stop_field)
-        if (temp_set_definition == SetDefinition.SCAN):
-            temp_pts = 0
-            for i in inclusive_float_range_with_step_flip(start_temperature, stop_temperature, step_temperature):
-                temp_pts += 1
-        else:
-            temp_pts = 1
-        if (field_set_definition == SetDefinition.SCAN):
-            field_pts = 0
-            for i in inclusive_float_range_with_step_flip(start_field, stop_field, step_field):
-                field_pts += 1
-        else:
-            field_pts = 1
-        return (float(mevents) * float(temp_pts) * float(field_pts)) / (float(self.global_params["Rate (Mev/hr)"]) / 3600.0)
+        # Costed in closed form from the sweeps, without compiling the plan
+        plan = SweepPlan(self.get_axis_sweep(start_temperature, stop_temperature, step_temperature),
+                         self.get_axis_sweep(start_field, stop_field, step_field), mevents)
+        cost_model = calibrated_cost_model("EMU", global_param(self, "Rate (Mev/hr)"))
+        return estimate_sweep_plan_seconds(cost_model, plan)
 
 
+    @cast_row_parameters(parameter_casters)
+    def get_row_plan(self,
+            start_temperature="keep", stop_temperature="keep", step_temperature=0,
+            start_field="keep", stop_field="keep", step_field=0,
+            custom="None", mevents=10, magnet_device="N/A"):
+        """
+        Get the plan of a row and the model of how long it takes, to lay the row out on a Timeline.
+
+        Returns:
+          RowPlan: The plan of the row and the calibrated cost model of EMU.
+        """
+        plan = ScanPlan.from_axes(self.get_scan_axis(start_temperature, stop_temperature, step_temperature),
+                                  self.get_scan_axis(start_field, stop_field, step_field), mevents)
+        return RowPlan(plan, calibrated_cost_model("EMU", global_param(self, "Rate (Mev/hr)")))
+
     # Loop through a set of temperatures or fields using a start, stop and step mechanism0
-    @cast_parameters_to(
-         start_temperature=float_or_keep, stop_temperature=float_or_keep, step_temperature=float,
-         start_field=float_or_keep, stop_field=float_or_keep, step_field=float, 
-         custom=cast_custom_expression, mevents=float, magnet_device=magnet_device_type)
+    @cast_row_parameters(parameter_casters)
     def run(self,
             start_temperature="keep", stop_temperature="keep", step_temperature=0,
             start_field="keep", stop_field="keep", step_field=0,
             custom="None", mevents=10, magnet_device="N/A"):
+        # Phases of this run are predicted with the history as it is when the run starts
+        calibrate_for_run()
         # Scan if start and stop are different, set once if they are equal or do not set if they are None
         temp_set_definition = self.check_set_definition(start_temperature, stop_temperature)
         field_set_definition = self.check_set_definition(start_field, stop_field)
@@ -199,9 +238,12 @@ If the field is zero magnet device must be ZF.\n
           mevents (float): The millions of events to wait for.
         """
         if mevents > 0:
-            g.begin(quiet=True)
-            g.waitfor_mevents(mevents)
-            g.end(quiet=True)
+            with timed_phase(BEGIN):
+                g.begin(quiet=True)
+            with timed_phase(COUNT, mevents=mevents):
+                g.waitfor_mevents(mevents)
+            with timed_phase(END):
+                g.end(quiet=True)
 
     def set_magnet_device(self, magnet_device, inst):
         """
@@ -213,7 +255,8 @@ If the field is zero magnet device must be ZF.\n
         """
         magnet_to_function_map = {"Active ZF": inst.f0, "Danfysik": inst.lf0, "T20 Coils": inst.tf0}
         if g.cget("a_selected_magnet")["value"] != magnet_device:
-            magnet_to_function_map[magnet_device]()
+            with timed_phase(SWITCH):
+                magnet_to_function_map[magnet_device]()
 
     def check_set_definition(self, start_temp_or_field, stop_temp_or_field):
         """
@@ -236,6 +279,48 @@ If the field is zero magnet device must be ZF.\n
         else:
             return SetDefinition.SCAN
 
+    def get_scan_axis(self, start, stop, step):
+        """
+        Get the values a temperature or field takes in a scan.
+
+        Parameters:
+          start (float): The value to start the scan with or set once.
+          stop (float): The value to end the scan with (inclusive).
+          step (float): The size of the steps to take from start to stop.
+
+        Returns:
+          list: The values of the scan, the one value if it is set once or None if it is not set.
+        """
+        set_definition = self.check_set_definition(start, stop)
+        if set_definition == SetDefinition.UNDEFINED:
+            return None
+        elif set_definition == SetDefinition.POINT:
+            return [start]
+        else:
+            return list(inclusive_float_range_with_step_flip(start, stop, step))
+
+    def get_axis_sweep(self, start, stop, step):
+        """
+        Get the sweep through the values get_scan_axis gives, without generating them.
+
+        Parameters:
+          start (float): The value to start the scan with or set once.
+          stop (float): The value to end the scan with (inclusive).
+          step (float): The size of the steps to take from start to stop.
+
+        Returns:
+          Sweep: The sweep of the scan, of the one value if it is set once or of NaN if it is not set.
+        """
+        set_definition = self.check_set_definition(start, stop)
+        if set_definition == SetDefinition.UNDEFINED:
+            return Sweep(np.nan, np.nan, 1)
+        elif set_definition == SetDefinition.POINT:
+            return Sweep(start, start, 1)
+        else:
+            places = decimal_places(start, stop, step)
+            return Sweep(start, last_arange_step(start, stop, step, places),
+                         count_arange_steps(start, stop, step, places))
+
     def run_temp_and_field_scans(self, start_temperature, stop_temperature, step_temperature,
                                  start_field, stop_field, step_field, mevents, inst):
         """
@@ -271,22 +356,20 @@ If the field is zero magnet device must be ZF.\n
             self.check_mevents_and_begin_waitfor_mevents_end(mevents)
 
     # Check to see if the provided parameters are valid
-    @cast_parameters_to(
-         start_temperature=float_or_keep, stop_temperature=float_or_keep, step_temperature=float,
-         start_field=float_or_keep, stop_field=float_or_keep, step_field=float, 
-         custom=cast_custom_expression, mevents=float, magnet_device=magnet_device_type)
+    @memoise_row(history_version)
+    @cast_row_parameters(parameter_casters)
     def parameters_valid(self,
                          start_temperature=1.0, stop_temperature=1.0, step_temperature=1.0,
                          start_field=1.0, stop_field=1.0, step_field=1.0,
                          custom="None",  mevents=10, magnet_device="N/A"):
         # The reason as to why the parameters are not valid
-        reason = ""
-        reason += self.check_start_and_stop_valid(start_temperature, stop_temperature, "temperature")
-        reason += self.check_start_and_stop_valid(start_field, stop_field, "field")
-        reason += self.check_step_set_correctly(start_temperature, stop_temperature, step_temperature, "temperature")
-        reason += self.check_step_set_correctly(start_field, stop_field, step_field, "field")
-        reason += self.check_magnet_selected_correctly(start_field, stop_field, magnet_device)
-        reason += self.check_if_start_or_stop_field_are_keep_then_magnet_is_na(start_field, stop_field, magnet_device)
+        reason = self.rules.reason(start_temperature=start_temperature, stop_temperature=stop_temperature,
+                                   step_temperature=step_temperature, start_field=start_field,
+                                   stop_field=stop_field, step_field=step_field, magnet_device=magnet_device)
+        # The data budget can only be checked once the scans are valid
+        if reason == "":
+            reason += self.check_row_data_budget(start_temperature, stop_temperature, step_temperature,
+                                                 start_field, stop_field, step_field, custom, mevents, magnet_device)
         # If there is no reason return None i.e. the parameters are valid
         if reason != "":
             return reason
@@ -295,7 +378,7 @@ If the field is zero magnet device must be ZF.\n
 
     def check_start_and_stop_valid(self, start, stop, variable_name):
         """
-        Check that start and stop are either both None or both values.
+        Check that start and stop are either both None or both values, as the keep_together rule of rules does.
 
         Parameters:
           start (float): The start value of a scan.
@@ -305,32 +388,29 @@ If the field is zero magnet device must be ZF.\n
         Returns:
           str: An empty string if start and stop are valid, or a string containing a reason why they are not.
         """
-        if (start is None and stop is not None) or (stop is None and start is not None):
-            return "If start {0} or stop {0} is keep, the other must also be keep\n".format(variable_name)
-        else:
-            return ""
-    
+        return self.rules.axis_reason(("keep_together",), variable_name, start, stop)
+
     def check_if_start_or_stop_field_are_keep_then_magnet_is_na(self, start_field, stop_field, magnet):
-      """
-      Check that if the start or stop fields are keep then the magnet is set to N/A
+        """
+        Check that if the start or stop fields are keep then the magnet is set to N/A, as the kept_field_with_magnet
+        rule of rules does.
 
-      Parameters:
+        Parameters:
           start_field (float): The start value of a scan.
           stop_field (float): The end value of a scan.
           magnet (str): The magnet device selected.
 
         Returns:
-          str: A string to raise awareness of invalidity if start or stop are "keep" and the magnet is not N/A, 
-           or an empty string to show they are valid. 
-      """
-      if (start_field is None or stop_field is None) and magnet != magnet_not_applicable:
-        return "If start_field or stop_field is keep, then the selected magnet must be N/A".format()
-      else:
-        return ""
+          str: A string to raise awareness of invalidity if start or stop are "keep" and the magnet is not N/A,
+           or an empty string to show they are valid.
+        """
+        return self.rules.axis_reason(("kept_field_with_magnet",), "field", start_field, stop_field,
+                                      magnet_device=magnet)
 
     def check_step_set_correctly(self, start, stop, step, variable_name):
         """
-        If we are scanning check that the step is positive and not zero.
+        If we are scanning check that the step is positive and not zero, as the step_zero and step_negative rules of
+        rules do.
 
         Parameters:
           start (float): The start value of a scan.
@@ -341,19 +421,11 @@ If the field is zero magnet device must be ZF.\n
         Returns:
           str: An empty string if valid, or a string containing a reason why they are not.
         """
-        reason = ""
-        set_definition = self.check_set_definition(start, stop)
-        if set_definition == SetDefinition.SCAN:
-            # We need to step through at some rate
-            if step == 0.0:
-                reason += "Cannot step through {}s when step is zero\n".format(variable_name)
-            elif step < 0.0:
-                reason += "Step {} must be positive\n".format(variable_name)
-        return reason
+        return self.rules.axis_reason(("step_zero", "step_negative"), variable_name, start, stop, step)
 
     def check_magnet_selected_correctly(self, start_field, stop_field, magnet_device):
         """
-        If we are setting a field check:
+        If we are setting a field check, as the magnet rules of rules do:
          - The magnet device that has been selected is a valid one i.e. one of our listed magnet devices
          - If the field is zero we are using the active zero field device
          - If the field is not zero we are not using the the active zero field device
@@ -366,18 +438,40 @@ If the field is zero magnet device must be ZF.\n
         Returns:
           str: An empty string if valid, or a string containing a reason why they are not.
         """
-        reason = ""
-        field_set_definition = self.check_set_definition(start_field, stop_field)
-        if field_set_definition != SetDefinition.UNDEFINED:
-            # If we are setting a field we need to set the magnet device to use
-            if magnet_device not in magnet_devices.values():
-                reason += "Field set but magnet devices {} not in possible devices {}\n".format(
-                    magnet_device, list(magnet_devices.keys()))
-            # Only the zero field can set a field of zero
-            if (np.isclose(start_field, 0.0) or np.isclose(stop_field, 0.0)) and magnet_device != self.active_zf:
-                reason += "Trying to set a zero field without using the active zero field ({}, {})\n".format(
-                    magnet_device, self.active_zf)
-            if (not np.isclose(start_field, 0.0) or not np.isclose(stop_field,
-                                                                   0.0)) and magnet_device == self.active_zf:
-                reason += "Cannot set a non-zero field with the active zero field\n"
-        return reason
+        return self.rules.axis_reason(magnet_selection_codes, "field", start_field, stop_field,
+                                      magnet_device=magnet_device)
+
+    def check_row_data_budget(self, start_temperature, stop_temperature, step_temperature,
+                              start_field, stop_field, step_field, custom, mevents, magnet_device):
+        """
+        Check that the runs of a row do not write data faster than EMU can take it. The scans of the row must be valid.
+
+        Returns:
+          str: An empty string if the row is within the data budget, or a string containing a reason why it is not.
+        """
+        cost_model = calibrated_cost_model("EMU", global_param(self, "Rate (Mev/hr)"))
+        if not may_exceed_data_budget(mevents, cost_model):
+            return ""
+        plan = ScanPlan.from_axes(self.get_scan_axis(start_temperature, stop_temperature, step_temperature),
+                                  self.get_scan_axis(start_field, stop_field, step_field), mevents)
+        return check_data_budget(plan, cost_model)
+
+    def validate_table(self, rows):
+        """
+        Validate every row of a script in one call, giving the same reasons as parameters_valid does for each row but
+        casting each column once and checking the rules of every row together.
+
+        Returns:
+          list: Why each row is not valid, or None if it is.
+        """
+        return validate_rows(self, rows)
+
+    def analyse_script(self, rows):
+        """
+        Find what the rows of a script waste beam time on together that no row can see alone, e.g. switching magnet
+        devices back and forth or measuring a point twice.
+
+        Returns:
+          ScriptAnalysis: What wastes beam time, with the seconds each wastes.
+        """
+        return analyse_script(self, rows)
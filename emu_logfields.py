@@ -1,9 +1,30 @@
-from genie_python.genie_script_generator import ScriptDefinition, cast_parameters_to
+from genie_python.genie_script_generator import ScriptDefinition
 from genie_python import genie as g
 import numpy as np
 from enum import Enum
 from collections import OrderedDict
 
+from beam_rate import beam_schedule_version, estimate_plan_seconds
+from cast_row import cast_row_parameters
+from data_volume import check_data_budget, get_data_volume_model, may_exceed_data_budget
+from estimate_history import (
+    BEGIN,
+    COUNT,
+    END,
+    SWITCH,
+    calibrate_for_run,
+    calibrated_cost_model,
+    history_version,
+    timed_phase,
+)
+from plan_summary import summarise_plan
+from scan_plan import ScanPlan
+from script_analysis import analyse_script
+from script_utilities import decimal_places, geometric_steps, global_param, memoise_row
+from table_validation import validate_rows
+from timeline import RowPlan
+from validation_rules import emu_rules, magnet_selection_codes
+
 
 class SetDefinition(Enum):
     """
@@ -103,7 +124,7 @@ def inclusive_float_range_with_step_flip(start, stop, step):
 #    stop = stop + step **** This original code can cause the scan to extend beyond the given range
     vstop = stop + step     # note 'arange' doesn't include last point
 # number of decimal places determined by required user entry
-    dec_places = max([len(str(start).split(".")[1]), len(str(stop).split(".")[1]), len(str(step).split(".")[1])])
+    dec_places = decimal_places(start, stop, step)
     for i in np.arange(start, vstop, step):
         p = round(i,dec_places)
         if ((p >= start) and (p <= stop)) or ((p >= stop) and (p <= start)):    # Check inserted here to ensure scan remains within defined range
@@ -113,40 +134,47 @@ def inclusive_float_range_with_step_flip(start, stop, step):
 #        if ((i >= start) and (i <= stop)) or ((i >= stop) and (i <= start)):    # Check inserted here to ensure scan remains within defined range
 #            yield i
 
+# The smallest field (in G) to step down to when a logarithmic field scan starts or ends at zero
+lowest_log_field = 1.0
+
+
 def log_range(start, stop, n):
     """
-    Do n fields between start and stop, logarithmically spaced.
+    Do n fields between start and stop (both inclusive), logarithmically spaced.
+    If start or stop is zero that point is measured at zero field and the other fields are spaced
+    logarithmically between lowest_log_field and the other end.
 
     Parameters:
       start (float): the value to start the range from
       stop (float): the value to stop the range at
-      step (float): the steps to take from start to stop
+      n (int): the number of fields to scan
 
     Returns:
-      The range from start to stop including all steps in between.
+      numpy.ndarray: The range from start to stop including all steps in between.
 
     Examples:
-      >>> inclusive_float_range_with_step_flip(0.5, 2, 0.5) == [0.5, 1, 1.5, 2]
-      >>> inclusive_float_range_with_step_flip(2, 0.5, 0.5) == [2, 1.5, 1, 0.5]
+      >>> log_range(1.0, 1000.0, 4) == [1.0, 10.0, 100.0, 1000.0]
+      >>> log_range(0.0, 100.0, 4) == [0.0, 1.0, 10.0, 100.0]
     """
+    return geometric_steps(start, stop, n, lowest_log_field)
 
-# number of decimal places determined by required user entry
-    dec_places = max([len(str(start).split(".")[1]), len(str(stop).split(".")[1])])
-    for i in range(0, n):
-        this_field = start + (stop-start) ** (i/(n*1.))
-        p = round(this_field, dec_places)
-        if ((p >= start) and (p <= stop)):    # Check inserted here to ensure scan remains within defined range
-            yield p
-#    for i in np.arange(start, vstop, step):
-#        print(i)
-#        if ((i >= start) and (i <= stop)) or ((i >= stop) and (i <= start)):    # Check inserted here to ensure scan remains within defined range
-#            yield i
+
+parameter_casters = {
+    "start_temperature": float_or_keep, "stop_temperature": float_or_keep, "step_temperature": float,
+    "start_field": float_or_keep, "stop_field": float_or_keep, "n_fields": int,
+    "custom": cast_custom_expression, "mevents": float, "magnet_device": magnet_device_type,
+}
 
 
 class DoRun(ScriptDefinition):
 
     active_zf = "Active ZF"
     possible_magnet_devices = [active_zf, "Danfysik", "T20 Coils"]
+    rules = emu_rules(magnet_devices, active_zf, magnet_not_applicable, field_step="n_fields", zero_field=False, log_fields=lowest_log_field)
+    parameter_casters = parameter_casters
+    # The parameters check_row_data_budget reads
+    data_budget_parameters = ("start_temperature", "stop_temperature", "step_temperature",
+                              "start_field", "stop_field", "n_fields", "mevents")
     
     global_params_definition = OrderedDict({"Rate (Mev/hr)": ("110", int)})
     
@@ -159,46 +187,61 @@ If the field is zero, active ZF will be engaged automatically.
 
         """.format(list(magnet_devices.keys()))
 
-    @cast_parameters_to(
-         start_temperature=float_or_keep, stop_temperature=float_or_keep, step_temperature=float,
-         start_field=float_or_keep, stop_field=float_or_keep, n_fields=int, 
-         custom=cast_custom_expression, mevents=float, magnet_device=magnet_device_type)	
+    @memoise_row(history_version, beam_schedule_version)
+    @cast_row_parameters(parameter_casters)
     def estimate_time(self,
             start_temperature="keep", stop_temperature="keep", step_temperature=0,
             start_field="keep", stop_field="keep", n_fields=1,
             custom="None", mevents=10, magnet_device="N/A"):
-        # Scan if start and stop are different, set once if they are equal or do not set if they are None
-        temp_set_definition = self.check_set_definition(start_temperature, stop_temperature)
-        field_set_definition = self.check_set_definition(start_field, stop_field)
-        if (temp_set_definition == SetDefinition.SCAN):
-            temp_pts = 0
-            for i in inclusive_float_range_with_step_flip(start_temperature, stop_temperature, step_temperature):
-                temp_pts += 1
-        else:
-            temp_pts = 1
-        if (field_set_definition == SetDefinition.SCAN):
-            field_pts = n_fields
-        else:
-            field_pts = 1
-        return (float(mevents) * float(temp_pts) * float(field_pts)) / (float(self.global_params["Rate (Mev/hr)"]) / 3600.0)
+        plan, magnet_switches = self.get_scan_plan(start_temperature, stop_temperature, step_temperature,
+                                                   start_field, stop_field, n_fields, mevents)
+        cost_model = calibrated_cost_model("EMU", global_param(self, "Rate (Mev/hr)"))
+        return estimate_plan_seconds(cost_model, plan, magnet_switches)
+
+    @memoise_row(history_version, beam_schedule_version)
+    @cast_row_parameters(parameter_casters)
+    def estimate_custom(self,
+            start_temperature="keep", stop_temperature="keep", step_temperature=0,
+            start_field="keep", stop_field="keep", n_fields=1,
+            custom="None", mevents=10, magnet_device="N/A"):
+        plan, magnet_switches = self.get_scan_plan(start_temperature, stop_temperature, step_temperature,
+                                                   start_field, stop_field, n_fields, mevents)
+        cost_model = calibrated_cost_model("EMU", global_param(self, "Rate (Mev/hr)"))
+        return summarise_plan(plan, cost_model, get_data_volume_model("EMU"), magnet_switches).custom_estimate()
 
 
+    @cast_row_parameters(parameter_casters)
+    def get_row_plan(self,
+            start_temperature="keep", stop_temperature="keep", step_temperature=0,
+            start_field="keep", stop_field="keep", n_fields=1,
+            custom="None", mevents=10, magnet_device="N/A"):
+        """
+        Get the plan of a row and the model of how long it takes, to lay the row out on a Timeline.
+
+        Returns:
+          RowPlan: The plan of the row and the calibrated cost model of EMU.
+        """
+        plan, magnet_switches = self.get_scan_plan(start_temperature, stop_temperature, step_temperature,
+                                                   start_field, stop_field, n_fields, mevents)
+        cost_model = calibrated_cost_model("EMU", global_param(self, "Rate (Mev/hr)"))
+        return RowPlan(plan, cost_model, magnet_switches)
+
     # Loop through a set of temperatures or fields using a start, stop and step mechanism0
-    @cast_parameters_to(
-         start_temperature=float_or_keep, stop_temperature=float_or_keep, step_temperature=float,
-         start_field=float_or_keep, stop_field=float_or_keep, n_fields=int, 
-         custom=cast_custom_expression, mevents=float, magnet_device=magnet_device_type)
+    @cast_row_parameters(parameter_casters)
     def run(self,
             start_temperature="keep", stop_temperature="keep", step_temperature=0,
             start_field="keep", stop_field="keep", n_fields=1,
             custom="None", mevents=10, magnet_device="N/A"):
+        # Phases of this run are predicted with the history as it is when the run starts
+        calibrate_for_run()
         # Scan if start and stop are different, set once if they are equal or do not set if they are None
         temp_set_definition = self.check_set_definition(start_temperature, stop_temperature)
         field_set_definition = self.check_set_definition(start_field, stop_field)
         # Use the instrument scripts to set the magnet device correctly
         import inst
         if field_set_definition != SetDefinition.UNDEFINED:
-            if start_field < 1e-3:
+            # A field scan only uses the active ZF for its zero field point (see run_field_scan)
+            if field_set_definition == SetDefinition.POINT and start_field < 1e-3:
                 magnet_device = self.active_zf
             self.set_magnet_device(magnet_device, inst)
         # Execute a custom command - changed from 'eval' to 'exec' by spc 2/1/24
@@ -213,14 +256,17 @@ If the field is zero, active ZF will be engaged automatically.
             else:
                 inst.setmag(start_field, wait=True)
         # If we are running scans do them
+        if field_set_definition == SetDefinition.SCAN:
+            # Work out the fields once and reuse them for every temperature
+            fields = log_range(start_field, stop_field, n_fields)
         if temp_set_definition == SetDefinition.SCAN and field_set_definition == SetDefinition.SCAN:
             # When we are running scans for both temperature and field do all combinations
             self.run_temp_and_field_scans(start_temperature, stop_temperature, step_temperature,
-                                          start_field, stop_field, n_fields, mevents, inst, magnet_device)
+                                          fields, mevents, inst, magnet_device)
         elif temp_set_definition == SetDefinition.SCAN:  # Run scans for the temperature
-            self.run_scans(start_temperature, stop_temperature, step_temperature, mevents, inst.settemp)
+            self.run_temp_scan(start_temperature, stop_temperature, step_temperature, mevents, inst.settemp)
         elif field_set_definition == SetDefinition.SCAN:  # Run scans for the field
-            self.run_field_scan(start_field, stop_field, n_fields, mevents, inst.setmag, magnet_device)
+            self.run_field_scan(fields, mevents, inst, magnet_device)
         else:
             # If we are not doing any scans do a run with temp and field as they are
             self.check_mevents_and_begin_waitfor_mevents_end(mevents)
@@ -233,9 +279,12 @@ If the field is zero, active ZF will be engaged automatically.
           mevents (float): The millions of events to wait for.
         """
         if mevents > 0:
-            g.begin(quiet=True)
-            g.waitfor_mevents(mevents)
-            g.end(quiet=True)
+            with timed_phase(BEGIN):
+                g.begin(quiet=True)
+            with timed_phase(COUNT, mevents=mevents):
+                g.waitfor_mevents(mevents)
+            with timed_phase(END):
+                g.end(quiet=True)
 
     def set_magnet_device(self, magnet_device, inst):
         """
@@ -247,7 +296,8 @@ If the field is zero, active ZF will be engaged automatically.
         """
         magnet_to_function_map = {"Active ZF": inst.f0, "Danfysik": inst.lf0, "T20 Coils": inst.tf0}
         if g.cget("a_selected_magnet")["value"] != magnet_device:
-            magnet_to_function_map[magnet_device]()
+            with timed_phase(SWITCH):
+                magnet_to_function_map[magnet_device]()
 
     def check_set_definition(self, start_temp_or_field, stop_temp_or_field):
         """
@@ -270,8 +320,60 @@ If the field is zero, active ZF will be engaged automatically.
         else:
             return SetDefinition.SCAN
 
+    def get_scan_plan(self, start_temperature, stop_temperature, step_temperature,
+                      start_field, stop_field, n_fields, mevents):
+        """
+        Compile every point of the scans into a plan, measuring every field at each temperature.
+
+        Parameters:
+          start_temperature (float): The temperature to start the temperature scan with.
+          stop_temperature (float): The temperature to end the temperature scan with (inclusive).
+          step_temperature (float): The size of the steps to take to go from start_temperature to
+            stop_temperature.
+          start_field (float): The field to start the field scan with.
+          stop_field (float): The field to end the field scan with (inclusive).
+          n_fields (int): The number of fields to step logarithmically through.
+          mevents (float): The amount of millions of events to wait for in each run.
+
+        Returns:
+          tuple: The plan of the scans and the number of times it selects a different magnet device.
+        """
+        field_set_definition = self.check_set_definition(start_field, stop_field)
+        if field_set_definition == SetDefinition.SCAN:
+            fields = log_range(start_field, stop_field, n_fields)
+        else:
+            fields = self.get_scan_axis(start_field, stop_field, 0)
+        plan = ScanPlan.from_axes(self.get_scan_axis(start_temperature, stop_temperature, step_temperature),
+                                  fields, mevents)
+        if field_set_definition == SetDefinition.SCAN:
+            # Each zero field point of a scan selects the active ZF and then the magnet device again
+            magnet_switches = 2 * int(np.count_nonzero(plan.fields < 1e-3))
+        else:
+            magnet_switches = 0
+        return plan, magnet_switches
+
+    def get_scan_axis(self, start, stop, step):
+        """
+        Get the values a temperature or field takes in a scan.
+
+        Parameters:
+          start (float): The value to start the scan with or set once.
+          stop (float): The value to end the scan with (inclusive).
+          step (float): The size of the steps to take from start to stop.
+
+        Returns:
+          list: The values of the scan, the one value if it is set once or None if it is not set.
+        """
+        set_definition = self.check_set_definition(start, stop)
+        if set_definition == SetDefinition.UNDEFINED:
+            return None
+        elif set_definition == SetDefinition.POINT:
+            return [start]
+        else:
+            return list(inclusive_float_range_with_step_flip(start, stop, step))
+
     def run_temp_and_field_scans(self, start_temperature, stop_temperature, step_temperature,
-                                 start_field, stop_field, n_fields, mevents, inst):
+                                 fields, mevents, inst, magnet_device):
         """
         Run scans for both the temperature and field.
 
@@ -279,15 +381,14 @@ If the field is zero, active ZF will be engaged automatically.
           start_temperature (float): The temperature to start the temperature scan with.
           stop_temperature (float): The temperature to end the temperature scan with (inclusive).
           step_temperature (float): The size of the steps to take to go from start_temperature to stop_temperature.
-          start_field (float): The field to start the field scan with.
-          stop_field (float): The field to end the field scan with (inclusive).
-          n_fields (int): Number of steps to take between start and stop field
+          fields (numpy.ndarray): The fields to scan at each temperature (see log_range).
           mevents (float): The amount of millions of events to wait for in each run.
           inst (module): The instrument scripts module to set the temperature and field with.
+          magnet_device (str): The magnet device to set the non-zero fields with.
         """
         for temp in inclusive_float_range_with_step_flip(start_temperature, stop_temperature, step_temperature):
             inst.settemp(temp, wait=True)
-            self.run_field_scan(start_field, stop_field, n_fields, mevents, inst.setmag)
+            self.run_field_scan(fields, mevents, inst, magnet_device)
 
     def run_temp_scan(self, start, stop, step, mevents, set_parameter_func):
         """
@@ -304,48 +405,44 @@ If the field is zero, active ZF will be engaged automatically.
             set_parameter_func(var, wait=True)
             self.check_mevents_and_begin_waitfor_mevents_end(mevents)
 
-    def run_field_scan(self, start, stop, n, mevents, set_parameter_func, magnet_device):
+    def run_field_scan(self, fields, mevents, inst, magnet_device):
         """
         Run a log scan for the fields
 
         Parameters:
-          start (float): The value to start the scan with.
-          stop (float): The value to end the scan with.
-          n (integer): Number of fields to scan
+          fields (numpy.ndarray): The fields to scan (see log_range).
           mevents (float): The amount of millions of events to wait for in each run.
-          set_parameter_func (function): A function to call to set the value with each step of the scan.
+          inst (module): The instrument scripts module to set the field with.
+          magnet_device (str): The magnet device to set the non-zero fields with.
         """
-        for var in log_range(start, stop, n):
+        for var in fields:
             if var < 1e-3:
                 # engage ZF automatically if a field < 1mG requested
                 print('ZF enganged')
-                self.set_magnet_device(self.active_zf)
+                self.set_magnet_device(self.active_zf, inst)
             else:
-                set_parameter_func(var, wait=True)
+                inst.setmag(var, wait=True)
             self.check_mevents_and_begin_waitfor_mevents_end(mevents)
             if var < 1e-3:
                 # put the field back on if in ZF mode
-                self.set_magnet_device(magnet_device)
-            
+                self.set_magnet_device(magnet_device, inst)
 
 
     # Check to see if the provided parameters are valid
-    @cast_parameters_to(
-         start_temperature=float_or_keep, stop_temperature=float_or_keep, step_temperature=float,
-         start_field=float_or_keep, stop_field=float_or_keep, n_fields=int, 
-         custom=cast_custom_expression, mevents=float, magnet_device=magnet_device_type)
+    @memoise_row(history_version)
+    @cast_row_parameters(parameter_casters)
     def parameters_valid(self,
                          start_temperature=1.0, stop_temperature=1.0, step_temperature=1.0,
                          start_field=1.0, stop_field=1.0, n_fields=1,
                          custom="None",  mevents=10, magnet_device="N/A"):
         # The reason as to why the parameters are not valid
-        reason = ""
-        reason += self.check_start_and_stop_valid(start_temperature, stop_temperature, "temperature")
-        reason += self.check_start_and_stop_valid(start_field, stop_field, "field")
-        reason += self.check_step_set_correctly(start_temperature, stop_temperature, step_temperature, "temperature")
-        reason += self.check_step_set_correctly(start_field, stop_field, n_fields, "field")
-        reason += self.check_magnet_selected_correctly(start_field, stop_field, magnet_device)
-        reason += self.check_if_start_or_stop_field_are_keep_then_magnet_is_na(start_field, stop_field, magnet_device)
+        reason = self.rules.reason(start_temperature=start_temperature, stop_temperature=stop_temperature,
+                                   step_temperature=step_temperature, start_field=start_field,
+                                   stop_field=stop_field, n_fields=n_fields, magnet_device=magnet_device)
+        # The data budget can only be checked once the scans are valid
+        if reason == "":
+            reason += self.check_row_data_budget(start_temperature, stop_temperature, step_temperature,
+                                                 start_field, stop_field, n_fields, custom, mevents, magnet_device)
         # If there is no reason return None i.e. the parameters are valid
         if reason != "":
             return reason
@@ -354,7 +451,7 @@ If the field is zero, active ZF will be engaged automatically.
 
     def check_start_and_stop_valid(self, start, stop, variable_name):
         """
-        Check that start and stop are either both None or both values.
+        Check that start and stop are either both None or both values, as the keep_together rule of rules does.
 
         Parameters:
           start (float): The start value of a scan.
@@ -364,32 +461,29 @@ If the field is zero, active ZF will be engaged automatically.
         Returns:
           str: An empty string if start and stop are valid, or a string containing a reason why they are not.
         """
-        if (start is None and stop is not None) or (stop is None and start is not None):
-            return "If start {0} or stop {0} is keep, the other must also be keep\n".format(variable_name)
-        else:
-            return ""
-    
+        return self.rules.axis_reason(("keep_together",), variable_name, start, stop)
+
     def check_if_start_or_stop_field_are_keep_then_magnet_is_na(self, start_field, stop_field, magnet):
-      """
-      Check that if the start or stop fields are keep then the magnet is set to N/A
+        """
+        Check that if the start or stop fields are keep then the magnet is set to N/A, as the kept_field_with_magnet
+        rule of rules does.
 
-      Parameters:
+        Parameters:
           start_field (float): The start value of a scan.
           stop_field (float): The end value of a scan.
           magnet (str): The magnet device selected.
 
         Returns:
-          str: A string to raise awareness of invalidity if start or stop are "keep" and the magnet is not N/A, 
-           or an empty string to show they are valid. 
-      """
-      if (start_field is None or stop_field is None) and magnet != magnet_not_applicable:
-        return "If start_field or stop_field is keep, then the selected magnet must be N/A".format()
-      else:
-        return ""
+          str: A string to raise awareness of invalidity if start or stop are "keep" and the magnet is not N/A,
+           or an empty string to show they are valid.
+        """
+        return self.rules.axis_reason(("kept_field_with_magnet",), "field", start_field, stop_field,
+                                      magnet_device=magnet)
 
     def check_step_set_correctly(self, start, stop, step, variable_name):
         """
-        If we are scanning check that the step is positive and not zero.
+        If we are scanning check that the step is positive and not zero, as the step_zero and step_negative rules of
+        rules do.
 
         Parameters:
           start (float): The start value of a scan.
@@ -400,21 +494,12 @@ If the field is zero, active ZF will be engaged automatically.
         Returns:
           str: An empty string if valid, or a string containing a reason why they are not.
         """
-        reason = ""
-        set_definition = self.check_set_definition(start, stop)
-        if set_definition == SetDefinition.SCAN:
-            # We need to step through at some rate
-            if step == 0.0:
-                reason += "Cannot step through {}s when step is zero\n".format(variable_name)
-            elif step < 0.0:
-                reason += "Step {} must be positive\n".format(variable_name)
-        return reason
+        return self.rules.axis_reason(("step_zero", "step_negative"), variable_name, start, stop, step)
 
     def check_magnet_selected_correctly(self, start_field, stop_field, magnet_device):
         """
-        If we are setting a field check:
+        If we are setting a field check, as the magnet rules of rules do:
          - The magnet device that has been selected is a valid one i.e. one of our listed magnet devices
-         - If the field is zero we are using the active zero field device
          - If the field is not zero we are not using the the active zero field device
 
         Parameters:
@@ -425,14 +510,40 @@ If the field is zero, active ZF will be engaged automatically.
         Returns:
           str: An empty string if valid, or a string containing a reason why they are not.
         """
-        reason = ""
-        field_set_definition = self.check_set_definition(start_field, stop_field)
-        if field_set_definition != SetDefinition.UNDEFINED:
-            # If we are setting a field we need to set the magnet device to use
-            if magnet_device not in magnet_devices.values():
-                reason += "Field set but magnet devices {} not in possible devices {}\n".format(
-                    magnet_device, list(magnet_devices.keys()))
-            if (not np.isclose(start_field, 0.0) or not np.isclose(stop_field,
-                                                                   0.0)) and magnet_device == self.active_zf:
-                reason += "Cannot set a non-zero field with the active zero field\n"
-        return reason
+        return self.rules.axis_reason(magnet_selection_codes, "field", start_field, stop_field,
+                                      magnet_device=magnet_device)
+
+    def check_row_data_budget(self, start_temperature, stop_temperature, step_temperature,
+                              start_field, stop_field, n_fields, custom, mevents, magnet_device):
+        """
+        Check that the runs of a row do not write data faster than EMU can take it. The scans of the row must be valid.
+
+        Returns:
+          str: An empty string if the row is within the data budget, or a string containing a reason why it is not.
+        """
+        cost_model = calibrated_cost_model("EMU", global_param(self, "Rate (Mev/hr)"))
+        if not may_exceed_data_budget(mevents, cost_model):
+            return ""
+        plan, _ = self.get_scan_plan(start_temperature, stop_temperature, step_temperature,
+                                     start_field, stop_field, n_fields, mevents)
+        return check_data_budget(plan, cost_model)
+
+    def validate_table(self, rows):
+        """
+        Validate every row of a script in one call, giving the same reasons as parameters_valid does for each row but
+        casting each column once and checking the rules of every row together.
+
+        Returns:
+          list: Why each row is not valid, or None if it is.
+        """
+        return validate_rows(self, rows)
+
+    def analyse_script(self, rows):
+        """
+        Find what the rows of a script waste beam time on together that no row can see alone, e.g. switching magnet
+        devices back and forth or measuring a point twice.
+
+        Returns:
+          ScriptAnalysis: What wastes beam time, with the seconds each wastes.
+        """
+        return analyse_script(self, rows)
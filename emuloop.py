@@ -1,12 +1,55 @@
+from collections import OrderedDict
+from contextlib import nullcontext
 from enum import Enum
 from types import ModuleType
-from typing import Callable, Generator, Optional
+from typing import List, Mapping, Optional, Sequence, Tuple
 
 import numpy as np
 from genie_python import genie as g
-from genie_python.genie_script_generator import ScriptDefinition, cast_parameters_to
-
-from script_utilities import get_steps
+from genie_python.genie_script_generator import ScriptDefinition
+
+from batch_estimate import TableEstimate, estimate_scan_seconds, estimate_scan_table
+from beam_rate import beam_schedule_version
+from cast_row import cast_row_parameters
+from data_volume import check_data_budget, get_data_volume_model, may_exceed_data_budget
+from estimate_history import (
+    BEGIN,
+    COUNT,
+    END,
+    SET,
+    SWITCH,
+    calibrate_for_run,
+    calibrated_cost_model,
+    history_version,
+    set_features,
+    timed_phase,
+)
+from plan_optimiser import (
+    emu_transition_costs,
+    max_optimised_points,
+    optimise_plan,
+    plan_cost,
+    sweep_plan_cost,
+)
+from plan_summary import summarise_plan, summarise_sweep_plan
+from progress import ProgressTracker, measured, track_plan
+from scan_plan import (
+    OPTIMISED,
+    RASTER,
+    SERPENTINE,
+    ScanAction,
+    ScanPlan,
+    Sweep,
+    SweepPlan,
+    round_trip,
+    round_trip_cycles_type,
+    scan_ordering_type,
+)
+from script_analysis import ScriptAnalysis, analyse_script
+from script_utilities import cached_steps, global_param, memoise_row
+from table_validation import validate_rows
+from timeline import RowPlan
+from validation_rules import emu_rules, magnet_selection_codes
 
 
 class SetDefinition(Enum):
@@ -89,7 +132,7 @@ def cast_custom_expression(expression: str) -> str:
         return expression
 
 
-def inclusive_float_range_with_step_flip(start: float, stop: float, step: float) -> Generator:
+def inclusive_float_range_with_step_flip(start: float, stop: float, step: float) -> np.ndarray:
     """
     If we are counting downwards from start to stop automatically flips step to be negative.
     Inclusive of stop. Only tested for float values.
@@ -100,36 +143,70 @@ def inclusive_float_range_with_step_flip(start: float, stop: float, step: float)
       step (float): the steps to take from start to stop
 
     Returns:
-      The range from start to stop including all steps in between.
+      numpy.ndarray: The range from start to stop including all steps in between. It is cached
+        and shared between calls with the same range, so it cannot be written to.
 
     Examples:
       >>> inclusive_float_range_with_step_flip(0.5, 2, 0.5) == [0.5, 1, 1.5, 2]
       >>> inclusive_float_range_with_step_flip(2, 0.5, 0.5) == [2, 1.5, 1, 0.5]
     """
-    yield from get_steps(start, step, stop)
+    return cached_steps(start, step, stop)
+
+
+# The casters of the parameters of each row
+parameter_casters = {
+    "start_temperature": float_or_keep,
+    "stop_temperature": float_or_keep,
+    "step_temperature": float,
+    "start_field": float_or_keep,
+    "stop_field": float_or_keep,
+    "step_field": float,
+    "custom": cast_custom_expression,
+    "mevents": float,
+    "magnet_device": magnet_device_type,
+}
 
 
 class DoRun(ScriptDefinition):
     active_zf = "Active ZF"
     possible_magnet_devices = [active_zf, "Danfysik", "T20 Coils"]
+    rules = emu_rules(magnet_devices, active_zf, magnet_not_applicable)
+    parameter_casters = parameter_casters
+    # The parameters check_row_data_budget reads
+    data_budget_parameters = (
+        "start_temperature",
+        "stop_temperature",
+        "step_temperature",
+        "start_field",
+        "stop_field",
+        "step_field",
+        "mevents",
+    )
+    global_params_definition = OrderedDict(
+        {
+            "Field ordering": (RASTER, scan_ordering_type),
+            "Round trip cycles": ("0", round_trip_cycles_type),
+        }
+    )
 
     def get_help(self) -> str:
         return (
             f"Magnet device must be one of {list(magnet_devices.keys())} or if the field is "
             f"KEEP then it can be N/A.\nIf the field is zero magnet device must be ZF.\n"
+            f"When scanning both temperature and field the Field ordering global parameter can be "
+            f"{RASTER} (sweep the fields from start to stop at every temperature) or {SERPENTINE} "
+            f"(reverse the sweep on alternate temperatures to save ramping the magnet back) or "
+            f"{OPTIMISED} (visit the points in the quickest order to set them in, given that the "
+            f"cryostat cools slower than it warms, or for more than {max_optimised_points} "
+            f"points by visiting the temperatures in turn and sweeping the fields at each from the "
+            f"nearer end).\n"
+            f"If Round trip cycles is more than 0 the field (or the temperature if only it is "
+            f"scanned) is swept from start to stop and back that many times, measuring each "
+            f"turning point once, and the Field ordering is {RASTER}.\n"
         )
 
-    @cast_parameters_to(
-        start_temperature=float_or_keep,
-        stop_temperature=float_or_keep,
-        step_temperature=float,
-        start_field=float_or_keep,
-        stop_field=float_or_keep,
-        step_field=float,
-        custom=cast_custom_expression,
-        mevents=float,
-        magnet_device=magnet_device_type,
-    )
+    @memoise_row(history_version, beam_schedule_version)
+    @cast_row_parameters(parameter_casters)
     def estimate_time(
         self,
         start_temperature: Optional[float] = 1.0,
@@ -141,21 +218,123 @@ class DoRun(ScriptDefinition):
         custom: str = "None",
         mevents: float = 10,
         magnet_device: str = "N/A",
-    ) -> int:
-        return 0
+    ) -> float:
+        return estimate_scan_seconds(
+            self,
+            calibrated_cost_model("EMU"),
+            start_temperature,
+            stop_temperature,
+            step_temperature,
+            start_field,
+            stop_field,
+            step_field,
+            mevents,
+        )
+
+    @classmethod
+    def estimate_table(
+        cls, rows: Sequence[Mapping[str, str]], global_params: Optional[Mapping[str, str]] = None
+    ) -> TableEstimate:
+        """
+        Estimate every row of a script in one call, giving the same estimates as estimate_time
+        does for each row but casting each column once and estimating the rows together.
+
+        Parameters:
+          rows (Sequence[Mapping[str, str]]): the raw parameters of each row
+          global_params (Mapping[str, str]): the raw global parameters of the script, the defaults
+            if None
+
+        Returns:
+          TableEstimate: The seconds each row is estimated to take (NaN where its parameters
+            cannot be cast) and their total.
+        """
+        script_definition = cls()
+        script_definition.global_params = dict(global_params) if global_params else None
+        return estimate_scan_table(
+            script_definition, rows, parameter_casters, calibrated_cost_model("EMU")
+        )
+
+    @memoise_row(history_version, beam_schedule_version)
+    @cast_row_parameters(parameter_casters)
+    def estimate_custom(
+        self,
+        start_temperature: Optional[float] = "keep",  # type: ignore[reportArgumentType]
+        stop_temperature: Optional[float] = "keep",  # type: ignore[reportArgumentType]
+        step_temperature: float = 0,
+        start_field: Optional[float] = "keep",  # type: ignore[reportArgumentType]
+        stop_field: Optional[float] = "keep",  # type: ignore[reportArgumentType]
+        step_field: float = 0,
+        custom: str = "None",
+        mevents: float = 10,
+        magnet_device: str = "N/A",
+    ) -> OrderedDict:
+        scan_parameters = (
+            start_temperature,
+            stop_temperature,
+            step_temperature,
+            start_field,
+            stop_field,
+            step_field,
+        )
+        # Temperatures and fields set once are set by run before the plan
+        point_sets = [
+            self.check_set_definition(start_temperature, stop_temperature),
+            self.check_set_definition(start_field, stop_field),
+        ].count(SetDefinition.POINT)
+        cost_model, data_volume_model = calibrated_cost_model("EMU"), get_data_volume_model("EMU")
+        sweep_plan = self.get_sweep_plan(*scan_parameters, mevents)
+        if sweep_plan is None:
+            plan = self.get_scan_plan(*scan_parameters, mevents)
+            estimate = summarise_plan(
+                plan, cost_model, data_volume_model, point_sets=point_sets
+            ).custom_estimate()
+            field_ramp_saved, time_saved = self.get_ordering_saving(plan, *scan_parameters)
+        else:
+            # Costed in closed form from the sweeps, without compiling the plan
+            estimate = summarise_sweep_plan(
+                sweep_plan, cost_model, data_volume_model, point_sets=point_sets
+            ).custom_estimate()
+            raster_plan = sweep_plan._replace(ordering=RASTER)
+            field_ramp_saved = raster_plan.field_ramp - sweep_plan.field_ramp
+            time_saved = sweep_plan_cost(raster_plan, emu_transition_costs) - sweep_plan_cost(
+                sweep_plan, emu_transition_costs
+            )
+        estimate["Field ramp saved"] = f"{field_ramp_saved:g}"
+        estimate["Ordering time saved (s)"] = f"{time_saved:.0f}"
+        return estimate
+
+    @cast_row_parameters(parameter_casters)
+    def get_row_plan(
+        self,
+        start_temperature: Optional[float] = "keep",  # type: ignore[reportArgumentType]
+        stop_temperature: Optional[float] = "keep",  # type: ignore[reportArgumentType]
+        step_temperature: float = 0,
+        start_field: Optional[float] = "keep",  # type: ignore[reportArgumentType]
+        stop_field: Optional[float] = "keep",  # type: ignore[reportArgumentType]
+        step_field: float = 0,
+        custom: str = "None",
+        mevents: float = 10,
+        magnet_device: str = "N/A",
+    ) -> RowPlan:
+        """
+        Get the plan of a row and the model of how long it takes, to lay the row out on a Timeline.
+
+        Returns:
+          RowPlan: The plan of the row and the calibrated cost model of EMU.
+        """
+        plan = self.get_scan_plan(
+            start_temperature,
+            stop_temperature,
+            step_temperature,
+            start_field,
+            stop_field,
+            step_field,
+            mevents,
+        )
+        return RowPlan(plan, calibrated_cost_model("EMU"))
 
     # Loop through a set of temperatures or fields using a start, stop and step mechanism
-    @cast_parameters_to(
-        start_temperature=float_or_keep,
-        stop_temperature=float_or_keep,
-        step_temperature=float,
-        start_field=float_or_keep,
-        stop_field=float_or_keep,
-        step_field=float,
-        custom=cast_custom_expression,
-        mevents=float,
-        magnet_device=magnet_device_type,
-    )
+    @cast_row_parameters(parameter_casters)
     def run(
         self,
         start_temperature: Optional[float] = "keep",  # type: ignore[reportArgumentType],
@@ -168,6 +347,8 @@ class DoRun(ScriptDefinition):
         mevents: float = 10,
         magnet_device: str = "N/A",
     ) -> None:
+        # Phases of this run are predicted with the history as it is when the run starts
+        calibrate_for_run()
         # Scan if start and stop are different, set once if they are equal or do not set if they are
         # None
         temp_set_definition = self.check_set_definition(start_temperature, stop_temperature)
@@ -184,14 +365,9 @@ class DoRun(ScriptDefinition):
             inst.settemp(start_temperature, wait=True)
         if field_set_definition == SetDefinition.POINT:
             inst.setmag(start_field, wait=True)
-        # If we are running scans do them
-        if temp_set_definition == SetDefinition.SCAN and field_set_definition == SetDefinition.SCAN:
-            assert start_temperature is not None
-            assert stop_temperature is not None
-            assert start_field is not None
-            assert stop_field is not None
-            # When we are running scans for both temperature and field do all combinations
-            self.run_temp_and_field_scans(
+        # Run the scans (or a single run with temp and field as they are if we are not scanning)
+        self.run_plan(
+            self.get_scan_plan(
                 start_temperature,
                 stop_temperature,
                 step_temperature,
@@ -199,37 +375,27 @@ class DoRun(ScriptDefinition):
                 stop_field,
                 step_field,
                 mevents,
-                inst,
-            )
-        elif temp_set_definition == SetDefinition.SCAN:  # Run scans for the temperature
-            assert start_temperature is not None
-            assert stop_temperature is not None
-            self.run_scans(
-                start_temperature,
-                stop_temperature,
-                step_temperature,
-                mevents,
-                inst.settemp,
-            )
-        elif field_set_definition == SetDefinition.SCAN:  # Run scans for the field
-            assert start_field is not None
-            assert stop_field is not None
-            self.run_scans(start_field, stop_field, step_field, mevents, inst.setmag)
-        else:
-            # If we are not doing any scans do a run with temp and field as they are
-            self.check_mevents_and_begin_waitfor_mevents_end(mevents)
+            ),
+            inst,
+        )
 
-    def check_mevents_and_begin_waitfor_mevents_end(self, mevents: float) -> None:
+    def check_mevents_and_begin_waitfor_mevents_end(
+        self, mevents: float, progress: Optional[ProgressTracker] = None
+    ) -> None:
         """
         If mevents are more than zero do a run and wait for the mevents in that run.
 
         Parameters:
           mevents (float): The millions of events to wait for.
+          progress (ProgressTracker): The tracker of the plan the run is part of, if any.
         """
         if mevents > 0:
-            g.begin(quiet=True)
-            g.waitfor_mevents(mevents)
-            g.end(quiet=True)
+            with timed_phase(BEGIN), measured(progress, BEGIN):
+                g.begin(quiet=True)
+            with timed_phase(COUNT, mevents=mevents), measured(progress, COUNT):
+                g.waitfor_mevents(mevents)
+            with timed_phase(END), measured(progress, END):
+                g.end(quiet=True)
 
     def set_magnet_device(self, magnet_device: str, inst: ModuleType) -> None:
         """
@@ -245,7 +411,8 @@ class DoRun(ScriptDefinition):
             "T20 Coils": inst.tf0,
         }
         if g.cget("a_selected_magnet")["value"] != magnet_device:
-            magnet_to_function_map[magnet_device]()
+            with timed_phase(SWITCH):
+                magnet_to_function_map[magnet_device]()
 
     def check_set_definition(
         self, start_temp_or_field: Optional[float], stop_temp_or_field: Optional[float]
@@ -270,19 +437,44 @@ class DoRun(ScriptDefinition):
         else:
             return SetDefinition.SCAN
 
-    def run_temp_and_field_scans(
+    def get_scan_axis(
+        self, start: Optional[float], stop: Optional[float], step: float
+    ) -> Optional[np.ndarray]:
+        """
+        Get the values a temperature or field takes in a scan plan.
+
+        Parameters:
+          start (float): The value to start the scan with or set once.
+          stop (float): The value to end the scan with (inclusive).
+          step (float): The size of the steps to take from start to stop.
+
+        Returns:
+          np.ndarray: The values of the scan, the one value if it is set once or None if it is not
+            set.
+        """
+        set_definition = self.check_set_definition(start, stop)
+        if set_definition == SetDefinition.UNDEFINED:
+            return None
+        assert start is not None
+        assert stop is not None
+        if set_definition == SetDefinition.POINT:
+            return np.array([start])
+        return inclusive_float_range_with_step_flip(start, stop, step)
+
+    def get_scan_plan(
         self,
-        start_temperature: float,
-        stop_temperature: float,
+        start_temperature: Optional[float],
+        stop_temperature: Optional[float],
         step_temperature: float,
-        start_field: float,
-        stop_field: float,
+        start_field: Optional[float],
+        stop_field: Optional[float],
         step_field: float,
         mevents: float,
-        inst: ModuleType,
-    ) -> None:
+        ordering: Optional[str] = None,
+    ) -> ScanPlan:
         """
-        Run scans for both the temperature and field.
+        Compile every point of the scans into a plan, measuring every field at each temperature.
+        Temperatures and fields that are only set once are recorded in the plan but not set by it.
 
         Parameters:
           start_temperature (float): The temperature to start the temperature scan with.
@@ -293,49 +485,191 @@ class DoRun(ScriptDefinition):
           stop_field (float): The field to end the field scan with (inclusive).
           step_field (float): The size of the steps to take to go from start_field to stop_field.
           mevents (float): The amount of millions of events to wait for in each run.
-          inst (module): The instrument scripts module to set the temperature and field with.
+          ordering (str): The order to visit the points in, the Field ordering global parameter if
+            None. Always RASTER when there are Round trip cycles.
+
+        Returns:
+          ScanPlan: The plan of the scans.
         """
-        for temp in inclusive_float_range_with_step_flip(
-            start_temperature, stop_temperature, step_temperature
-        ):
-            inst.settemp(temp, wait=True)
-            self.run_scans(start_field, stop_field, step_field, mevents, inst.setmag)
+        temperatures = self.get_scan_axis(start_temperature, stop_temperature, step_temperature)
+        fields = self.get_scan_axis(start_field, stop_field, step_field)
+        set_temperature = (
+            self.check_set_definition(start_temperature, stop_temperature) == SetDefinition.SCAN
+        )
+        set_field = self.check_set_definition(start_field, stop_field) == SetDefinition.SCAN
+        cycles = global_param(self, "Round trip cycles")
+        if cycles > 0:
+            # Reordering the points would undo the sweeps there and back
+            ordering = RASTER
+            if set_field:
+                fields = round_trip(fields, cycles)
+            elif set_temperature:
+                temperatures = round_trip(temperatures, cycles)
+        elif ordering is None:
+            ordering = global_param(self, "Field ordering")
+        plan = ScanPlan.from_axes(
+            temperatures,
+            fields,
+            mevents,
+            ordering=ordering,
+            set_temperature=set_temperature,
+            set_field=set_field,
+        )
+        if ordering == OPTIMISED:
+            plan = optimise_plan(plan, emu_transition_costs).plan
+        return plan
+
+    def get_axis_sweep(self, start: Optional[float], stop: Optional[float], step: float) -> Sweep:
+        """
+        Get the sweep of the values get_scan_axis gives without generating them.
+
+        Parameters:
+          start (float): The value to start the scan with or set once.
+          stop (float): The value to end the scan with (inclusive).
+          step (float): The size of the steps to take from start to stop.
 
-    def run_scans(
+        Returns:
+          Sweep: The sweep of the scan, of the one value if it is set once or of NaN if it is not
+            set.
+        """
+        set_definition = self.check_set_definition(start, stop)
+        if set_definition == SetDefinition.UNDEFINED:
+            return Sweep(np.nan, np.nan, 1)
+        assert start is not None
+        assert stop is not None
+        if set_definition == SetDefinition.POINT:
+            return Sweep(start, start, 1)
+        return Sweep.from_steps(start, step, stop)
+
+    def get_sweep_plan(
         self,
-        start: float,
-        stop: float,
-        step: float,
+        start_temperature: Optional[float],
+        stop_temperature: Optional[float],
+        step_temperature: float,
+        start_field: Optional[float],
+        stop_field: Optional[float],
+        step_field: float,
         mevents: float,
-        set_parameter_func: Callable,
-    ) -> None:
+    ) -> Optional[SweepPlan]:
         """
-        Run a scan for the given set_parameter_func
+        Describe the plan get_scan_plan compiles by the sweeps of its temperatures and fields, so
+        that it can be estimated without compiling it (see SweepPlan).
 
         Parameters:
-          start (float): The value to start the scan with.
-          stop (float): The value to end the scan with.
-          step (float): The size of the steps to take from start to stop.
+          start_temperature (float): The temperature to start the temperature scan with.
+          stop_temperature (float): The temperature to end the temperature scan with (inclusive).
+          step_temperature (float): The size of the steps to take to go from start_temperature to
+            stop_temperature.
+          start_field (float): The field to start the field scan with.
+          stop_field (float): The field to end the field scan with (inclusive).
+          step_field (float): The size of the steps to take to go from start_field to stop_field.
           mevents (float): The amount of millions of events to wait for in each run.
-          set_parameter_func (function): A function to call to set the value with each step of the
-            scan.
+
+        Returns:
+          SweepPlan: The plan of the scans, or None if it is in OPTIMISED order and has few enough
+            points for optimise_plan to reorder them, which needs the plan compiled.
+        """
+        temperatures = self.get_axis_sweep(start_temperature, stop_temperature, step_temperature)
+        fields = self.get_axis_sweep(start_field, stop_field, step_field)
+        set_temperature = (
+            self.check_set_definition(start_temperature, stop_temperature) == SetDefinition.SCAN
+        )
+        set_field = self.check_set_definition(start_field, stop_field) == SetDefinition.SCAN
+        cycles = global_param(self, "Round trip cycles")
+        if cycles > 0:
+            # Reordering the points would undo the sweeps there and back
+            ordering = RASTER
+            if set_field:
+                fields = fields.round_trip(cycles)
+            elif set_temperature:
+                temperatures = temperatures.round_trip(cycles)
+        else:
+            ordering = global_param(self, "Field ordering")
+        plan = SweepPlan(temperatures, fields, mevents, set_temperature, set_field, ordering)
+        if ordering == OPTIMISED:
+            if plan.points <= max_optimised_points:
+                return None
+            # Larger plans are ordered by visiting the temperatures in turn and sweeping the
+            # fields from the nearer end, which is the serpentine order of the sweeps
+            plan = plan._replace(ordering=SERPENTINE)
+        return plan
+
+    def get_ordering_saving(
+        self,
+        plan: ScanPlan,
+        start_temperature: Optional[float],
+        stop_temperature: Optional[float],
+        step_temperature: float,
+        start_field: Optional[float],
+        stop_field: Optional[float],
+        step_field: float,
+    ) -> Tuple[float, float]:
         """
-        for var in inclusive_float_range_with_step_flip(start, stop, step):
-            set_parameter_func(var, wait=True)
-            self.check_mevents_and_begin_waitfor_mevents_end(mevents)
+        Get how much less the magnet is ramped, and how much time setting temperatures and fields
+        is saved, by visiting the points of the scans in the Field ordering rather than in raster
+        order.
+
+        Parameters:
+          plan (ScanPlan): The plan of the scans in the Field ordering (see get_scan_plan).
+          start_temperature (float): The temperature to start the temperature scan with.
+          stop_temperature (float): The temperature to end the temperature scan with (inclusive).
+          step_temperature (float): The size of the steps to take to go from start_temperature to
+            stop_temperature.
+          start_field (float): The field to start the field scan with.
+          stop_field (float): The field to end the field scan with (inclusive).
+          step_field (float): The size of the steps to take to go from start_field to stop_field.
+
+        Returns:
+          Tuple[float, float]: The field ramp saved and the seconds saved.
+        """
+        raster_plan = self.get_scan_plan(
+            start_temperature,
+            stop_temperature,
+            step_temperature,
+            start_field,
+            stop_field,
+            step_field,
+            0,
+            ordering=RASTER,
+        )
+        return (
+            raster_plan.field_ramp - plan.field_ramp,
+            plan_cost(raster_plan, emu_transition_costs) - plan_cost(plan, emu_transition_costs),
+        )
+
+    def run_plan(self, plan: ScanPlan, inst: ModuleType) -> None:
+        """
+        Set the temperature and field and do the runs for each point of a scan plan in turn.
+        How long setting each point after the first takes is recorded in the estimate history.
+        The time left is predicted as the plan runs and reported to the progress callbacks.
+
+        Parameters:
+          plan (ScanPlan): The plan to run.
+          inst (module): The instrument scripts module to set the temperature and field with.
+        """
+        progress = track_plan(plan, calibrated_cost_model("EMU"))
+        previous = None
+        for index, point in enumerate(plan):
+            progress.start_point(index)
+            setting = (
+                timed_phase(SET, **set_features(previous, point))
+                if previous is not None
+                and point["action"] & (ScanAction.SET_TEMPERATURE | ScanAction.SET_FIELD)
+                else nullcontext()
+            )
+            with setting, progress.measure(SET):
+                if point["action"] & ScanAction.SET_TEMPERATURE:
+                    inst.settemp(float(point["temperature"]), wait=True)
+                if point["action"] & ScanAction.SET_FIELD:
+                    inst.setmag(float(point["field"]), wait=True)
+            previous = point
+            if point["action"] & ScanAction.COUNT:
+                self.check_mevents_and_begin_waitfor_mevents_end(float(point["mevents"]), progress)
+        progress.finish()
 
     # Check to see if the provided parameters are valid
-    @cast_parameters_to(
-        start_temperature=float_or_keep,
-        stop_temperature=float_or_keep,
-        step_temperature=float,
-        start_field=float_or_keep,
-        stop_field=float_or_keep,
-        step_field=float,
-        custom=cast_custom_expression,
-        mevents=float,
-        magnet_device=magnet_device_type,
-    )
+    @memoise_row(history_version)
+    @cast_row_parameters(parameter_casters)
     def parameters_valid(
         self,
         start_temperature: Optional[float] = 1.0,
@@ -349,19 +683,28 @@ class DoRun(ScriptDefinition):
         magnet_device: str = "N/A",
     ) -> Optional[str]:
         # The reason as to why the parameters are not valid
-        reason = ""
-        reason += self.check_start_and_stop_valid(
-            start_temperature, stop_temperature, "temperature"
-        )
-        reason += self.check_start_and_stop_valid(start_field, stop_field, "field")
-        reason += self.check_step_set_correctly(
-            start_temperature, stop_temperature, step_temperature, "temperature"
-        )
-        reason += self.check_step_set_correctly(start_field, stop_field, step_field, "field")
-        reason += self.check_magnet_selected_correctly(start_field, stop_field, magnet_device)
-        reason += self.check_if_start_or_stop_field_are_keep_then_magnet_is_na(
-            start_field, stop_field, magnet_device
+        reason = self.rules.reason(
+            start_temperature=start_temperature,
+            stop_temperature=stop_temperature,
+            step_temperature=step_temperature,
+            start_field=start_field,
+            stop_field=stop_field,
+            step_field=step_field,
+            magnet_device=magnet_device,
         )
+        # The data budget can only be checked once the scans are valid
+        if reason == "":
+            reason += self.check_row_data_budget(
+                start_temperature,
+                stop_temperature,
+                step_temperature,
+                start_field,
+                stop_field,
+                step_field,
+                custom,
+                mevents,
+                magnet_device,
+            )
         # If there is no reason return None i.e. the parameters are valid
         if reason != "":
             return reason
@@ -372,7 +715,8 @@ class DoRun(ScriptDefinition):
         self, start: Optional[float], stop: Optional[float], variable_name: str
     ) -> str:
         """
-        Check that start and stop are either both None or both values.
+        Check that start and stop are either both None or both values, as the keep_together rule
+        of rules does.
 
         Parameters:
           start (float): The start value of a scan.
@@ -383,18 +727,14 @@ class DoRun(ScriptDefinition):
           str: An empty string if start and stop are valid, or a string containing a reason why they
            are not.
         """
-        if (start is None and stop is not None) or (stop is None and start is not None):
-            return "If start {0} or stop {0} is keep, the other must also be keep\n".format(
-                variable_name
-            )
-        else:
-            return ""
+        return self.rules.axis_reason(("keep_together",), variable_name, start, stop)
 
     def check_if_start_or_stop_field_are_keep_then_magnet_is_na(
         self, start_field: Optional[float], stop_field: Optional[float], magnet: str
     ) -> str:
         """
-        Check that if the start or stop fields are keep then the magnet is set to N/A
+        Check that if the start or stop fields are keep then the magnet is set to N/A, as the
+        kept_field_with_magnet rule of rules does.
 
         Parameters:
             start_field (float): The start value of a scan.
@@ -405,10 +745,9 @@ class DoRun(ScriptDefinition):
             str: A string to raise awareness of invalidity if start or stop are "keep" and the
                 magnet is not N/A, or an empty string to show they are valid.
         """
-        if (start_field is None or stop_field is None) and magnet != magnet_not_applicable:
-            return "If start_field or stop_field is keep, then the selected magnet must be N/A"
-        else:
-            return ""
+        return self.rules.axis_reason(
+            ("kept_field_with_magnet",), "field", start_field, stop_field, magnet_device=magnet
+        )
 
     def check_step_set_correctly(
         self,
@@ -418,7 +757,8 @@ class DoRun(ScriptDefinition):
         variable_name: str,
     ) -> str:
         """
-        If we are scanning check that the step is positive and not zero.
+        If we are scanning check that the step is positive and not zero, as the step_zero and
+        step_negative rules of rules do.
 
         Parameters:
           start (float): The start value of a scan.
@@ -429,17 +769,9 @@ class DoRun(ScriptDefinition):
         Returns:
           str: An empty string if valid, or a string containing a reason why they are not.
         """
-        reason = ""
-        set_definition = self.check_set_definition(start, stop)
-        if set_definition == SetDefinition.SCAN:
-            assert start is not None
-            assert stop is not None
-            # We need to step through at some rate
-            if step == 0.0:
-                reason += "Cannot step through {}s when step is zero\n".format(variable_name)
-            elif step < 0.0:
-                reason += "Step {} must be positive\n".format(variable_name)
-        return reason
+        return self.rules.axis_reason(
+            ("step_zero", "step_negative"), variable_name, start, stop, step
+        )
 
     def check_magnet_selected_correctly(
         self,
@@ -448,9 +780,10 @@ class DoRun(ScriptDefinition):
         magnet_device: str,
     ) -> str:
         """
-        If we are setting a field check:
+        If we are setting a field check, as the magnet rules of rules do:
          - The magnet device that has been selected is a valid one i.e. one of our listed magnet
-            devices If the field is zero we are using the active zero field device
+            devices
+         - If the field is zero we are using the active zero field device
          - If the field is not zero we are not using the the active zero field device
 
         Parameters:
@@ -461,27 +794,67 @@ class DoRun(ScriptDefinition):
         Returns:
           str: An empty string if valid, or a string containing a reason why they are not.
         """
-        reason = ""
-        field_set_definition = self.check_set_definition(start_field, stop_field)
-        if field_set_definition != SetDefinition.UNDEFINED:
-            assert start_field is not None
-            assert stop_field is not None
-            # If we are setting a field we need to set the magnet device to use
-            if magnet_device not in magnet_devices.values():
-                reason += (
-                    f"Field set but magnet devices {magnet_device} "
-                    f"not in possible devices {list(magnet_devices.keys())}\n"
-                )
-            # Only the zero field can set a field of zero
-            if (
-                np.isclose(start_field, 0.0) or np.isclose(stop_field, 0.0)
-            ) and magnet_device != self.active_zf:
-                reason += (
-                    f"Trying to set a zero field without using the active zero field "
-                    f"({magnet_device}, {self.active_zf})\n"
-                )
-            if (
-                not np.isclose(start_field, 0.0) or not np.isclose(stop_field, 0.0)
-            ) and magnet_device == self.active_zf:
-                reason += "Cannot set a non-zero field with the active zero field\n"
-        return reason
+        return self.rules.axis_reason(
+            magnet_selection_codes, "field", start_field, stop_field, magnet_device=magnet_device
+        )
+
+    def check_row_data_budget(
+        self,
+        start_temperature: Optional[float],
+        stop_temperature: Optional[float],
+        step_temperature: float,
+        start_field: Optional[float],
+        stop_field: Optional[float],
+        step_field: float,
+        custom: str,
+        mevents: float,
+        magnet_device: str,
+    ) -> str:
+        """
+        Check that the runs of a row do not write data faster than EMU can take it. The scans of
+        the row must be valid.
+
+        Returns:
+          str: An empty string if the row is within the data budget, or a string containing a
+            reason why it is not.
+        """
+        cost_model = calibrated_cost_model("EMU")
+        if not may_exceed_data_budget(mevents, cost_model):
+            return ""
+        plan = self.get_scan_plan(
+            start_temperature,
+            stop_temperature,
+            step_temperature,
+            start_field,
+            stop_field,
+            step_field,
+            mevents,
+        )
+        return check_data_budget(plan, cost_model)
+
+    def validate_table(self, rows: Sequence[Mapping[str, str]]) -> List[Optional[str]]:
+        """
+        Validate every row of a script in one call, giving the same reasons as parameters_valid
+        does for each row but casting each column once and checking the rules of every row
+        together.
+
+        Parameters:
+          rows (Sequence[Mapping[str, str]]): the raw parameters of each row
+
+        Returns:
+          List[Optional[str]]: Why each row is not valid, or None if it is.
+        """
+        return validate_rows(self, rows)
+
+    def analyse_script(self, rows: Sequence[Mapping[str, str]]) -> ScriptAnalysis:
+        """
+        Find what the rows of a script waste beam time on together that no row can see alone, e.g.
+        switching magnet devices back and forth or measuring a point twice.
+
+        Parameters:
+          rows (Sequence[Mapping[str, str]]): the raw parameters of each row
+
+        Returns:
+          ScriptAnalysis: What wastes beam time, with the seconds each wastes.
+        """
+        return analyse_script(self, rows)
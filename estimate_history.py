@@ -0,0 +1,404 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import ContextManager, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+from cost_model import CostModel, get_cost_model
+from plan_optimiser import TransitionCosts
+from script_utilities import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Set this environment variable to the path of an SQLite file to record how long each phase of
+# each run takes in it. Nothing is recorded (and estimates are not calibrated) if it is not set.
+HISTORY_PATH_VARIABLE = "EMU_ESTIMATE_HISTORY"
+
+# The phases of a run. SET is ramping and settling the temperature and field to a point, COUNT is
+# waiting for the events of a run, BEGIN and END are beginning and ending a run and SWITCH is
+# selecting a different magnet device.
+SET = "set"
+COUNT = "count"
+BEGIN = "begin"
+END = "end"
+SWITCH = "switch"
+
+# What is recorded about each phase to fit the parameters of a cost model with
+_set_features = ("warming", "cooling", "field_change", "temperature_changed", "field_changed")
+_features = _set_features + ("mevents",)
+
+# The parameters of a phase are only fitted once it has been recorded this many times
+min_samples = 5
+
+_schema = """
+CREATE TABLE IF NOT EXISTS phases (
+    id INTEGER PRIMARY KEY,
+    recorded REAL NOT NULL,
+    instrument TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    predicted REAL NOT NULL,
+    actual REAL NOT NULL,
+    warming REAL NOT NULL DEFAULT 0,
+    cooling REAL NOT NULL DEFAULT 0,
+    field_change REAL NOT NULL DEFAULT 0,
+    temperature_changed REAL NOT NULL DEFAULT 0,
+    field_changed REAL NOT NULL DEFAULT 0,
+    mevents REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS phases_by_instrument ON phases (instrument, phase, recorded);
+"""
+
+
+def predict_phase(cost_model: CostModel, phase: str, **features: float) -> float:
+    """
+    Parameters:
+      cost_model (CostModel): the model to predict with
+      phase (str): the phase to predict (SET, COUNT, BEGIN, END or SWITCH)
+      features (float): what is recorded about the phase (warming, cooling, field_change,
+        temperature_changed and field_changed of a SET, mevents of a COUNT)
+
+    Returns:
+      float: The seconds the phase is predicted to take.
+    """
+    if phase == SET:
+        transitions = cost_model.transitions
+        return (
+            features.get("warming", 0.0) / transitions.warming_rate
+            + features.get("cooling", 0.0) / transitions.cooling_rate
+            + features.get("field_change", 0.0) / transitions.field_ramp_rate
+            + features.get("temperature_changed", 0.0) * transitions.temperature_settle
+            + features.get("field_changed", 0.0) * transitions.field_settle
+        )
+    elif phase == COUNT:
+        return features.get("mevents", 0.0) / cost_model.event_rate
+    elif phase in (BEGIN, END):
+        return cost_model.run_overhead / 2
+    elif phase == SWITCH:
+        return cost_model.magnet_switch
+    raise ValueError("Phase must be one of {}".format([SET, COUNT, BEGIN, END, SWITCH]))
+
+
+def set_features(from_point: np.void, to_point: np.void) -> Dict[str, float]:
+    """
+    Parameters:
+      from_point (np.void): the scan plan point the temperature and field are set from
+      to_point (np.void): the scan plan point the temperature and field are set to
+
+    Returns:
+      Dict[str, float]: What is recorded about setting the temperature and field between them.
+    """
+    temperature_change = float(np.nan_to_num(to_point["temperature"] - from_point["temperature"]))
+    field_change = abs(float(np.nan_to_num(to_point["field"] - from_point["field"])))
+    return {
+        "warming": max(temperature_change, 0.0),
+        "cooling": max(-temperature_change, 0.0),
+        "field_change": field_change,
+        "temperature_changed": float(temperature_change != 0),
+        "field_changed": float(field_change != 0),
+    }
+
+
+class EstimateHistory:
+    """
+    A local SQLite database of how long each phase of each run was predicted to take and how long
+    it actually took. Cost models are calibrated from it with least squares, using sums done by
+    SQLite, so even years of history are fitted in one pass without loading it into memory. The
+    history can be used from any thread, one query at a time.
+    """
+
+    def __init__(self, path: str, instrument: str = "EMU") -> None:
+        """
+        Parameters:
+          path (str): the path of the SQLite file (created if it does not exist)
+          instrument (str): the instrument to record and calibrate the phases of
+        """
+        self.path = path
+        self.instrument = instrument.upper()
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(_schema)
+        # The calibrated model the phases of the current run are predicted with
+        self._run_model: Optional[CostModel] = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def calibrate_for_run(self) -> None:
+        """
+        Calibrate the cost model the phases recorded from now on are predicted with, once for each
+        run rather than for every phase recorded (each of which changes the calibration).
+        """
+        self._run_model = self.calibrated(get_cost_model(self.instrument))
+
+    def record(
+        self, phase: str, actual: float, predicted: Optional[float] = None, **features: float
+    ) -> None:
+        """
+        Record how long a phase took, with how long it was predicted to take.
+
+        Parameters:
+          phase (str): the phase (SET, COUNT, BEGIN, END or SWITCH)
+          actual (float): the seconds the phase took
+          predicted (float): the seconds the phase was predicted to take, if None predicted by the
+            model calibrated for the run (see calibrate_for_run), calibrated now if there is none
+          features (float): what is recorded about the phase (see predict_phase)
+
+        Raises:
+          ValueError: If the phase or a feature is not known.
+          sqlite3.Error: If the history cannot be written to (e.g. it is locked or read only).
+        """
+        unknown = set(features) - set(_features)
+        if unknown:
+            raise ValueError("Unknown features {}".format(sorted(unknown)))
+        if predicted is None:
+            if self._run_model is None:
+                self.calibrate_for_run()
+            predicted = predict_phase(self._run_model, phase, **features)
+        columns = ("recorded", "instrument", "phase", "predicted", "actual") + tuple(features)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO phases ({}) VALUES ({})".format(
+                    ", ".join(columns), ", ".join("?" * len(columns))
+                ),
+                (time.time(), self.instrument, phase, predicted, actual, *features.values()),
+            )
+
+    @contextmanager
+    def timed(self, phase: str, **features: float) -> Iterator[None]:
+        """
+        Record how long the body of the with statement takes as a phase. Nothing is recorded if it
+        raises. Recording is only bookkeeping, so a history that cannot be written to is logged
+        rather than raised out of the phase.
+
+        Parameters:
+          phase (str): the phase (SET, COUNT, BEGIN, END or SWITCH)
+          features (float): what is recorded about the phase (see predict_phase)
+        """
+        start = time.monotonic()
+        yield
+        try:
+            self.record(phase, time.monotonic() - start, **features)
+        except (sqlite3.Error, OSError) as error:
+            logger.warning("Cannot record the %s phase in %s: %s", phase, self.path, error)
+
+    def last_id(self) -> int:
+        """
+        Returns:
+          int: The id of the last phase recorded (0 if none have been), which changes whenever
+            a phase is recorded.
+        """
+        with self._lock:
+            return self._connection.execute("SELECT COALESCE(MAX(id), 0) FROM phases").fetchone()[0]
+
+    def calibrated(self, cost_model: CostModel, since: Optional[float] = None) -> CostModel:
+        """
+        Get a cost model with its parameters fitted to the history. A calibration is reused until
+        another phase is recorded.
+
+        Parameters:
+          cost_model (CostModel): the model to calibrate, its parameters are kept for phases that
+            have been recorded fewer than min_samples times
+          since (float): only fit phases recorded since this time (seconds since the epoch)
+
+        Returns:
+          CostModel: The calibrated cost model.
+        """
+        return _calibrations.get_or_compute(
+            (self.path, self.instrument, cost_model, since, self.last_id()),
+            lambda: self.calibrate(cost_model, since),
+        )
+
+    def calibrate(self, cost_model: CostModel, since: Optional[float] = None) -> CostModel:
+        """
+        Fit the parameters of a cost model to the history, without caching (see calibrated).
+
+        Parameters:
+          cost_model (CostModel): the model to calibrate, its parameters are kept for phases that
+            have been recorded fewer than min_samples times
+          since (float): only fit phases recorded since this time (seconds since the epoch)
+
+        Returns:
+          CostModel: The calibrated cost model.
+        """
+        return cost_model._replace(
+            transitions=self._fit_transitions(cost_model.transitions, since),
+            event_rate=self._fit_event_rate(cost_model.event_rate, since),
+            run_overhead=self._fit_run_overhead(cost_model.run_overhead, since),
+            magnet_switch=self._fit_mean(SWITCH, cost_model.magnet_switch, since),
+        )
+
+    def _select(self, columns: str, phase: str, since: Optional[float]) -> Tuple:
+        query = "SELECT {}, COUNT(*) FROM phases WHERE instrument = ? AND phase = ?".format(columns)
+        parameters: Tuple = (self.instrument, phase)
+        if since is not None:
+            query += " AND recorded >= ?"
+            parameters += (since,)
+        with self._lock:
+            return self._connection.execute(query, parameters).fetchone()
+
+    def _fit_transitions(
+        self, transitions: TransitionCosts, since: Optional[float]
+    ) -> TransitionCosts:
+        """
+        The time to set is linear in the inverse rates and the settling times, so fit them with
+        least squares from the sums of the normal equations. Each parameter is pulled slightly
+        towards its current value so that ones the history says nothing about are kept.
+        """
+        sums = ["SUM({} * {})".format(a, b) for a in _set_features for b in _set_features]
+        sums += ["SUM({} * actual)".format(a) for a in _set_features]
+        row = self._select(", ".join(sums), SET, since)
+        if row[-1] < min_samples:
+            return transitions
+        size = len(_set_features)
+        xtx = np.array(row[: size * size], dtype=float).reshape(size, size)
+        xty = np.array(row[size * size : -1], dtype=float)
+        prior = np.array(
+            [
+                1 / transitions.warming_rate,
+                1 / transitions.cooling_rate,
+                1 / transitions.field_ramp_rate,
+                transitions.temperature_settle,
+                transitions.field_settle,
+            ]
+        )
+        ridge = 1e-6 * np.diag(xtx) + 1e-9
+        fit = np.linalg.solve(xtx + np.diag(ridge), xty + ridge * prior)
+        # A time per kelvin or gauss must be positive and a settling time cannot be negative
+        fit[:3] = np.where(fit[:3] > 0, fit[:3], prior[:3])
+        fit[3:] = np.maximum(fit[3:], 0.0)
+        return TransitionCosts(
+            warming_rate=float(1 / fit[0]),
+            cooling_rate=float(1 / fit[1]),
+            field_ramp_rate=float(1 / fit[2]),
+            temperature_settle=float(fit[3]),
+            field_settle=float(fit[4]),
+        )
+
+    def _fit_event_rate(self, event_rate: float, since: Optional[float]) -> float:
+        sum_xx, sum_xy, samples = self._select(
+            "SUM(mevents * mevents), SUM(mevents * actual)", COUNT, since
+        )
+        if samples < min_samples or not sum_xy or sum_xy <= 0:
+            return event_rate
+        return sum_xx / sum_xy
+
+    def _fit_run_overhead(self, run_overhead: float, since: Optional[float]) -> float:
+        begin = self._fit_mean(BEGIN, None, since)
+        end = self._fit_mean(END, None, since)
+        if begin is None or end is None:
+            return run_overhead
+        return begin + end
+
+    def _fit_mean(
+        self, phase: str, default: Optional[float], since: Optional[float]
+    ) -> Optional[float]:
+        mean, samples = self._select("AVG(actual)", phase, since)
+        return mean if samples >= min_samples else default
+
+
+_calibrations = LRUCache(max_weight=64)
+# The history of each path and instrument, None if it cannot be opened (so it is only tried once)
+_histories: Dict[Tuple[str, str], Optional[EstimateHistory]] = {}
+
+
+def get_estimate_history(instrument: str = "EMU") -> Optional[EstimateHistory]:
+    """
+    Parameters:
+      instrument (str): the instrument to record and calibrate the phases of
+
+    Returns:
+      EstimateHistory: The history in the file named by the EMU_ESTIMATE_HISTORY environment
+        variable, or None if it is not set or cannot be opened (which is logged).
+    """
+    path = os.environ.get(HISTORY_PATH_VARIABLE)
+    if not path:
+        return None
+    key = (path, instrument.upper())
+    if key not in _histories:
+        try:
+            _histories[key] = EstimateHistory(path, instrument)
+        except (sqlite3.Error, OSError) as error:
+            logger.warning("Cannot open the estimate history %s: %s", path, error)
+            _histories[key] = None
+    return _histories[key]
+
+
+def history_version(instrument: str = "EMU") -> Optional[Tuple[str, int]]:
+    """
+    Returns:
+      Tuple[str, int]: The path of the history and the id of the last phase recorded in it, which
+        changes whenever the calibration can have changed, or None if there is no history or it
+        cannot be read (which is logged).
+    """
+    history = get_estimate_history(instrument)
+    if history is None:
+        return None
+    try:
+        return history.path, history.last_id()
+    except (sqlite3.Error, OSError) as error:
+        logger.warning("Cannot read the estimate history %s: %s", history.path, error)
+        return None
+
+
+def calibrate_for_run(instrument: str = "EMU") -> None:
+    """
+    Calibrate the cost model the phases of the run starting are predicted with, if there is a
+    history (see EstimateHistory.calibrate_for_run). A history that cannot be read is logged.
+
+    Parameters:
+      instrument (str): the instrument starting a run
+    """
+    history = get_estimate_history(instrument)
+    if history is not None:
+        try:
+            history.calibrate_for_run()
+        except (sqlite3.Error, OSError) as error:
+            logger.warning("Cannot calibrate from the estimate history %s: %s", history.path, error)
+
+
+def timed_phase(phase: str, instrument: str = "EMU", **features: float) -> ContextManager:
+    """
+    Record how long the body of the with statement takes as a phase, if there is a history.
+
+    Parameters:
+      phase (str): the phase (SET, COUNT, BEGIN, END or SWITCH)
+      instrument (str): the instrument the phase is of
+      features (float): what is recorded about the phase (see predict_phase)
+
+    Returns:
+      ContextManager: The context to run the phase in.
+    """
+    history = get_estimate_history(instrument)
+    if history is None:
+        return nullcontext()
+    return history.timed(phase, **features)
+
+
+def calibrated_cost_model(
+    instrument: str = "EMU", mevents_per_hour: Optional[float] = None
+) -> CostModel:
+    """
+    Parameters:
+      instrument (str): the instrument to get the cost model of
+      mevents_per_hour (float): the event rate to use unless the history has calibrated it
+
+    Returns:
+      CostModel: The cost model of the instrument, calibrated from the history if there is one and
+        it can be read (which is logged if not).
+    """
+    cost_model = get_cost_model(instrument)
+    if mevents_per_hour is not None:
+        cost_model = cost_model.with_event_rate(mevents_per_hour)
+    history = get_estimate_history(instrument)
+    if history is None:
+        return cost_model
+    try:
+        return history.calibrated(cost_model)
+    except (sqlite3.Error, OSError) as error:
+        logger.warning("Cannot calibrate from the estimate history %s: %s", history.path, error)
+        return cost_model
@@ -1,12 +1,12 @@
-from typing import Generator, Optional
+from typing import Optional
 
 from genie_python import genie as g
 from genie_python.genie_script_generator import ScriptDefinition, cast_parameters_to
 
-from script_utilities import get_steps
+from script_utilities import LatticeRange
 
 
-def inclusive_float_range_with_step_flip(start: float, stop: float, step: float) -> Generator:
+def inclusive_float_range_with_step_flip(start: float, stop: float, step: float) -> LatticeRange:
     """
     If we are counting downwards from start to stop automatically flips step to be negative.
     Inclusive of stop. Only tested for float values.
@@ -17,30 +17,39 @@ def inclusive_float_range_with_step_flip(start: float, stop: float, step: float)
       step (float): the steps to take from start to stop
 
     Returns:
-      The range from start to stop including all steps in between.
+      LatticeRange: The range from start to stop including all steps in between.
 
     Examples:
       >>> inclusive_float_range_with_step_flip(0.5, 2, 0.5) == [0.5, 1, 1.5, 2]
       >>> inclusive_float_range_with_step_flip(2, 0.5, 0.5) == [2, 1.5, 1, 0.5]
     """
-    # Get the modulo so we know to stop early like arrange if the steps don't fit evenly.
-    yield from get_steps(start, step, stop)
+    return LatticeRange(start, step, stop)
 
 
 class DoRun(ScriptDefinition):
-    @cast_parameters_to(start_temp=float, stop_temp=float, step_temp=float)
-    def run(self, start_temp: float = 1.0, stop_temp: float = 1.0, step_temp: float = 0.5) -> None:
+    def get_temperatures(
+        self, start_temp: float, stop_temp: float, step_temp: float
+    ) -> LatticeRange:
+        """
+        Get the temperatures to loop through, so that run and estimate_time share the same points.
+
+        Parameters:
+          start_temp (float): The temperature to start the loop with.
+          stop_temp (float): The temperature to end the loop with (inclusive).
+          step_temp (float): The size of the steps to take from start_temp to stop_temp.
+
+        Returns:
+          LatticeRange: The temperatures to set.
+        """
         # Execute the loop once
         if start_temp == stop_temp:
             step_temp = 1.0
-        # Done to account for pythons range non inclusivity
-        small_amount = 0.000001
-        if start_temp <= stop_temp:
-            stop_temp += small_amount
-        else:
-            stop_temp -= small_amount
-        # Regular range can't use floats
-        for temp in inclusive_float_range_with_step_flip(start_temp, stop_temp, step_temp):
+        # Step exactly in decimal so that stop is included without a fudge factor
+        return inclusive_float_range_with_step_flip(start_temp, stop_temp, step_temp)
+
+    @cast_parameters_to(start_temp=float, stop_temp=float, step_temp=float)
+    def run(self, start_temp: float = 1.0, stop_temp: float = 1.0, step_temp: float = 0.5) -> None:
+        for temp in self.get_temperatures(start_temp, stop_temp, step_temp):
             g.cset("temperature", temp)
             g.begin(quiet=True)
             g.waitfor_time(seconds=30)
@@ -65,12 +74,7 @@ class DoRun(ScriptDefinition):
     def estimate_time(
         self, start_temp: float = 1.0, stop_temp: float = 1.0, step_temp: float = 0.5
     ) -> int:
-        if stop_temp >= start_temp:
-            steps = round((stop_temp - start_temp) / step_temp)
-            estimated_time = 30 + steps * 30
-            return estimated_time
-        else:
-            return 0
+        return 30 * len(self.get_temperatures(start_temp, stop_temp, step_temp))
 
     def get_help(self) -> str:
         return "An example config to show a looping mechanism"
@@ -0,0 +1,339 @@
+from typing import NamedTuple, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from scan_plan import ScanPlan, SweepPlan
+
+
+class TransitionCosts(NamedTuple):
+    """
+    A model of the time taken to move between the points of a scan plan. Cryostats warm faster
+    than they cool, so warming and cooling have their own rates. A settling time is added whenever
+    the temperature or field changes.
+    """
+
+    warming_rate: float  # K/s
+    cooling_rate: float  # K/s
+    field_ramp_rate: float  # G/s
+    temperature_settle: float = 0.0  # s
+    field_settle: float = 0.0  # s
+
+    def transition(
+        self,
+        from_temperature: npt.ArrayLike,
+        from_field: npt.ArrayLike,
+        to_temperature: npt.ArrayLike,
+        to_field: npt.ArrayLike,
+    ) -> np.ndarray:
+        """
+        Get the time taken to move between points (ramping and settling). The arguments are
+        broadcast against each other and a temperature or field of NaN (kept) is never changed.
+
+        Parameters:
+          from_temperature (npt.ArrayLike): the temperatures to move from
+          from_field (npt.ArrayLike): the fields to move from
+          to_temperature (npt.ArrayLike): the temperatures to move to
+          to_field (npt.ArrayLike): the fields to move to
+
+        Returns:
+          np.ndarray: The seconds taken to move from each point to the next.
+        """
+        changes = _changes(from_temperature, from_field, to_temperature, to_field)
+        return self._ramp(*changes) + self._settle(*changes)
+
+    def ramp(
+        self,
+        from_temperature: npt.ArrayLike,
+        from_field: npt.ArrayLike,
+        to_temperature: npt.ArrayLike,
+        to_field: npt.ArrayLike,
+    ) -> np.ndarray:
+        """
+        Returns:
+          np.ndarray: The seconds spent ramping the temperature and field in transition.
+        """
+        return self._ramp(*_changes(from_temperature, from_field, to_temperature, to_field))
+
+    def settle(
+        self,
+        from_temperature: npt.ArrayLike,
+        from_field: npt.ArrayLike,
+        to_temperature: npt.ArrayLike,
+        to_field: npt.ArrayLike,
+    ) -> np.ndarray:
+        """
+        Returns:
+          np.ndarray: The seconds spent settling the temperature and field in transition.
+        """
+        return self._settle(*_changes(from_temperature, from_field, to_temperature, to_field))
+
+    def sweep_moves(self, plan: SweepPlan) -> Tuple[float, float]:
+        """
+        Get the time taken to move between the points of a sweep plan in closed form, the same (to
+        rounding) as ramp and settle summed over the points of the plan it compiles to.
+
+        Parameters:
+          plan (SweepPlan): the plan to cost
+
+        Returns:
+          Tuple[float, float]: The seconds spent ramping and settling the temperature and field.
+        """
+        if not plan.points:
+            return 0.0, 0.0
+        temperatures = plan.temperatures
+        field_distance, field_changes = plan.field_moves
+        ramp = (
+            temperatures.rise / self.warming_rate
+            + temperatures.fall / self.cooling_rate
+            + field_distance / self.field_ramp_rate
+        )
+        settle = self.temperature_settle * temperatures.changes + self.field_settle * field_changes
+        return ramp, settle
+
+    def _ramp(
+        self, warming: np.ndarray, cooling: np.ndarray, field_change: np.ndarray
+    ) -> np.ndarray:
+        return (
+            warming / self.warming_rate
+            + cooling / self.cooling_rate
+            + field_change / self.field_ramp_rate
+        )
+
+    def _settle(
+        self, warming: np.ndarray, cooling: np.ndarray, field_change: np.ndarray
+    ) -> np.ndarray:
+        return self.temperature_settle * ((warming + cooling) > 0) + self.field_settle * (
+            field_change > 0
+        )
+
+
+def _changes(
+    from_temperature: npt.ArrayLike,
+    from_field: npt.ArrayLike,
+    to_temperature: npt.ArrayLike,
+    to_field: npt.ArrayLike,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns:
+      Tuple[np.ndarray, np.ndarray, np.ndarray]: How far the temperature is warmed and cooled and
+        how far the field is changed between points.
+    """
+    temperature_change = np.subtract(to_temperature, from_temperature)
+    # fmax ignores NaN, so a kept temperature or field takes no time to change
+    warming = np.fmax(temperature_change, 0.0)
+    cooling = np.fmax(-temperature_change, 0.0)
+    field_change = np.fmax(np.abs(np.subtract(to_field, from_field)), 0.0)
+    return warming, cooling, field_change
+
+
+# Rough figures for the EMU cryostats and magnets
+emu_transition_costs = TransitionCosts(
+    warming_rate=0.1,
+    cooling_rate=0.02,
+    field_ramp_rate=10.0,
+    temperature_settle=120.0,
+    field_settle=10.0,
+)
+
+
+# Searching for the quickest order takes time quadratic in the points of a plan, so larger plans
+# are only ordered monotonically (see optimise_plan)
+max_optimised_points = 2000
+
+
+class OptimisedPlan(NamedTuple):
+    plan: ScanPlan
+    original_cost: float
+    cost: float
+
+    @property
+    def time_saved(self) -> float:
+        """
+        Returns:
+          float: The seconds of setting temperatures and fields saved by reordering the plan.
+        """
+        return self.original_cost - self.cost
+
+
+def plan_cost(plan: ScanPlan, costs: TransitionCosts = emu_transition_costs) -> float:
+    """
+    Parameters:
+      plan (ScanPlan): the plan to cost
+      costs (TransitionCosts): the model of the time taken to move between points
+
+    Returns:
+      float: The seconds taken to move between the points of the plan, from its first point on.
+    """
+    return _order_cost(np.arange(len(plan)), plan.temperatures, plan.fields, costs)
+
+
+def sweep_plan_cost(plan: SweepPlan, costs: TransitionCosts = emu_transition_costs) -> float:
+    """
+    Parameters:
+      plan (SweepPlan): the plan to cost
+      costs (TransitionCosts): the model of the time taken to move between points
+
+    Returns:
+      float: The seconds taken to move between the points of the plan, the same (to rounding) as
+        plan_cost of the plan it compiles to.
+    """
+    return sum(costs.sweep_moves(plan))
+
+
+def _order_cost(
+    order: np.ndarray, temperatures: np.ndarray, fields: np.ndarray, costs: TransitionCosts
+) -> float:
+    temperatures, fields = temperatures[order], fields[order]
+    return float(
+        np.sum(costs.transition(temperatures[:-1], fields[:-1], temperatures[1:], fields[1:]))
+    )
+
+
+def optimise_plan(
+    plan: ScanPlan,
+    costs: TransitionCosts = emu_transition_costs,
+    monotonic: bool = False,
+    window: int = 32,
+) -> OptimisedPlan:
+    """
+    Reorder the points of a plan (e.g. one row's scan, or a ScanPlan.concatenate of several rows)
+    to minimise the time taken to move between them. The plan is never made slower than the order
+    it was given in.
+
+    Parameters:
+      plan (ScanPlan): the plan to reorder
+      costs (TransitionCosts): the model of the time taken to move between points
+      monotonic (bool): if True the temperatures are visited in one direction (the direction from
+        the first to the last temperature of the plan) and only the order of the fields at each
+        temperature is optimised. If False the points are ordered by nearest neighbour (or as if
+        monotonic if that is quicker), then refined by 2-opt, unless there are more than
+        max_optimised_points of them when they are ordered as if monotonic.
+      window (int): the longest run of points 2-opt will try reversing
+
+    Returns:
+      OptimisedPlan: The reordered plan with the time taken to move between its points before and
+        after.
+    """
+    temperatures, fields = plan.temperatures, plan.fields
+    original_order = np.arange(len(plan))
+    original_cost = _order_cost(original_order, temperatures, fields, costs)
+    if len(plan) < 3:
+        return OptimisedPlan(plan, original_cost, original_cost)
+    if monotonic or len(plan) > max_optimised_points:
+        order = _monotonic_order(temperatures, fields)
+    else:
+        order = min(
+            _nearest_neighbour_order(temperatures, fields, costs),
+            _monotonic_order(temperatures, fields),
+            key=lambda order: _order_cost(order, temperatures, fields, costs),
+        )
+        order = _two_opt(order, temperatures, fields, costs, window)
+    cost = _order_cost(order, temperatures, fields, costs)
+    if cost >= original_cost:
+        return OptimisedPlan(plan, original_cost, original_cost)
+    return OptimisedPlan(plan.reordered(order), original_cost, cost)
+
+
+def _monotonic_order(temperatures: np.ndarray, fields: np.ndarray) -> np.ndarray:
+    """
+    Visit the temperatures in order, sweeping the fields at each temperature up or down starting
+    from whichever end is nearer the field we are already at (the quickest way to visit points on
+    a line).
+    """
+    temperature_key = np.nan_to_num(temperatures)
+    if temperature_key[-1] < temperature_key[0]:
+        temperature_key = -temperature_key
+    field_key = np.nan_to_num(fields)
+    order = np.lexsort((field_key, temperature_key))
+    group_starts = np.flatnonzero(np.diff(temperature_key[order], prepend=np.nan) != 0)
+    group_ends = np.append(group_starts[1:], len(order))
+    current_field = field_key[0]
+    for start, end in zip(group_starts, group_ends):
+        lowest, highest = field_key[order[start]], field_key[order[end - 1]]
+        if abs(highest - current_field) < abs(lowest - current_field):
+            order[start:end] = order[start:end][::-1]
+        current_field = field_key[order[end - 1]]
+    return order
+
+
+def _nearest_neighbour_order(
+    temperatures: np.ndarray, fields: np.ndarray, costs: TransitionCosts
+) -> np.ndarray:
+    """
+    Starting from the first point, always move to the quickest point to get to that has not been
+    visited yet (ties go to the point that came first).
+    """
+    visited = np.zeros(len(temperatures), dtype=bool)
+    order = np.empty(len(temperatures), dtype=np.intp)
+    current = 0
+    for position in range(len(order)):
+        order[position] = current
+        visited[current] = True
+        if position == len(order) - 1:
+            break
+        step_costs = costs.transition(temperatures[current], fields[current], temperatures, fields)
+        step_costs[visited] = np.inf
+        current = int(np.argmin(step_costs))
+    return order
+
+
+def _two_opt(
+    order: np.ndarray,
+    temperatures: np.ndarray,
+    fields: np.ndarray,
+    costs: TransitionCosts,
+    window: int,
+    max_passes: int = 100,
+) -> np.ndarray:
+    """
+    Refine an order by reversing runs of up to window points wherever that makes it quicker.
+
+    The costs are asymmetric, so reversing a run changes the cost of moving between the points in
+    it. Prefix sums of the cost of each move forwards and backwards give the cost of any run in
+    O(1), so each pass costs every reversal of every run up to window points long in window
+    vectorised steps, then makes the best reversals that do not touch each other.
+    """
+    order = order.copy()
+    n = len(order)
+    for _ in range(max_passes):
+        t, f = temperatures[order], fields[order]
+        forward = costs.transition(t[:-1], f[:-1], t[1:], f[1:])
+        backward = costs.transition(t[1:], f[1:], t[:-1], f[:-1])
+        forward_sums = np.concatenate(([0.0], np.cumsum(forward)))
+        backward_sums = np.concatenate(([0.0], np.cumsum(backward)))
+        best_gain = np.zeros(n)
+        best_end = np.zeros(n, dtype=np.intp)
+        # Reverse order[i:j+1] for 1 <= i < j <= n-1, keeping the first point first
+        for length in range(1, min(window, n - 2) + 1):
+            i = np.arange(1, n - length)
+            j = i + length
+            has_next = j < n - 1
+            next_ = np.minimum(j + 1, n - 1)
+            old = (
+                forward[i - 1]
+                + forward_sums[j]
+                - forward_sums[i]
+                + np.where(has_next, forward[np.minimum(j, n - 2)], 0.0)
+            )
+            new = (
+                costs.transition(t[i - 1], f[i - 1], t[j], f[j])
+                + backward_sums[j]
+                - backward_sums[i]
+                + np.where(has_next, costs.transition(t[i], f[i], t[next_], f[next_]), 0.0)
+            )
+            gain = old - new
+            better = gain > best_gain[i]
+            best_gain[i[better]] = gain[better]
+            best_end[i[better]] = j[better]
+        starts = np.flatnonzero(best_gain > 1e-9)
+        if not len(starts):
+            break
+        # Moves (k, k+1) for k in [i-1, j] are replaced by a reversal of order[i:j+1]
+        replaced = np.zeros(n, dtype=bool)
+        for i in starts[np.argsort(-best_gain[starts], kind="stable")]:
+            j = best_end[i]
+            if not replaced[i - 1 : j + 1].any():
+                replaced[i - 1 : j + 1] = True
+                order[i : j + 1] = order[i : j + 1][::-1]
+    return order
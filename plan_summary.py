@@ -0,0 +1,150 @@
+import math
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from beam_rate import estimate_plan_seconds, estimate_sweep_plan_seconds
+from cost_model import CostModel
+from data_volume import DataVolumeModel, run_write_rates
+from plan_optimiser import TransitionCosts
+from scan_plan import RASTER, ScanAction, ScanPlan, SweepPlan
+
+
+class PlanSummary(NamedTuple):
+    """
+    What a scan plan does and costs, to budget beam time and disk space with.
+    """
+
+    runs: int
+    mevents: float
+    setpoint_changes: int
+    magnet_switches: int
+    data_volume: float  # bytes
+    seconds: float
+    peak_write_rate: float = 0.0  # bytes/s, of the run that writes data fastest
+
+    def custom_estimate(self) -> "OrderedDict[str, str]":
+        """
+        Returns:
+          OrderedDict[str, str]: The summary as the columns of a custom estimate.
+        """
+        return OrderedDict(
+            [
+                ("Runs", str(self.runs)),
+                ("Mevents", f"{self.mevents:g}"),
+                ("Setpoint changes", str(self.setpoint_changes)),
+                ("Magnet switches", str(self.magnet_switches)),
+                ("Data volume (MB)", f"{self.data_volume / 1e6:.1f}"),
+                ("Peak write rate (MB/s)", f"{self.peak_write_rate / 1e6:.2f}"),
+                ("Time (s)", f"{self.seconds:.0f}"),
+            ]
+        )
+
+
+def summarise_plan(
+    plan: ScanPlan,
+    cost_model: CostModel,
+    data_volume_model: DataVolumeModel,
+    magnet_switches: int = 0,
+    count_seconds: Optional[float] = None,
+    point_sets: int = 0,
+) -> PlanSummary:
+    """
+    Parameters:
+      plan (ScanPlan): the plan to summarise
+      cost_model (CostModel): the model to estimate the time of the plan with
+      data_volume_model (DataVolumeModel): the model to estimate the data the runs write with
+      magnet_switches (int): the number of times a different magnet device is selected
+      count_seconds (float): the seconds each count takes if counting for a time rather than for
+        the mevents of the plan, the mevents are then those counted at the event rate of the cost
+        model
+      point_sets (int): the number of temperatures and fields set once before the plan
+
+    Returns:
+      PlanSummary: The summary of the plan.
+    """
+    counting = (plan.actions & ScanAction.COUNT) != 0
+    write_rates = run_write_rates(plan, cost_model, data_volume_model, count_seconds)
+    if count_seconds is None:
+        mevents = plan.mevents[counting]
+    else:
+        mevents = np.full(np.count_nonzero(counting), count_seconds * cost_model.event_rate)
+    return PlanSummary(
+        runs=int(np.count_nonzero(counting)),
+        mevents=float(mevents.sum()),
+        setpoint_changes=plan.count_actions(ScanAction.SET_TEMPERATURE)
+        + plan.count_actions(ScanAction.SET_FIELD)
+        + point_sets,
+        magnet_switches=magnet_switches,
+        data_volume=float(data_volume_model.run_volumes(mevents).sum()),
+        seconds=estimate_plan_seconds(cost_model, plan, magnet_switches, count_seconds),
+        peak_write_rate=float(write_rates.max()) if len(write_rates) else 0.0,
+    )
+
+
+def summarise_sweep_plan(
+    plan: SweepPlan,
+    cost_model: CostModel,
+    data_volume_model: DataVolumeModel,
+    magnet_switches: int = 0,
+    count_seconds: Optional[float] = None,
+    point_sets: int = 0,
+) -> PlanSummary:
+    """
+    Summarise a sweep plan in closed form, the same (to rounding) as summarise_plan of the plan it
+    compiles to (see its parameters), without compiling it unless the beam schedule needs it.
+
+    Returns:
+      PlanSummary: The summary of the plan.
+    """
+    runs = plan.points if plan.mevents > 0 else 0
+    if count_seconds is None:
+        mevents = plan.mevents
+        run_seconds = plan.mevents / cost_model.event_rate + cost_model.run_overhead
+    else:
+        mevents = count_seconds * cost_model.event_rate
+        run_seconds = count_seconds + cost_model.run_overhead
+    run_volume = float(data_volume_model.run_volumes(mevents))
+    # Every run writes the same data, so the fastest is the one moved to the quickest
+    peak_write_rate = 0.0
+    if runs:
+        seconds = _quickest_move(plan, cost_model.transitions) + run_seconds
+        peak_write_rate = run_volume / max(seconds, 1e-9)
+    return PlanSummary(
+        runs=runs,
+        mevents=runs * mevents,
+        setpoint_changes=plan.setpoint_changes + point_sets,
+        magnet_switches=magnet_switches,
+        data_volume=runs * run_volume,
+        seconds=estimate_sweep_plan_seconds(cost_model, plan, magnet_switches, count_seconds),
+        peak_write_rate=peak_write_rate,
+    )
+
+
+def _quickest_move(plan: SweepPlan, transitions: TransitionCosts) -> float:
+    """
+    Returns:
+      float: The seconds taken by the quickest move to a point of the plan, including settling at
+        the first point (whose move is not known).
+    """
+    temperatures, fields = plan.temperatures, plan.fields
+    first = transitions.temperature_settle * (
+        not math.isnan(temperatures.first)
+    ) + transitions.field_settle * (not math.isnan(fields.first))
+    # The steps of a sweep are all the same size, so only one of each kind of move is costed
+    moves: List[Tuple[float, float, float, float]] = []
+    if fields.total_points > 1:
+        step = fields.distance / fields.changes
+        moves.append((math.nan, fields.first, math.nan, fields.first + step))
+    if temperatures.total_points > 1:
+        step = temperatures.distance / temperatures.changes
+        # The field is ramped back to the start of its sweep between temperatures if in raster order
+        field = fields.end if plan.ordering == RASTER else fields.first
+        if temperatures.rise > 0:
+            moves.append((temperatures.first, field, temperatures.first + step, fields.first))
+        if temperatures.fall > 0:
+            moves.append((temperatures.first, field, temperatures.first - step, fields.first))
+    if not moves:
+        return first
+    return min(first, float(np.min(transitions.transition(*np.array(moves).T))))
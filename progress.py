@@ -0,0 +1,326 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, NamedTuple, Optional
+
+import numpy as np
+
+from cost_model import CostModel
+from estimate_history import BEGIN, COUNT, END, SET
+from scan_plan import ScanAction, ScanPlan
+
+logger = logging.getLogger(__name__)
+
+# Set this environment variable to the path of a file to keep the progress of the running plan in
+PROGRESS_PATH_VARIABLE = "EMU_PROGRESS_STATE"
+
+# How much each measured phase moves the smoothed durations and event rate towards it
+default_smoothing = 0.3
+
+# The state file is written at most this often (s), and when the plan finishes
+default_state_interval = 5.0
+
+
+class Progress(NamedTuple):
+    """
+    How far through a plan a run is and how long the rest of it is predicted to take.
+    """
+
+    point: int  # the index of the point being run
+    points: int
+    elapsed: float  # s
+    remaining: float  # s
+    event_rate: float  # Mev/s, smoothed from the counts so far
+    finished: bool = False
+
+    @property
+    def fraction(self) -> float:
+        """
+        Returns:
+          float: The fraction of the plan predicted to be done.
+        """
+        total = self.elapsed + self.remaining
+        return 1.0 if total <= 0 else self.elapsed / total
+
+    def state(self) -> Dict[str, Any]:
+        """
+        Returns:
+          Dict[str, Any]: The progress as written to the state file, with when it was written and
+            the predicted finish time as seconds since the epoch.
+        """
+        now = time.time()
+        return dict(
+            self._asdict(), fraction=self.fraction, updated=now, finish=now + self.remaining
+        )
+
+
+# Called with the Progress of every plan run after each phase of it
+progress_callbacks: List[Callable[[Progress], None]] = []
+
+
+class ProgressTracker:
+    """
+    Predict how long the rest of a running plan takes from how long its phases have taken so far.
+
+    The plan is predicted with a cost model to begin with. As each phase is measured the ratio of
+    the measured to the predicted time of setting points, the event rate and the seconds taken to
+    begin and end runs are exponentially smoothed towards it, and the rest of the plan is predicted
+    with them. What the rest of the plan is made of is summed once up front, so each update is a
+    few arithmetic operations.
+    """
+
+    def __init__(
+        self,
+        plan: ScanPlan,
+        cost_model: CostModel,
+        callback: Optional[Callable[[Progress], None]] = None,
+        state_path: Optional[str] = None,
+        smoothing: float = default_smoothing,
+        state_interval: float = default_state_interval,
+    ) -> None:
+        """
+        Parameters:
+          plan (ScanPlan): the plan being run
+          cost_model (CostModel): the model to predict the plan with until phases are measured
+          callback (Callable[[Progress], None]): called with the progress after each phase
+          state_path (str): the path of a file to keep the progress in as JSON
+          smoothing (float): how much each measured phase moves the smoothed values towards it
+          state_interval (float): the seconds to wait before writing the state file again
+        """
+        times = cost_model.point_times(plan)
+        counting = (plan.actions & ScanAction.COUNT) != 0
+        self.points = len(plan)
+        self.callback = callback
+        self.state_path = state_path
+        self.smoothing = smoothing
+        self.state_interval = state_interval
+        # Python floats rather than numpy scalars keep each update to microseconds
+        self._set_seconds: List[float] = (times["ramp"] + times["settle"]).tolist()
+        self._mevents: List[float] = np.where(counting, plan.mevents, 0.0).tolist()
+        self._counting: List[bool] = counting.tolist()
+        # What the points from each point on are made of
+        self._rest_set_seconds = _suffix_sums(times["ramp"] + times["settle"])
+        self._rest_mevents = _suffix_sums(np.where(counting, plan.mevents, 0.0))
+        self._rest_counts = _suffix_sums(counting.astype(float))
+        self.set_ratio = 1.0
+        self.event_rate = cost_model.event_rate
+        self.begin_seconds = self.end_seconds = cost_model.run_overhead / 2
+        self.point = 0
+        self._phase: Optional[str] = None
+        self._phase_started = self._started = time.monotonic()
+        self._written = -float("inf")
+
+    def start_point(self, index: int) -> None:
+        """
+        Parameters:
+          index (int): the index of the point the run has got to
+        """
+        self.point = index
+        self._phase = None
+
+    def start_phase(self, phase: str) -> None:
+        """
+        Parameters:
+          phase (str): the phase of the current point starting (SET, BEGIN, COUNT or END)
+        """
+        self._phase = phase
+        self._phase_started = time.monotonic()
+
+    def end_phase(self) -> None:
+        """
+        Measure the phase that started last, update the smoothed values from it and report the
+        progress.
+        """
+        seconds = time.monotonic() - self._phase_started
+        phase, point, smoothing = self._phase, self.point, self.smoothing
+        if phase == SET and self._set_seconds[point] > 0:
+            ratio = seconds / self._set_seconds[point]
+            self.set_ratio += smoothing * (ratio - self.set_ratio)
+        elif phase == COUNT and seconds > 0 and self._mevents[point] > 0:
+            self.event_rate += smoothing * (self._mevents[point] / seconds - self.event_rate)
+        elif phase == BEGIN:
+            self.begin_seconds += smoothing * (seconds - self.begin_seconds)
+        elif phase == END:
+            self.end_seconds += smoothing * (seconds - self.end_seconds)
+        self._report(self.progress(done=True))
+
+    @contextmanager
+    def measure(self, phase: str) -> Iterator[None]:
+        """
+        Measure the body of the with statement as a phase of the current point.
+
+        Parameters:
+          phase (str): the phase (SET, BEGIN, COUNT or END)
+        """
+        self.start_phase(phase)
+        yield
+        self.end_phase()
+
+    def remaining(self, done: bool = False) -> float:
+        """
+        Parameters:
+          done (bool): whether the current phase has finished rather than still running
+
+        Returns:
+          float: The seconds the rest of the plan is predicted to take.
+        """
+        point, phase = self.point, self._phase
+        if point >= self.points:
+            return 0.0
+        overhead = self.begin_seconds + self.end_seconds
+        rest = (
+            self.set_ratio * self._rest_set_seconds[point + 1]
+            + self._rest_mevents[point + 1] / self.event_rate
+            + self._rest_counts[point + 1] * overhead
+        )
+        # The phases of the current point, each with what is left after it
+        count = self._mevents[point] / self.event_rate
+        predicted = {
+            None: 0.0,
+            SET: self.set_ratio * self._set_seconds[point],
+            BEGIN: self.begin_seconds,
+            COUNT: count,
+            END: self.end_seconds,
+        }
+        after = {
+            None: self.set_ratio * self._set_seconds[point] + count + overhead,
+            SET: count + overhead,
+            BEGIN: count + self.end_seconds,
+            COUNT: self.end_seconds,
+            END: 0.0,
+        }
+        if not self._counting[point]:
+            after[None], after[SET] = predicted[SET], 0.0
+        if not done:
+            rest += max(predicted[phase] - (time.monotonic() - self._phase_started), 0.0)
+        return rest + after[phase]
+
+    def progress(self, done: bool = False) -> Progress:
+        """
+        Parameters:
+          done (bool): whether the current phase has finished rather than still running
+
+        Returns:
+          Progress: How far through the plan the run is.
+        """
+        return Progress(
+            point=self.point,
+            points=self.points,
+            elapsed=time.monotonic() - self._started,
+            remaining=self.remaining(done),
+            event_rate=self.event_rate,
+        )
+
+    def finish(self) -> None:
+        """
+        Report that the plan has finished.
+        """
+        self.point = self.points
+        self._phase = None
+        self._written = -float("inf")
+        self._report(self.progress()._replace(finished=True))
+
+    def _report(self, progress: Progress) -> None:
+        """
+        Report progress to the callback and the state file. Reporting must never stop the plan, so
+        a callback or state file that fails is logged and not reported to again.
+        """
+        if self.callback is not None:
+            try:
+                self.callback(progress)
+            except Exception:
+                logger.exception("Progress callback failed, no longer reporting progress to it")
+                self.callback = None
+        if self.state_path is not None and (
+            progress.finished or time.monotonic() - self._written >= self.state_interval
+        ):
+            self._written = time.monotonic()
+            try:
+                write_state(self.state_path, progress)
+            except (OSError, TypeError, ValueError):
+                logger.exception(
+                    "Cannot write the progress state file %s, no longer writing it",
+                    self.state_path,
+                )
+                self.state_path = None
+
+
+def _suffix_sums(values: np.ndarray) -> List[float]:
+    """
+    The sum of the values from each index on, with 0 after the last.
+    """
+    return np.concatenate((np.cumsum(values[::-1])[::-1], [0.0])).tolist()
+
+
+def write_state(path: str, progress: Progress) -> None:
+    """
+    Write progress to a file as JSON, replacing it whole so readers never see part of it.
+
+    Parameters:
+      path (str): the path of the file
+      progress (Progress): the progress to write
+    """
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as state_file:
+        json.dump(progress.state(), state_file)
+    os.replace(temporary_path, path)
+
+
+def read_state(path: str) -> Optional[Dict[str, Any]]:
+    """
+    Parameters:
+      path (str): the path of a state file
+
+    Returns:
+      Dict[str, Any]: The progress last written to the file (see Progress.state), or None if
+        there is none.
+    """
+    try:
+        with open(path) as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return None
+
+
+def _call_progress_callbacks(progress: Progress) -> None:
+    """
+    Call each of progress_callbacks, removing any that fail so the others are still called.
+    """
+    for callback in list(progress_callbacks):
+        try:
+            callback(progress)
+        except Exception:
+            logger.exception("Progress callback %r failed, removing it", callback)
+            progress_callbacks.remove(callback)
+
+
+def track_plan(plan: ScanPlan, cost_model: CostModel) -> ProgressTracker:
+    """
+    Parameters:
+      plan (ScanPlan): the plan about to be run
+      cost_model (CostModel): the model to predict the plan with until phases are measured
+
+    Returns:
+      ProgressTracker: A tracker reporting to progress_callbacks and to the state file named by the
+        EMU_PROGRESS_STATE environment variable, if it is set.
+    """
+    return ProgressTracker(
+        plan,
+        cost_model,
+        callback=_call_progress_callbacks,
+        state_path=os.environ.get(PROGRESS_PATH_VARIABLE) or None,
+    )
+
+
+def measured(tracker: Optional[ProgressTracker], phase: str) -> ContextManager:
+    """
+    Parameters:
+      tracker (ProgressTracker): the tracker of the running plan, or None if it is not tracked
+      phase (str): the phase (SET, BEGIN, COUNT or END)
+
+    Returns:
+      ContextManager: The context to run the phase in.
+    """
+    return nullcontext() if tracker is None else tracker.measure(phase)
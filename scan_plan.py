@@ -0,0 +1,613 @@
+import math
+from enum import IntFlag
+from typing import Iterator, NamedTuple, Optional, Sequence, Tuple, Union, overload
+
+import numpy as np
+
+from script_utilities import ScanBatch, count_steps, last_step
+
+
+class ScanAction(IntFlag):
+    """
+    What to do at a point of a scan plan.
+    SET_TEMPERATURE means set the temperature of the point (and wait for it).
+    SET_FIELD means set the field of the point (and wait for it).
+    COUNT means do a run, waiting for the mevents of the point.
+    """
+
+    SET_TEMPERATURE = 1
+    SET_FIELD = 2
+    COUNT = 4
+
+
+# The orders the fields of a temperature and field scan can be visited in. Raster sweeps the fields
+# from start to stop at every temperature, serpentine reverses the sweep on alternate temperatures
+# so the magnet does not have to ramp back to the start field between temperatures. Optimised
+# visits the points in the order plan_optimiser finds to be quickest.
+RASTER = "raster"
+SERPENTINE = "serpentine"
+OPTIMISED = "optimised"
+scan_orderings = [RASTER, SERPENTINE, OPTIMISED]
+
+
+def scan_ordering_type(ordering: str) -> str:
+    """
+    Cast the input to one of the scan orderings.
+
+    Parameters:
+      ordering (str): The ordering to cast
+
+    Returns:
+      str: The scan ordering (lower case)
+
+    Raises:
+      ValueError: If the input is not one of the scan orderings. Allows the conversion error to be
+       caught and displayed to the user.
+    """
+    ordering = ordering.strip().lower()
+    if ordering in scan_orderings:
+        return ordering
+    raise ValueError("Ordering must be one of {}".format(scan_orderings))
+
+
+def round_trip_cycles_type(cycles: str) -> int:
+    """
+    Cast the input to a number of round trip cycles.
+
+    Parameters:
+      cycles (str): The number of cycles to cast
+
+    Returns:
+      int: The number of cycles
+
+    Raises:
+      ValueError: If the input is not a whole number of zero or more. Allows the conversion error to
+       be caught and displayed to the user.
+    """
+    cycles_int = int(cycles)
+    if cycles_int < 0:
+        raise ValueError("Round trip cycles must be zero or more")
+    return cycles_int
+
+
+def round_trip(values: Sequence[float], cycles: int) -> np.ndarray:
+    """
+    Sweep through values and back again a number of times, measuring each turning point once.
+
+    Parameters:
+      values (Sequence[float]): the values of one sweep
+      cycles (int): the number of times to sweep there and back again, 0 to sweep once
+
+    Returns:
+      np.ndarray: The values of the sweeps, 1 + 2 * cycles * (len(values) - 1) of them when cycles
+        is more than 0.
+
+    Examples:
+      >>> round_trip([1, 2, 3], 2) == [1, 2, 3, 2, 1, 2, 3, 2, 1]
+    """
+    values = np.asarray(values)
+    if cycles == 0 or len(values) < 2:
+        return values
+    there_and_back = np.concatenate((values[1:], values[-2::-1]))
+    return np.concatenate((values[:1], np.tile(there_and_back, cycles)))
+
+
+def count_round_trip_points(points: int, cycles: int) -> int:
+    """
+    Parameters:
+      points (int): the number of values in one sweep
+      cycles (int): the number of times to sweep there and back again, 0 to sweep once
+
+    Returns:
+      int: The number of values round_trip returns.
+    """
+    if cycles == 0 or points < 2:
+        return points
+    return 1 + 2 * cycles * (points - 1)
+
+
+def round_trip_batch(batch: ScanBatch, cycles: int, rows: np.ndarray) -> ScanBatch:
+    """
+    The equivalent of round_trip for many scans at once.
+
+    Parameters:
+      batch (ScanBatch): the values of one sweep of each scan
+      cycles (int): the number of times to sweep there and back again, 0 to sweep once
+      rows (np.ndarray): a mask of the scans to sweep there and back, the others are swept once
+
+    Returns:
+      ScanBatch: The values of the sweeps of each scan.
+    """
+    counts = batch.counts
+    round_trips = rows & (counts >= 2) & (cycles > 0)
+    if not round_trips.any():
+        return batch
+    new_counts = np.where(round_trips, 1 + 2 * cycles * (counts - 1), counts)
+    offsets = np.zeros(len(counts) + 1, dtype=np.intp)
+    np.cumsum(new_counts, out=offsets[1:])
+    scans = np.repeat(np.arange(len(counts)), new_counts)
+    positions = np.arange(offsets[-1]) - offsets[scans]
+    # After the first value each cycle goes up to the last value and back down to the first
+    last = counts[scans] - 1
+    in_cycle = (positions - 1) % np.maximum(2 * last, 1)
+    swept = np.where(
+        positions == 0, 0, np.where(in_cycle < last, in_cycle + 1, 2 * last - 1 - in_cycle)
+    )
+    positions = np.where(round_trips[scans], swept, positions)
+    return ScanBatch(batch.values[batch.offsets[scans] + positions], offsets)
+
+
+class Sweep(NamedTuple):
+    """
+    The values a temperature or field takes in a scan plan, held as the ends and number of evenly
+    spaced values of one sweep (there and back cycles times if cycles is more than 0, see
+    round_trip) rather than as the values, so that how far and how often it moves are known
+    without generating them. A kept temperature or field is a sweep of one NaN.
+    """
+
+    first: float
+    last: float
+    points: int  # the values from first to last
+    cycles: int = 0
+
+    @classmethod
+    def from_steps(cls, start: float, step: float, stop: float) -> "Sweep":
+        """
+        Parameters:
+          start (float): the value to start the sweep from
+          step (float): the steps to take from start to stop, the sign is ignored
+          stop (float): the value to stop the sweep at
+
+        Returns:
+          Sweep: The sweep through the values of get_steps(start, step, stop).
+
+        Raises:
+          ZeroDivisionError: If step is zero.
+        """
+        return cls(float(start), last_step(start, step, stop), count_steps(start, step, stop))
+
+    def round_trip(self, cycles: int) -> "Sweep":
+        """
+        Parameters:
+          cycles (int): the number of times to sweep there and back again, 0 to sweep once
+
+        Returns:
+          Sweep: This sweep swept there and back again cycles times.
+        """
+        return self._replace(cycles=cycles)
+
+    @property
+    def total_points(self) -> int:
+        """
+        Returns:
+          int: The number of values of the whole sweep, there and back again.
+        """
+        return count_round_trip_points(self.points, self.cycles)
+
+    @property
+    def end(self) -> float:
+        """
+        Returns:
+          float: The value the sweep ends at.
+        """
+        return self.first if self.total_points > self.points else self.last
+
+    @property
+    def changes(self) -> int:
+        """
+        Returns:
+          int: The number of times the value changes from one point to the next.
+        """
+        return max(self.total_points - 1, 0)
+
+    @property
+    def rise(self) -> float:
+        """
+        Returns:
+          float: The total distance the value increases by over the sweep.
+        """
+        if self.points < 2:
+            return 0.0
+        distance = abs(self.last - self.first)
+        if self.total_points > self.points:
+            return self.cycles * distance
+        return max(self.last - self.first, 0.0)
+
+    @property
+    def fall(self) -> float:
+        """
+        Returns:
+          float: The total distance the value decreases by over the sweep.
+        """
+        if self.points < 2:
+            return 0.0
+        return self._replace(first=self.last, last=self.first).rise
+
+    @property
+    def distance(self) -> float:
+        """
+        Returns:
+          float: The total distance the value moves over the sweep.
+        """
+        return self.rise + self.fall
+
+    def values(self) -> np.ndarray:
+        """
+        Returns:
+          np.ndarray: The values of the sweep, the same as those of get_steps (then round_trip) for
+            a sweep from_steps.
+        """
+        return round_trip(np.linspace(self.first, self.last, self.points), self.cycles)
+
+
+# A temperature or field of NaN means it is not set by the plan (i.e. it is kept)
+scan_point_dtype = np.dtype(
+    [
+        ("temperature", np.float64),
+        ("field", np.float64),
+        ("mevents", np.float64),
+        ("action", np.uint8),
+    ]
+)
+
+
+def _changed(values: np.ndarray) -> np.ndarray:
+    """
+    Returns:
+      np.ndarray: Whether each value differs from the one before it (the first always does).
+    """
+    changed = np.ones(len(values), dtype=bool)
+    changed[1:] = values[1:] != values[:-1]
+    return changed
+
+
+class ScanPlan:
+    """
+    Every point of a temperature and field scan, in the order they will be measured, compiled
+    into one structured array (see scan_point_dtype). Points can be looked up by position in O(1)
+    and the remaining points sliced out as a view, e.g. to show progress or resume a scan.
+    """
+
+    def __init__(self, points: np.ndarray) -> None:
+        """
+        Parameters:
+          points (np.ndarray): the points of the plan with dtype scan_point_dtype
+        """
+        self.points = points
+
+    @classmethod
+    def from_axes(
+        cls,
+        temperatures: Optional[Sequence[float]],
+        fields: Optional[Sequence[float]],
+        mevents: float,
+        set_temperature: bool = True,
+        set_field: bool = True,
+        ordering: str = RASTER,
+    ) -> "ScanPlan":
+        """
+        Compile the plan for measuring every field at each temperature in turn.
+
+        Parameters:
+          temperatures (Sequence[float]): the temperatures to measure at, or None if the
+            temperature is kept
+          fields (Sequence[float]): the fields to measure at each temperature, or None if the field
+            is kept
+          mevents (float): The amount of millions of events to wait for at each point.
+          set_temperature (bool): whether the plan sets the temperatures (False if they have
+            already been set)
+          set_field (bool): whether the plan sets the fields (False if they have already been set)
+          ordering (str): RASTER to measure the fields in the same order at every temperature or
+            SERPENTINE to reverse the order of the fields on alternate temperatures (OPTIMISED
+            plans are compiled in RASTER order for plan_optimiser to reorder)
+
+        Returns:
+          ScanPlan: The compiled plan.
+        """
+        temperature_axis = np.asarray(temperatures if temperatures is not None else [np.nan])
+        field_axis = np.asarray(fields if fields is not None else [np.nan])
+        points = np.zeros(len(temperature_axis) * len(field_axis), dtype=scan_point_dtype)
+        points["temperature"] = np.repeat(temperature_axis, len(field_axis))
+        field = np.tile(field_axis, (len(temperature_axis), 1))
+        if ordering == SERPENTINE:
+            field[1::2] = field[1::2, ::-1]
+        points["field"] = field.ravel()
+        points["mevents"] = mevents
+        return cls(cls._compile_actions(points, set_temperature, set_field))
+
+    @classmethod
+    def concatenate(cls, plans: Sequence["ScanPlan"]) -> "ScanPlan":
+        """
+        Join the plans of several rows of a script into one plan, e.g. to reorder all their points.
+
+        Parameters:
+          plans (Sequence[ScanPlan]): the plans to join, in order
+
+        Returns:
+          ScanPlan: The joined plan, setting the temperature and field wherever they change if
+            any of the plans set them.
+        """
+        points = np.concatenate([plan.points for plan in plans])
+        return cls(
+            cls._compile_actions(
+                points,
+                any(plan.count_actions(ScanAction.SET_TEMPERATURE) for plan in plans),
+                any(plan.count_actions(ScanAction.SET_FIELD) for plan in plans),
+            )
+        )
+
+    def reordered(self, order: Sequence[int]) -> "ScanPlan":
+        """
+        Parameters:
+          order (Sequence[int]): the positions of the points of this plan in the order to visit them
+
+        Returns:
+          ScanPlan: A plan visiting the points in the given order, with the sets flagged wherever
+            the temperature or field now changes.
+        """
+        return ScanPlan(
+            self._compile_actions(
+                self.points[np.asarray(order)],
+                self.count_actions(ScanAction.SET_TEMPERATURE) > 0,
+                self.count_actions(ScanAction.SET_FIELD) > 0,
+            )
+        )
+
+    @staticmethod
+    def _compile_actions(points: np.ndarray, set_temperature: bool, set_field: bool) -> np.ndarray:
+        """
+        Flag a set wherever the temperature or field changes and a count wherever there are events
+        to wait for.
+        """
+        action = np.zeros(len(points), dtype=np.uint8)
+        if set_temperature:
+            changed = _changed(points["temperature"]) & ~np.isnan(points["temperature"])
+            action[changed] |= np.uint8(ScanAction.SET_TEMPERATURE)
+        if set_field:
+            changed = _changed(points["field"]) & ~np.isnan(points["field"])
+            action[changed] |= np.uint8(ScanAction.SET_FIELD)
+        action[points["mevents"] > 0] |= np.uint8(ScanAction.COUNT)
+        points["action"] = action
+        return points
+
+    @property
+    def temperatures(self) -> np.ndarray:
+        return self.points["temperature"]
+
+    @property
+    def fields(self) -> np.ndarray:
+        return self.points["field"]
+
+    @property
+    def mevents(self) -> np.ndarray:
+        return self.points["mevents"]
+
+    @property
+    def actions(self) -> np.ndarray:
+        return self.points["action"]
+
+    @property
+    def field_ramp(self) -> float:
+        """
+        Returns:
+          float: The total distance the field is ramped between the points of the plan.
+        """
+        return float(np.nansum(np.abs(np.diff(self.fields))))
+
+    def count_actions(self, action: ScanAction) -> int:
+        """
+        Parameters:
+          action (ScanAction): the action to count
+
+        Returns:
+          int: The number of points where the action is done.
+        """
+        return int(np.count_nonzero(self.actions & action))
+
+    def progress(self, position: int) -> float:
+        """
+        Parameters:
+          position (int): the number of points that have been measured
+
+        Returns:
+          float: The fraction of the plan that has been measured.
+        """
+        return position / len(self) if len(self) else 1.0
+
+    def remaining(self, position: int) -> "ScanPlan":
+        """
+        Parameters:
+          position (int): the number of points that have been measured
+
+        Returns:
+          ScanPlan: A view of the points that are still to be measured.
+        """
+        return self[position:]
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    @overload
+    def __getitem__(self, index: int) -> np.void: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "ScanPlan": ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[np.void, "ScanPlan"]:
+        if isinstance(index, slice):
+            return ScanPlan(self.points[index])
+        return self.points[index]
+
+    def __iter__(self) -> Iterator[np.void]:
+        return iter(self.points)
+
+    def __repr__(self) -> str:
+        return f"ScanPlan({len(self)} points)"
+
+
+# The most points of a plan compiled at once when it is compiled in chunks (see SweepPlan.chunks)
+chunk_points = 100000
+
+
+class SweepPlan(NamedTuple):
+    """
+    The plan ScanPlan.from_axes compiles from a temperature and a field sweep, held as the sweeps
+    rather than as its points so that it can be costed in closed form (see
+    CostModel.estimate_sweep_plan) and compiled a chunk at a time, however many points it has.
+    """
+
+    temperatures: Sweep
+    fields: Sweep
+    mevents: float
+    set_temperature: bool = True
+    set_field: bool = True
+    ordering: str = RASTER  # RASTER or SERPENTINE
+
+    @property
+    def points(self) -> int:
+        """
+        Returns:
+          int: The number of points of the plan.
+        """
+        return self.temperatures.total_points * self.fields.total_points
+
+    @property
+    def field_moves(self) -> Tuple[float, int]:
+        """
+        Returns:
+          Tuple[float, int]: The total distance the field is ramped between the points of the plan
+            and the number of times it changes.
+        """
+        temperatures, fields = self.temperatures.total_points, self.fields
+        # The field is swept at every temperature
+        distance = temperatures * fields.distance
+        changes = temperatures * fields.changes
+        if self.ordering == RASTER and temperatures > 1 and fields.points > 1:
+            # and ramped back to the start of the sweep before each temperature after the first
+            back = abs(fields.first - fields.end)
+            if back > 0:
+                distance += (temperatures - 1) * back
+                changes += temperatures - 1
+        return distance, changes
+
+    @property
+    def field_ramp(self) -> float:
+        """
+        Returns:
+          float: The total distance the field is ramped between the points of the plan.
+        """
+        return self.field_moves[0]
+
+    @property
+    def setpoint_changes(self) -> int:
+        """
+        Returns:
+          int: The number of points of the plan that set the temperature or field.
+        """
+        changes = 0
+        if not self.points:
+            return changes
+        if self.set_temperature and not math.isnan(self.temperatures.first):
+            changes += 1 + self.temperatures.changes
+        if self.set_field and not math.isnan(self.fields.first):
+            changes += 1 + self.field_moves[1]
+        return changes
+
+    def chunks(self) -> Iterator[ScanPlan]:
+        """
+        Compile the points of the plan chunk_points at a time, so that they are never all held at
+        once.
+
+        Returns:
+          Iterator[ScanPlan]: The chunks of the plan in order. Each chunk after the first begins
+            with the last point of the chunk before it, so that the move between them is in it.
+        """
+        temperatures, fields = self.temperatures.values(), self.fields.values()
+        points = len(temperatures) * len(fields)
+        for begin in range(0, points, chunk_points):
+            indices = np.arange(max(begin - 1, 0), min(begin + chunk_points, points))
+            temperature_index, field_index = np.divmod(indices, len(fields))
+            if self.ordering == SERPENTINE:
+                reversed_fields = temperature_index % 2 == 1
+                field_index[reversed_fields] = len(fields) - 1 - field_index[reversed_fields]
+            chunk = np.zeros(len(indices), dtype=scan_point_dtype)
+            chunk["temperature"] = temperatures[temperature_index]
+            chunk["field"] = fields[field_index]
+            chunk["mevents"] = self.mevents
+            yield ScanPlan(ScanPlan._compile_actions(chunk, self.set_temperature, self.set_field))
+
+
+class ScanPlanBatch(NamedTuple):
+    """
+    The temperatures and fields of the points of many scan plans (e.g. one for each row of a
+    script) stored in flat arrays. The points of plan i are [offsets[i]:offsets[i + 1]], each
+    counting mevents[i].
+    """
+
+    temperatures: np.ndarray
+    fields: np.ndarray
+    mevents: np.ndarray
+    offsets: np.ndarray
+
+    @classmethod
+    def from_axes(
+        cls,
+        temperatures: ScanBatch,
+        fields: ScanBatch,
+        mevents: np.ndarray,
+        ordering: str = RASTER,
+    ) -> "ScanPlanBatch":
+        """
+        The equivalent of ScanPlan.from_axes for many plans at once.
+
+        Parameters:
+          temperatures (ScanBatch): the temperatures of each plan, [NaN] if the temperature is kept
+          fields (ScanBatch): the fields of each plan, [NaN] if the field is kept
+          mevents (np.ndarray): the millions of events to wait for at each point of each plan
+          ordering (str): RASTER or SERPENTINE
+
+        Returns:
+          ScanPlanBatch: The points of the plans.
+        """
+        temperature_counts, field_counts = temperatures.counts, fields.counts
+        counts = temperature_counts * field_counts
+        offsets = np.zeros(len(counts) + 1, dtype=np.intp)
+        np.cumsum(counts, out=offsets[1:])
+        plans = np.repeat(np.arange(len(counts)), counts)
+        temperature_index, field_index = np.divmod(
+            np.arange(offsets[-1]) - offsets[plans], field_counts[plans]
+        )
+        if ordering == SERPENTINE:
+            reversed_fields = temperature_index % 2 == 1
+            field_index[reversed_fields] = (
+                field_counts[plans][reversed_fields] - 1 - field_index[reversed_fields]
+            )
+        return cls(
+            temperatures.values[temperatures.offsets[plans] + temperature_index],
+            fields.values[fields.offsets[plans] + field_index],
+            np.asarray(mevents, dtype=float),
+            offsets,
+        )
+
+    @property
+    def counts(self) -> np.ndarray:
+        """
+        Returns:
+          np.ndarray: The number of points in each plan.
+        """
+        return np.diff(self.offsets)
+
+    def plan(self, index: int) -> ScanPlan:
+        """
+        Parameters:
+          index (int): the plan to get
+
+        Returns:
+          ScanPlan: The plan, setting the temperature and field wherever they change.
+        """
+        start, stop = self.offsets[index], self.offsets[index + 1]
+        points = np.zeros(stop - start, dtype=scan_point_dtype)
+        points["temperature"] = self.temperatures[start:stop]
+        points["field"] = self.fields[start:stop]
+        points["mevents"] = self.mevents[index]
+        return ScanPlan(ScanPlan._compile_actions(points, True, True))
@@ -0,0 +1,307 @@
+import math
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from cast_row import CastRow, cast_row
+from plan_optimiser import TransitionCosts
+from scan_plan import ScanAction
+from timeline import plan_row
+
+# What each finding of analyse_script is about. REDUNDANT_MAGNET_SWITCH is selecting a magnet
+# device again that an earlier row already used, DUPLICATED_POINTS is counting again at
+# (temperature, field) points an earlier row already counted at, RAMP_REVERSAL is ramping away and
+# back between two rows that could have been measured the other way round and ZERO_MEVENTS is a row
+# that counts nothing.
+REDUNDANT_MAGNET_SWITCH = "redundant_magnet_switch"
+DUPLICATED_POINTS = "duplicated_points"
+RAMP_REVERSAL = "ramp_reversal"
+ZERO_MEVENTS = "zero_mevents"
+finding_kinds = [REDUNDANT_MAGNET_SWITCH, DUPLICATED_POINTS, RAMP_REVERSAL, ZERO_MEVENTS]
+
+# Temperatures and fields closer than this are the same point
+point_decimals = 6
+
+# A reversal saving less than this is not worth reordering the rows for (s)
+minimum_reversal_saving = 1.0
+
+
+class Finding(NamedTuple):
+    """
+    Something a script does across its rows that wastes beam time.
+    """
+
+    kind: str  # one of finding_kinds
+    rows: Tuple[int, ...]  # the indices of the rows involved, the row wasting the time last
+    message: str
+    wasted_seconds: float  # the seconds the script is estimated to waste on it
+
+
+class ScriptAnalysis(NamedTuple):
+    """
+    What analysing every row of a script together found.
+    """
+
+    findings: List[Finding]  # in the order of the rows wasting the time
+    errors: List[Optional[str]]  # why each row could not be analysed, or None if it was
+
+    @property
+    def wasted_seconds(self) -> float:
+        """
+        Returns:
+          float: The seconds wasted by every finding. Findings can overlap (e.g. a duplicated row
+            that is also ramped back to), so this is at most what fixing all of them saves.
+        """
+        return sum(finding.wasted_seconds for finding in self.findings)
+
+    def of_kind(self, kind: str) -> List[Finding]:
+        """
+        Parameters:
+          kind (str): one of finding_kinds
+
+        Returns:
+          List[Finding]: The findings of that kind, in order.
+        """
+        return [finding for finding in self.findings if finding.kind == kind]
+
+
+def _kept(value: float, state: float) -> float:
+    """
+    Returns:
+      float: The value a temperature or field has after being set to value (NaN if kept) from state.
+    """
+    return state if math.isnan(value) else value
+
+
+def analyse_script(script_definition: Any, rows: Sequence[Mapping[str, str]]) -> ScriptAnalysis:
+    """
+    Find what the rows of a script waste beam time on that no row can see alone: selecting a magnet
+    device again after switching away from it, counting again at points already counted at, ramping
+    away and back between rows and rows that count nothing. The temperature, field and magnet device
+    each row leaves are carried to the next, starting unknown, and every counting point is kept in
+    an index of the points counted so far, so the analysis takes time linear in the points of the
+    script. Custom commands are taken not to change the temperature, field or magnet device.
+
+    Parameters:
+      script_definition (ScriptDefinition): the definition of the rows, with parameter_casters,
+        rules and a get_row_plan method and its global_params set
+      rows (Sequence[Mapping[str, str]]): the raw parameters of each row
+
+    Returns:
+      ScriptAnalysis: What wastes beam time, with the seconds each wastes, and the rows that could
+        not be analysed (e.g. as they cannot be cast or are not valid), which are skipped.
+    """
+    casters = script_definition.parameter_casters
+    errors: List[Optional[str]] = [None] * len(rows)
+    # The findings of each row, so that they come out in order of rows without sorting them
+    findings: List[List[Finding]] = [[] for _ in rows]
+    # The plan of each distinct row, as scripts repeat rows
+    row_plans: Dict[CastRow, Any] = {}
+    temperature = field = math.nan
+    device: Optional[str] = None
+    # The last row selecting each magnet device
+    device_rows: Dict[str, int] = {}
+    # The first row counting at each (magnet device, temperature, field)
+    point_index: Dict[Tuple[Optional[str], float, float], int] = {}
+    # Each row that was planned, where the temperature and field were before it, where it ramps to
+    # first and last and the costs of ramping to it
+    planned: List[int] = []
+    moves: List[Tuple[float, float, float, float, float, float]] = []
+    transitions: List[TransitionCosts] = []
+    for index, row in enumerate(rows):
+        cast = cast_row(casters, row)
+        try:
+            row_plan = row_plans.get(cast)
+        except TypeError:
+            # e.g. a parameter that is not a string, which cannot be a key
+            row_plan = plan_row(script_definition, cast)
+        if row_plan is None:
+            row_plan = row_plans[cast] = plan_row(script_definition, cast)
+        if isinstance(row_plan, str):
+            errors[index] = row_plan
+            continue
+        plan, cost_model = row_plan.plan, row_plan.cost_model
+        if not len(plan):
+            continue
+        parameters = cast.parameters
+        temperatures, fields = plan.temperatures, plan.fields
+        # A temperature or field that is kept is kept at every point of a plan
+        row_move = (
+            temperature,
+            field,
+            temperatures.item(0),
+            fields.item(0),
+            temperatures.item(-1),
+            fields.item(-1),
+        )
+        # A row selects its magnet device if it sets the field
+        selected = parameters.get("magnet_device", "N/A")
+        if selected != "N/A" and not math.isnan(row_move[3]):
+            if selected != device and selected in device_rows:
+                findings[index].append(
+                    Finding(
+                        REDUNDANT_MAGNET_SWITCH,
+                        (device_rows[selected], index),
+                        f"Row {index} selects the {selected} again after row "
+                        f"{device_rows[selected]} used it, measuring the rows using it together "
+                        "saves switching to it",
+                        cost_model.magnet_switch,
+                    )
+                )
+            device = selected
+            device_rows[selected] = index
+        planned.append(index)
+        moves.append(row_move)
+        transitions.append(cost_model.transitions)
+        counting = (plan.actions & ScanAction.COUNT) != 0
+        if not counting.any():
+            # A row running a custom command is there for the command
+            if parameters.get("custom", "None") == "None":
+                # What the row ramps, settles and switches is wasted
+                estimate = cost_model.estimate(plan, row_plan.magnet_switches)
+                findings[index].append(
+                    Finding(
+                        ZERO_MEVENTS,
+                        (index,),
+                        f"Row {index} counts nothing",
+                        estimate.ramp + estimate.settle + estimate.magnet_switch,
+                    )
+                )
+        else:
+            if row_plan.count_seconds is None:
+                count_seconds = plan.mevents[counting] / cost_model.event_rate
+            else:
+                count_seconds = np.full(np.count_nonzero(counting), row_plan.count_seconds)
+            points = np.round(
+                np.stack(
+                    (
+                        np.where(np.isnan(temperatures), temperature, temperatures)[counting],
+                        np.where(np.isnan(fields), field, fields)[counting],
+                    )
+                ),
+                point_decimals,
+            ).tolist()
+            # The points and seconds duplicated from each earlier row
+            duplicated: Dict[int, List[float]] = {}
+            for point_temperature, point_field, seconds in zip(
+                points[0], points[1], (count_seconds + cost_model.run_overhead).tolist()
+            ):
+                # A point that is not known is not the same as any other
+                if math.isnan(point_temperature) or math.isnan(point_field):
+                    continue
+                first_row = point_index.setdefault((device, point_temperature, point_field), index)
+                if first_row != index:
+                    counts = duplicated.setdefault(first_row, [0, 0.0])
+                    counts[0] += 1
+                    counts[1] += seconds
+            for first_row, (count, seconds) in duplicated.items():
+                findings[index].append(
+                    Finding(
+                        DUPLICATED_POINTS,
+                        (first_row, index),
+                        f"Row {index} counts again at {count} point{'s' if count != 1 else ''} "
+                        f"row {first_row} already counted at",
+                        seconds,
+                    )
+                )
+        temperature = _kept(row_move[4], temperature)
+        field = _kept(row_move[5], field)
+    for earlier, later, seconds in _ramp_reversals(planned, moves, transitions):
+        findings[later].append(
+            Finding(
+                RAMP_REVERSAL,
+                (earlier, later),
+                f"Row {later} ramps back to where the rows before row {earlier} were, measuring "
+                f"row {later} before row {earlier} saves ramping away and back",
+                seconds,
+            )
+        )
+    return ScriptAnalysis(
+        [finding for row_findings in findings for finding in row_findings], errors
+    )
+
+
+def _ramp_reversals(
+    planned: Sequence[int],
+    moves: Sequence[Tuple[float, float, float, float, float, float]],
+    transitions: Sequence[TransitionCosts],
+) -> List[Tuple[int, int, float]]:
+    """
+    Find the pairs of consecutive rows that would ramp less measured the other way round, e.g. a
+    row at 2 K between two at 300 K. Swapping a pair only changes the moves into the first row,
+    between the two and out of the second, so every pair is costed together from where each row
+    starts and ends, and of the pairs that overlap those saving the most together are chosen.
+
+    Parameters:
+      planned (Sequence[int]): the index of each row that was planned, in order
+      moves (Sequence[Tuple[float, ...]]): the temperature and field before each planned row and
+        the first and last temperature and field it sets (NaN if kept or not known)
+      transitions (Sequence[TransitionCosts]): the costs of ramping to each planned row
+
+    Returns:
+      List[Tuple[int, int, float]]: The index of the first and second row of each pair and the
+        seconds saved by swapping them, in order.
+    """
+    if len(planned) < 2:
+        return []
+    state_temperature, state_field, first_temperature, first_field, last_temperature, last_field = (
+        np.array(moves).T
+    )
+    # Rows j and k of each pair and where the row after them starts, NaN (no move) after the last
+    j, k = slice(0, -1), slice(1, None)
+    next_temperature = np.append(first_temperature[2:], np.nan)
+    next_field = np.append(first_field[2:], np.nan)
+    # The cost of each move is that of the row moved to, so the costs of the rows can differ
+    costs = TransitionCosts(*np.array(transitions).T)
+    first_costs = TransitionCosts(*(value[j] for value in costs))
+    second_costs = TransitionCosts(*(value[k] for value in costs))
+
+    def path(
+        into: TransitionCosts,
+        then: TransitionCosts,
+        first: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray],
+        second: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray],
+    ) -> np.ndarray:
+        """
+        The seconds moving into the first row of each pair, then the second, then the row after.
+        """
+        temperature, field = state_temperature[j], state_field[j]
+        seconds = into.transition(temperature, field, first[0], first[1])
+        temperature = np.where(np.isnan(first[2]), temperature, first[2])
+        field = np.where(np.isnan(first[3]), field, first[3])
+        seconds += then.transition(temperature, field, second[0], second[1])
+        temperature = np.where(np.isnan(second[2]), temperature, second[2])
+        field = np.where(np.isnan(second[3]), field, second[3])
+        # The move out of the pair is costed by the row after, taken as the second row
+        return seconds + second_costs.transition(temperature, field, next_temperature, next_field)
+
+    rows_j = (first_temperature[j], first_field[j], last_temperature[j], last_field[j])
+    rows_k = (first_temperature[k], first_field[k], last_temperature[k], last_field[k])
+    savings = path(first_costs, second_costs, rows_j, rows_k) - path(
+        second_costs, first_costs, rows_k, rows_j
+    )
+    # Where a row starts from is not known before the temperature or field it sets is first set,
+    # so a pair setting it then cannot be costed
+    unknown = (
+        np.isnan(state_temperature[j])
+        & ~(np.isnan(first_temperature[j]) & np.isnan(first_temperature[k]))
+    ) | (np.isnan(state_field[j]) & ~(np.isnan(first_field[j]) & np.isnan(first_field[k])))
+    savings[unknown] = 0.0
+    # The move out of a pair is the move into the pair after the next, so only pairs at least three
+    # apart can both be swapped. The most saved by swapping the pairs up to each pair, and the
+    # pairs swapped for it as a chain of (position, the chain before it).
+    best = [0.0, 0.0, 0.0]
+    swapped: List[Optional[Tuple[int, Any]]] = [None, None, None]
+    for position, saving in enumerate(savings.tolist()):
+        if saving >= minimum_reversal_saving and saving + best[-3] > best[-1]:
+            best.append(saving + best[-3])
+            swapped.append((position, swapped[-3]))
+        else:
+            best.append(best[-1])
+            swapped.append(swapped[-1])
+    pairs = []
+    chain = swapped[-1]
+    while chain is not None:
+        position, chain = chain
+        pairs.append((planned[position], planned[position + 1], float(savings[position])))
+    return pairs[::-1]
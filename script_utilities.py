@@ -1,16 +1,786 @@
-from typing import Generator
+import math
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Hashable, Sequence
+from decimal import Decimal
+from functools import wraps
+from typing import Any, Callable, Generator, Iterator, NamedTuple, Optional, Tuple, Union, overload
 
 import numpy as np
+import numpy.typing as npt
 
 
 def get_steps(start: float, step: float, stop: float) -> Generator[float, None, None]:
+    yield from ScanRange(start, step, stop)
+
+
+def last_step(start: float, step: float, stop: float) -> float:
+    """
+    Get the last point get_steps would yield without generating them: stop if it is a whole number
+    of steps from start, otherwise the last whole step before it.
+
+    Parameters:
+      start (float): the value to start the range from
+      step (float): the steps to take from start to stop
+      stop (float): the value to stop the range at
+
+    Returns:
+      float: The last point of get_steps(start, step, stop).
+
+    Raises:
+      ZeroDivisionError: If step is zero, as get_steps does.
+    """
     modulo = abs(stop - start) % abs(step)
     if stop > start:
-        vstop = stop - modulo
+        return float(stop - modulo)
+    return float(stop + modulo)
+
+
+def count_steps(start: float, step: float, stop: float) -> int:
+    """
+    Count the points get_steps would yield without generating them.
+
+    Parameters:
+      start (float): the value to start the range from
+      step (float): the steps to take from start to stop
+      stop (float): the value to stop the range at
+
+    Returns:
+      int: The number of points in get_steps(start, step, stop).
+
+    Raises:
+      ZeroDivisionError: If step is zero, as get_steps does.
+    """
+    # The end points of the linspace are start and the last step, both of which lie inside the
+    # range, so the range check in get_steps never drops a point.
+    return int(abs(last_step(start, step, stop) - float(start)) / abs(step)) + 1
+
+
+def count_arange_steps(
+    start: float, stop: float, step: float, decimal_places: Optional[int] = None
+) -> int:
+    """
+    Count the points of an inclusive, step flipping range built with np.arange (as used by the
+    older EMU definitions) without generating them.
+
+    Parameters:
+      start (float): the value to start the range from
+      stop (float): the value to stop the range at
+      step (float): the steps to take from start to stop
+      decimal_places (int): if given, points are rounded to this many decimal places before they
+        are checked against the range
+
+    Returns:
+      int: The number of points in the range.
+    """
+    if start > stop and step > 0:
+        step = -step
+    lowest, highest = min(start, stop), max(start, stop)
+    # np.arange gives ceil((stop - start) / step) points and fills them from the first two values
+    length = max(math.ceil((stop + step - start) / step), 0)
+    # The points are monotonic, so only the last few can fall outside of the range
+    while length > 0:
+        point = _arange_point(start, step, length - 1, decimal_places)
+        if lowest <= point <= highest:
+            break
+        length -= 1
+    return length
+
+
+def last_arange_step(
+    start: float, stop: float, step: float, decimal_places: Optional[int] = None
+) -> float:
+    """
+    Get the last point of an inclusive, step flipping range built with np.arange (as used by the
+    older EMU definitions) without generating the range.
+
+    Parameters:
+      start (float): the value to start the range from
+      stop (float): the value to stop the range at
+      step (float): the steps to take from start to stop
+      decimal_places (int): if given, points are rounded to this many decimal places
+
+    Returns:
+      float: The last point in the range, or start if the range is empty.
+    """
+    if start > stop and step > 0:
+        step = -step
+    points = count_arange_steps(start, stop, step, decimal_places)
+    return float(_arange_point(start, step, max(points - 1, 0), decimal_places))
+
+
+def _arange_point(start: float, step: float, index: int, decimal_places: Optional[int]) -> float:
+    """
+    Returns:
+      float: The point at index of np.arange from start in steps of step, rounded to decimal_places
+        if given.
+    """
+    if index == 0:
+        point = start
+    elif index == 1:
+        point = start + step
+    else:
+        point = start + index * ((start + step) - start)
+    if decimal_places is not None:
+        point = round(point, decimal_places)
+    return point
+
+
+class _IndexedRange(Sequence, ABC):
+    """
+    A sequence of scan points which are computed from their index when they are needed rather
+    than stored, so it can be measured, indexed, sliced and reversed in O(1) memory. Subclasses
+    provide the point at an index and the index of a point.
+    """
+
+    _indices: range
+
+    @abstractmethod
+    def _point(self, i: int) -> float:
+        """
+        Returns:
+          float: The point at index i.
+        """
+
+    @abstractmethod
+    def _index_of(self, value: float) -> Optional[int]:
+        """
+        Returns:
+          int: The index of the point equal to value, or None if there is no such point.
+        """
+
+    def _view(self, indices: range) -> "_IndexedRange":
+        view = type(self).__new__(type(self))
+        view.__dict__.update(self.__dict__)
+        view._indices = indices
+        return view
+
+    def __len__(self) -> int:
+        return len(self._indices)
+
+    @overload
+    def __getitem__(self, index: int) -> float: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "_IndexedRange": ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[float, "_IndexedRange"]:
+        if isinstance(index, slice):
+            return self._view(self._indices[index])
+        return self._point(self._indices[index])
+
+    def __iter__(self) -> Iterator[float]:
+        for i in self._indices:
+            yield self._point(i)
+
+    def __reversed__(self) -> Iterator[float]:
+        for i in reversed(self._indices):
+            yield self._point(i)
+
+    def __contains__(self, value: object) -> bool:
+        try:
+            self.index(value)
+        except ValueError:
+            return False
+        return True
+
+    def index(self, value: object, start: int = 0, stop: Optional[int] = None) -> int:
+        """
+        Find the position of a point in the range, without searching through the points.
+
+        Parameters:
+          value (float): the point to find
+          start (int): the position to start looking from
+          stop (int): the position to stop looking at (exclusive)
+
+        Returns:
+          int: The position of the point.
+
+        Raises:
+          ValueError: If the value is not a point in the range.
+        """
+        if isinstance(value, (int, float, np.floating, np.integer)) and math.isfinite(value):
+            i = self._index_of(float(value))
+            if i is not None and i in self._indices:
+                position = self._indices.index(i)
+                if position in range(len(self))[start:stop]:
+                    return position
+        raise ValueError(f"{value} is not in {self!r}")
+
+    def count(self, value: object) -> int:
+        return 1 if value in self else 0
+
+    def to_array(self) -> np.ndarray:
+        """
+        Returns:
+          np.ndarray: The points in a new array.
+        """
+        return np.fromiter(self, dtype=float, count=len(self))
+
+
+class ScanRange(_IndexedRange):
+    """
+    The points of a scan from start to stop in steps of step. Holds the same values as
+    np.linspace in get_steps without storing them.
+
+    Examples:
+      >>> list(ScanRange(0.5, 0.5, 2)) == [0.5, 1, 1.5, 2]
+      >>> list(ScanRange(2, 0.5, 0.5)[1:]) == [1.5, 1, 0.5]
+      >>> ScanRange(0.5, 0.5, 2).index(1.5) == 2
+    """
+
+    def __init__(self, start: float, step: float, stop: float) -> None:
+        """
+        Parameters:
+          start (float): the value to start the range from
+          step (float): the steps to take from start to stop, the sign is ignored
+          stop (float): the value to stop the range at (inclusive if it is a whole number of steps
+            from start)
+
+        Raises:
+          ZeroDivisionError: If step is zero.
+        """
+        self.start = start
+        self.step = step
+        self.stop = stop
+        self._first = float(start)
+        self._last = last_step(start, step, stop)
+        self._points = count_steps(start, step, stop)
+        # Same arithmetic as np.linspace so every point matches get_steps exactly
+        if self._points > 1:
+            self._increment = (self._last - self._first) / (self._points - 1)
+        else:
+            self._increment = 0.0
+        self._indices = range(self._points)
+
+    def _point(self, i: int) -> float:
+        if i == self._points - 1 and i > 0:
+            return self._last
+        return i * self._increment + self._first
+
+    def to_array(self) -> np.ndarray:
+        points = np.linspace(self._first, self._last, self._points)
+        if self._indices == range(self._points):
+            return points
+        return points[np.arange(self._indices.start, self._indices.stop, self._indices.step)]
+
+    def _index_of(self, value: float) -> Optional[int]:
+        if self._increment == 0.0:
+            nearest = 0
+        else:
+            nearest = round((value - self._first) / self._increment)
+        # Rounding in the division can put us one point either side
+        for i in (nearest, nearest - 1, nearest + 1):
+            if 0 <= i < self._points and self._point(i) == value:
+                return i
+        return None
+
+    def __repr__(self) -> str:
+        return f"ScanRange({self.start!r}, {self.step!r}, {self.stop!r})[{self._indices!r}]"
+
+
+def _exact_decimal(value: float) -> Decimal:
+    """
+    Get the decimal a user entered from the float it was cast to.
+
+    Parameters:
+      value (float): the value entered by the user
+
+    Returns:
+      Decimal: The shortest decimal that casts back to the same float.
+    """
+    return Decimal(repr(float(value)))
+
+
+def decimal_places(*values: float) -> int:
+    """
+    Get the number of decimal places needed to represent all of the given user entries.
+    Handles whole numbers and numbers written in scientific notation.
+
+    Parameters:
+      values (float): the values entered by the user
+
+    Returns:
+      int: The largest number of decimal places of any of the values.
+    """
+    return max(max(-int(_exact_decimal(value).as_tuple().exponent), 0) for value in values)
+
+
+class LatticeRange(_IndexedRange):
+    """
+    The points of a scan from start to stop in steps of step, where every point is start plus a
+    whole number of steps worked out exactly in decimal. Includes stop whenever it is a whole
+    number of steps from start, with no float error or fudge factor.
+
+    Each point is the float nearest to its exact decimal value, so equal setpoints compare and hash
+    equal wherever they come from (e.g. when looking for the same point across rows), and finding
+    the position of a setpoint is O(1).
+
+    Examples:
+      >>> list(LatticeRange(0, 0.1, 0.3)) == [0, 0.1, 0.2, 0.3]
+      >>> list(LatticeRange(2, 0.3, 1)) == [2, 1.7, 1.4, 1.1]
+      >>> LatticeRange(0, 0.1, 0.3).index(0.3) == 3
+    """
+
+    def __init__(self, start: float, step: float, stop: float) -> None:
+        """
+        Parameters:
+          start (float): the value to start the range from
+          step (float): the steps to take from start to stop, the sign is ignored
+          stop (float): the value to stop the range at (inclusive if it is a whole number of steps
+            from start)
+
+        Raises:
+          ZeroDivisionError: If step is zero.
+        """
+        self.start = start
+        self.step = step
+        self.stop = stop
+        # Work in integer multiples of the smallest decimal place entered
+        self._scale = 10 ** decimal_places(start, step, stop)
+        self._first = self._units(start)
+        self._step = abs(self._units(step))
+        if self._step == 0:
+            raise ZeroDivisionError("Cannot step through a range when step is zero")
+        last = self._units(stop)
+        self._direction = 1 if last >= self._first else -1
+        self._indices = range(abs(last - self._first) // self._step + 1)
+
+    def _units(self, value: float) -> int:
+        return int(_exact_decimal(value) * self._scale)
+
+    def _point(self, i: int) -> float:
+        # Dividing integers gives the float nearest to the exact result
+        return (self._first + self._direction * i * self._step) / self._scale
+
+    def _index_of(self, value: float) -> Optional[int]:
+        units = _exact_decimal(value) * self._scale
+        if units != units.to_integral_value():
+            return None
+        i, remainder = divmod((int(units) - self._first) * self._direction, self._step)
+        return None if remainder else i
+
+    def __repr__(self) -> str:
+        return f"LatticeRange({self.start!r}, {self.step!r}, {self.stop!r})[{self._indices!r}]"
+
+
+class ScanBatch(NamedTuple):
+    """
+    The points of many scans stored in one flat array. The points of scan i are
+    values[offsets[i]:offsets[i + 1]].
+    """
+
+    values: np.ndarray
+    offsets: np.ndarray
+
+    @property
+    def counts(self) -> np.ndarray:
+        """
+        Returns:
+          np.ndarray: The number of points in each scan.
+        """
+        return np.diff(self.offsets)
+
+    def row(self, index: int) -> np.ndarray:
+        """
+        Parameters:
+          index (int): the scan to get the points of
+
+        Returns:
+          np.ndarray: A view of the points of the scan.
+        """
+        return self.values[self.offsets[index] : self.offsets[index + 1]]
+
+
+def _batch_extents(
+    starts: np.ndarray, steps: np.ndarray, stops: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The vectorised equivalent of the step flipping and end point calculation in count_steps.
+
+    Returns:
+      tuple: The number of points and the last point of each scan.
+    """
+    if np.any(steps == 0):
+        raise ZeroDivisionError(
+            f"Cannot step with a step of zero (scans {np.flatnonzero(steps == 0)})"
+        )
+    absolute_steps = np.abs(steps)
+    modulo = np.abs(stops - starts) % absolute_steps
+    lasts = np.where(stops > starts, stops - modulo, stops + modulo)
+    counts = (np.abs(lasts - starts) / absolute_steps).astype(np.intp) + 1
+    return counts, lasts
+
+
+def count_steps_batch(
+    starts: npt.ArrayLike, steps: npt.ArrayLike, stops: npt.ArrayLike
+) -> np.ndarray:
+    """
+    Count the points get_steps would yield for many scans at once.
+
+    Parameters:
+      starts (array like): the value to start each range from
+      steps (array like): the steps to take from start to stop in each range
+      stops (array like): the value to stop each range at
+
+    Returns:
+      np.ndarray: The number of points in each scan.
+
+    Raises:
+      ZeroDivisionError: If any step is zero.
+    """
+    starts, steps, stops = np.broadcast_arrays(
+        *(np.asarray(values, dtype=float).ravel() for values in (starts, steps, stops))
+    )
+    return _batch_extents(starts, steps, stops)[0]
+
+
+def get_steps_batch(starts: npt.ArrayLike, steps: npt.ArrayLike, stops: npt.ArrayLike) -> ScanBatch:
+    """
+    Generate the points of many scans (e.g. the rows of a script) in one pass. Gives the same
+    points as calling get_steps for each scan.
+
+    Parameters:
+      starts (array like): the value to start each range from
+      steps (array like): the steps to take from start to stop in each range
+      stops (array like): the value to stop each range at
+
+    Returns:
+      ScanBatch: The points of all of the scans.
+
+    Raises:
+      ZeroDivisionError: If any step is zero.
+
+    Examples:
+      >>> batch = get_steps_batch([0.5, 2], [0.5, 0.5], [2, 0.5])
+      >>> list(batch.row(0)) == [0.5, 1, 1.5, 2] and list(batch.row(1)) == [2, 1.5, 1, 0.5]
+    """
+    starts, steps, stops = np.broadcast_arrays(
+        *(np.asarray(values, dtype=float).ravel() for values in (starts, steps, stops))
+    )
+    counts, lasts = _batch_extents(starts, steps, stops)
+    offsets = np.zeros(len(counts) + 1, dtype=np.intp)
+    np.cumsum(counts, out=offsets[1:])
+    rows = np.repeat(np.arange(len(counts)), counts)
+    positions = np.arange(offsets[-1]) - offsets[rows]
+    # Same arithmetic as np.linspace in get_steps
+    increments = np.where(counts > 1, (lasts - starts) / np.maximum(counts - 1, 1), 0.0)
+    values = positions * increments[rows] + starts[rows]
+    multiple_points = counts > 1
+    values[offsets[1:][multiple_points] - 1] = lasts[multiple_points]
+    # Same check as get_steps to ensure each scan remains within its defined range
+    inside = (values >= np.minimum(starts, stops)[rows]) & (
+        values <= np.maximum(starts, stops)[rows]
+    )
+    if not inside.all():
+        values = values[inside]
+        np.cumsum(np.bincount(rows[inside], minlength=len(counts)), out=offsets[1:])
+    return ScanBatch(values, offsets)
+
+
+def count_geometric_steps(start: float, stop: float, count: int) -> int:
+    """
+    Count the points geometric_steps gives without generating them.
+
+    Parameters:
+      start (float): the value to start the range from
+      stop (float): the value to stop the range at
+      count (int): the number of points asked for
+
+    Returns:
+      int: The number of points in geometric_steps(start, stop, count).
+    """
+    if start == stop:
+        return min(max(count, 0), 1)
+    return max(count, 0)
+
+
+def geometric_steps(
+    start: float, stop: float, count: int, lowest_non_zero: float = 1.0
+) -> np.ndarray:
+    """
+    Get count points from start to stop (both inclusive) with a constant ratio between neighbouring
+    points, like np.geomspace. If start or stop is zero, that end is measured at exactly zero and
+    the remaining points are spaced geometrically between lowest_non_zero and the other end.
+
+    Parameters:
+      start (float): the value to start the range from
+      stop (float): the value to stop the range at
+      count (int): the number of points
+      lowest_non_zero (float): the smallest magnitude to step down to when one end is zero
+
+    Returns:
+      np.ndarray: The points.
+
+    Raises:
+      ValueError: If start and stop have opposite signs, or one is zero and the other is not
+        larger in magnitude than lowest_non_zero.
+
+    Examples:
+      >>> list(geometric_steps(1, 1000, 4)) == [1, 10, 100, 1000]
+      >>> list(geometric_steps(0, 100, 4)) == [0, 1, 10, 100]
+    """
+    count = count_geometric_steps(start, stop, count)
+    if count <= 1:
+        return np.full(count, float(start))
+    if start * stop < 0:
+        raise ValueError("Cannot step geometrically between values of opposite sign")
+    if start != 0 and stop != 0:
+        points = np.geomspace(start, stop, count)
     else:
-        vstop = stop + modulo
-    for i in np.linspace(start, vstop, int(abs(vstop - start) / abs(step)) + 1):
-        if ((i >= start) and (i <= stop)) or (
-            (i >= stop) and (i <= start)
-        ):  # Check inserted here to ensure scan remains within defined range
-            yield i
+        other_end = stop if start == 0 else start
+        if abs(other_end) <= lowest_non_zero:
+            raise ValueError(
+                f"Cannot step geometrically from zero to a value within {lowest_non_zero} of zero"
+            )
+        if count == 2:
+            non_zero = np.array([float(other_end)])
+        else:
+            non_zero = np.geomspace(np.copysign(lowest_non_zero, other_end), other_end, count - 1)
+        if start == 0:
+            points = np.concatenate(([0.0], non_zero))
+        else:
+            points = np.concatenate((non_zero[::-1], [0.0]))
+    points[0] = start
+    points[-1] = stop
+    return points
+
+
+class CacheStats(NamedTuple):
+    """
+    A snapshot of how well an LRUCache is doing.
+    """
+
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    weight: int
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        Returns:
+          float: The fraction of lookups that were hits (0 if there have been no lookups).
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class LRUCache:
+    """
+    A least recently used cache bounded by the total weight of the values it holds (e.g. the number
+    of points in the cached scans) as well as by the number of entries.
+    """
+
+    def __init__(
+        self,
+        max_weight: int,
+        weigh: Callable[[Any], int] = lambda value: 1,
+        max_entries: Optional[int] = None,
+    ) -> None:
+        """
+        Parameters:
+          max_weight (int): the largest total weight to hold, values weighing more than this on
+            their own are never cached
+          weigh (function): gives the weight of a value, by default every value weighs 1
+          max_entries (int): the largest number of entries to hold, or None for no limit
+        """
+        self.max_weight = max_weight
+        self.max_entries = max_entries
+        self._weigh = weigh
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._weight = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Get the value for key, computing and caching it if it is not already cached.
+
+        Parameters:
+          key (Hashable): the key of the value
+          compute (function): called with no arguments to compute the value on a miss
+
+        Returns:
+          The cached or computed value.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+        self._misses += 1
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Cache a value, evicting the least recently used values until it fits.
+
+        Parameters:
+          key (Hashable): the key of the value
+          value: the value to cache
+        """
+        weight = self._weigh(value)
+        if key in self._entries:
+            self._weight -= self._entries.pop(key)[1]
+        if weight > self.max_weight:
+            return
+        self._entries[key] = (value, weight)
+        self._weight += weight
+        while self._weight > self.max_weight or (
+            self.max_entries is not None and len(self._entries) > self.max_entries
+        ):
+            self._weight -= self._entries.popitem(last=False)[1][1]
+            self._evictions += 1
+
+    def clear(self) -> None:
+        """
+        Remove every value from the cache. The statistics are kept.
+        """
+        self._entries.clear()
+        self._weight = 0
+
+    def stats(self) -> CacheStats:
+        """
+        Returns:
+          CacheStats: The hits, misses and evictions so far and the current size of the cache.
+        """
+        return CacheStats(
+            self._hits, self._misses, self._evictions, len(self._entries), self._weight
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+
+# Up to a million cached scan points (8 MB)
+scan_cache = LRUCache(max_weight=1000000, weigh=len)
+
+
+def cached_steps(start: float, step: float, stop: float) -> np.ndarray:
+    """
+    Get the points of get_steps(start, step, stop) as a read only array, reusing the array from
+    scan_cache when the same scan has been asked for recently.
+
+    Parameters:
+      start (float): the value to start the range from
+      step (float): the steps to take from start to stop, the sign is ignored
+      stop (float): the value to stop the range at
+
+    Returns:
+      np.ndarray: The points of the scan. It is shared between callers so cannot be written to.
+
+    Raises:
+      ZeroDivisionError: If step is zero.
+    """
+    # Adding 0.0 makes -0.0 and 0.0 the same key
+    key = (float(start) + 0.0, abs(float(step)), float(stop) + 0.0)
+
+    def compute() -> np.ndarray:
+        points = ScanRange(*key).to_array()
+        points.flags.writeable = False
+        return points
+
+    return scan_cache.get_or_compute(key, compute)
+
+
+def global_param(script_definition: Any, name: str) -> Any:
+    """
+    Get the value of a global parameter of a script definition, cast with the caster from its
+    global_params_definition. Falls back to the default from global_params_definition when the
+    global parameters have not been set (e.g. the definition is used outside the script generator).
+
+    Parameters:
+      script_definition (ScriptDefinition): the script definition to get the parameter of
+      name (str): the name of the global parameter
+
+    Returns:
+      Any: The cast value of the global parameter.
+
+    Raises:
+      ValueError: If the value of the global parameter cannot be cast.
+    """
+    default, caster = script_definition.global_params_definition[name]
+    global_params = getattr(script_definition, "global_params", None) or {}
+    return caster(global_params.get(name, default))
+
+
+# Up to 10000 estimates and validations of rows of any script definition
+row_cache = LRUCache(max_weight=10000)
+
+
+def memoise_row(
+    *dependencies: Callable[[], Hashable], cache: Optional[LRUCache] = None
+) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    A decorator caching what a method of a script definition (e.g. estimate_time or
+    parameters_valid) returns for the raw parameters of a row, so that rows that have not changed
+    are not cast, validated or estimated again. Put it above cast_row_parameters (or
+    cast_parameters_to) so the raw parameters, or the CastRow, are the key. The global parameters
+    of the definition are part of the key, so changing one recomputes every row. A mapping the
+    method returns is cached as its items and rebuilt for each caller, so callers cannot change
+    what the others get.
+
+    Parameters:
+      dependencies (function): called with no arguments to get anything else the method depends on
+        (e.g. the version of a calibration), which is added to the key
+      cache (LRUCache): the cache to use, row_cache if None
+
+    Returns:
+      The decorator.
+    """
+
+    store = row_cache if cache is None else cache
+
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        @wraps(func)
+        def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+            global_params = getattr(self, "global_params", None) or {}
+            key = (
+                type(self).__module__,
+                type(self).__qualname__,
+                func.__name__,
+                args,
+                tuple(sorted(kwargs.items())),
+                tuple(sorted(global_params.items())),
+                tuple(dependency() for dependency in dependencies),
+            )
+            try:
+                hash(key)
+            except TypeError:
+                # e.g. a parameter that is not a string, which cannot be a key
+                return func(self, *args, **kwargs)
+            return _thaw(store.get_or_compute(key, lambda: _freeze(func(self, *args, **kwargs))))
+
+        return wrapper
+
+    return decorator
+
+
+class _FrozenMapping(NamedTuple):
+    """
+    A mapping (e.g. the OrderedDict estimate_custom returns) cached as its items, so that what one
+    caller does to the mapping it gets cannot change what the others get.
+    """
+
+    type: type
+    items: Tuple[Tuple[Any, Any], ...]
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return _FrozenMapping(type(value), tuple(value.items()))
+    return value
+
+
+def _thaw(value: Any) -> Any:
+    if isinstance(value, _FrozenMapping):
+        return value.type(value.items)
+    return value
@@ -0,0 +1,229 @@
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence
+
+from cast_row import cast_row, cast_value, missing_parameters_reason
+from validation_rules import Validation, render
+
+
+class RowValidation(NamedTuple):
+    """
+    What validating a row found, kept so that after an edit only what the edit affects is cast and
+    checked again.
+    """
+
+    row: Mapping[str, str]  # the raw parameters
+    parameters: Dict[str, Any]  # the parameters that could be cast
+    cast_errors: Dict[str, str]  # why each parameter that could not be cast could not be
+    rules: Optional[Validation]  # None if some parameter could not be cast
+    data_budget: Optional[str]  # the data budget check, None if the row breaks a rule
+    reason: Optional[str]  # as parameters_valid gives for the row
+
+
+def revalidate_row(
+    script_definition: Any,
+    previous: Optional[RowValidation],
+    changed: Iterable[str],
+    row: Mapping[str, str],
+) -> RowValidation:
+    """
+    Validate a row again after some of its parameters have changed, casting only the parameters
+    that changed and checking only the rules reading them (see RuleSet.revalidate). The data
+    budget is only checked again if a parameter it reads changed. A change to the global
+    parameters of the definition or its calibration needs the row validating from scratch.
+
+    Parameters:
+      script_definition (ScriptDefinition): the definition of the row, with rules,
+        parameter_casters, data_budget_parameters and check_row_data_budget
+      previous (RowValidation): the validation of the row before the change, or None to validate
+        it from scratch
+      changed (Iterable[str]): the names of the parameters that changed
+      row (Mapping[str, str]): the raw parameters of the row now
+
+    Returns:
+      RowValidation: The validation of the row, with the reason parameters_valid gives for it.
+    """
+    casters = script_definition.parameter_casters
+    if not casters.keys() <= row.keys():
+        return RowValidation(dict(row), {}, {}, None, None, missing_parameters_reason)
+    # A row with different parameters than before is validated from scratch
+    if previous is not None and previous.row.keys() == row.keys():
+        parameters, cast_errors = dict(previous.parameters), dict(previous.cast_errors)
+        changed = [name for name in dict.fromkeys(changed) if name in row]
+    else:
+        # Shared with the other methods of the definition casting the row
+        cast = cast_row(casters, row)
+        previous = None
+        parameters, cast_errors = dict(cast.parameters), dict(cast.cast_errors)
+        changed = []
+    for name in changed:
+        parameters.pop(name, None)
+        cast_errors.pop(name, None)
+        value, error = cast_value(casters[name], row[name])
+        if error is None:
+            parameters[name] = value
+        else:
+            cast_errors[name] = error
+    if cast_errors:
+        reason = "".join(cast_errors[name] for name in row if name in cast_errors)
+        return RowValidation(dict(row), parameters, cast_errors, None, None, reason)
+    rules = script_definition.rules
+    if previous is None or previous.rules is None:
+        validation = rules.check(**parameters)
+    else:
+        validation = rules.revalidate(previous.rules, changed, **parameters)
+    reason = render(validation.errors)
+    data_budget = None
+    # The data budget can only be checked once the scans are valid
+    if reason == "":
+        budget_parameters = script_definition.data_budget_parameters
+        if (
+            previous is None
+            or previous.data_budget is None
+            or any(name in budget_parameters for name in changed)
+        ):
+            data_budget = script_definition.check_row_data_budget(**parameters)
+        else:
+            data_budget = previous.data_budget
+        reason = data_budget
+    return RowValidation(dict(row), parameters, {}, validation, data_budget, reason or None)
+
+
+def validate_row(script_definition: Any, row: Mapping[str, str]) -> RowValidation:
+    """
+    Parameters:
+      script_definition (ScriptDefinition): the definition of the row (see revalidate_row)
+      row (Mapping[str, str]): the raw parameters of the row
+
+    Returns:
+      RowValidation: The validation of the row, with the reason parameters_valid gives for it.
+    """
+    return revalidate_row(script_definition, None, row, row)
+
+
+def validate_rows(script_definition: Any, rows: Sequence[Mapping[str, str]]) -> List[Optional[str]]:
+    """
+    Validate every row of a script in one call, giving the reasons parameters_valid gives for each
+    row but casting each distinct value of a column once and checking each rule against every row
+    together (see RuleSet.check_columns). Only the data budget of the rows keeping every rule is
+    checked a row at a time, and that is only costly for rows that may exceed it.
+
+    Parameters:
+      script_definition (ScriptDefinition): the definition of the rows (see revalidate_row)
+      rows (Sequence[Mapping[str, str]]): the raw parameters of each row
+
+    Returns:
+      List[Optional[str]]: Why each row is not valid, or None if it is.
+
+    Raises:
+      KeyError: If a row has a parameter the definition does not, as parameters_valid does.
+    """
+    casters = script_definition.parameter_casters
+    reasons: List[Optional[str]] = [None] * len(rows)
+    complete = []
+    for index, row in enumerate(rows):
+        if row.keys() == casters.keys():
+            complete.append(index)
+        elif casters.keys() <= row.keys():
+            raise KeyError(next(name for name in row if name not in casters))
+        else:
+            reasons[index] = missing_parameters_reason
+    columns: Dict[str, List[Any]] = {}
+    # The reason each parameter of the rows that cannot be cast cannot be, by position in complete
+    cast_errors: Dict[int, Dict[str, str]] = {}
+    for name, caster in casters.items():
+        raw_values = [rows[index][name] for index in complete]
+        # Most rows of a script repeat the values of the rows around them
+        casts = {raw: cast_value(caster, raw) for raw in set(raw_values)}
+        columns[name] = [casts[raw][0] for raw in raw_values]
+        if any(error is not None for _, error in casts.values()):
+            for position, raw in enumerate(raw_values):
+                error = casts[raw][1]
+                if error is not None:
+                    cast_errors.setdefault(position, {})[name] = error
+    for position, errors in cast_errors.items():
+        row = rows[complete[position]]
+        reasons[complete[position]] = "".join(errors[name] for name in row if name in errors)
+    # Rows that cannot be cast are not checked any further
+    cast = [position for position in range(len(complete)) if position not in cast_errors]
+    if cast_errors:
+        columns = {
+            name: [values[position] for position in cast] for name, values in columns.items()
+        }
+    rule_reasons = script_definition.rules.reasons(**columns) if cast else []
+    names = list(columns)
+    for position, reason, values in zip(cast, rule_reasons, zip(*columns.values())):
+        # The data budget can only be checked once the scans are valid
+        if reason == "":
+            reason = script_definition.check_row_data_budget(**dict(zip(names, values)))
+        reasons[complete[position]] = reason or None
+    return reasons
+
+
+class TableValidation:
+    """
+    The validation of every row of a script, kept up to date as rows are edited. Editing a row
+    casts and checks only what the edit changed in it, so however large the table an edit costs
+    the checks it affects.
+    """
+
+    def __init__(self, script_definition: Any, rows: Sequence[Mapping[str, str]] = ()) -> None:
+        """
+        Parameters:
+          script_definition (ScriptDefinition): the definition of the rows (see revalidate_row),
+            with its global_params set
+          rows (Sequence[Mapping[str, str]]): the raw parameters of each row
+        """
+        self.script_definition = script_definition
+        self._rows: List[RowValidation] = [validate_row(script_definition, row) for row in rows]
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __getitem__(self, index: int) -> RowValidation:
+        return self._rows[index]
+
+    @property
+    def reasons(self) -> List[Optional[str]]:
+        """
+        Returns:
+          List[Optional[str]]: Why each row is not valid, or None if it is.
+        """
+        return [row.reason for row in self._rows]
+
+    def update_row(self, index: int, row: Mapping[str, str]) -> Optional[str]:
+        """
+        Parameters:
+          index (int): the index of the row that changed
+          row (Mapping[str, str]): the raw parameters of the row now
+
+        Returns:
+          Optional[str]: Why the row is not valid, or None if it is.
+        """
+        previous = self._rows[index]
+        changed = [name for name, value in row.items() if previous.row.get(name) != value]
+        self._rows[index] = revalidate_row(self.script_definition, previous, changed, row)
+        return self._rows[index].reason
+
+    def insert_row(self, index: int, row: Mapping[str, str]) -> Optional[str]:
+        """
+        Parameters:
+          index (int): the index to insert the row at
+          row (Mapping[str, str]): the raw parameters of the row
+
+        Returns:
+          Optional[str]: Why the row is not valid, or None if it is.
+        """
+        self._rows.insert(index, validate_row(self.script_definition, row))
+        return self._rows[index].reason
+
+    def remove_row(self, index: int) -> None:
+        """
+        Parameters:
+          index (int): the index of the row to remove
+        """
+        del self._rows[index]
+
+    def refresh(self) -> None:
+        """
+        Validate every row from scratch, e.g. after the global parameters of the definition change.
+        """
+        self._rows = [validate_row(self.script_definition, row.row) for row in self._rows]
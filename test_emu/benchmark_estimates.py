@@ -0,0 +1,357 @@
+"""
+Benchmarks of the step generators, of estimating and validating the rows of each EMU definition at
+realistic table sizes and scan densities, of reordering plans, and of the work done while a plan
+runs.
+
+This is not named test_*.py so the unit tests do not run it. Run it from the root of the repository:
+
+    python -m test_emu.benchmark_estimates            compare with the baseline
+    python -m test_emu.benchmark_estimates --update   record a new baseline
+    python -m test_emu.benchmark_estimates --quick    leave out the largest cases
+
+It exits with 1 if any benchmark is slower than its baseline by more than the threshold. Nothing
+talks to an instrument: the genie functions the definitions call are patched out and inst is a
+stand-in module.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+from mock import MagicMock, patch
+
+import emu_default
+import emu_logfields
+import emu_test_by_time
+import emuloop
+import emulooptime
+from cost_model import get_cost_model
+from estimate_history import COUNT
+from plan_optimiser import optimise_plan
+from progress import ProgressTracker
+from scan_plan import ScanPlan
+from script_utilities import get_steps, row_cache
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "benchmark_baseline.json")
+
+# A benchmark more than this fraction slower than its baseline is a regression
+default_threshold = 0.5
+
+table_sizes = (1, 100, 10000)
+scan_densities = (10, 1000, 100000)
+# The largest of these are left out with --quick
+quick_table_size = 100
+quick_scan_density = 1000
+
+definitions = {
+    "emuloop": emuloop,
+    "emulooptime": emulooptime,
+    "emu_default": emu_default,
+    "emu_logfields": emu_logfields,
+    "emu_test_by_time": emu_test_by_time,
+}
+
+
+def definition_row(module_name: str, row: Mapping[str, str]) -> Dict[str, str]:
+    """
+    Adapt a row of emuloop parameters to the parameters of another definition.
+    """
+    row = dict(row)
+    if module_name == "emu_logfields":
+        start, stop = float(row["start_field"]), float(row["stop_field"])
+        n_fields = 1 if start == stop else int(abs(stop - start) / float(row.pop("step_field"))) + 1
+        row.pop("step_field", None)
+        row["n_fields"] = str(n_fields)
+    elif module_name == "emu_test_by_time":
+        row["Run_Time_Mins"] = row.pop("mevents")
+    return row
+
+
+def table_rows(count: int, seed: int = 0) -> List[Dict[str, str]]:
+    """
+    Rows like those of a real script: temperature and field scans of up to a hundred points.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for _ in range(count):
+        start_temperature = float(rng.integers(1, 250))
+        start_field = float(rng.integers(10, 300))
+        rows.append(
+            {
+                "start_temperature": str(start_temperature),
+                "stop_temperature": str(start_temperature + float(rng.integers(0, 50))),
+                "step_temperature": str(float(rng.integers(5, 20))),
+                "start_field": str(start_field),
+                "stop_field": str(start_field + float(rng.integers(0, 100))),
+                "step_field": str(float(rng.integers(10, 50))),
+                "custom": "None",
+                "mevents": str(float(rng.integers(1, 20))),
+                "magnet_device": "LF",
+            }
+        )
+    return rows
+
+
+def dense_row(points: int) -> Dict[str, str]:
+    """
+    A row scanning the temperature through points points at one field.
+    """
+    return {
+        "start_temperature": "1.0",
+        "stop_temperature": str(float(points)),
+        "step_temperature": "1.0",
+        "start_field": "10.0",
+        "stop_field": "10.0",
+        "step_field": "1.0",
+        "custom": "None",
+        "mevents": "1.0",
+        "magnet_device": "LF",
+    }
+
+
+def grid_row() -> Dict[str, str]:
+    """
+    A row of millions of points: 2990 temperatures at each of 3000 fields.
+    """
+    return dict(
+        dense_row(1),
+        stop_temperature="300.0",
+        step_temperature="0.1",
+        start_field="1.0",
+        stop_field="3000.0",
+    )
+
+
+def estimate_rows(
+    method_name: str, module_name: str, rows: Sequence[Mapping[str, str]]
+) -> Callable:
+    script_definition = definitions[module_name].DoRun()
+    method = getattr(script_definition, method_name)
+    rows = [definition_row(module_name, row) for row in rows]
+
+    def benchmark() -> None:
+        # Every row is estimated afresh rather than from the row cache
+        row_cache.clear()
+        for row in rows:
+            method(**row)
+
+    return benchmark
+
+
+def validate_table(module_name: str, rows: Sequence[Mapping[str, str]]) -> Callable:
+    script_definition = definitions[module_name].DoRun()
+    rows = [definition_row(module_name, row) for row in rows]
+    return lambda: script_definition.validate_table(rows)
+
+
+def estimate_table(module_name: str, rows: Sequence[Mapping[str, str]]) -> Callable:
+    rows = [definition_row(module_name, row) for row in rows]
+    return lambda: definitions[module_name].DoRun.estimate_table(rows)
+
+
+def optimise_random_plan(points: int) -> Callable:
+    # Fields scattered at random temperatures, as rows concatenated to be reordered together
+    rng = np.random.default_rng(0)
+    plan = ScanPlan.concatenate(
+        [
+            ScanPlan.from_axes(rng.uniform(1, 300, 1), rng.uniform(0, 4000, 10), 5)
+            for _ in range(points // 10)
+        ]
+    )
+    return lambda: optimise_plan(plan)
+
+
+def measure_phase(points: int) -> Callable:
+    # Halfway through a plan of points points, as the progress of a run is updated after each phase
+    tracker = ProgressTracker(
+        ScanPlan.from_axes(np.arange(1.0, points + 1.0), None, 1.0), get_cost_model("EMU")
+    )
+    tracker.start_point(points // 2)
+
+    def benchmark() -> None:
+        tracker.start_phase(COUNT)
+        tracker.end_phase()
+
+    return benchmark
+
+
+def benchmarks(quick: bool = False) -> Dict[str, Callable[[], None]]:
+    """
+    Returns:
+      Dict[str, Callable[[], None]]: Each benchmark by name.
+    """
+    densities = [points for points in scan_densities if not quick or points <= quick_scan_density]
+    sizes = [size for size in table_sizes if not quick or size <= quick_table_size]
+    cases: Dict[str, Callable[[], None]] = {}
+    for points in densities:
+        cases[f"get_steps/{points}"] = lambda points=points: list(get_steps(1.0, 1.0, points))
+        for module_name, module in definitions.items():
+            cases[f"{module_name}.inclusive_float_range_with_step_flip/{points}"] = (
+                lambda module=module, points=points: list(
+                    module.inclusive_float_range_with_step_flip(1.0, float(points), 1.0)
+                )
+            )
+        cases[f"emu_logfields.log_range/{points}"] = lambda points=points: list(
+            emu_logfields.log_range(0.0, 4000.0, points)
+        )
+    for module_name in definitions:
+        for method_name in ("estimate_time", "parameters_valid"):
+            for size in sizes:
+                cases[f"{module_name}.{method_name}/{size} rows"] = estimate_rows(
+                    method_name, module_name, table_rows(size)
+                )
+            for points in densities:
+                cases[f"{module_name}.{method_name}/{points} points"] = estimate_rows(
+                    method_name, module_name, [dense_row(points)]
+                )
+        for size in sizes:
+            cases[f"{module_name}.validate_table/{size} rows"] = validate_table(
+                module_name, table_rows(size)
+            )
+    for module_name in ("emuloop", "emulooptime", "emu_default"):
+        cases[f"{module_name}.estimate_time/grid of millions of points"] = estimate_rows(
+            "estimate_time", module_name, [grid_row()]
+        )
+    for module_name in ("emuloop", "emulooptime"):
+        cases[f"{module_name}.estimate_custom/grid of millions of points"] = estimate_rows(
+            "estimate_custom", module_name, [grid_row()]
+        )
+        for size in sizes:
+            cases[f"{module_name}.estimate_table/{size} rows"] = estimate_table(
+                module_name, table_rows(size)
+            )
+        for points in densities:
+            cases[f"{module_name}.estimate_table/{points} points"] = estimate_table(
+                module_name, [dense_row(points)]
+            )
+    for points in (100, 1000, 3000):
+        cases[f"optimise_plan/{points} random points"] = optimise_random_plan(points)
+    for points in densities:
+        cases[f"progress.end_phase/{points} points"] = measure_phase(points)
+    return cases
+
+
+def measure(benchmark: Callable[[], None], min_seconds: float = 0.2, repeats: int = 3) -> float:
+    """
+    Returns:
+      float: The fastest seconds a call to benchmark took, over enough calls to take min_seconds
+        in each of repeats repeats (and at least one call in each).
+    """
+    start = time.perf_counter()
+    benchmark()
+    once = time.perf_counter() - start
+    calls = max(1, int(min_seconds / max(once, 1e-9)))
+    best = once
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(calls):
+            benchmark()
+        best = min(best, (time.perf_counter() - start) / calls)
+    return best
+
+
+def run_benchmarks(
+    cases: Mapping[str, Callable[[], None]], min_seconds: float = 0.2
+) -> Dict[str, float]:
+    """
+    Run benchmarks with stand-ins for genie and inst.
+
+    Returns:
+      Dict[str, float]: The seconds each benchmark took by name.
+    """
+    results = {}
+    with (
+        patch.dict("sys.modules", inst=MagicMock()),
+        patch("genie_python.genie.cget", return_value={"value": "Danfysik"}),
+        patch("genie_python.genie.begin"),
+        patch("genie_python.genie.end"),
+        patch("genie_python.genie.waitfor_mevents"),
+        patch("genie_python.genie.waitfor_time"),
+    ):
+        for name, benchmark in cases.items():
+            results[name] = measure(benchmark, min_seconds)
+            print(f"{name:<70} {results[name] * 1e3:12.3f} ms", flush=True)
+    return results
+
+
+def compare(
+    results: Mapping[str, float], baseline: Mapping[str, float], threshold: float
+) -> List[Tuple[str, float, float]]:
+    """
+    Returns:
+      List[Tuple[str, float, float]]: The name, baseline seconds and seconds of each benchmark
+        more than threshold slower than its baseline.
+    """
+    return [
+        (name, baseline[name], seconds)
+        for name, seconds in results.items()
+        if name in baseline and seconds > baseline[name] * (1 + threshold)
+    ]
+
+
+def load_baseline(path: str) -> Optional[dict]:
+    try:
+        with open(path) as baseline_file:
+            return json.load(baseline_file)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path: str, results: Mapping[str, float], threshold: float) -> None:
+    baseline = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "threshold": threshold,
+        "results": dict(sorted(results.items())),
+    }
+    with open(path, "w") as baseline_file:
+        json.dump(baseline, baseline_file, indent=2)
+        baseline_file.write("\n")
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark estimating and validating EMU rows.")
+    parser.add_argument("--update", action="store_true", help="record the results as baseline")
+    parser.add_argument("--quick", action="store_true", help="leave out the largest cases")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="the baseline JSON file")
+    parser.add_argument("--threshold", type=float, help="the fraction slower that regresses")
+    parser.add_argument("--filter", default="", help="only run benchmarks with this in the name")
+    parser.add_argument("--output", help="a JSON file to write the results to")
+    arguments = parser.parse_args(argv)
+    cases = {
+        name: benchmark
+        for name, benchmark in benchmarks(arguments.quick).items()
+        if arguments.filter in name
+    }
+    results = run_benchmarks(cases)
+    if arguments.output:
+        with open(arguments.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    baseline = load_baseline(arguments.baseline)
+    threshold = arguments.threshold
+    if threshold is None:
+        threshold = baseline["threshold"] if baseline else default_threshold
+    if arguments.update:
+        if baseline:
+            # Keep the baselines of the benchmarks that were not run
+            results = dict(baseline["results"], **results)
+        save_baseline(arguments.baseline, results, threshold)
+        print(f"Baseline written to {arguments.baseline}")
+        return 0
+    if baseline is None:
+        print(f"No baseline at {arguments.baseline}, record one with --update")
+        return 0
+    regressions = compare(results, baseline["results"], threshold)
+    for name, before, after in regressions:
+        print(f"REGRESSION {name}: {before * 1e3:.3f} ms -> {after * 1e3:.3f} ms")
+    print(f"{len(regressions)} of {len(results)} benchmarks regressed by more than {threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+import unittest
+
+import numpy as np
+from mock import MagicMock, patch
+from parameterized import parameterized
+
+from batch_estimate import axis_batch, cast_column, count_axis_points
+from cost_model import CostModel
+from emuloop import DoRun
+from emulooptime import DoRun as DoRunTime
+from scan_plan import (
+    SERPENTINE,
+    ScanPlan,
+    ScanPlanBatch,
+    chunk_points,
+    round_trip,
+    round_trip_batch,
+)
+from script_utilities import get_steps_batch
+
+
+def random_rows(count, seed=0):
+    rng = np.random.default_rng(seed)
+
+    def value(low, high):
+        return str(float(np.round(rng.uniform(low, high), 1)))
+
+    rows = []
+    for _ in range(count):
+        kind = rng.integers(4)
+        start_temperature, stop_temperature = value(1, 300), value(1, 300)
+        if kind == 0:
+            stop_temperature = start_temperature
+        elif kind == 1:
+            start_temperature = stop_temperature = "keep"
+        start_field, stop_field = value(0, 400), value(0, 400)
+        if kind == 2:
+            stop_field = start_field
+        elif kind == 3:
+            start_field = stop_field = "keep"
+        rows.append(
+            {
+                "start_temperature": start_temperature,
+                "stop_temperature": stop_temperature,
+                "step_temperature": value(5, 60),
+                "start_field": start_field,
+                "stop_field": stop_field,
+                "step_field": value(10, 100),
+                "custom": "None",
+                "mevents": str(int(rng.integers(0, 20))),
+                "magnet_device": "N/A" if kind == 3 else "LF",
+            }
+        )
+    return rows
+
+
+invalid_rows = [
+    # Cannot be cast
+    dict(random_rows(1)[0], mevents="lots"),
+    dict(random_rows(1)[0], magnet_device="XF"),
+    {"start_temperature": "1"},
+    # Cannot step through the scan
+    dict(random_rows(1)[0], start_field="0", stop_field="10", step_field="0"),
+]
+
+
+class TestBatchEstimate(unittest.TestCase):
+    def test_GIVEN_repeated_values_WHEN_cast_column_THEN_each_value_cast_once(self):
+        caster = MagicMock(side_effect=float)
+        values, cast = cast_column(
+            [{"mevents": "1"}, {"mevents": "2"}, {"mevents": "1"}, {}], "mevents", caster
+        )
+        self.assertEqual(values, [1.0, 2.0, 1.0, None])
+        np.testing.assert_array_equal(cast, [True, True, True, False])
+        self.assertEqual(caster.call_count, 3)
+
+    def test_GIVEN_kept_points_and_scans_WHEN_axis_batch_THEN_axis_of_each_row(self):
+        batch = axis_batch(
+            np.array([np.nan, 5.0, 1.0, 3.0]),
+            np.array([np.nan, 5.0, 3.0, 1.0]),
+            np.array([1.0, 1.0, 1.0, 1.0]),
+            np.array([True, True, True, False]),
+        )
+        np.testing.assert_array_equal(batch.row(0), [np.nan])
+        np.testing.assert_array_equal(batch.row(1), [5.0])
+        np.testing.assert_array_equal(batch.row(2), [1.0, 2.0, 3.0])
+        np.testing.assert_array_equal(batch.row(3), [np.nan])
+
+    def test_GIVEN_kept_points_and_scans_WHEN_count_axis_points_THEN_length_of_axis_batch(self):
+        axis = (
+            np.array([np.nan, 5.0, 1.0, 3.0, 0.0]),
+            np.array([np.nan, 5.0, 3.0, 1.0, 1.0]),
+            np.array([1.0, 1.0, 1.0, 1.0, 0.3]),
+            np.array([True, True, True, False, True]),
+        )
+        np.testing.assert_array_equal(count_axis_points(*axis), np.diff(axis_batch(*axis).offsets))
+
+    def test_GIVEN_scans_WHEN_round_trip_batch_THEN_same_as_round_trip(self):
+        batch = get_steps_batch([1.0, 5.0, 2.0, 10.0], 1.0, [3.0, 5.0, 6.0, 8.0])
+        rows = np.array([True, True, False, True])
+        round_trips = round_trip_batch(batch, 2, rows)
+        for index in range(4):
+            np.testing.assert_array_equal(
+                round_trips.row(index), round_trip(batch.row(index), 2 if rows[index] else 0)
+            )
+
+    def test_GIVEN_axes_WHEN_scan_plan_batch_THEN_same_points_as_scan_plans(self):
+        temperatures = get_steps_batch([1.0, 4.0], 1.0, [3.0, 4.0])
+        fields = get_steps_batch([10.0, 0.0], 10.0, [30.0, 20.0])
+        plans = ScanPlanBatch.from_axes(temperatures, fields, np.array([5.0, 0.0]), SERPENTINE)
+        for index in range(2):
+            expected = ScanPlan.from_axes(
+                temperatures.row(index), fields.row(index), 5.0, ordering=SERPENTINE
+            )
+            np.testing.assert_array_equal(plans.plan(index).temperatures, expected.temperatures)
+            np.testing.assert_array_equal(plans.plan(index).fields, expected.fields)
+
+
+class TestEmuEstimateTable(unittest.TestCase):
+    @parameterized.expand(
+        [
+            (DoRun, None),
+            (DoRunTime, None),
+            (DoRun, {"Field ordering": "serpentine"}),
+            (DoRunTime, {"Field ordering": "optimised"}),
+            (DoRun, {"Round trip cycles": "2"}),
+        ]
+    )
+    def test_GIVEN_table_WHEN_estimate_table_THEN_same_as_estimate_time_of_each_row(
+        self, definition, global_params
+    ):
+        rows = random_rows(40) + invalid_rows
+        estimate = definition.estimate_table(rows, global_params)
+        script_definition = definition()
+        script_definition.global_params = global_params
+        for row, row_estimate in zip(rows[:40], estimate.rows):
+            self.assertAlmostEqual(row_estimate, script_definition.estimate_time(**row), places=6)
+        self.assertTrue(np.all(np.isnan(estimate.rows[40:])))
+        self.assertAlmostEqual(estimate.total, float(np.sum(estimate.rows[:40])))
+
+    @parameterized.expand(
+        [(None,), ({"Field ordering": "serpentine"},), ({"Round trip cycles": "2"},)]
+    )
+    def test_GIVEN_row_of_millions_of_points_WHEN_estimate_table_THEN_same_as_estimate_time(
+        self, global_params
+    ):
+        huge_row = dict(random_rows(1)[0], start_temperature="1", stop_temperature="300")
+        huge_row.update(step_temperature="0.1", start_field="1", stop_field="3000", step_field="1")
+        rows = random_rows(5) + [huge_row]
+        with (
+            patch.object(DoRun, "get_scan_plan", autospec=True) as get_scan_plan,
+            patch(
+                "batch_estimate.ScanPlanBatch.from_axes", wraps=ScanPlanBatch.from_axes
+            ) as from_axes,
+        ):
+            estimate = DoRun.estimate_table(rows, global_params)
+        # The huge row is estimated in closed form rather than by generating its points
+        get_scan_plan.assert_not_called()
+        (temperatures, fields, _, _), _ = from_axes.call_args
+        self.assertLessEqual(int(np.sum(temperatures.counts * fields.counts)), chunk_points)
+        script_definition = DoRun()
+        script_definition.global_params = global_params
+        for row, row_estimate in zip(rows, estimate.rows):
+            self.assertAlmostEqual(row_estimate, script_definition.estimate_time(**row), places=6)
+
+    def test_GIVEN_thousand_rows_WHEN_estimate_table_THEN_rows_costed_together(self):
+        rows = random_rows(1000)
+        with (
+            patch.object(
+                CostModel, "estimate_batch", autospec=True, wraps=CostModel.estimate_batch
+            ) as estimate_batch,
+            patch.object(DoRun, "get_scan_plan", autospec=True) as get_scan_plan,
+            patch.object(DoRun, "get_sweep_plan", autospec=True) as get_sweep_plan,
+        ):
+            estimate = DoRun.estimate_table(rows)
+        estimate_batch.assert_called_once()
+        get_scan_plan.assert_not_called()
+        get_sweep_plan.assert_not_called()
+        self.assertEqual(np.count_nonzero(np.isnan(estimate.rows)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
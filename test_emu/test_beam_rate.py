@@ -0,0 +1,218 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+from mock import patch
+from parameterized import parameterized
+
+from beam_rate import (
+    BEAM_SCHEDULE_VARIABLE,
+    BeamSchedule,
+    beam_schedule_version,
+    estimate_plan_seconds,
+    estimate_sweep_plan_seconds,
+    estimate_with_beam,
+    get_beam_schedule,
+    nominal_current,
+)
+from cost_model import CostModel
+from emu_default import DoRun as DoRunDefault
+from emuloop import DoRun
+from plan_optimiser import TransitionCosts
+from scan_plan import SERPENTINE, ScanPlan, Sweep, SweepPlan
+from script_utilities import row_cache
+
+cost_model = CostModel(
+    transitions=TransitionCosts(warming_rate=1.0, cooling_rate=0.1, field_ramp_rate=10.0),
+    event_rate=0.5,
+    run_overhead=3.0,
+    magnet_switch=60.0,
+)
+
+row = dict(
+    start_temperature="keep",
+    stop_temperature="keep",
+    step_temperature="0",
+    start_field="keep",
+    stop_field="keep",
+    step_field="0",
+    custom="None",
+    mevents="1",
+    magnet_device="N/A",
+)
+
+# Nominal current for an hour from t=1000, then beam off for an hour, then half the current
+schedule = BeamSchedule(
+    [1000.0, 4600.0, 8200.0, 11800.0], [nominal_current, 0.0, nominal_current / 2, 0.0]
+)
+
+
+class TestBeamSchedule(unittest.TestCase):
+    def test_GIVEN_schedule_WHEN_charge_at_THEN_current_integrated_over_time(self):
+        np.testing.assert_allclose(
+            schedule.charge_at([0.0, 1000.0, 2000.0, 6000.0, 9000.0, 12800.0]),
+            np.array([-1000.0, 0.0, 1000.0, 3600.0, 3600.0 + 400.0, 3600.0 + 1800.0 + 1000.0])
+            * nominal_current,
+        )
+
+    def test_GIVEN_charges_WHEN_time_at_charge_THEN_inverse_of_charge_at(self):
+        times = np.array([0.0, 1000.0, 2000.0, 4600.0, 9000.0, 12800.0])
+        np.testing.assert_allclose(schedule.time_at_charge(schedule.charge_at(times)), times)
+
+    def test_GIVEN_beam_off_WHEN_count_end_THEN_count_waits_for_beam(self):
+        # Half an hour of events at the nominal current is left when the beam goes off, then
+        # counted at half the current
+        end = schedule.count_end(1000.0 + 1800.0, 0.5 * 3600.0, 0.5)
+        self.assertAlmostEqual(float(end), 8200.0 + 3600.0)
+
+    def test_GIVEN_counts_WHEN_count_end_THEN_end_of_each_count(self):
+        np.testing.assert_allclose(
+            schedule.count_end([1000.0, 5000.0, 20000.0], [0.5 * 60.0] * 3, 0.5),
+            [1060.0, 8320.0, 20060.0],
+        )
+
+    @parameterized.expand([([], []), ([1.0, 2.0], [1.0]), ([1.0], [-1.0])])
+    def test_GIVEN_invalid_schedule_WHEN_created_THEN_value_error(self, times, currents):
+        with self.assertRaises(ValueError):
+            BeamSchedule(times, currents)
+
+
+class TestBeamScheduleFile(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "schedule.csv")
+        environment = patch.dict("os.environ", {BEAM_SCHEDULE_VARIABLE: self.path})
+        environment.start()
+        self.addCleanup(environment.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_schedule(self, *lines):
+        with open(self.path, "w") as schedule_file:
+            schedule_file.write("\n".join(lines) + "\n")
+
+    def test_GIVEN_header_and_iso_and_epoch_times_WHEN_from_file_THEN_schedule_loaded(self):
+        self.write_schedule("time,current", "2026-10-18T12:00:00,150", "", "1792324800,0")
+        loaded = BeamSchedule.from_file(self.path)
+        np.testing.assert_array_equal(
+            loaded.times, [datetime(2026, 10, 18, 12).timestamp(), 1792324800.0]
+        )
+        self.assertEqual(loaded.currents[0], 150.0)
+
+    def test_GIVEN_no_variable_WHEN_get_beam_schedule_THEN_none(self):
+        with patch.dict("os.environ", {BEAM_SCHEDULE_VARIABLE: ""}):
+            self.assertIsNone(get_beam_schedule())
+
+    def test_GIVEN_file_changed_WHEN_get_beam_schedule_THEN_reloaded(self):
+        self.write_schedule("0,100")
+        self.assertEqual(get_beam_schedule().currents[0], nominal_current)
+        self.write_schedule("0,100", "10,50")
+        os.utime(self.path, (1, 1))
+        self.assertEqual(get_beam_schedule().currents[0], 100.0)
+
+    def test_GIVEN_missing_file_WHEN_estimate_time_THEN_warned_once_and_constant_rate(self):
+        with patch.dict("os.environ", {BEAM_SCHEDULE_VARIABLE: ""}):
+            without_beam = DoRun().estimate_time(**row)
+        row_cache.clear()
+        with self.assertLogs("beam_rate", "WARNING") as logs:
+            self.assertIsNone(get_beam_schedule())
+            self.assertIsNone(beam_schedule_version())
+            self.assertEqual(DoRun().estimate_time(**row), without_beam)
+            self.assertEqual(DoRun().estimate_time(**row), without_beam)
+        self.assertEqual(len(logs.output), 1)
+
+    def test_GIVEN_file_without_schedule_WHEN_get_beam_schedule_THEN_warned_and_none(self):
+        self.write_schedule("time,current")
+        with self.assertLogs("beam_rate", "WARNING"):
+            self.assertIsNone(get_beam_schedule())
+        self.assertIsNone(get_beam_schedule())
+
+    @patch("beam_rate.time.time")
+    def test_GIVEN_beam_off_now_WHEN_estimate_time_THEN_counts_wait_for_beam(self, now):
+        now.return_value = 5000.0
+        self.write_schedule("1000,160", "4600,0", "8200,80", "11800,0")
+        with patch.dict("os.environ", {BEAM_SCHEDULE_VARIABLE: ""}):
+            without_beam = DoRun().estimate_time(**row)
+        self.assertGreater(DoRun().estimate_time(**row), without_beam + 3200.0)
+
+
+class TestEstimateWithBeam(unittest.TestCase):
+    def test_GIVEN_nominal_current_WHEN_estimate_with_beam_THEN_same_as_cost_model(self):
+        plan = ScanPlan.from_axes([1.0, 2.0], [0.0, 10.0], 4)
+        self.assertAlmostEqual(
+            estimate_with_beam(cost_model, plan, BeamSchedule([0.0], [0.0]), 0.0, 1),
+            cost_model.estimate(plan, 1).total,
+        )
+
+    def test_GIVEN_beam_off_WHEN_estimate_with_beam_THEN_counts_resume_with_beam(self):
+        plan = ScanPlan.from_axes(None, None, 0.5 * 3600.0)
+        # After the overhead half of the count is before the gap, the rest at half the current
+        start = 4600.0 - 1800.0 - cost_model.run_overhead
+        self.assertAlmostEqual(
+            estimate_with_beam(cost_model, plan, schedule, start), 11800.0 - start
+        )
+
+    def test_GIVEN_no_schedule_or_counting_for_time_WHEN_estimate_plan_seconds_THEN_cost_model(
+        self,
+    ):
+        plan = ScanPlan.from_axes([1.0, 2.0], None, 4)
+        with patch.dict("os.environ", {BEAM_SCHEDULE_VARIABLE: ""}):
+            self.assertEqual(
+                estimate_plan_seconds(cost_model, plan, 1), cost_model.estimate(plan, 1).total
+            )
+        with patch("beam_rate.get_beam_schedule", return_value=schedule):
+            self.assertEqual(
+                estimate_plan_seconds(cost_model, plan, count_seconds=60.0),
+                cost_model.estimate(plan, count_seconds=60.0).total,
+            )
+
+    @patch("scan_plan.chunk_points", 4)
+    @patch("beam_rate.time.time", return_value=2000.0)
+    @patch("beam_rate.get_beam_schedule", return_value=schedule)
+    def test_GIVEN_schedule_WHEN_estimate_sweep_plan_seconds_THEN_same_as_plan_in_chunks(self, *_):
+        plan = SweepPlan(Sweep(1.0, 3.0, 3), Sweep(0.0, 20.0, 3), 100.0, ordering=SERPENTINE)
+        compiled = ScanPlan.from_axes(
+            [1.0, 2.0, 3.0], [0.0, 10.0, 20.0], 100.0, ordering=SERPENTINE
+        )
+        self.assertAlmostEqual(
+            estimate_sweep_plan_seconds(cost_model, plan, 1),
+            estimate_with_beam(cost_model, compiled, schedule, 2000.0, 1),
+        )
+
+    def test_GIVEN_no_schedule_WHEN_estimate_sweep_plan_seconds_THEN_closed_form(
+        self,
+    ):
+        plan = SweepPlan(Sweep(1.0, 2.0, 2), Sweep(np.nan, np.nan, 1), 4)
+        with patch.dict("os.environ", {BEAM_SCHEDULE_VARIABLE: ""}):
+            self.assertEqual(
+                estimate_sweep_plan_seconds(cost_model, plan, 1),
+                cost_model.estimate_sweep_plan(plan, 1).total,
+            )
+        with patch("beam_rate.get_beam_schedule", return_value=schedule):
+            self.assertEqual(
+                estimate_sweep_plan_seconds(cost_model, plan, count_seconds=60.0),
+                cost_model.estimate_sweep_plan(plan, count_seconds=60.0).total,
+            )
+
+    @patch("beam_rate.time.time")
+    @patch("beam_rate.get_beam_schedule")
+    def test_GIVEN_schedule_WHEN_emu_default_estimate_time_THEN_rate_scaled_by_current(
+        self, get_schedule, now
+    ):
+        now.return_value = 0.0
+        get_schedule.return_value = None
+        row_cache.clear()
+        nominal = DoRunDefault().estimate_time(**row)
+        row_cache.clear()
+        get_schedule.return_value = BeamSchedule([0.0], [0.0], default_current=nominal_current / 2)
+        halved = DoRunDefault().estimate_time(**row)
+        self.assertGreater(halved, nominal)
+        self.assertLess(halved, 2 * nominal)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+import unittest
+
+from genie_python.genie_script_generator import cast_parameters_to
+from mock import MagicMock, patch
+from parameterized import parameterized
+
+from cast_row import CastRow, cast_cache, cast_row, cast_row_parameters
+from emuloop import DoRun, parameter_casters
+from emulooptime import DoRun as DoRunTime
+from script_utilities import row_cache
+
+row = dict(
+    start_temperature="1",
+    stop_temperature="5",
+    step_temperature="1",
+    start_field="10",
+    stop_field="50",
+    step_field="10",
+    custom="None",
+    mevents="5",
+    magnet_device="LF",
+)
+
+
+class Definition:
+    """
+    A definition casting its rows with a caster counting its calls.
+    """
+
+    caster = MagicMock(side_effect=float)
+    parameter_casters = dict(x=caster)
+
+    @cast_row_parameters(parameter_casters)
+    def run(self, x):
+        return x
+
+    @cast_row_parameters(parameter_casters)
+    def parameters_valid(self, x):
+        return None
+
+    @cast_row_parameters(parameter_casters)
+    def estimate_time(self, x):
+        return 2 * x
+
+
+class TestCastRow(unittest.TestCase):
+    def setUp(self):
+        cast_cache.clear()
+        row_cache.clear()
+        self.addCleanup(cast_cache.clear)
+        self.addCleanup(row_cache.clear)
+
+    def test_GIVEN_cast_row_WHEN_set_attribute_THEN_immutable(self):
+        cast = cast_row(parameter_casters, row)
+        with self.assertRaises(AttributeError):
+            cast.reason = "changed"
+        with self.assertRaises(TypeError):
+            cast.parameters["mevents"] = 1.0
+        self.assertFalse(hasattr(cast, "__dict__"))
+
+    def test_GIVEN_equal_rows_WHEN_cast_row_THEN_cast_once(self):
+        cast = cast_row(parameter_casters, row)
+        self.assertIs(cast_row(parameter_casters, dict(row)), cast)
+        self.assertTrue(cast.valid)
+        self.assertEqual(cast.parameters["magnet_device"], "Danfysik")
+        self.assertIsNone(
+            cast_row(parameter_casters, dict(row, stop_field="keep")).parameters["stop_field"]
+        )
+        self.assertEqual(cast, CastRow(parameter_casters, row))
+        self.assertEqual(hash(cast), hash(CastRow(parameter_casters, row)))
+        self.assertNotEqual(cast, CastRow(parameter_casters, dict(row, mevents="6")))
+
+    def test_GIVEN_row_WHEN_run_estimated_and_validated_THEN_cast_once(self):
+        Definition.caster.reset_mock()
+        definition = Definition()
+        self.assertEqual(definition.run(x="2"), 2.0)
+        self.assertIsNone(definition.parameters_valid(x="2"))
+        self.assertEqual(
+            definition.estimate_time(cast_row(Definition.parameter_casters, dict(x="2"))), 4.0
+        )
+        Definition.caster.assert_called_once_with("2")
+
+    def test_GIVEN_emu_row_WHEN_estimated_and_validated_THEN_cast_once(self):
+        script_definition = DoRun()
+        misses = cast_cache.stats().misses
+        script_definition.parameters_valid(**row)
+        script_definition.estimate_time(**row)
+        script_definition.estimate_custom(**row)
+        script_definition.get_row_plan(cast_row(parameter_casters, row))
+        stats = cast_cache.stats()
+        self.assertEqual((stats.misses - misses, stats.entries), (1, 1))
+
+    @parameterized.expand(
+        [
+            (dict(mevents="x"),),
+            (dict(mevents="x", magnet_device="Q", step_field=""),),
+            (dict(start_field="kept"),),
+        ]
+    )
+    def test_GIVEN_row_that_cannot_be_cast_WHEN_cast_row_THEN_reason_of_cast_parameters_to(
+        self, changes
+    ):
+        bad_row = dict(row, **changes)
+        genie_reason = cast_parameters_to(**parameter_casters)(lambda self, **_: None)(
+            None, **bad_row
+        )
+        cast = cast_row(parameter_casters, bad_row)
+        self.assertFalse(cast.valid)
+        self.assertEqual(cast.reason, genie_reason)
+        self.assertEqual(set(cast.cast_errors), set(changes))
+        script_definition = DoRun()
+        self.assertEqual(script_definition.parameters_valid(cast), genie_reason)
+        self.assertEqual(script_definition.estimate_time(**bad_row), genie_reason)
+        self.assertEqual(script_definition.run(cast), genie_reason)
+
+    def test_GIVEN_missing_parameter_WHEN_cast_row_THEN_reason_of_cast_parameters_to(self):
+        partial = dict(row)
+        del partial["custom"]
+        genie_reason = cast_parameters_to(**parameter_casters)(lambda self, **_: None)(
+            None, **partial
+        )
+        self.assertEqual(cast_row(parameter_casters, partial).reason, genie_reason)
+
+    def test_GIVEN_unknown_parameter_WHEN_cast_row_THEN_key_error(self):
+        with self.assertRaises(KeyError):
+            cast_row(parameter_casters, dict(row, unknown="1"))
+
+    def test_GIVEN_cast_row_WHEN_estimate_and_validate_THEN_as_raw_parameters(self):
+        script_definition = DoRun()
+        cast = cast_row(DoRun.parameter_casters, row)
+        self.assertEqual(
+            script_definition.estimate_time(cast), script_definition.estimate_time(**row)
+        )
+        self.assertEqual(
+            script_definition.parameters_valid(cast), script_definition.parameters_valid(**row)
+        )
+        self.assertEqual(
+            script_definition.parameters_valid(
+                cast_row(parameter_casters, dict(row, step_field="0"))
+            ),
+            "Cannot step through fields when step is zero\n",
+        )
+
+    def test_GIVEN_row_cast_for_other_definition_WHEN_validated_THEN_cast_again(self):
+        cast = cast_row(parameter_casters, dict(row, magnet_device="ZF"))
+        script_definition = DoRunTime()
+        with patch("cast_row.cast_row", wraps=cast_row) as recast:
+            reason = script_definition.parameters_valid(cast)
+        recast.assert_called_once_with(DoRunTime.parameter_casters, dict(cast.raw))
+        self.assertEqual(reason, "Cannot set a non-zero field with the active zero field\n")
+
+    def test_GIVEN_positional_parameters_WHEN_called_THEN_type_error(self):
+        with self.assertRaises(TypeError):
+            DoRun().parameters_valid("1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,227 @@
+import unittest
+
+import numpy as np
+from mock import patch
+from parameterized import parameterized
+
+from cost_model import CostModel, TimeEstimate, get_cost_model
+from emu_default import DoRun as DoRunDefault
+from emu_logfields import DoRun as DoRunLogFields
+from emu_test_by_time import DoRun as DoRunByTime
+from emuloop import DoRun as DoRunLoop
+from emulooptime import DoRun as DoRunLoopTime
+from plan_optimiser import TransitionCosts
+from scan_plan import RASTER, SERPENTINE, ScanPlan, ScanPlanBatch, Sweep, SweepPlan
+from script_utilities import ScanBatch, row_cache
+
+cost_model = CostModel(
+    transitions=TransitionCosts(
+        warming_rate=1.0,
+        cooling_rate=0.1,
+        field_ramp_rate=10.0,
+        temperature_settle=5.0,
+        field_settle=1.0,
+    ),
+    event_rate=0.5,
+    run_overhead=3.0,
+    magnet_switch=60.0,
+)
+
+emu_cost_model = get_cost_model("EMU")
+
+scan_params = {
+    "start_temperature": "10",
+    "stop_temperature": "20",
+    "step_temperature": "5",
+    "start_field": "0",
+    "stop_field": "100",
+    "step_field": "50",
+    "custom": "None",
+    "magnet_device": "LF",
+}
+
+
+class TestCostModel(unittest.TestCase):
+    def test_GIVEN_plan_WHEN_point_times_THEN_ramp_settle_count_and_overhead_of_each_point(self):
+        plan = ScanPlan.from_axes([10.0, 20.0], [0.0, 100.0], 2)
+        times = cost_model.point_times(plan)
+        np.testing.assert_array_equal(times["ramp"], [0.0, 10.0, 10.0 + 10.0, 10.0])
+        np.testing.assert_array_equal(times["settle"], [5.0 + 1.0, 1.0, 5.0 + 1.0, 1.0])
+        np.testing.assert_array_equal(times["count"], [4.0] * 4)
+        np.testing.assert_array_equal(times["overhead"], [3.0] * 4)
+
+    def test_GIVEN_kept_temperature_WHEN_point_times_THEN_temperature_never_settled(self):
+        times = cost_model.point_times(ScanPlan.from_axes(None, [0.0, 100.0], 2))
+        np.testing.assert_array_equal(times["settle"], [1.0, 1.0])
+
+    def test_GIVEN_no_mevents_WHEN_point_times_THEN_no_count_or_overhead(self):
+        times = cost_model.point_times(ScanPlan.from_axes([10.0, 5.0], None, 0))
+        np.testing.assert_array_equal(times["count"], [0.0, 0.0])
+        np.testing.assert_array_equal(times["overhead"], [0.0, 0.0])
+        np.testing.assert_array_equal(times["ramp"], [0.0, 50.0])
+
+    def test_GIVEN_count_seconds_WHEN_point_times_THEN_counts_take_count_seconds(self):
+        times = cost_model.point_times(ScanPlan.from_axes([10.0, 20.0], None, 30), 1800.0)
+        np.testing.assert_array_equal(times["count"], [1800.0, 1800.0])
+
+    def test_GIVEN_plan_and_magnet_switches_WHEN_estimate_THEN_parts_summed(self):
+        plan = ScanPlan.from_axes([10.0, 20.0], [0.0, 100.0], 2)
+        estimate = cost_model.estimate(plan, magnet_switches=2)
+        self.assertEqual(estimate, TimeEstimate(40.0, 14.0, 16.0, 12.0, 120.0))
+        self.assertEqual(estimate.total, 40.0 + 14.0 + 16.0 + 12.0 + 120.0)
+
+    def test_GIVEN_empty_plan_WHEN_estimate_THEN_zero(self):
+        plan = ScanPlan.from_axes([], None, 2)
+        self.assertEqual(cost_model.estimate(plan).total, 0.0)
+
+    def test_GIVEN_plans_WHEN_estimate_batch_THEN_same_as_estimate_of_each_plan(self):
+        plans = ScanPlanBatch.from_axes(
+            ScanBatch(np.array([10.0, 20.0, np.nan, 5.0]), np.array([0, 2, 3, 4])),
+            ScanBatch(np.array([0.0, 50.0, 10.0, 30.0, np.nan]), np.array([0, 2, 4, 5])),
+            np.array([4.0, 0.0, 2.0]),
+        )
+        np.testing.assert_allclose(
+            cost_model.estimate_batch(plans),
+            [cost_model.estimate(plans.plan(index)).total for index in range(3)],
+        )
+
+    @parameterized.expand(
+        [
+            (SweepPlan(Sweep(1.0, 3.0, 3), Sweep(10.0, 30.0, 3), 2, ordering=RASTER), None),
+            (SweepPlan(Sweep(20.0, 1.0, 5), Sweep(30.0, 0.0, 4), 2, ordering=SERPENTINE), None),
+            (SweepPlan(Sweep(2.0, 4.0, 3), Sweep(0.0, 20.0, 3, cycles=2), 2), None),
+            (SweepPlan(Sweep(5.0, 1.0, 5, cycles=1), Sweep(np.nan, np.nan, 1), 2), None),
+            (SweepPlan(Sweep(4.0, 4.0, 1), Sweep(10.0, 10.0, 1), 0), None),
+            (SweepPlan(Sweep(1.0, 3.0, 3), Sweep(0.0, 0.0, 0), 2), None),
+            (SweepPlan(Sweep(1.0, 3.0, 3), Sweep(10.0, 30.0, 3), 30), 1800.0),
+        ]
+    )
+    def test_GIVEN_sweep_plan_WHEN_estimate_sweep_plan_THEN_same_as_estimate_of_its_points(
+        self, plan, count_seconds
+    ):
+        compiled = ScanPlan.from_axes(
+            plan.temperatures.values(), plan.fields.values(), plan.mevents, ordering=plan.ordering
+        )
+        expected = cost_model.estimate(compiled, 2, count_seconds)
+        estimate = cost_model.estimate_sweep_plan(plan, 2, count_seconds)
+        for part, expected_part in zip(estimate, expected):
+            self.assertAlmostEqual(part, expected_part)
+
+    def test_GIVEN_rate_WHEN_with_event_rate_THEN_counts_at_rate(self):
+        self.assertEqual(cost_model.with_event_rate(7200).event_rate, 2.0)
+
+    def test_GIVEN_instrument_WHEN_get_cost_model_THEN_model_returned_or_key_error(self):
+        self.assertIs(get_cost_model("emu"), emu_cost_model)
+        self.assertRaises(KeyError, get_cost_model, "NOT_AN_INSTRUMENT")
+
+
+class TestEmuEstimateTime(unittest.TestCase):
+    @parameterized.expand([(DoRunLoop,), (DoRunLoopTime,)])
+    def test_GIVEN_loop_definition_WHEN_estimate_time_THEN_seconds_of_plan(self, definition):
+        script_definition = definition()
+        estimate = script_definition.estimate_time(mevents="5", **scan_params)
+        plan = script_definition.get_scan_plan(10.0, 20.0, 5.0, 0.0, 100.0, 50.0, 5)
+        self.assertEqual(estimate, emu_cost_model.estimate(plan).total)
+        self.assertGreater(estimate, 9 * 5 / emu_cost_model.event_rate)
+
+    @parameterized.expand(
+        [
+            (DoRunLoop, "raster"),
+            (DoRunLoopTime, "serpentine"),
+            (DoRunLoopTime, "optimised"),
+        ]
+    )
+    def test_GIVEN_millions_of_points_WHEN_estimate_time_THEN_closed_form(
+        self, definition, ordering
+    ):
+        row_cache.clear()
+        self.addCleanup(row_cache.clear)
+        script_definition = definition()
+        script_definition.global_params = {"Field ordering": ordering}
+        params = dict(scan_params, start_temperature="1", stop_temperature="300", mevents="5")
+        params.update(step_temperature="0.1", start_field="1", stop_field="3000", step_field="1")
+        with (
+            patch.object(definition, "get_scan_plan", autospec=True) as get_scan_plan,
+            patch.object(ScanPlan, "from_axes") as from_axes,
+        ):
+            estimate = script_definition.estimate_time(**params)
+        # Costed from the sweeps without generating the points
+        get_scan_plan.assert_not_called()
+        from_axes.assert_not_called()
+        # 2990 temperatures (the steps to 300 K fall just short of it) and 3000 fields
+        self.assertGreater(estimate, 2990 * 3000 * 5 / emu_cost_model.event_rate)
+
+    def test_GIVEN_too_many_points_to_hold_WHEN_estimate_time_THEN_estimated(self):
+        row_cache.clear()
+        self.addCleanup(row_cache.clear)
+        params = dict(scan_params, start_temperature="0", stop_temperature="300", mevents="5")
+        params.update(step_temperature="0.01", start_field="1", stop_field="3000", step_field="0.1")
+        estimate = DoRunLoopTime().estimate_time(**params)
+        self.assertGreater(estimate, 30000 * 29990 * 5 / emu_cost_model.event_rate)
+
+    def test_GIVEN_rate_global_WHEN_emu_default_estimate_time_THEN_counts_at_rate(self):
+        script_definition = DoRunDefault()
+        script_definition.global_params = {"Rate (Mev/hr)": "36"}
+        estimate = script_definition.estimate_time(mevents="5", **scan_params)
+        plan = ScanPlan.from_axes([10.0, 15.0, 20.0], [0.0, 50.0, 100.0], 5)
+        self.assertEqual(estimate, emu_cost_model.with_event_rate(36).estimate(plan).total)
+        self.assertEqual(emu_cost_model.with_event_rate(36).estimate(plan).counting, 9 * 500)
+
+    @parameterized.expand(
+        [
+            ((0.3, 0.2, 0.05), (0.0, 1.0, 0.3)),
+            ((5.0, 1.5, 0.35), (400.0, 10.0, 33.3)),
+            ((10.0, 10.0, 1.0), (None, None, 0.0)),
+        ]
+    )
+    def test_GIVEN_old_definitions_WHEN_estimate_time_THEN_same_as_estimate_of_compiled_plan(
+        self, temperature, field
+    ):
+        params = dict(scan_params)
+        for prefix, scan in (("temperature", temperature), ("field", field)):
+            for name, value in zip(("start_", "stop_", "step_"), scan):
+                params[name + prefix] = "keep" if value is None else str(value)
+        by_time, default = DoRunByTime(), DoRunDefault()
+        default.global_params = {"Rate (Mev/hr)": "36"}
+        expected = emu_cost_model.estimate(
+            by_time.get_scan_plan(*temperature, *field, 30), count_seconds=1800.0
+        )
+        self.assertAlmostEqual(by_time.estimate_time(Run_Time_Mins="30", **params), expected.total)
+        plan = ScanPlan.from_axes(
+            default.get_scan_axis(*temperature), default.get_scan_axis(*field), 5
+        )
+        self.assertAlmostEqual(
+            default.estimate_time(mevents="5", **params),
+            emu_cost_model.with_event_rate(36).estimate(plan).total,
+        )
+
+    def test_GIVEN_millions_of_points_WHEN_emu_default_estimate_time_THEN_closed_form(self):
+        params = dict(scan_params, start_temperature="1", stop_temperature="300", mevents="5")
+        params.update(step_temperature="0.1", start_field="1", stop_field="3000", step_field="1")
+        with (
+            patch.object(DoRunDefault, "get_scan_axis", autospec=True) as get_scan_axis,
+            patch.object(ScanPlan, "from_axes") as from_axes,
+        ):
+            estimate = DoRunDefault().estimate_time(**params)
+        get_scan_axis.assert_not_called()
+        from_axes.assert_not_called()
+        # The rounded arange steps reach 300 K, unlike get_steps
+        self.assertGreater(estimate, 2991 * 3000 * 5 / emu_cost_model.event_rate)
+
+    def test_GIVEN_run_time_WHEN_emu_test_by_time_estimate_time_THEN_counts_for_run_time(self):
+        estimate = DoRunByTime().estimate_time(Run_Time_Mins="30", **scan_params)
+        plan = ScanPlan.from_axes([10.0, 15.0, 20.0], [0.0, 50.0, 100.0], 30)
+        expected = emu_cost_model.estimate(plan, count_seconds=1800.0)
+        self.assertEqual(estimate, expected.total)
+        self.assertEqual(expected.counting, 9 * 1800.0)
+
+    def test_GIVEN_log_field_scan_from_zero_WHEN_estimate_time_THEN_zf_switches_counted(self):
+        params = dict(scan_params, stop_field="100", n_fields="3", mevents="5")
+        del params["step_field"]
+        estimate = DoRunLogFields().estimate_time(**params)
+        plan = ScanPlan.from_axes([10.0, 15.0, 20.0], [0.0, 1.0, 100.0], 5)
+        self.assertAlmostEqual(estimate, emu_cost_model.estimate(plan, magnet_switches=3 * 2).total)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+from mock import MagicMock, call, patch
+
+from emu_logfields import DoRun, log_range
+
+inst = MagicMock()
+
+
+class TestLogFieldsRun(unittest.TestCase):
+    def setUp(self):
+        self.script_definition = DoRun()
+        self.check_mevents_mock = MagicMock()
+        self.script_definition.check_mevents_and_begin_waitfor_mevents_end = self.check_mevents_mock
+        inst.reset_mock()
+
+    def test_GIVEN_log_range_WHEN_get_fields_THEN_inclusive_of_start_and_stop(self):
+        self.assertEqual(list(log_range(1.0, 1000.0, 4)), [1.0, 10.0, 100.0, 1000.0])
+
+    @patch.dict("sys.modules", inst=inst)
+    @patch("genie_python.genie.cget", return_value={"value": "Danfysik"})
+    def test_GIVEN_field_scan_from_zero_WHEN_run_THEN_zero_point_uses_active_zf(self, _):
+        self.script_definition.run(
+            start_temperature="keep",
+            stop_temperature="keep",
+            step_temperature="0",
+            start_field="0",
+            stop_field="100",
+            n_fields="4",
+            custom="None",
+            mevents="10",
+            magnet_device="LF",
+        )
+        inst.f0.assert_called_once()
+        self.assertEqual(
+            inst.setmag.call_args_list,
+            [call(1.0, wait=True), call(10.0, wait=True), call(100.0, wait=True)],
+        )
+        self.assertEqual(self.check_mevents_mock.call_count, 4)
+
+    @patch.dict("sys.modules", inst=inst)
+    @patch("genie_python.genie.cget", return_value={"value": "Danfysik"})
+    def test_GIVEN_temp_and_field_scans_WHEN_run_THEN_fields_scanned_at_each_temperature(self, _):
+        self.script_definition.run(
+            start_temperature="1.0",
+            stop_temperature="3.0",
+            step_temperature="1.0",
+            start_field="1",
+            stop_field="1000",
+            n_fields="4",
+            custom="None",
+            mevents="10",
+            magnet_device="LF",
+        )
+        self.assertEqual(inst.settemp.call_count, 3)
+        self.assertEqual(inst.setmag.call_count, 3 * 4)
+        self.assertEqual(self.check_mevents_mock.call_count, 3 * 4)
@@ -0,0 +1,350 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+from mock import MagicMock, patch
+from parameterized import parameterized
+
+import estimate_history
+from cost_model import get_cost_model
+from emuloop import DoRun
+from estimate_history import (
+    BEGIN,
+    COUNT,
+    END,
+    HISTORY_PATH_VARIABLE,
+    SET,
+    SWITCH,
+    EstimateHistory,
+    calibrate_for_run,
+    calibrated_cost_model,
+    get_estimate_history,
+    history_version,
+    predict_phase,
+    set_features,
+    timed_phase,
+)
+from plan_optimiser import TransitionCosts
+from scan_plan import ScanPlan
+
+true_transitions = TransitionCosts(
+    warming_rate=0.2,
+    cooling_rate=0.05,
+    field_ramp_rate=20.0,
+    temperature_settle=60.0,
+    field_settle=5.0,
+)
+true_model = get_cost_model("EMU")._replace(
+    transitions=true_transitions, event_rate=0.05, run_overhead=8.0, magnet_switch=90.0
+)
+
+
+def simulated_phases(samples, seed=0):
+    """
+    Phases as they would be recorded on an instrument behaving like true_model.
+    """
+    rng = np.random.default_rng(seed)
+    temperature_change = rng.choice([0.0, 1.0], samples) * rng.uniform(-20, 20, samples)
+    field_change = rng.choice([0.0, 1.0], samples) * rng.uniform(0, 200, samples)
+    for dt, db in zip(temperature_change, field_change):
+        features = {
+            "warming": max(dt, 0.0),
+            "cooling": max(-dt, 0.0),
+            "field_change": db,
+            "temperature_changed": float(dt != 0),
+            "field_changed": float(db != 0),
+        }
+        yield SET, predict_phase(true_model, SET, **features), features
+    for mevents in rng.uniform(1, 20, samples):
+        yield COUNT, predict_phase(true_model, COUNT, mevents=mevents), {"mevents": mevents}
+    for phase in (BEGIN, END, SWITCH):
+        for _ in range(samples):
+            yield phase, predict_phase(true_model, phase), {}
+
+
+row = dict(
+    start_temperature="1",
+    stop_temperature="1",
+    step_temperature="0",
+    start_field="keep",
+    stop_field="keep",
+    step_field="0",
+    custom="None",
+    mevents="10",
+    magnet_device="N/A",
+)
+
+
+class TestEstimateHistory(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "history.sqlite")
+        self.history = EstimateHistory(self.path)
+
+    def tearDown(self):
+        self.history.close()
+        shutil.rmtree(self.directory)
+
+    def assert_models_close(self, model, expected):
+        for actual_transition, expected_transition in zip(model.transitions, expected.transitions):
+            self.assertAlmostEqual(actual_transition, expected_transition, places=3)
+        self.assertAlmostEqual(model.event_rate, expected.event_rate)
+        self.assertAlmostEqual(model.run_overhead, expected.run_overhead)
+        self.assertAlmostEqual(model.magnet_switch, expected.magnet_switch)
+
+    def test_GIVEN_phases_WHEN_predict_phase_THEN_seconds_from_cost_model(self):
+        self.assertEqual(
+            predict_phase(true_model, SET, warming=2.0, temperature_changed=1.0), 10.0 + 60.0
+        )
+        self.assertEqual(predict_phase(true_model, SET, cooling=1.0, field_change=40.0), 22.0)
+        self.assertEqual(predict_phase(true_model, COUNT, mevents=5.0), 100.0)
+        self.assertEqual(predict_phase(true_model, BEGIN), 4.0)
+        self.assertEqual(predict_phase(true_model, SWITCH), 90.0)
+        self.assertRaises(ValueError, predict_phase, true_model, "pause")
+
+    def test_GIVEN_points_WHEN_set_features_THEN_changes_with_kept_values_unchanged(self):
+        plan = ScanPlan.from_axes([10.0, 5.0], None, 5)
+        self.assertEqual(
+            set_features(plan[0], plan[1]),
+            {
+                "warming": 0.0,
+                "cooling": 5.0,
+                "field_change": 0.0,
+                "temperature_changed": 1.0,
+                "field_changed": 0.0,
+            },
+        )
+
+    def test_GIVEN_history_of_instrument_WHEN_calibrate_THEN_its_parameters_recovered(self):
+        for phase, actual, features in simulated_phases(50):
+            self.history.record(phase, actual, **features)
+        self.assert_models_close(self.history.calibrate(get_cost_model("EMU")), true_model)
+
+    def test_GIVEN_too_few_records_WHEN_calibrate_THEN_parameters_kept(self):
+        for phase, actual, features in simulated_phases(estimate_history.min_samples - 1):
+            self.history.record(phase, actual, **features)
+        self.assertEqual(self.history.calibrate(get_cost_model("EMU")), get_cost_model("EMU"))
+
+    def test_GIVEN_only_warming_recorded_WHEN_calibrate_THEN_cooling_rate_kept(self):
+        for warming in np.linspace(1.0, 10.0, 10):
+            self.history.record(SET, warming / 0.2 + 60.0, warming=warming, temperature_changed=1.0)
+        transitions = self.history.calibrate(get_cost_model("EMU")).transitions
+        self.assertAlmostEqual(transitions.warming_rate, 0.2, places=3)
+        self.assertAlmostEqual(transitions.temperature_settle, 60.0, places=2)
+        self.assertEqual(transitions.cooling_rate, get_cost_model("EMU").transitions.cooling_rate)
+
+    def test_GIVEN_records_WHEN_recorded_THEN_prediction_of_calibrated_model_stored(self):
+        for phase, actual, features in simulated_phases(10):
+            self.history.record(phase, actual, **features)
+        self.history.calibrate_for_run()
+        self.history.record(COUNT, 200.0, mevents=10.0)
+        predicted, actual = (
+            sqlite3.connect(self.path)
+            .execute("SELECT predicted, actual FROM phases ORDER BY id DESC LIMIT 1")
+            .fetchone()
+        )
+        self.assertAlmostEqual(predicted, 200.0)
+        self.assertEqual(actual, 200.0)
+
+    def test_GIVEN_unknown_feature_WHEN_record_THEN_error(self):
+        self.assertRaises(ValueError, self.history.record, COUNT, 1.0, mevents_per_hour=1.0)
+
+    def test_GIVEN_calibration_WHEN_calibrated_again_THEN_reused_until_phase_recorded(self):
+        for phase, actual, features in simulated_phases(10):
+            self.history.record(phase, actual, **features)
+        calibration = self.history.calibrated(get_cost_model("EMU"))
+        self.assertIs(self.history.calibrated(get_cost_model("EMU")), calibration)
+        self.history.record(SWITCH, 1000.0)
+        self.assertGreater(
+            self.history.calibrated(get_cost_model("EMU")).magnet_switch,
+            calibration.magnet_switch,
+        )
+
+    def test_GIVEN_phase_WHEN_timed_THEN_recorded_unless_it_raises(self):
+        with self.history.timed(COUNT, mevents=1.0):
+            pass
+        with self.assertRaises(KeyboardInterrupt):
+            with self.history.timed(BEGIN):
+                raise KeyboardInterrupt()
+        phases = sqlite3.connect(self.path).execute("SELECT phase, actual FROM phases").fetchall()
+        self.assertEqual(len(phases), 1)
+        self.assertEqual(phases[0][0], COUNT)
+        self.assertGreaterEqual(phases[0][1], 0.0)
+
+    def test_GIVEN_phases_of_run_WHEN_recorded_THEN_calibrated_once_for_run(self):
+        with patch.object(self.history, "calibrate", wraps=self.history.calibrate) as calibrate:
+            for phase, actual, features in simulated_phases(10):
+                self.history.record(phase, actual, **features)
+            self.assertEqual(calibrate.call_count, 1)
+            self.history.record(SWITCH, 1000.0, predicted=90.0)
+            self.history.calibrate_for_run()
+            self.history.record(SWITCH, 1000.0)
+            self.assertEqual(calibrate.call_count, 2)
+        predicted = sqlite3.connect(self.path).execute(
+            "SELECT predicted FROM phases WHERE actual = 1000.0 ORDER BY id"
+        )
+        self.assertEqual([value for (value,) in predicted][0], 90.0)
+
+    @parameterized.expand(
+        [(sqlite3.OperationalError("database is locked"),), (OSError("disk full"),)]
+    )
+    def test_GIVEN_history_cannot_be_written_WHEN_timed_THEN_logged_not_raised(self, error):
+        ran = MagicMock()
+        with patch.object(self.history, "record", side_effect=error):
+            with self.assertLogs("estimate_history", "WARNING") as logs:
+                with self.history.timed(COUNT, mevents=1.0):
+                    ran()
+        ran.assert_called_once()
+        self.assertIn(str(error), logs.output[0])
+
+    def test_GIVEN_years_of_history_WHEN_calibrate_THEN_fitted_from_sums_in_one_pass(self):
+        rows = [
+            (float(i), "EMU", phase, actual, actual, features.get("warming", 0.0),
+             features.get("cooling", 0.0), features.get("field_change", 0.0),
+             features.get("temperature_changed", 0.0), features.get("field_changed", 0.0),
+             features.get("mevents", 0.0))
+            for i, (phase, actual, features) in enumerate(simulated_phases(40000))
+        ]  # fmt: skip
+        with sqlite3.connect(self.path) as connection:
+            connection.executemany(
+                "INSERT INTO phases (recorded, instrument, phase, predicted, actual, warming, "
+                "cooling, field_change, temperature_changed, field_changed, mevents) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        statements = []
+        self.history._connection.set_trace_callback(statements.append)
+        model = self.history.calibrate(get_cost_model("EMU"))
+        self.assert_models_close(model, true_model)
+        # One aggregate query for each kind of phase, however many have been recorded
+        self.assertEqual(len(statements), 5)
+        self.assertTrue(all("COUNT(*)" in statement for statement in statements))
+
+    def test_GIVEN_history_opened_in_another_thread_WHEN_used_THEN_recorded_and_calibrated(self):
+        errors = []
+
+        def use_history():
+            try:
+                self.history.record(COUNT, 2.0, mevents=1.0)
+                self.history.calibrated(get_cost_model("EMU"))
+            except sqlite3.Error as error:
+                errors.append(error)
+
+        thread = threading.Thread(target=use_history)
+        thread.start()
+        thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.history.last_id(), 1)
+
+
+class TestEmuEstimateHistory(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "history.sqlite")
+        environment = patch.dict("os.environ", {HISTORY_PATH_VARIABLE: self.path})
+        environment.start()
+        self.addCleanup(environment.stop)
+
+    def tearDown(self):
+        for history in estimate_history._histories.values():
+            if history is not None:
+                history.close()
+        estimate_history._histories.clear()
+        shutil.rmtree(self.directory)
+
+    def recorded_phases(self):
+        return [
+            phase for (phase,) in sqlite3.connect(self.path).execute("SELECT phase FROM phases")
+        ]
+
+    def test_GIVEN_no_history_path_WHEN_timed_phase_THEN_nothing_recorded(self):
+        with patch.dict("os.environ", {HISTORY_PATH_VARIABLE: ""}):
+            self.assertIsNone(get_estimate_history())
+            with timed_phase(COUNT, mevents=1.0):
+                pass
+            self.assertEqual(calibrated_cost_model("EMU", 60.0).event_rate, 60.0 / 3600.0)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_GIVEN_history_cannot_be_opened_WHEN_timed_phase_THEN_logged_and_not_recorded(self):
+        path = os.path.join(self.directory, "missing", "history.sqlite")
+        with patch.dict("os.environ", {HISTORY_PATH_VARIABLE: path}):
+            with self.assertLogs("estimate_history", "WARNING"):
+                with timed_phase(COUNT, mevents=1.0):
+                    pass
+                calibrate_for_run()
+                self.assertEqual(calibrated_cost_model("EMU"), get_cost_model("EMU"))
+
+    def test_GIVEN_history_cannot_be_opened_WHEN_used_again_THEN_open_not_retried(self):
+        path = os.path.join(self.directory, "missing", "history.sqlite")
+        with patch.dict("os.environ", {HISTORY_PATH_VARIABLE: path}):
+            with self.assertLogs("estimate_history", "WARNING") as logs:
+                for _ in range(3):
+                    self.assertIsNone(get_estimate_history())
+                self.assertIsNone(history_version())
+        self.assertEqual(len(logs.output), 1)
+
+    def test_GIVEN_history_cannot_be_read_WHEN_estimate_and_validate_THEN_uncalibrated(self):
+        history = get_estimate_history()
+        error = sqlite3.DatabaseError("database disk image is malformed")
+        with (
+            patch.object(history, "last_id", side_effect=error),
+            self.assertLogs("estimate_history", "WARNING") as logs,
+        ):
+            self.assertIsNone(history_version())
+            self.assertEqual(calibrated_cost_model("EMU"), get_cost_model("EMU"))
+            self.assertIsNone(DoRun().parameters_valid(**row))
+            self.assertGreater(DoRun().estimate_time(**row), 0.0)
+        self.assertIn(str(error), logs.output[0])
+
+    def test_GIVEN_history_WHEN_estimate_and_validate_in_another_thread_THEN_no_error(self):
+        get_estimate_history()
+        results = []
+
+        def validate_and_estimate():
+            try:
+                results.append(DoRun().parameters_valid(**row))
+                results.append(DoRun().estimate_time(**row) > 0.0)
+            except sqlite3.Error as error:
+                results.append(error)
+
+        thread = threading.Thread(target=validate_and_estimate)
+        thread.start()
+        thread.join()
+        self.assertEqual(results, [None, True])
+
+    def test_GIVEN_temp_scan_WHEN_run_plan_THEN_sets_and_runs_recorded(self):
+        inst = MagicMock()
+        with (
+            patch("genie_python.genie.begin"),
+            patch("genie_python.genie.waitfor_mevents"),
+            patch("genie_python.genie.end"),
+        ):
+            DoRun().run_plan(ScanPlan.from_axes([1.0, 2.0, 3.0], None, 5), inst)
+        phases = self.recorded_phases()
+        # The first temperature is set from wherever the cryostat was, so it is not recorded
+        self.assertEqual(phases.count(SET), 2)
+        self.assertEqual(phases.count(BEGIN), 3)
+        self.assertEqual(phases.count(COUNT), 3)
+        self.assertEqual(phases.count(END), 3)
+
+    def test_GIVEN_history_WHEN_estimate_time_THEN_calibrated_estimate(self):
+        script_definition = DoRun()
+        arguments = row
+        uncalibrated = script_definition.estimate_time(**arguments)
+        history = get_estimate_history()
+        for phase, actual, features in simulated_phases(10):
+            history.record(phase, actual, **features)
+        self.assertAlmostEqual(
+            script_definition.estimate_time(**arguments),
+            true_model.estimate(ScanPlan.from_axes([1.0], None, 10)).total,
+            places=3,
+        )
+        self.assertNotAlmostEqual(script_definition.estimate_time(**arguments), uncalibrated)
+
+
+if __name__ == "__main__":
+    unittest.main()
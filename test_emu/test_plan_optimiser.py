@@ -0,0 +1,195 @@
+import unittest
+
+import numpy as np
+from mock import patch
+
+import plan_optimiser
+from emuloop import DoRun
+from plan_optimiser import TransitionCosts, optimise_plan, plan_cost
+from scan_plan import ScanAction, ScanPlan
+
+costs = TransitionCosts(
+    warming_rate=1.0,
+    cooling_rate=0.1,
+    field_ramp_rate=10.0,
+    temperature_settle=5.0,
+    field_settle=1.0,
+)
+
+
+def visited_points(plan):
+    return sorted(zip(plan.temperatures.tolist(), plan.fields.tolist()))
+
+
+class TestTransitionCosts(unittest.TestCase):
+    def test_GIVEN_warming_and_cooling_WHEN_transition_THEN_cooling_slower(self):
+        np.testing.assert_array_equal(
+            costs.transition([10.0, 20.0], [0.0, 0.0], [20.0, 10.0], [0.0, 0.0]), [15.0, 105.0]
+        )
+
+    def test_GIVEN_field_change_WHEN_transition_THEN_ramp_and_settle_time(self):
+        self.assertEqual(costs.transition(10.0, 0.0, 10.0, -100.0), 11.0)
+
+    def test_GIVEN_no_change_or_kept_values_WHEN_transition_THEN_no_time(self):
+        np.testing.assert_array_equal(
+            costs.transition([10.0, np.nan], [5.0, np.nan], [10.0, np.nan], [5.0, np.nan]), [0, 0]
+        )
+
+
+class TestPlanOptimiser(unittest.TestCase):
+    def test_GIVEN_plan_WHEN_plan_cost_THEN_sum_of_transitions(self):
+        plan = ScanPlan.from_axes([10.0, 20.0], [0.0, 100.0], 5)
+        # ramp up, warm and ramp down, ramp up
+        self.assertEqual(plan_cost(plan, costs), 11.0 + (15.0 + 11.0) + 11.0)
+
+    def test_GIVEN_raster_grid_WHEN_optimise_monotonic_THEN_serpentine_order(self):
+        plan = ScanPlan.from_axes([10.0, 20.0, 30.0], [0.0, 50.0, 100.0], 5)
+        optimised = optimise_plan(plan, costs, monotonic=True)
+        np.testing.assert_array_equal(optimised.plan.temperatures, np.repeat([10.0, 20.0, 30.0], 3))
+        np.testing.assert_array_equal(
+            optimised.plan.fields, [0.0, 50.0, 100.0, 100.0, 50.0, 0.0, 0.0, 50.0, 100.0]
+        )
+        self.assertEqual(optimised.time_saved, 2 * 11.0)
+
+    def test_GIVEN_descending_temperatures_WHEN_optimise_monotonic_THEN_still_descending(self):
+        plan = ScanPlan.concatenate(
+            [
+                ScanPlan.from_axes([30.0, 20.0], [0.0, 100.0], 5),
+                ScanPlan.from_axes([10.0], [0.0], 5),
+            ]
+        )
+        optimised = optimise_plan(plan, costs, monotonic=True)
+        self.assertTrue(np.all(np.diff(optimised.plan.temperatures) <= 0))
+
+    def test_GIVEN_rows_out_of_order_WHEN_optimise_THEN_cooling_avoided(self):
+        plan = ScanPlan.concatenate(
+            [
+                ScanPlan.from_axes([temperature], [0.0], 5)
+                for temperature in [10.0, 40.0, 20.0, 30.0]
+            ]
+        )
+        optimised = optimise_plan(plan, costs)
+        np.testing.assert_array_equal(optimised.plan.temperatures, [10.0, 20.0, 30.0, 40.0])
+        self.assertEqual(optimised.cost, 3 * 15.0)
+        self.assertEqual(optimised.original_cost, 35.0 + 205.0 + 15.0)
+        self.assertEqual(optimised.time_saved, optimised.original_cost - optimised.cost)
+
+    def test_GIVEN_optimal_plan_WHEN_optimise_THEN_plan_unchanged(self):
+        plan = ScanPlan.from_axes([10.0, 20.0], [0.0], 5)
+        optimised = optimise_plan(plan, costs)
+        self.assertIs(optimised.plan, plan)
+        self.assertEqual(optimised.time_saved, 0)
+
+    def test_GIVEN_reordered_plan_WHEN_optimise_THEN_sets_flagged_where_values_change(self):
+        plan = ScanPlan.concatenate(
+            [
+                ScanPlan.from_axes([temperature], [0.0, 10.0], 5)
+                for temperature in [10.0, 30.0, 20.0]
+            ]
+        )
+        optimised = optimise_plan(plan, costs).plan
+        self.assertEqual(optimised.count_actions(ScanAction.SET_TEMPERATURE), 3)
+        self.assertEqual(optimised.count_actions(ScanAction.SET_FIELD), 4)
+        self.assertEqual(optimised.count_actions(ScanAction.COUNT), 6)
+
+    def test_GIVEN_thousands_of_random_points_WHEN_optimise_THEN_vectorised_permutation_quicker(
+        self,
+    ):
+        rng = np.random.default_rng(0)
+        plan = ScanPlan.concatenate(
+            [
+                ScanPlan.from_axes(rng.uniform(1, 300, 1), rng.uniform(0, 4000, 10), 5)
+                for _ in range(300)
+            ]
+        )
+        transition = patch.object(
+            TransitionCosts, "transition", autospec=True, wraps=TransitionCosts.transition
+        )
+        with transition as transitions:
+            optimised = optimise_plan(plan, costs)
+        # The moves are costed for all the points at once rather than point by point
+        self.assertLessEqual(transitions.call_count, 2)
+        self.assertEqual(visited_points(optimised.plan), visited_points(plan))
+        self.assertLess(optimised.cost, optimised.original_cost)
+        self.assertAlmostEqual(optimised.cost, plan_cost(optimised.plan, costs))
+
+    def test_GIVEN_more_points_than_max_optimised_WHEN_optimise_THEN_monotonic_order(self):
+        plan = ScanPlan.from_axes(np.arange(100.0, 0.0, -1.0), np.arange(0.0, 2000.0, 10.0), 5)
+        self.assertGreater(len(plan), plan_optimiser.max_optimised_points)
+        optimised = optimise_plan(plan, costs)
+        self.assertEqual(
+            optimised.plan.points.tolist(),
+            optimise_plan(plan, costs, monotonic=True).plan.points.tolist(),
+        )
+        nearest_neighbour = patch.object(
+            plan_optimiser,
+            "_nearest_neighbour_order",
+            wraps=plan_optimiser._nearest_neighbour_order,
+        )
+        two_opt = patch.object(plan_optimiser, "_two_opt", wraps=plan_optimiser._two_opt)
+        with nearest_neighbour as nearest_neighbour_order, two_opt as two_opt_order:
+            optimise_plan(plan[:100], costs)
+            nearest_neighbour_order.assert_called_once()
+            two_opt_order.assert_called_once()
+            nearest_neighbour_order.reset_mock()
+            two_opt_order.reset_mock()
+            optimise_plan(plan, costs)
+            nearest_neighbour_order.assert_not_called()
+            two_opt_order.assert_not_called()
+
+
+class TestEmuOptimisedOrdering(unittest.TestCase):
+    def setUp(self):
+        self.script_definition = DoRun()
+        self.script_definition.global_params = {"Field ordering": "optimised"}
+
+    def test_GIVEN_optimised_ordering_WHEN_get_scan_plan_THEN_points_reordered(self):
+        plan = self.script_definition.get_scan_plan(1.0, 3.0, 1.0, 10.0, 30.0, 10.0, 5)
+        raster_plan = self.script_definition.get_scan_plan(
+            1.0, 3.0, 1.0, 10.0, 30.0, 10.0, 5, ordering="raster"
+        )
+        self.assertEqual(visited_points(plan), visited_points(raster_plan))
+        self.assertLess(plan.field_ramp, raster_plan.field_ramp)
+
+    def test_GIVEN_optimised_ordering_WHEN_estimate_custom_THEN_time_saved_reported(self):
+        estimate = self.script_definition.estimate_custom(
+            start_temperature="1",
+            stop_temperature="3",
+            step_temperature="1",
+            start_field="10",
+            stop_field="30",
+            step_field="10",
+            custom="None",
+            mevents="5",
+            magnet_device="LF",
+        )
+        self.assertEqual(estimate["Field ramp saved"], "40")
+        self.assertGreater(float(estimate["Ordering time saved (s)"]), 0)
+
+    def test_GIVEN_optimised_row_of_many_points_WHEN_estimate_time_THEN_not_compiled(self):
+        row = dict(
+            start_temperature="1",
+            stop_temperature="100",
+            step_temperature="1",
+            start_field="0",
+            stop_field="1990",
+            step_field="10",
+            custom="None",
+            mevents="5",
+            magnet_device="LF",
+        )
+        with (
+            patch.object(DoRun, "get_scan_plan", autospec=True) as get_scan_plan,
+            patch("emuloop.optimise_plan") as optimise,
+        ):
+            estimate = self.script_definition.estimate_time(**row)
+        # Too many points to reorder, so they are estimated from the sweeps in serpentine order
+        get_scan_plan.assert_not_called()
+        optimise.assert_not_called()
+        serpentine = DoRun()
+        serpentine.global_params = {"Field ordering": "serpentine"}
+        self.assertEqual(estimate, serpentine.estimate_time(**row))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,251 @@
+import unittest
+
+import numpy as np
+from mock import patch
+from parameterized import parameterized
+
+from cost_model import CostModel
+from data_volume import (
+    DataBudget,
+    DataVolumeModel,
+    check_data_budget,
+    get_data_volume_model,
+    may_exceed_data_budget,
+    run_write_rates,
+)
+from emu_default import DoRun as DoRunDefault
+from emu_logfields import DoRun as DoRunLogFields
+from emu_test_by_time import DoRun as DoRunByTime
+from emuloop import DoRun as DoRunLoop
+from emulooptime import DoRun as DoRunLoopTime
+from plan_optimiser import TransitionCosts
+from plan_summary import PlanSummary, summarise_plan, summarise_sweep_plan
+from scan_plan import RASTER, SERPENTINE, ScanPlan, Sweep, SweepPlan
+from script_utilities import row_cache
+
+cost_model = CostModel(
+    transitions=TransitionCosts(warming_rate=1.0, cooling_rate=0.1, field_ramp_rate=10.0),
+    event_rate=0.5,
+    run_overhead=3.0,
+    magnet_switch=60.0,
+)
+data_volume_model = DataVolumeModel(detectors=2, bytes_per_detector=100.0, bytes_per_mevent=10.0)
+
+loop_row = dict(
+    start_temperature="1",
+    stop_temperature="3",
+    step_temperature="1",
+    start_field="10",
+    stop_field="10",
+    step_field="0",
+    custom="None",
+    mevents="5",
+    magnet_device="LF",
+)
+
+
+class TestPlanSummary(unittest.TestCase):
+    def test_GIVEN_plan_WHEN_summarise_plan_THEN_runs_events_sets_volume_and_time(self):
+        plan = ScanPlan.from_axes([1.0, 2.0], [0.0, 10.0], 4)
+        summary = summarise_plan(plan, cost_model, data_volume_model, magnet_switches=1)
+        self.assertEqual(
+            summary,
+            PlanSummary(
+                runs=4,
+                mevents=16.0,
+                setpoint_changes=2 + 4,
+                magnet_switches=1,
+                data_volume=4 * (200.0 + 40.0),
+                seconds=cost_model.estimate(plan, 1).total,
+                peak_write_rate=float(run_write_rates(plan, cost_model, data_volume_model).max()),
+            ),
+        )
+
+    def test_GIVEN_count_seconds_WHEN_summarise_plan_THEN_mevents_counted_at_event_rate(self):
+        plan = ScanPlan.from_axes([1.0, 2.0], None, 30)
+        summary = summarise_plan(plan, cost_model, data_volume_model, count_seconds=60.0)
+        self.assertEqual(summary.mevents, 2 * 30.0)
+        self.assertEqual(summary.data_volume, 2 * (200.0 + 300.0))
+
+    @parameterized.expand(
+        [
+            (SweepPlan(Sweep(1.0, 3.0, 3), Sweep(10.0, 30.0, 3), 4, ordering=RASTER), None),
+            (SweepPlan(Sweep(20.0, 1.0, 5), Sweep(30.0, 0.0, 4), 4, ordering=SERPENTINE), None),
+            (SweepPlan(Sweep(2.0, 4.0, 3), Sweep(0.0, 20.0, 3, cycles=2), 4), None),
+            (SweepPlan(Sweep(5.0, 1.0, 5, cycles=1), Sweep(np.nan, np.nan, 1), 4), None),
+            (SweepPlan(Sweep(4.0, 4.0, 1), Sweep(50.0, 10.0, 5), 4, set_temperature=False), None),
+            (SweepPlan(Sweep(4.0, 4.0, 1), Sweep(10.0, 10.0, 1), 0, False, False), None),
+            (SweepPlan(Sweep(1.0, 3.0, 3), Sweep(10.0, 30.0, 3), 30), 60.0),
+        ]
+    )
+    def test_GIVEN_sweep_plan_WHEN_summarise_sweep_plan_THEN_same_as_summary_of_its_points(
+        self, plan, count_seconds
+    ):
+        settling_cost_model = cost_model._replace(
+            transitions=cost_model.transitions._replace(temperature_settle=5.0, field_settle=1.0)
+        )
+        compiled = ScanPlan.from_axes(
+            plan.temperatures.values(),
+            plan.fields.values(),
+            plan.mevents,
+            plan.set_temperature,
+            plan.set_field,
+            plan.ordering,
+        )
+        expected = summarise_plan(
+            compiled, settling_cost_model, data_volume_model, 1, count_seconds, point_sets=1
+        )
+        summary = summarise_sweep_plan(
+            plan, settling_cost_model, data_volume_model, 1, count_seconds, point_sets=1
+        )
+        self.assertEqual(summary[:4], expected[:4])
+        for part, expected_part in zip(summary[4:], expected[4:]):
+            self.assertAlmostEqual(part, expected_part)
+
+    def test_GIVEN_summary_WHEN_custom_estimate_THEN_formatted_columns(self):
+        summary = PlanSummary(3, 7.5, 4, 0, 2.5e6, 100.4, 1.25e6)
+        self.assertEqual(
+            list(summary.custom_estimate().items()),
+            [
+                ("Runs", "3"),
+                ("Mevents", "7.5"),
+                ("Setpoint changes", "4"),
+                ("Magnet switches", "0"),
+                ("Data volume (MB)", "2.5"),
+                ("Peak write rate (MB/s)", "1.25"),
+                ("Time (s)", "100"),
+            ],
+        )
+
+
+class TestDataBudget(unittest.TestCase):
+    def setUp(self):
+        row_cache.clear()
+        self.addCleanup(row_cache.clear)
+
+    def test_GIVEN_plan_WHEN_run_write_rates_THEN_volume_over_time_since_last_run(self):
+        # Each run writes 240 bytes, the first takes 8 s counting and 3 s beginning and ending,
+        # the second also takes 1 s to warm to
+        plan = ScanPlan.from_axes([1.0, 2.0], None, 4)
+        np.testing.assert_allclose(
+            run_write_rates(plan, cost_model, data_volume_model), [240.0 / 11.0, 240.0 / 12.0]
+        )
+
+    def test_GIVEN_count_seconds_WHEN_run_write_rates_THEN_mevents_at_event_rate(self):
+        plan = ScanPlan.from_axes(None, None, 1)
+        np.testing.assert_allclose(
+            run_write_rates(plan, cost_model, data_volume_model, count_seconds=10.0),
+            [(200.0 + 5 * 10.0) / 13.0],
+        )
+
+    @parameterized.expand([(1e6, ""), (1.0, "Runs are predicted to write up to")])
+    def test_GIVEN_budget_WHEN_check_data_budget_THEN_reason_if_over_it(self, write_rate, reason):
+        plan = ScanPlan.from_axes([1.0, 2.0], None, 4)
+        with patch.dict("data_volume.data_budgets", {"EMU": DataBudget(write_rate)}):
+            self.assertTrue(check_data_budget(plan, cost_model).startswith(reason))
+
+    def test_GIVEN_no_runs_WHEN_check_data_budget_THEN_within_budget(self):
+        with patch.dict("data_volume.data_budgets", {"EMU": DataBudget(0.0)}):
+            self.assertEqual(check_data_budget(ScanPlan.from_axes([1.0], None, 0), cost_model), "")
+
+    @parameterized.expand([(30.0, False), (20.0, True)])
+    def test_GIVEN_budget_WHEN_may_exceed_data_budget_THEN_bound_on_fastest_run(
+        self, write_rate, may_exceed
+    ):
+        # The first run writes 240 bytes in 11 s, as fast as any run counting 4 Mev can
+        plan = ScanPlan.from_axes([1.0, 2.0], None, 4)
+        with (
+            patch.dict("data_volume.data_budgets", {"EMU": DataBudget(write_rate)}),
+            patch.dict("data_volume.data_volume_models", {"EMU": data_volume_model}),
+        ):
+            self.assertEqual(may_exceed_data_budget(4.0, cost_model), may_exceed)
+            self.assertEqual(check_data_budget(plan, cost_model) != "", may_exceed)
+
+    def test_GIVEN_count_seconds_WHEN_may_exceed_data_budget_THEN_mevents_at_event_rate(self):
+        with (
+            patch.dict("data_volume.data_budgets", {"EMU": DataBudget(20.0)}),
+            patch.dict("data_volume.data_volume_models", {"EMU": data_volume_model}),
+        ):
+            self.assertFalse(may_exceed_data_budget(0.0, cost_model, count_seconds=10.0))
+            self.assertTrue(may_exceed_data_budget(0.0, cost_model, count_seconds=1.0))
+
+    @parameterized.expand([(DoRunLoop,), (DoRunLoopTime,), (DoRunDefault,)])
+    def test_GIVEN_small_budget_WHEN_parameters_valid_THEN_rejected(self, definition):
+        self.assertIsNone(definition().parameters_valid(**loop_row))
+        row_cache.clear()
+        with patch.dict("data_volume.data_budgets", {"EMU": DataBudget(1e3)}):
+            self.assertIn("MB/s", definition().parameters_valid(**loop_row))
+
+    def test_GIVEN_small_budget_WHEN_logfields_and_by_time_parameters_valid_THEN_rejected(self):
+        log_row = dict(loop_row, n_fields="1")
+        del log_row["step_field"]
+        time_row = dict(loop_row, Run_Time_Mins="1")
+        del time_row["mevents"]
+        with patch.dict("data_volume.data_budgets", {"EMU": DataBudget(1e3)}):
+            self.assertIn("MB/s", DoRunLogFields().parameters_valid(**log_row))
+            self.assertIn("MB/s", DoRunByTime().parameters_valid(**time_row))
+
+
+class TestEmuEstimateCustom(unittest.TestCase):
+    @parameterized.expand([(DoRunLoop,), (DoRunLoopTime,)])
+    def test_GIVEN_temperature_scan_at_field_WHEN_estimate_custom_THEN_metrics_of_row(
+        self, definition
+    ):
+        script_definition = definition()
+        estimate = script_definition.estimate_custom(**loop_row)
+        self.assertEqual(estimate["Runs"], "3")
+        self.assertEqual(estimate["Mevents"], "15")
+        # Three temperatures and the field set once
+        self.assertEqual(estimate["Setpoint changes"], "4")
+        self.assertEqual(
+            estimate["Data volume (MB)"],
+            f"{get_data_volume_model('EMU').run_volumes([5.0] * 3).sum() / 1e6:.1f}",
+        )
+        self.assertEqual(estimate["Time (s)"], f"{script_definition.estimate_time(**loop_row):.0f}")
+        self.assertEqual(estimate["Field ramp saved"], "0")
+
+    @parameterized.expand([("raster", "9"), ("serpentine", "0"), ("optimised", "0")])
+    def test_GIVEN_millions_of_points_WHEN_estimate_custom_THEN_closed_form(
+        self, ordering, field_ramp_saved_mega
+    ):
+        row_cache.clear()
+        self.addCleanup(row_cache.clear)
+        script_definition = DoRunLoop()
+        script_definition.global_params = {"Field ordering": ordering}
+        row = dict(loop_row, stop_temperature="300", step_temperature="0.1")
+        row.update(start_field="1", stop_field="3000", step_field="1")
+        with (
+            patch.object(DoRunLoop, "get_scan_plan", autospec=True) as get_scan_plan,
+            patch.object(ScanPlan, "from_axes") as from_axes,
+            patch("emuloop.summarise_plan") as summarise,
+        ):
+            estimate = script_definition.estimate_custom(**row)
+        # Summarised from the sweeps without generating the points
+        get_scan_plan.assert_not_called()
+        from_axes.assert_not_called()
+        summarise.assert_not_called()
+        self.assertEqual(estimate["Runs"], str(2990 * 3000))
+        self.assertEqual(estimate["Time (s)"], f"{script_definition.estimate_time(**row):.0f}")
+        # Serpentine saves ramping back 2999 G before each temperature after the first
+        raster_saving = 2989 * 2999
+        self.assertEqual(
+            estimate["Field ramp saved"], "0" if ordering == "raster" else f"{raster_saving:g}"
+        )
+
+    def test_GIVEN_log_field_scan_from_zero_WHEN_estimate_custom_THEN_zf_switches_reported(self):
+        row = dict(loop_row, start_field="0", stop_field="100", n_fields="3")
+        del row["step_field"]
+        estimate = DoRunLogFields().estimate_custom(**row)
+        self.assertEqual(estimate["Runs"], "9")
+        self.assertEqual(estimate["Magnet switches"], "6")
+
+    def test_GIVEN_run_time_WHEN_emu_test_by_time_estimate_custom_THEN_mevents_from_rate(self):
+        row = dict(loop_row, Run_Time_Mins="60")
+        del row["mevents"]
+        estimate = DoRunByTime().estimate_custom(**row)
+        self.assertEqual(estimate["Runs"], "3")
+        self.assertEqual(estimate["Mevents"], "330")
+
+
+if __name__ == "__main__":
+    unittest.main()
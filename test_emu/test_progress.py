@@ -0,0 +1,210 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from mock import MagicMock, patch
+
+import progress
+from cost_model import CostModel
+from emuloop import DoRun
+from estimate_history import BEGIN, COUNT, END, SET
+from plan_optimiser import TransitionCosts
+from progress import (
+    PROGRESS_PATH_VARIABLE,
+    Progress,
+    ProgressTracker,
+    progress_callbacks,
+    read_state,
+)
+from scan_plan import ScanPlan
+
+cost_model = CostModel(
+    transitions=TransitionCosts(warming_rate=1.0, cooling_rate=0.1, field_ramp_rate=10.0),
+    event_rate=0.5,
+    run_overhead=4.0,
+)
+# Two points 10 K apart, each counting 5 Mev: set 10 s, count 10 s and 4 s of overhead after the
+# first point
+plan = ScanPlan.from_axes([1.0, 11.0], None, 5)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestProgressTracker(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        monotonic = patch("progress.time.monotonic", self.clock)
+        monotonic.start()
+        self.addCleanup(monotonic.stop)
+        self.callback = MagicMock()
+        self.tracker = ProgressTracker(plan, cost_model, callback=self.callback, smoothing=0.5)
+
+    def run_phase(self, phase, seconds):
+        self.tracker.start_phase(phase)
+        self.clock.now += seconds
+        self.tracker.end_phase()
+
+    def test_GIVEN_nothing_measured_WHEN_remaining_THEN_cost_model_estimate(self):
+        self.assertAlmostEqual(self.tracker.remaining(), cost_model.estimate(plan).total)
+
+    def test_GIVEN_phases_as_predicted_WHEN_run_THEN_remaining_counts_down(self):
+        total = cost_model.estimate(plan).total
+        self.tracker.start_point(0)
+        self.run_phase(BEGIN, 2.0)
+        self.run_phase(COUNT, 10.0)
+        self.run_phase(END, 2.0)
+        self.assertAlmostEqual(self.tracker.remaining(done=True), total - 14.0)
+        self.tracker.start_point(1)
+        self.run_phase(SET, 10.0)
+        self.assertAlmostEqual(self.tracker.remaining(done=True), total - 24.0)
+        progress = self.callback.call_args[0][0]
+        self.assertEqual((progress.point, progress.points), (1, 2))
+        self.assertAlmostEqual(progress.elapsed, 24.0)
+
+    def test_GIVEN_slow_count_WHEN_measured_THEN_event_rate_smoothed_towards_it(self):
+        self.tracker.start_point(0)
+        self.run_phase(COUNT, 20.0)
+        self.assertAlmostEqual(self.tracker.event_rate, 0.5 + 0.5 * (0.25 - 0.5))
+        self.run_phase(END, 2.0)
+        # The second count at the smoothed rate
+        self.assertAlmostEqual(self.tracker.remaining(done=True), 10.0 + 4.0 + 5 / 0.375)
+
+    def test_GIVEN_slow_set_WHEN_measured_THEN_later_sets_scaled(self):
+        two_sets = ScanPlan.from_axes([1.0, 11.0, 21.0], None, 0)
+        tracker = ProgressTracker(two_sets, cost_model, smoothing=0.5)
+        tracker.start_point(1)
+        tracker.start_phase(SET)
+        self.clock.now += 30.0
+        tracker.end_phase()
+        self.assertAlmostEqual(tracker.set_ratio, 2.0)
+        self.assertAlmostEqual(tracker.remaining(done=True), 2.0 * 10.0)
+
+    def test_GIVEN_phase_running_WHEN_remaining_THEN_time_in_phase_taken_off(self):
+        self.tracker.start_point(0)
+        self.tracker.start_phase(COUNT)
+        self.clock.now += 4.0
+        self.assertAlmostEqual(
+            self.tracker.remaining(), cost_model.estimate(plan).total - 2.0 - 4.0
+        )
+        # An overrunning phase is predicted to end now
+        self.clock.now += 100.0
+        self.assertAlmostEqual(self.tracker.remaining(), 2.0 + 10.0 + 10.0 + 4.0)
+
+    def test_GIVEN_finished_WHEN_finish_THEN_nothing_remaining(self):
+        self.tracker.finish()
+        progress = self.callback.call_args[0][0]
+        self.assertTrue(progress.finished)
+        self.assertEqual(progress.remaining, 0.0)
+        self.assertEqual(progress.fraction, 1.0)
+
+    def test_GIVEN_plan_of_many_points_WHEN_phase_measured_THEN_plan_not_gone_through(self):
+        tracker = ProgressTracker(ScanPlan.from_axes(np.arange(1.0, 100001.0), None, 5), cost_model)
+        tracker.start_point(50000)
+        with (
+            patch("progress.np") as numpy,
+            patch.object(CostModel, "point_times") as point_times,
+        ):
+            tracker.start_phase(COUNT)
+            self.clock.now += 10.0
+            tracker.end_phase()
+            remaining = tracker.remaining()
+        # Each update only reads what was summed up front
+        self.assertEqual(numpy.mock_calls, [])
+        point_times.assert_not_called()
+        self.assertGreater(remaining, 0.0)
+
+
+class TestProgressState(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "progress.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_GIVEN_state_path_WHEN_phases_measured_THEN_writes_throttled(self):
+        tracker = ProgressTracker(plan, cost_model, state_path=self.path, state_interval=3600.0)
+        with patch("progress.write_state", wraps=progress.write_state) as write_state:
+            for phase in (BEGIN, COUNT, END):
+                with tracker.measure(phase):
+                    pass
+            self.assertEqual(write_state.call_count, 1)
+            tracker.finish()
+            self.assertEqual(write_state.call_count, 2)
+        state = read_state(self.path)
+        self.assertTrue(state["finished"])
+        self.assertEqual(state["points"], 2)
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+    def test_GIVEN_no_state_file_WHEN_read_state_THEN_none(self):
+        self.assertIsNone(read_state(self.path))
+
+    def test_GIVEN_progress_WHEN_state_THEN_finish_time_and_fraction(self):
+        state = Progress(point=1, points=4, elapsed=30.0, remaining=10.0, event_rate=1.0).state()
+        self.assertEqual(state["fraction"], 0.75)
+        self.assertAlmostEqual(state["finish"] - state["updated"], 10.0)
+
+
+class TestEmuRunProgress(unittest.TestCase):
+    @patch("genie_python.genie.end")
+    @patch("genie_python.genie.waitfor_mevents")
+    @patch("genie_python.genie.begin")
+    def test_GIVEN_plan_WHEN_run_plan_THEN_progress_reported_to_callbacks_and_state(self, *_):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "progress.json")
+        callback = MagicMock()
+        progress_callbacks.append(callback)
+        self.addCleanup(progress_callbacks.remove, callback)
+        with patch.dict("os.environ", {PROGRESS_PATH_VARIABLE: path}):
+            DoRun().run_plan(plan, MagicMock())
+        reported = [call[0][0] for call in callback.call_args_list]
+        # A set and a begin, count and end for each point and then the end of the plan
+        self.assertEqual(len(reported), 2 * 4 + 1)
+        self.assertEqual([progress.point for progress in reported[4:8]], [1] * 4)
+        self.assertTrue(reported[-1].finished)
+        self.assertTrue(read_state(path)["finished"])
+
+    @patch("genie_python.genie.end")
+    @patch("genie_python.genie.waitfor_mevents")
+    @patch("genie_python.genie.begin")
+    def test_GIVEN_failing_callback_and_state_file_WHEN_run_plan_THEN_run_and_disabled(
+        self, begin, *_
+    ):
+        failing, working = MagicMock(side_effect=RuntimeError("display gone")), MagicMock()
+        callbacks = [failing, working]
+        # The state file is on a share that has gone offline
+        write_state = patch("progress.write_state", side_effect=OSError("share offline"))
+        with patch("progress.progress_callbacks", callbacks), write_state as write_state:
+            with patch.dict("os.environ", {PROGRESS_PATH_VARIABLE: "progress.json"}):
+                with self.assertLogs("progress", "ERROR") as logs:
+                    DoRun().run_plan(plan, MagicMock())
+        # Both points still run
+        self.assertEqual(begin.call_count, 2)
+        failing.assert_called_once()
+        self.assertEqual(callbacks, [working])
+        self.assertEqual(working.call_count, 2 * 4 + 1)
+        write_state.assert_called_once()
+        self.assertEqual(len(logs.output), 2)
+
+    def test_GIVEN_failing_callback_WHEN_tracked_THEN_callback_disabled(self):
+        callback = MagicMock(side_effect=ValueError)
+        tracker = ProgressTracker(plan, cost_model, callback=callback)
+        with self.assertLogs("progress", "ERROR"):
+            with tracker.measure(SET):
+                pass
+        tracker.finish()
+        callback.assert_called_once()
+        self.assertIsNone(tracker.callback)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,325 @@
+import unittest
+
+import numpy as np
+from mock import MagicMock, patch
+from parameterized import parameterized
+
+import scan_plan
+from cost_model import get_cost_model
+from emuloop import DoRun
+from emulooptime import DoRun as DoRunTime
+from scan_plan import (
+    RASTER,
+    SERPENTINE,
+    ScanAction,
+    ScanPlan,
+    Sweep,
+    SweepPlan,
+    count_round_trip_points,
+    round_trip,
+    round_trip_cycles_type,
+    scan_ordering_type,
+)
+from script_utilities import get_steps
+
+inst = MagicMock()
+
+# Sweep plans of temperature and field scans, set once and kept, there and back and in both orders
+sweep_plans = [
+    SweepPlan(Sweep(1.0, 3.0, 3), Sweep(10.0, 30.0, 3), 5, ordering=ordering)
+    for ordering in (RASTER, SERPENTINE)
+] + [
+    SweepPlan(Sweep(300.0, 1.0, 4), Sweep(0.0, 20.0, 3, cycles=2), 5),
+    SweepPlan(Sweep(5.0, 1.0, 5, cycles=1), Sweep(np.nan, np.nan, 1), 5, set_field=False),
+    SweepPlan(Sweep(4.0, 4.0, 1), Sweep(30.0, 10.0, 3), 5, set_temperature=False),
+    SweepPlan(Sweep(np.nan, np.nan, 1), Sweep(10.0, 10.0, 1), 0, False, False),
+    SweepPlan(Sweep(1.0, 2.0, 2), Sweep(10.0, 10.0, 1), 5, set_field=False, ordering=SERPENTINE),
+]
+
+
+class TestScanPlan(unittest.TestCase):
+    def test_GIVEN_temperatures_and_fields_WHEN_from_axes_THEN_fields_measured_at_each_temp(
+        self,
+    ):
+        plan = ScanPlan.from_axes([1.0, 2.0], [10.0, 20.0, 30.0], 5)
+        self.assertEqual(len(plan), 6)
+        np.testing.assert_array_equal(plan.temperatures, [1.0, 1.0, 1.0, 2.0, 2.0, 2.0])
+        np.testing.assert_array_equal(plan.fields, [10.0, 20.0, 30.0, 10.0, 20.0, 30.0])
+        np.testing.assert_array_equal(plan.mevents, [5] * 6)
+
+    def test_GIVEN_temperatures_and_fields_WHEN_from_axes_THEN_sets_flagged_where_values_change(
+        self,
+    ):
+        plan = ScanPlan.from_axes([1.0, 2.0], [10.0, 20.0, 30.0], 5)
+        self.assertEqual(plan.count_actions(ScanAction.SET_TEMPERATURE), 2)
+        self.assertEqual(plan.count_actions(ScanAction.SET_FIELD), 6)
+        self.assertEqual(plan.count_actions(ScanAction.COUNT), 6)
+        self.assertEqual(
+            ScanAction(int(plan[3]["action"])),
+            ScanAction.SET_TEMPERATURE | ScanAction.SET_FIELD | ScanAction.COUNT,
+        )
+
+    def test_GIVEN_one_field_WHEN_from_axes_THEN_field_set_once(self):
+        plan = ScanPlan.from_axes([1.0, 2.0, 3.0], [10.0], 5)
+        self.assertEqual(plan.count_actions(ScanAction.SET_FIELD), 1)
+
+    def test_GIVEN_kept_temperature_WHEN_from_axes_THEN_temperature_never_set(self):
+        plan = ScanPlan.from_axes(None, [10.0, 20.0], 5)
+        self.assertTrue(np.isnan(plan.temperatures).all())
+        self.assertEqual(plan.count_actions(ScanAction.SET_TEMPERATURE), 0)
+
+    def test_GIVEN_temperature_already_set_WHEN_from_axes_THEN_temperature_recorded_but_not_set(
+        self,
+    ):
+        plan = ScanPlan.from_axes([4.0], [10.0, 20.0], 5, set_temperature=False)
+        np.testing.assert_array_equal(plan.temperatures, [4.0, 4.0])
+        self.assertEqual(plan.count_actions(ScanAction.SET_TEMPERATURE), 0)
+
+    def test_GIVEN_no_mevents_WHEN_from_axes_THEN_no_counts(self):
+        plan = ScanPlan.from_axes([1.0, 2.0], None, 0)
+        self.assertEqual(plan.count_actions(ScanAction.COUNT), 0)
+
+    def test_GIVEN_position_WHEN_progress_and_remaining_THEN_fraction_done_and_rest_of_plan(self):
+        plan = ScanPlan.from_axes([1.0, 2.0], [10.0, 20.0], 5)
+        self.assertEqual(plan.progress(1), 0.25)
+        self.assertEqual(plan.progress(len(plan)), 1.0)
+        remaining = plan.remaining(1)
+        self.assertEqual(len(remaining), 3)
+        self.assertEqual(remaining[0]["field"], 20.0)
+        self.assertTrue(np.shares_memory(remaining.points, plan.points))
+        self.assertEqual(len(plan.remaining(len(plan))), 0)
+
+    def test_GIVEN_serpentine_ordering_WHEN_from_axes_THEN_fields_reversed_on_alternate_temps(self):
+        plan = ScanPlan.from_axes([1.0, 2.0, 3.0], [10.0, 20.0, 30.0], 5, ordering=SERPENTINE)
+        np.testing.assert_array_equal(
+            plan.fields, [10.0, 20.0, 30.0, 30.0, 20.0, 10.0, 10.0, 20.0, 30.0]
+        )
+        np.testing.assert_array_equal(plan.temperatures, np.repeat([1.0, 2.0, 3.0], 3))
+        # The field is already at the first field of the next temperature so is not set again
+        self.assertEqual(plan.count_actions(ScanAction.SET_FIELD), 7)
+
+    def test_GIVEN_serpentine_ordering_WHEN_field_ramp_THEN_return_ramps_saved(self):
+        raster = ScanPlan.from_axes([1.0, 2.0, 3.0], [10.0, 20.0, 30.0], 5)
+        serpentine = ScanPlan.from_axes([1.0, 2.0, 3.0], [10.0, 20.0, 30.0], 5, ordering=SERPENTINE)
+        self.assertEqual(raster.field_ramp, 100.0)
+        self.assertEqual(serpentine.field_ramp, 60.0)
+
+    def test_GIVEN_kept_field_WHEN_field_ramp_THEN_zero(self):
+        self.assertEqual(ScanPlan.from_axes([1.0, 2.0], None, 5).field_ramp, 0.0)
+
+    def test_GIVEN_ordering_WHEN_scan_ordering_type_THEN_cast_or_error(self):
+        self.assertEqual(scan_ordering_type(" Serpentine"), SERPENTINE)
+        self.assertRaises(ValueError, scan_ordering_type, "spiral")
+
+
+class TestRoundTrip(unittest.TestCase):
+    @parameterized.expand(
+        [
+            ([1.0, 2.0, 3.0], 0, [1.0, 2.0, 3.0]),
+            ([1.0, 2.0, 3.0], 1, [1.0, 2.0, 3.0, 2.0, 1.0]),
+            ([1.0, 2.0, 3.0], 2, [1.0, 2.0, 3.0, 2.0, 1.0, 2.0, 3.0, 2.0, 1.0]),
+            ([3.0, 1.0], 1, [3.0, 1.0, 3.0]),
+            ([5.0], 3, [5.0]),
+        ]
+    )
+    def test_GIVEN_sweep_WHEN_round_trip_THEN_turning_points_measured_once(
+        self, values, cycles, expected
+    ):
+        np.testing.assert_array_equal(round_trip(values, cycles), expected)
+        self.assertEqual(count_round_trip_points(len(values), cycles), len(expected))
+
+    def test_GIVEN_cycles_WHEN_round_trip_cycles_type_THEN_cast_or_error(self):
+        self.assertEqual(round_trip_cycles_type("3"), 3)
+        self.assertRaises(ValueError, round_trip_cycles_type, "-1")
+        self.assertRaises(ValueError, round_trip_cycles_type, "1.5")
+
+
+class TestSweepPlan(unittest.TestCase):
+    @parameterized.expand([(0.5, 0.5, 2.0), (2.0, 0.5, 0.5), (0.0, 0.3, 1.0), (1.0, 1.0, 1.5)])
+    def test_GIVEN_steps_WHEN_sweep_from_steps_THEN_values_of_get_steps(self, start, step, stop):
+        np.testing.assert_array_equal(
+            Sweep.from_steps(start, step, stop).values(), list(get_steps(start, step, stop))
+        )
+
+    @parameterized.expand([(plan,) for plan in sweep_plans])
+    def test_GIVEN_sweep_plan_WHEN_points_ramp_and_sets_THEN_same_as_compiled_plan(self, plan):
+        compiled = ScanPlan.from_axes(
+            plan.temperatures.values(),
+            plan.fields.values(),
+            plan.mevents,
+            plan.set_temperature,
+            plan.set_field,
+            plan.ordering,
+        )
+        self.assertEqual(plan.points, len(compiled))
+        self.assertAlmostEqual(plan.field_ramp, compiled.field_ramp)
+        self.assertEqual(
+            plan.setpoint_changes,
+            compiled.count_actions(ScanAction.SET_TEMPERATURE)
+            + compiled.count_actions(ScanAction.SET_FIELD),
+        )
+
+    @parameterized.expand([(plan,) for plan in sweep_plans])
+    def test_GIVEN_sweep_plan_WHEN_chunks_THEN_points_of_compiled_plan_in_order(self, plan):
+        compiled = ScanPlan.from_axes(
+            plan.temperatures.values(),
+            plan.fields.values(),
+            plan.mevents,
+            plan.set_temperature,
+            plan.set_field,
+            plan.ordering,
+        )
+        with patch("scan_plan.chunk_points", 4):
+            chunks = list(plan.chunks())
+        self.assertEqual(len(chunks), -(-len(compiled) // 4))
+        for before, after in zip(chunks, chunks[1:]):
+            np.testing.assert_array_equal(
+                [after.temperatures[0], after.fields[0]],
+                [before.temperatures[-1], before.fields[-1]],
+            )
+        points = np.concatenate([chunks[0].points] + [chunk.points[1:] for chunk in chunks[1:]])
+        for name in compiled.points.dtype.names:
+            np.testing.assert_array_equal(points[name], compiled.points[name])
+
+    def test_GIVEN_default_chunk_points_WHEN_chunks_THEN_one_chunk_per_chunk_points(self):
+        plan = SweepPlan(Sweep(1.0, 3.0, 3), Sweep(0.0, 1.0, scan_plan.chunk_points), 5)
+        self.assertEqual(
+            [len(chunk) for chunk in plan.chunks()],
+            [scan_plan.chunk_points] + [scan_plan.chunk_points + 1] * 2,
+        )
+
+    def test_GIVEN_empty_field_sweep_WHEN_sweep_plan_THEN_no_points_moves_or_chunks(self):
+        plan = SweepPlan(Sweep(1.0, 3.0, 3), Sweep(0.0, 0.0, 0), 5)
+        self.assertEqual((plan.points, plan.field_moves, plan.setpoint_changes), (0, (0.0, 0), 0))
+        self.assertEqual(list(plan.chunks()), [])
+
+
+class TestEmuRunPlan(unittest.TestCase):
+    def setUp(self):
+        self.script_definition = DoRun()
+        self.check_mevents_mock = MagicMock()
+        self.script_definition.check_mevents_and_begin_waitfor_mevents_end = self.check_mevents_mock
+        inst.reset_mock(side_effect=True)
+
+    def test_GIVEN_temp_and_field_scans_WHEN_get_scan_plan_THEN_plan_has_every_point(self):
+        plan = self.script_definition.get_scan_plan(1.0, 2.0, 1.0, 10.0, 30.0, 10.0, 5)
+        self.assertEqual(len(plan), 6)
+        np.testing.assert_array_equal(plan.fields[:3], [10.0, 20.0, 30.0])
+
+    def test_GIVEN_temp_point_AND_field_scan_WHEN_get_scan_plan_THEN_temperature_not_set(self):
+        plan = self.script_definition.get_scan_plan(4.0, 4.0, 1.0, 10.0, 30.0, 10.0, 5)
+        np.testing.assert_array_equal(plan.temperatures, [4.0, 4.0, 4.0])
+        self.assertEqual(plan.count_actions(ScanAction.SET_TEMPERATURE), 0)
+        self.assertEqual(plan.count_actions(ScanAction.SET_FIELD), 3)
+
+    def test_GIVEN_serpentine_global_param_WHEN_get_scan_plan_THEN_fields_reversed(self):
+        self.script_definition.global_params = {"Field ordering": "serpentine"}
+        plan = self.script_definition.get_scan_plan(1.0, 2.0, 1.0, 10.0, 30.0, 10.0, 5)
+        np.testing.assert_array_equal(plan.fields, [10.0, 20.0, 30.0, 30.0, 20.0, 10.0])
+
+    def test_GIVEN_serpentine_global_param_WHEN_estimate_custom_THEN_ramp_saved_reported(self):
+        self.script_definition.global_params = {"Field ordering": "serpentine"}
+        estimate = self.script_definition.estimate_custom(
+            start_temperature="1",
+            stop_temperature="3",
+            step_temperature="1",
+            start_field="10",
+            stop_field="30",
+            step_field="10",
+            custom="None",
+            mevents="5",
+            magnet_device="LF",
+        )
+        self.assertEqual(estimate["Field ramp saved"], "40")
+
+    def test_GIVEN_no_global_params_WHEN_estimate_custom_THEN_raster_AND_no_ramp_saved(self):
+        estimate = self.script_definition.estimate_custom(
+            start_temperature="1",
+            stop_temperature="3",
+            step_temperature="1",
+            start_field="10",
+            stop_field="30",
+            step_field="10",
+            custom="None",
+            mevents="5",
+            magnet_device="LF",
+        )
+        self.assertEqual(estimate["Field ramp saved"], "0")
+
+    def test_GIVEN_round_trip_cycles_WHEN_get_scan_plan_THEN_fields_swept_there_and_back(self):
+        self.script_definition.global_params = {
+            "Field ordering": "serpentine",
+            "Round trip cycles": "1",
+        }
+        plan = self.script_definition.get_scan_plan(1.0, 2.0, 1.0, 0.0, 20.0, 10.0, 5)
+        np.testing.assert_array_equal(plan.fields, [0.0, 10.0, 20.0, 10.0, 0.0] * 2)
+        self.assertEqual(plan.count_actions(ScanAction.COUNT), 10)
+        # The field is already at 0 for the second temperature
+        self.assertEqual(plan.count_actions(ScanAction.SET_FIELD), 9)
+
+    def test_GIVEN_round_trip_cycles_AND_temp_scan_only_WHEN_get_scan_plan_THEN_temp_swept_back(
+        self,
+    ):
+        self.script_definition.global_params = {"Round trip cycles": "1"}
+        plan = self.script_definition.get_scan_plan(1.0, 3.0, 1.0, 5.0, 5.0, 1.0, 5)
+        np.testing.assert_array_equal(plan.temperatures, [1.0, 2.0, 3.0, 2.0, 1.0])
+        self.assertEqual(plan.count_actions(ScanAction.SET_FIELD), 0)
+
+    def test_GIVEN_round_trip_cycles_WHEN_estimate_time_THEN_turning_points_measured_once(self):
+        script_definition = DoRunTime()
+        script_definition.global_params = {"Round trip cycles": "2"}
+        estimate = script_definition.estimate_time(
+            start_temperature="1",
+            stop_temperature="2",
+            step_temperature="1",
+            start_field="0",
+            stop_field="20",
+            step_field="10",
+            custom="None",
+            mevents="5",
+            magnet_device="LF",
+        )
+        plan = script_definition.get_scan_plan(1.0, 2.0, 1.0, 0.0, 20.0, 10.0, 5)
+        self.assertEqual(len(plan), 2 * count_round_trip_points(3, 2))
+        # Estimated in closed form, so only the same to rounding
+        self.assertAlmostEqual(estimate, get_cost_model("EMU").estimate(plan).total, places=6)
+
+    @patch.dict("sys.modules", inst=inst)
+    @patch("genie_python.genie.cget", return_value={"value": "Active ZF"})
+    def test_GIVEN_temp_and_field_scans_WHEN_run_THEN_sets_and_runs_in_plan_order(self, _):
+        calls = []
+        inst.settemp.side_effect = lambda temp, wait: calls.append(("settemp", temp))
+        inst.setmag.side_effect = lambda field, wait: calls.append(("setmag", field))
+        self.check_mevents_mock.side_effect = lambda mevents, progress: calls.append(
+            ("run", mevents)
+        )
+        self.script_definition.run(
+            start_temperature="1",
+            stop_temperature="2",
+            step_temperature="1",
+            start_field="10",
+            stop_field="20",
+            step_field="10",
+            custom="None",
+            mevents="5",
+            magnet_device="ZF",
+        )
+        self.assertEqual(
+            calls,
+            [
+                ("settemp", 1.0),
+                ("setmag", 10.0),
+                ("run", 5.0),
+                ("setmag", 20.0),
+                ("run", 5.0),
+                ("settemp", 2.0),
+                ("setmag", 10.0),
+                ("run", 5.0),
+                ("setmag", 20.0),
+                ("run", 5.0),
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,191 @@
+import unittest
+
+from mock import patch
+from parameterized import parameterized
+
+from cost_model import CostModel
+from emu_default import DoRun as DoRunDefault
+from emu_logfields import DoRun as DoRunLogFields
+from emu_test_by_time import DoRun as DoRunTestByTime
+from emuloop import DoRun
+from emulooptime import DoRun as DoRunTime
+from plan_optimiser import TransitionCosts
+from script_analysis import (
+    DUPLICATED_POINTS,
+    RAMP_REVERSAL,
+    REDUNDANT_MAGNET_SWITCH,
+    ZERO_MEVENTS,
+    analyse_script,
+)
+from script_utilities import row_cache
+
+cost_model = CostModel(
+    transitions=TransitionCosts(warming_rate=1.0, cooling_rate=0.1, field_ramp_rate=10.0),
+    event_rate=0.5,
+    run_overhead=3.0,
+    magnet_switch=60.0,
+)
+
+row = dict(
+    start_temperature="1",
+    stop_temperature="3",
+    step_temperature="1",
+    start_field="10",
+    stop_field="10",
+    step_field="0",
+    custom="None",
+    mevents="5",
+    magnet_device="LF",
+)
+
+
+def point(temperature, field="keep", magnet_device="N/A", **changes):
+    return dict(
+        row,
+        start_temperature=temperature,
+        stop_temperature=temperature,
+        start_field=field,
+        stop_field=field,
+        magnet_device=magnet_device,
+        **changes,
+    )
+
+
+class TestAnalyseScript(unittest.TestCase):
+    def setUp(self):
+        row_cache.clear()
+        self.addCleanup(row_cache.clear)
+        calibrated = patch("emuloop.calibrated_cost_model", return_value=cost_model)
+        calibrated.start()
+        self.addCleanup(calibrated.stop)
+
+    def analyse(self, rows):
+        return analyse_script(DoRun(), rows)
+
+    def test_GIVEN_magnets_toggled_WHEN_analyse_THEN_switch_back_redundant(self):
+        analysis = self.analyse(
+            [point("1", "10", "LF"), point("2", "10", "TF"), point("3", "10", "LF")]
+        )
+        self.assertEqual(
+            [(finding.kind, finding.rows, finding.wasted_seconds) for finding in analysis.findings],
+            [(REDUNDANT_MAGNET_SWITCH, (0, 2), 60.0)],
+        )
+        self.assertEqual(analysis.errors, [None, None, None])
+
+    def test_GIVEN_magnet_kept_or_not_applicable_WHEN_analyse_THEN_no_switch(self):
+        analysis = self.analyse(
+            [point("1", "10", "LF"), point("2", "10", "LF"), point("3"), point("4", "20", "LF")]
+        )
+        self.assertEqual(analysis.findings, [])
+
+    def test_GIVEN_repeated_row_WHEN_analyse_THEN_points_duplicated_with_count_time(self):
+        analysis = self.analyse([row, point("5", "10", "LF"), row])
+        (finding,) = analysis.of_kind(DUPLICATED_POINTS)
+        self.assertEqual(finding.rows, (0, 2))
+        self.assertIn("3 points", finding.message)
+        self.assertAlmostEqual(finding.wasted_seconds, 3 * (5 / 0.5 + 3.0))
+
+    def test_GIVEN_kept_temperature_WHEN_analyse_THEN_point_of_row_before(self):
+        analysis = self.analyse(
+            [point("2", "10", "LF"), point("keep", "10", "LF"), point("keep", "10", "TF")]
+        )
+        self.assertEqual(
+            [(finding.kind, finding.rows) for finding in analysis.findings],
+            [(DUPLICATED_POINTS, (0, 1))],
+        )
+
+    def test_GIVEN_temperature_not_known_WHEN_analyse_THEN_points_not_duplicated(self):
+        self.assertEqual(self.analyse([point("keep"), point("keep")]).findings, [])
+
+    def test_GIVEN_cooled_and_warmed_back_WHEN_analyse_THEN_reversal_wastes_ramp_back(self):
+        analysis = self.analyse(
+            [point("300", "10", "LF"), point("2", "10", "LF"), point("300", "10", "LF")]
+        )
+        (finding,) = analysis.of_kind(RAMP_REVERSAL)
+        self.assertEqual(finding.rows, (1, 2))
+        # Cooling to 2 K once after both rows at 300 K rather than warming back to 300 K
+        self.assertAlmostEqual(finding.wasted_seconds, 298.0)
+        self.assertEqual(len(analysis.of_kind(DUPLICATED_POINTS)), 1)
+        self.assertAlmostEqual(analysis.wasted_seconds, 298.0 + 5 / 0.5 + 3.0)
+
+    def test_GIVEN_monotonic_rows_WHEN_analyse_THEN_no_reversal(self):
+        analysis = self.analyse([point(str(temperature)) for temperature in (2, 50, 100, 300)])
+        self.assertEqual(analysis.findings, [])
+
+    def test_GIVEN_rows_reversing_in_turn_WHEN_analyse_THEN_swaps_do_not_overlap(self):
+        analysis = self.analyse([point(str(temperature)) for temperature in (300, 2) * 4])
+        pairs = [finding.rows for finding in analysis.of_kind(RAMP_REVERSAL)]
+        self.assertGreater(len(pairs), 1)
+        for (_, first), (second, _) in zip(pairs, pairs[1:]):
+            self.assertGreaterEqual(second - first, 2)
+
+    def test_GIVEN_zero_mevents_WHEN_analyse_THEN_ramps_of_row_wasted(self):
+        analysis = self.analyse([dict(row, mevents="0"), dict(row, mevents="0", custom="print()")])
+        (finding,) = analysis.findings
+        self.assertEqual((finding.kind, finding.rows), (ZERO_MEVENTS, (0,)))
+        # Warming from 1 K to 3 K
+        self.assertAlmostEqual(finding.wasted_seconds, 2.0)
+
+    def test_GIVEN_invalid_row_WHEN_analyse_THEN_error_and_rest_analysed(self):
+        analysis = self.analyse([row, dict(row, mevents="lots"), row])
+        self.assertEqual(
+            analysis.errors, [None, DoRun().parameters_valid(**dict(row, mevents="lots")), None]
+        )
+        self.assertEqual(analysis.of_kind(DUPLICATED_POINTS)[0].rows, (0, 2))
+
+    @parameterized.expand(
+        [
+            ("zero step", dict(row, stop_temperature="5", step_temperature="0")),
+            ("not a number", dict(row, start_temperature="nan")),
+            ("zero field without zero field magnet", point("2", "0", "LF")),
+        ]
+    )
+    def test_GIVEN_row_breaking_rules_WHEN_analyse_THEN_error_and_rest_analysed(self, _, broken):
+        analysis = self.analyse([row, broken, row])
+        self.assertEqual(analysis.errors, [None, DoRun().parameters_valid(**broken), None])
+        self.assertEqual(
+            [(finding.kind, finding.rows) for finding in analysis.findings],
+            [(DUPLICATED_POINTS, (0, 2))],
+        )
+
+    def test_GIVEN_thousands_of_rows_WHEN_analyse_THEN_each_distinct_row_planned_once(self):
+        rows = [
+            point(str(index % 300), str(index % 7 * 10 + 10), "LF" if index % 2 else "TF")
+            for index in range(4000)
+        ]
+        with patch.object(DoRun, "get_row_plan", autospec=True, wraps=DoRun.get_row_plan) as plan:
+            analysis = self.analyse(rows)
+        self.assertEqual(plan.call_count, 2100)
+        self.assertEqual(len(analysis.of_kind(REDUNDANT_MAGNET_SWITCH)), 3998)
+        # The magnet device, temperature and field repeat every 2100 rows
+        self.assertEqual(len(analysis.of_kind(DUPLICATED_POINTS)), 4000 - 2100)
+
+
+class TestDefinitionAnalyseScript(unittest.TestCase):
+    @parameterized.expand(
+        [
+            (DoRun, "emuloop"),
+            (DoRunTime, "emulooptime"),
+            (DoRunLogFields, "emu_logfields"),
+            (DoRunTestByTime, "emu_test_by_time"),
+            (DoRunDefault, "emu_default"),
+        ]
+    )
+    def test_GIVEN_repeated_row_WHEN_analyse_script_THEN_points_duplicated(
+        self, definition, module
+    ):
+        definition_row = dict(row)
+        if definition is DoRunLogFields:
+            definition_row["n_fields"] = str(1 + int(definition_row.pop("step_field")))
+        elif definition is DoRunTestByTime:
+            definition_row["Run_Time_Mins"] = definition_row.pop("mevents")
+        with patch(f"{module}.calibrated_cost_model", return_value=cost_model):
+            analysis = definition().analyse_script([definition_row, definition_row])
+        self.assertEqual(
+            [(finding.kind, finding.rows) for finding in analysis.findings],
+            [(DUPLICATED_POINTS, (0, 1))],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
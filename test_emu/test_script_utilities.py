@@ -0,0 +1,416 @@
+import unittest
+from collections import OrderedDict
+
+import numpy as np
+from mock import MagicMock
+from parameterized import parameterized
+
+from emu_default import DoRun as DoRunDefault
+from emu_logfields import inclusive_float_range_with_step_flip as rounded_arange_range
+from emu_test_by_time import inclusive_float_range_with_step_flip as arange_range
+from emuloop import DoRun
+from script_utilities import (
+    CacheStats,
+    LatticeRange,
+    LRUCache,
+    ScanRange,
+    _IndexedRange,
+    cached_steps,
+    count_arange_steps,
+    count_geometric_steps,
+    count_steps,
+    count_steps_batch,
+    decimal_places,
+    geometric_steps,
+    get_steps,
+    get_steps_batch,
+    global_param,
+    last_arange_step,
+    memoise_row,
+    scan_cache,
+)
+
+scan_triples = [
+    (start, step, stop)
+    for start in [0.0, 0.1, 0.5, 1.0, 2.0, 10.5, 300.0]
+    for stop in [0.0, 0.3, 0.5, 1.0, 2.0, 10.0, 250.5]
+    for step in [0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 3.0, -0.3]
+]
+
+
+class TestCountSteps(unittest.TestCase):
+    def test_GIVEN_scan_triples_WHEN_count_steps_THEN_same_as_number_of_points_in_get_steps(self):
+        for start, step, stop in scan_triples:
+            self.assertEqual(
+                count_steps(start, step, stop),
+                len(list(get_steps(start, step, stop))),
+                f"start={start}, step={step}, stop={stop}",
+            )
+
+    @parameterized.expand([(0.0, 0.0, 0.0), (1.0, 0.0, 2.0)])
+    def test_GIVEN_step_of_zero_WHEN_count_steps_THEN_raises_like_get_steps(
+        self, start, step, stop
+    ):
+        with self.assertRaises(ZeroDivisionError):
+            list(get_steps(start, step, stop))
+        with self.assertRaises(ZeroDivisionError):
+            count_steps(start, step, stop)
+
+    def test_GIVEN_huge_scan_WHEN_count_steps_THEN_counted_without_generating(self):
+        self.assertEqual(count_steps(0.0, 1e-6, 1000.0), 1000000001)
+
+
+class TestCountArangeSteps(unittest.TestCase):
+    def test_GIVEN_scan_triples_WHEN_count_arange_steps_THEN_same_as_number_of_points_in_range(
+        self,
+    ):
+        for start, step, stop in scan_triples:
+            if start == stop or step < 0:
+                continue
+            self.assertEqual(
+                count_arange_steps(start, stop, step),
+                len(list(arange_range(start, stop, step))),
+                f"start={start}, step={step}, stop={stop}",
+            )
+
+    def test_GIVEN_scan_triples_AND_rounding_WHEN_count_arange_steps_THEN_same_as_rounded_range(
+        self,
+    ):
+        for start, step, stop in scan_triples:
+            if start == stop or step < 0:
+                continue
+            self.assertEqual(
+                count_arange_steps(start, stop, step, decimal_places(start, stop, step)),
+                len(list(rounded_arange_range(start, stop, step))),
+                f"start={start}, step={step}, stop={stop}",
+            )
+
+    def test_GIVEN_scan_triples_WHEN_last_arange_step_THEN_last_point_in_range(self):
+        for start, step, stop in scan_triples:
+            if start == stop or step < 0:
+                continue
+            places = decimal_places(start, stop, step)
+            for last, expected in (
+                (last_arange_step(start, stop, step), list(arange_range(start, stop, step))),
+                (
+                    last_arange_step(start, stop, step, places),
+                    list(rounded_arange_range(start, stop, step)),
+                ),
+            ):
+                self.assertEqual(last, expected[-1], f"start={start}, step={step}, stop={stop}")
+
+
+class TestScanRange(unittest.TestCase):
+    def test_GIVEN_scan_triples_WHEN_iterate_THEN_same_values_as_linspace_in_get_steps(self):
+        for start, step, stop in scan_triples:
+            modulo = abs(stop - start) % abs(step)
+            vstop = stop - modulo if stop > start else stop + modulo
+            expected = np.linspace(start, vstop, int(abs(vstop - start) / abs(step)) + 1)
+            self.assertEqual(list(ScanRange(start, step, stop)), list(expected))
+
+    def test_GIVEN_range_WHEN_len_and_index_THEN_points_computed_from_index(self):
+        scan_range = ScanRange(1, 0.3, 2)
+        self.assertEqual(len(scan_range), 4)
+        self.assertEqual(scan_range[0], 1)
+        self.assertEqual(scan_range[-1], 1.9)
+        self.assertRaises(IndexError, lambda: scan_range[4])
+
+    def test_GIVEN_range_WHEN_sliced_THEN_remaining_points_returned_as_range(self):
+        scan_range = ScanRange(2, 0.5, 0.5)
+        remaining = scan_range[1:]
+        self.assertIsInstance(remaining, ScanRange)
+        self.assertEqual(list(remaining), [1.5, 1, 0.5])
+        self.assertEqual(list(scan_range[::2]), [2, 1])
+        self.assertEqual(list(scan_range[::-1]), [0.5, 1, 1.5, 2])
+
+    def test_GIVEN_range_WHEN_reversed_THEN_points_in_reverse_order(self):
+        self.assertEqual(list(reversed(ScanRange(0.5, 0.5, 2))), [2, 1.5, 1, 0.5])
+
+    def test_GIVEN_point_in_range_WHEN_index_THEN_position_returned(self):
+        scan_range = ScanRange(0.0, 1e-6, 1000.0)
+        for position in [0, 1, 123456, len(scan_range) - 1]:
+            self.assertEqual(scan_range.index(scan_range[position]), position)
+        self.assertEqual(scan_range[10:].index(scan_range[15]), 5)
+
+    @parameterized.expand([(1.15,), (3.0,), (float("nan"),), ("1.0",)])
+    def test_GIVEN_value_not_in_range_WHEN_index_THEN_value_error(self, value):
+        scan_range = ScanRange(1, 0.3, 2)
+        self.assertRaises(ValueError, scan_range.index, value)
+        self.assertNotIn(value, scan_range)
+
+
+class TestGetStepsBatch(unittest.TestCase):
+    def test_GIVEN_many_scans_WHEN_get_steps_batch_THEN_each_row_same_as_get_steps(self):
+        starts, steps, stops = zip(*scan_triples)
+        batch = get_steps_batch(starts, steps, stops)
+        self.assertEqual(len(batch.offsets), len(scan_triples) + 1)
+        for index, (start, step, stop) in enumerate(scan_triples):
+            self.assertEqual(list(batch.row(index)), list(get_steps(start, step, stop)))
+
+    def test_GIVEN_many_scans_WHEN_count_steps_batch_THEN_same_as_count_steps(self):
+        starts, steps, stops = zip(*scan_triples)
+        expected = [count_steps(start, step, stop) for start, step, stop in scan_triples]
+        self.assertEqual(list(count_steps_batch(starts, steps, stops)), expected)
+        self.assertEqual(list(get_steps_batch(starts, steps, stops).counts), expected)
+
+    def test_GIVEN_scalar_step_WHEN_get_steps_batch_THEN_step_used_for_every_scan(self):
+        batch = get_steps_batch([0.5, 2], 0.5, [2, 0.5])
+        self.assertEqual(list(batch.values), [0.5, 1, 1.5, 2, 2, 1.5, 1, 0.5])
+        self.assertEqual(list(batch.offsets), [0, 4, 8])
+
+    def test_GIVEN_no_scans_WHEN_get_steps_batch_THEN_empty(self):
+        batch = get_steps_batch([], [], [])
+        self.assertEqual(len(batch.values), 0)
+        self.assertEqual(list(batch.offsets), [0])
+
+    def test_GIVEN_a_step_of_zero_WHEN_get_steps_batch_THEN_raises(self):
+        self.assertRaises(ZeroDivisionError, get_steps_batch, [0, 1], [1, 0], [2, 2])
+
+    def test_GIVEN_range_without_index_of_WHEN_instantiated_THEN_type_error(self):
+        class PointsOnly(_IndexedRange):
+            def _point(self, i):
+                return float(i)
+
+        with self.assertRaises(TypeError):
+            PointsOnly()
+
+
+class TestLatticeRange(unittest.TestCase):
+    @parameterized.expand(
+        [
+            (0, 0.1, 0.3, [0, 0.1, 0.2, 0.3]),
+            (0.5, 0.5, 2, [0.5, 1, 1.5, 2]),
+            (1, 0.3, 2, [1, 1.3, 1.6, 1.9]),
+            (2, 0.3, 1, [2, 1.7, 1.4, 1.1]),
+            (2, -0.3, 1, [2, 1.7, 1.4, 1.1]),
+            (1e-5, 2e-5, 5e-5, [1e-5, 3e-5, 5e-5]),
+            (300, 25, 250, [300, 275, 250]),
+            (4.2, 1, 4.2, [4.2]),
+        ]
+    )
+    def test_GIVEN_decimal_range_WHEN_iterate_THEN_exact_decimal_points(
+        self, start, step, stop, expected
+    ):
+        self.assertEqual(list(LatticeRange(start, step, stop)), expected)
+
+    def test_GIVEN_end_point_float_range_misses_WHEN_lattice_range_THEN_end_point_included(self):
+        self.assertEqual(list(get_steps(0, 0.1, 0.3))[-1], 0.2)
+        self.assertEqual(LatticeRange(0, 0.1, 0.3)[-1], 0.3)
+
+    def test_GIVEN_setpoint_WHEN_index_THEN_position_found_from_lattice(self):
+        lattice_range = LatticeRange(0, 0.001, 1000)
+        self.assertEqual(len(lattice_range), 1000001)
+        self.assertEqual(lattice_range.index(0.3), 300)
+        self.assertEqual(lattice_range.index(999.999), 999999)
+        self.assertEqual(lattice_range[250:].index(0.3), 50)
+
+    @parameterized.expand([(0.30000000000000004,), (0.0005,), (1000.001,), (-0.001,)])
+    def test_GIVEN_value_off_lattice_or_out_of_range_WHEN_index_THEN_value_error(self, value):
+        self.assertRaises(ValueError, LatticeRange(0, 0.001, 1000).index, value)
+
+    def test_GIVEN_same_setpoint_in_different_rows_WHEN_compared_THEN_points_hash_equal(self):
+        first_row = LatticeRange(0, 0.1, 1)
+        second_row = LatticeRange(0.25, 0.05, 0.5)
+        self.assertEqual(set(first_row) & set(second_row), {0.3, 0.4, 0.5})
+
+    def test_GIVEN_step_of_zero_WHEN_lattice_range_THEN_raises(self):
+        self.assertRaises(ZeroDivisionError, LatticeRange, 1, 0, 2)
+
+
+class TestDecimalPlaces(unittest.TestCase):
+    @parameterized.expand(
+        [((2.0,), 1), ((2,), 1), ((0.25, 1.5), 2), ((1e-05,), 5), ((1e16,), 0), ((3.5e-3, 1), 4)]
+    )
+    def test_GIVEN_values_WHEN_decimal_places_THEN_largest_number_of_places(self, values, places):
+        self.assertEqual(decimal_places(*values), places)
+
+
+class TestGeometricSteps(unittest.TestCase):
+    @parameterized.expand(
+        [
+            (1, 1000, 4, [1, 10, 100, 1000]),
+            (1000, 1, 4, [1000, 100, 10, 1]),
+            (-1, -1000, 4, [-1, -10, -100, -1000]),
+            (0, 100, 4, [0, 1, 10, 100]),
+            (100, 0, 4, [100, 10, 1, 0]),
+            (0, 100, 2, [0, 100]),
+            (5, 5, 3, [5]),
+            (1, 1000, 0, []),
+        ]
+    )
+    def test_GIVEN_range_WHEN_geometric_steps_THEN_inclusive_geometric_points(
+        self, start, stop, count, expected
+    ):
+        points = geometric_steps(start, stop, count)
+        np.testing.assert_allclose(points, expected)
+        self.assertEqual(len(points), count_geometric_steps(start, stop, count))
+        if len(points) > 0:
+            self.assertEqual(points[0], start)
+            self.assertEqual(points[-1], stop)
+
+    def test_GIVEN_many_points_WHEN_geometric_steps_THEN_constant_ratio(self):
+        points = geometric_steps(1, 5000, 100)
+        np.testing.assert_allclose(points[1:] / points[:-1], (5000 ** (1 / 99)))
+
+    @parameterized.expand([(-1, 10), (0, 0.5)])
+    def test_GIVEN_range_that_cannot_be_stepped_geometrically_WHEN_geometric_steps_THEN_raises(
+        self, start, stop
+    ):
+        self.assertRaises(ValueError, geometric_steps, start, stop, 5)
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_GIVEN_value_cached_WHEN_get_or_compute_again_THEN_hit_without_computing(self):
+        cache = LRUCache(max_weight=10)
+        compute = MagicMock(return_value="value")
+        self.assertEqual(cache.get_or_compute("key", compute), "value")
+        self.assertEqual(cache.get_or_compute("key", compute), "value")
+        compute.assert_called_once()
+        self.assertEqual(
+            cache.stats(), CacheStats(hits=1, misses=1, evictions=0, entries=1, weight=1)
+        )
+        self.assertEqual(cache.stats().hit_rate, 0.5)
+
+    def test_GIVEN_cache_over_weight_WHEN_put_THEN_least_recently_used_evicted(self):
+        cache = LRUCache(max_weight=5, weigh=len)
+        cache.put("a", [1, 2])
+        cache.put("b", [1, 2])
+        cache.get_or_compute("a", MagicMock())
+        cache.put("c", [1, 2])
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+        self.assertEqual(cache.stats().evictions, 1)
+        self.assertEqual(cache.stats().weight, 4)
+
+    def test_GIVEN_value_heavier_than_cache_WHEN_put_THEN_not_cached(self):
+        cache = LRUCache(max_weight=5, weigh=len)
+        cache.put("a", [1, 2])
+        cache.put("big", list(range(6)))
+        self.assertNotIn("big", cache)
+        self.assertIn("a", cache)
+
+    def test_GIVEN_max_entries_WHEN_put_more_THEN_oldest_evicted(self):
+        cache = LRUCache(max_weight=100, max_entries=2)
+        for key in "abc":
+            cache.put(key, key)
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn("a", cache)
+
+
+class TestCachedSteps(unittest.TestCase):
+    def setUp(self):
+        scan_cache.clear()
+
+    def test_GIVEN_scan_WHEN_cached_steps_THEN_same_points_as_get_steps_AND_read_only(self):
+        points = cached_steps(1, 0.3, 2)
+        self.assertEqual(list(points), list(get_steps(1, 0.3, 2)))
+        self.assertRaises(ValueError, points.__setitem__, 0, 5.0)
+
+    def test_GIVEN_same_scan_with_flipped_step_WHEN_cached_steps_THEN_shared_array_returned(self):
+        hits = scan_cache.stats().hits
+        points = cached_steps(2, 0.3, 1)
+        self.assertIs(cached_steps(2.0, -0.3, 1.0), points)
+        self.assertEqual(scan_cache.stats().hits, hits + 1)
+
+
+class TestGlobalParam(unittest.TestCase):
+    def setUp(self):
+        self.script_definition = MagicMock(global_params_definition={"Rate": ("110", int)})
+
+    def test_GIVEN_global_param_set_WHEN_global_param_THEN_cast_value_returned(self):
+        self.script_definition.global_params = {"Rate": "55"}
+        self.assertEqual(global_param(self.script_definition, "Rate"), 55)
+
+    def test_GIVEN_global_params_not_set_WHEN_global_param_THEN_cast_default_returned(self):
+        self.script_definition.global_params = None
+        self.assertEqual(global_param(self.script_definition, "Rate"), 110)
+
+    def test_GIVEN_invalid_global_param_WHEN_global_param_THEN_value_error(self):
+        self.script_definition.global_params = {"Rate": "fast"}
+        self.assertRaises(ValueError, global_param, self.script_definition, "Rate")
+
+
+class TestMemoiseRow(unittest.TestCase):
+    def setUp(self):
+        self.cache = LRUCache(max_weight=2)
+        self.version = 0
+        self.compute = MagicMock(side_effect=lambda **row: row["mevents"])
+
+        class Definition:
+            global_params = None
+
+            @memoise_row(lambda: self.version, cache=self.cache)
+            def estimate_time(definition, **row):
+                return self.compute(**row)
+
+        self.script_definition = Definition()
+
+    def test_GIVEN_same_row_WHEN_called_again_THEN_cached(self):
+        self.assertEqual(self.script_definition.estimate_time(mevents="5"), "5")
+        self.assertEqual(self.script_definition.estimate_time(mevents="5"), "5")
+        self.compute.assert_called_once()
+        self.assertEqual(self.cache.stats().hit_rate, 0.5)
+
+    def test_GIVEN_global_param_or_dependency_changed_WHEN_called_again_THEN_recomputed(self):
+        self.script_definition.estimate_time(mevents="5")
+        self.script_definition.global_params = {"Rate (Mev/hr)": "50"}
+        self.script_definition.estimate_time(mevents="5")
+        self.version += 1
+        self.script_definition.estimate_time(mevents="5")
+        self.assertEqual(self.compute.call_count, 3)
+
+    def test_GIVEN_more_rows_than_cache_holds_WHEN_called_THEN_bounded(self):
+        for mevents in "1234":
+            self.script_definition.estimate_time(mevents=mevents)
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.stats().evictions, 2)
+
+    def test_GIVEN_unhashable_parameter_WHEN_called_THEN_computed_without_caching(self):
+        self.assertEqual(self.script_definition.estimate_time(mevents=["5"]), ["5"])
+        self.assertEqual(len(self.cache), 0)
+
+    def test_GIVEN_mapping_returned_WHEN_caller_changes_it_THEN_cached_mapping_unchanged(self):
+        self.compute.side_effect = lambda **row: OrderedDict([("Runs", row["mevents"])])
+        estimate = self.script_definition.estimate_time(mevents="5")
+        estimate["x"] = "1"
+        again = self.script_definition.estimate_time(mevents="5")
+        self.assertEqual(again, OrderedDict([("Runs", "5")]))
+        self.assertIsInstance(again, OrderedDict)
+        self.compute.assert_called_once()
+
+    def test_GIVEN_row_WHEN_estimate_custom_changed_by_caller_THEN_next_call_unchanged(self):
+        row = dict(
+            start_temperature="1",
+            stop_temperature="3",
+            step_temperature="1",
+            start_field="keep",
+            stop_field="keep",
+            step_field="0",
+            custom="None",
+            mevents="10",
+            magnet_device="N/A",
+        )
+        script_definition = DoRun()
+        script_definition.estimate_custom(**row)["x"] = 1
+        self.assertNotIn("x", script_definition.estimate_custom(**row))
+
+    def test_GIVEN_rate_changed_WHEN_emu_default_estimate_time_THEN_estimate_changes(self):
+        script_definition = DoRunDefault()
+        row = dict(
+            start_temperature="keep",
+            stop_temperature="keep",
+            step_temperature="0",
+            start_field="keep",
+            stop_field="keep",
+            step_field="0",
+            custom="None",
+            mevents="10",
+            magnet_device="N/A",
+        )
+        script_definition.global_params = {"Rate (Mev/hr)": "100"}
+        slow = script_definition.estimate_time(**row)
+        script_definition.global_params = {"Rate (Mev/hr)": "200"}
+        self.assertLess(script_definition.estimate_time(**row), slow)
+        script_definition.global_params = {"Rate (Mev/hr)": "100"}
+        self.assertEqual(script_definition.estimate_time(**row), slow)
@@ -0,0 +1,238 @@
+import unittest
+
+from mock import MagicMock, patch
+from parameterized import parameterized
+
+import table_validation
+from data_volume import DataBudget
+from emu_default import DoRun as DoRunDefault
+from emu_logfields import DoRun as DoRunLogFields
+from emu_test_by_time import DoRun as DoRunTestByTime
+from emuloop import DoRun
+from emulooptime import DoRun as DoRunTime
+from script_utilities import row_cache
+from table_validation import TableValidation, revalidate_row, validate_row, validate_rows
+from validation_rules import Axis, Rule, RuleSet
+
+row = dict(
+    start_temperature="1",
+    stop_temperature="5",
+    step_temperature="1",
+    start_field="10",
+    stop_field="50",
+    step_field="10",
+    custom="None",
+    mevents="5",
+    magnet_device="LF",
+)
+
+
+class TestRuleDependencies(unittest.TestCase):
+    def test_GIVEN_emu_rules_WHEN_dependants_THEN_magnet_device_only_read_by_magnet_rules(self):
+        rules = DoRun.rules
+        codes = {rules.rules[index].code for index in rules.dependants["magnet_device"]}
+        self.assertEqual(
+            codes,
+            {
+                "magnet_unknown",
+                "zero_field_without_active_zf",
+                "non_zero_field_with_active_zf",
+                "kept_field_with_magnet",
+            },
+        )
+        self.assertNotIn("mevents", rules.dependants)
+        self.assertNotIn("custom", rules.dependants)
+
+    def test_GIVEN_changed_parameter_WHEN_revalidate_THEN_only_rules_reading_it_checked(self):
+        x_rule, y_rule = MagicMock(return_value=False), MagicMock(return_value=True)
+        rules = RuleSet(
+            [Axis("x", "start_x", "stop_x", "step_x"), Axis("y", "start_y", "stop_y", "step_y")],
+            [Rule("x", (), "x", x_rule, "x\n"), Rule("y", (), "y", y_rule, "y\n")],
+        )
+        parameters = dict(start_x=1.0, stop_x=2.0, step_x=1.0, start_y=1.0, stop_y=2.0, step_y=1.0)
+        previous = rules.check(**parameters)
+        x_rule.reset_mock()
+        y_rule.reset_mock()
+        y_rule.return_value = False
+        validation = rules.revalidate(previous, ["stop_y"], **dict(parameters, stop_y=3.0))
+        x_rule.assert_not_called()
+        self.assertEqual(y_rule.call_count, 1)
+        self.assertEqual(validation.errors, [])
+        self.assertIs(rules.revalidate(validation, ["other"], **parameters), validation)
+
+
+class TestRevalidateRow(unittest.TestCase):
+    def setUp(self):
+        self.script_definition = DoRun()
+        row_cache.clear()
+        self.addCleanup(row_cache.clear)
+
+    def revalidate(self, previous, **changes):
+        return revalidate_row(
+            self.script_definition, previous, list(changes), dict(previous.row, **changes)
+        )
+
+    def test_GIVEN_magnet_edited_WHEN_revalidate_row_THEN_data_budget_not_checked_again(self):
+        previous = validate_row(self.script_definition, row)
+        with patch.object(
+            self.script_definition, "check_row_data_budget", return_value=""
+        ) as check_row_data_budget:
+            self.assertIsNone(self.revalidate(previous, magnet_device="TF").reason)
+            check_row_data_budget.assert_not_called()
+            self.revalidate(previous, mevents="10")
+            check_row_data_budget.assert_called_once()
+
+    def test_GIVEN_mevents_edited_WHEN_revalidate_row_THEN_rules_not_checked_again(self):
+        previous = validate_row(self.script_definition, row)
+        with patch.object(DoRun.rules, "_compiled", ()):
+            validation = self.revalidate(previous, mevents="10")
+        self.assertIs(validation.rules, previous.rules)
+
+    @parameterized.expand(
+        [
+            (dict(magnet_device="ZF"),),
+            (dict(start_field="keep"),),
+            (dict(step_temperature="0", step_field="-1"),),
+            (dict(mevents="nonsense", step_field="x"),),
+            (dict(mevents="100000"),),
+        ]
+    )
+    def test_GIVEN_edit_WHEN_revalidate_row_THEN_reason_of_parameters_valid(self, changes):
+        validation = self.revalidate(validate_row(self.script_definition, row), **changes)
+        self.assertEqual(
+            validation.reason, self.script_definition.parameters_valid(**dict(row, **changes))
+        )
+        # And back again
+        self.assertIsNone(
+            self.revalidate(validation, **{name: row[name] for name in changes}).reason
+        )
+
+    def test_GIVEN_missing_parameter_WHEN_validate_row_THEN_reason_of_parameters_valid(self):
+        partial = dict(row)
+        del partial["mevents"]
+        self.assertEqual(
+            validate_row(self.script_definition, partial).reason,
+            self.script_definition.parameters_valid(**partial),
+        )
+
+
+class TestTableValidation(unittest.TestCase):
+    def setUp(self):
+        row_cache.clear()
+        self.addCleanup(row_cache.clear)
+
+    def test_GIVEN_table_WHEN_rows_edited_THEN_reasons_of_parameters_valid(self):
+        script_definition = DoRun()
+        rows = [row, dict(row, magnet_device="ZF"), dict(row, start_temperature="keep")]
+        table = TableValidation(script_definition, rows)
+        self.assertEqual(
+            table.reasons, [script_definition.parameters_valid(**each) for each in rows]
+        )
+        self.assertIsNone(table.update_row(1, row))
+        self.assertIsNotNone(table.insert_row(0, dict(row, step_field="0", start_field="1")))
+        table.remove_row(3)
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.reasons[1:], [None, None])
+
+    def test_GIVEN_log_fields_table_WHEN_refresh_THEN_rows_validated_again(self):
+        log_row = dict(row, n_fields="3", start_field="0", stop_field="0.5", magnet_device="LF")
+        del log_row["step_field"]
+        table = TableValidation(DoRunLogFields(), [log_row])
+        self.assertEqual(table.reasons, [DoRunLogFields().parameters_valid(**log_row)])
+        table.refresh()
+        self.assertIn("logarithmic", table.reasons[0])
+
+
+# Edits of row breaking rules, casts, the data budget or nothing
+row_edits = [
+    dict(),
+    dict(magnet_device="ZF"),
+    dict(magnet_device="N/A"),
+    dict(magnet_device="bogus"),
+    dict(start_field="0", stop_field="0"),
+    dict(start_field="0", stop_field="0", magnet_device="ZF"),
+    dict(start_field="keep"),
+    dict(start_field="keep", stop_field="keep"),
+    dict(start_field="keep", stop_field="keep", magnet_device="N/A"),
+    dict(start_temperature="keep", stop_temperature="keep"),
+    dict(stop_temperature="keep", step_field="0"),
+    dict(step_temperature="0", step_field="-1"),
+    dict(step_temperature="-1", start_temperature="5", stop_temperature="5"),
+    dict(start_field="-50", stop_field="50"),
+    dict(start_field="0", stop_field="0.5"),
+    dict(mevents="nonsense", step_field="x"),
+    dict(start_temperature="", magnet_device="ZF"),
+    dict(mevents="100000"),
+]
+
+
+def definition_rows(definition):
+    rows = [dict(row, **edit) for edit in row_edits]
+    if definition is DoRunLogFields:
+        for each in rows:
+            each["n_fields"] = "0" if each.pop("step_field") == "-1" else "3"
+    elif definition is DoRunTestByTime:
+        for each in rows:
+            each["Run_Time_Mins"] = each.pop("mevents")
+    missing = dict(rows[0])
+    del missing["magnet_device"]
+    return rows + [missing]
+
+
+class TestValidateRows(unittest.TestCase):
+    def setUp(self):
+        row_cache.clear()
+        self.addCleanup(row_cache.clear)
+
+    @parameterized.expand(
+        [(DoRun,), (DoRunTime,), (DoRunLogFields,), (DoRunTestByTime,), (DoRunDefault,)]
+    )
+    def test_GIVEN_table_WHEN_validate_table_THEN_reasons_of_parameters_valid(self, definition):
+        script_definition = definition()
+        rows = definition_rows(definition)
+        reasons = script_definition.validate_table(rows)
+        self.assertEqual(reasons, [script_definition.parameters_valid(**each) for each in rows])
+        self.assertIsNone(reasons[0])
+        self.assertEqual(script_definition.validate_table([]), [])
+
+    @parameterized.expand([(DoRun,), (DoRunTestByTime,)])
+    def test_GIVEN_small_data_budget_WHEN_validate_table_THEN_reasons_of_parameters_valid(
+        self, definition
+    ):
+        script_definition = definition()
+        rows = definition_rows(definition)
+        with patch.dict("data_volume.data_budgets", {"EMU": DataBudget(1e-3)}):
+            reasons = script_definition.validate_table(rows)
+            self.assertEqual(reasons, [script_definition.parameters_valid(**each) for each in rows])
+        self.assertIn("can write and archive", reasons[0])
+
+    def test_GIVEN_row_with_unknown_parameter_WHEN_validate_rows_THEN_key_error(self):
+        with self.assertRaises(KeyError):
+            validate_rows(DoRun(), [row, dict(row, unknown="1")])
+
+    def test_GIVEN_rows_WHEN_validate_rows_THEN_rules_checked_for_all_rows_at_once(self):
+        script_definition = DoRun()
+        with patch.object(DoRun.rules, "reasons", wraps=DoRun.rules.reasons) as reasons:
+            validate_rows(script_definition, [row, dict(row, magnet_device="ZF"), row])
+        reasons.assert_called_once()
+
+    def test_GIVEN_two_thousand_rows_WHEN_validate_table_THEN_each_distinct_value_cast_once(self):
+        script_definition = DoRun()
+        rows = [dict(row, start_temperature=str(index % 300)) for index in range(2000)]
+        with (
+            patch.object(
+                table_validation, "cast_value", wraps=table_validation.cast_value
+            ) as cast_value,
+            patch.object(DoRun.rules, "reasons", wraps=DoRun.rules.reasons) as reasons_of_rows,
+            patch.object(DoRun.rules, "reason", wraps=DoRun.rules.reason) as reason_of_row,
+        ):
+            reasons = script_definition.validate_table(rows)
+        # 300 start temperatures and one value of each of the other 8 parameters
+        self.assertEqual(cast_value.call_count, 300 + 8)
+        reasons_of_rows.assert_called_once()
+        reason_of_row.assert_not_called()
+        self.assertEqual(reasons, [None] * 2000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,245 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from mock import patch
+from parameterized import parameterized
+
+import timeline
+from beam_rate import BeamSchedule, nominal_current
+from cost_model import CostModel
+from emu_logfields import DoRun as DoRunLogFields
+from emu_test_by_time import DoRun as DoRunByTime
+from emuloop import DoRun
+from plan_optimiser import TransitionCosts
+from scan_plan import ScanPlan
+from timeline import RowPlan, StepKind, Timeline, row_steps
+
+cost_model = CostModel(
+    transitions=TransitionCosts(warming_rate=1.0, cooling_rate=0.1, field_ramp_rate=10.0),
+    event_rate=0.5,
+    run_overhead=3.0,
+    magnet_switch=60.0,
+)
+
+loop_row = dict(
+    start_temperature="1",
+    stop_temperature="3",
+    step_temperature="1",
+    start_field="10",
+    stop_field="10",
+    step_field="0",
+    custom="None",
+    mevents="5",
+    magnet_device="LF",
+)
+rows = [
+    loop_row,
+    dict(
+        loop_row,
+        start_temperature="keep",
+        stop_temperature="keep",
+        start_field="20",
+        stop_field="20",
+    ),
+    dict(loop_row, mevents="lots"),
+    dict(loop_row, start_field="10", stop_field="30", step_field="10"),
+]
+
+
+def assert_steps_equal(first, second):
+    for name in first.dtype.names:
+        np.testing.assert_allclose(first[name], second[name], err_msg=name)
+
+
+class TestRowSteps(unittest.TestCase):
+    def test_GIVEN_plan_WHEN_row_steps_THEN_set_and_count_steps_take_estimate(self):
+        plan = ScanPlan.from_axes([1.0, 2.0], [0.0, 10.0], 4)
+        steps = row_steps(RowPlan(plan, cost_model, magnet_switches=1), row=3)
+        self.assertEqual(
+            list(steps["kind"]),
+            [StepKind.SWITCH] + [StepKind.SET, StepKind.COUNT] * 4,
+        )
+        np.testing.assert_array_equal(steps["row"], 3)
+        np.testing.assert_array_equal(steps["start"][1:], steps["end"][:-1])
+        self.assertAlmostEqual(steps["end"][-1], cost_model.estimate(plan, 1).total)
+        np.testing.assert_array_equal(steps["temperature"][1::2], [1.0, 1.0, 2.0, 2.0])
+        np.testing.assert_array_equal(steps["mevents"][1:], [0.0, 4.0] * 4)
+
+    def test_GIVEN_count_seconds_WHEN_row_steps_THEN_counts_without_mevents(self):
+        plan = ScanPlan.from_axes(None, None, 1)
+        steps = row_steps(RowPlan(plan, cost_model, count_seconds=60.0))
+        self.assertEqual(list(steps["kind"]), [StepKind.COUNT])
+        self.assertTrue(np.isnan(steps["mevents"][0]))
+        self.assertEqual(steps["end"][0], 63.0)
+
+
+class TestTimeline(unittest.TestCase):
+    def setUp(self):
+        self.timeline = Timeline(DoRun(), rows, start=1000.0)
+
+    def test_GIVEN_rows_WHEN_timeline_THEN_rows_follow_each_other_for_their_estimates(self):
+        steps = self.timeline.steps
+        self.assertEqual(steps["start"][0], 1000.0)
+        np.testing.assert_allclose(steps["start"][1:], steps["end"][:-1])
+        estimates = [DoRun().estimate_time(**row) for row in rows if row is not rows[2]]
+        self.assertAlmostEqual(self.timeline.end, 1000.0 + sum(estimates), places=6)
+        for index in (0, 1, 3):
+            row_steps = self.timeline.row_steps(index)
+            np.testing.assert_array_equal(row_steps["row"], index)
+            self.assertAlmostEqual(
+                row_steps["end"][-1] - row_steps["start"][0],
+                DoRun().estimate_time(**rows[index]),
+                places=6,
+            )
+
+    def test_GIVEN_invalid_row_WHEN_timeline_THEN_error_and_no_steps(self):
+        self.assertEqual([error is None for error in self.timeline.errors], [1, 1, 0, 1])
+        self.assertEqual(len(self.timeline.row_steps(2)), 0)
+
+    @parameterized.expand(
+        [
+            ("zero step", dict(loop_row, stop_temperature="5", step_temperature="0")),
+            ("not a number", dict(loop_row, start_temperature="nan")),
+            ("zero field without zero field magnet", dict(loop_row, start_field="0")),
+            ("too many points", dict(loop_row, step_temperature="1e-300")),
+        ]
+    )
+    def test_GIVEN_row_breaking_rules_WHEN_timeline_THEN_error_and_rest_planned(self, _, row):
+        script_timeline = Timeline(DoRun(), [loop_row, row, loop_row], start=0.0)
+        self.assertEqual([error is None for error in script_timeline.errors], [1, 0, 1])
+        self.assertEqual(len(script_timeline.row_steps(1)), 0)
+        expected = Timeline(DoRun(), [loop_row, loop_row], start=0.0)
+        fields = ["start", "end", "kind"]
+        assert_steps_equal(script_timeline.steps[fields], expected.steps[fields])
+
+    @parameterized.expand([(DoRun,), (DoRunByTime,), (DoRunLogFields,)])
+    def test_GIVEN_zero_step_WHEN_timeline_THEN_error_of_parameters_valid(self, definition):
+        row = dict(loop_row, stop_temperature="5", step_temperature="0")
+        if definition is DoRunByTime:
+            row["Run_Time_Mins"] = row.pop("mevents")
+        elif definition is DoRunLogFields:
+            row["n_fields"] = row.pop("step_field")
+        script_timeline = Timeline(definition(), [row], start=0.0)
+        self.assertEqual(script_timeline.errors, [definition().parameters_valid(**row)])
+
+    @parameterized.expand(
+        [
+            ("update", lambda t: t.update_row(1, dict(loop_row, stop_temperature="5"))),
+            ("update invalid", lambda t: t.update_row(0, rows[2])),
+            ("update to valid", lambda t: t.update_row(2, loop_row)),
+            ("insert", lambda t: t.insert_row(0, dict(loop_row, mevents="1"))),
+            ("insert at end", lambda t: t.insert_row(4, loop_row)),
+            ("remove", lambda t: t.remove_row(1)),
+            ("remove last", lambda t: t.remove_row(3)),
+        ]
+    )
+    def test_GIVEN_row_changed_WHEN_timeline_changed_THEN_same_as_new_timeline(self, _, change):
+        change(self.timeline)
+        expected = Timeline(DoRun(), self.timeline.rows, start=1000.0)
+        assert_steps_equal(self.timeline.steps, expected.steps)
+        self.assertAlmostEqual(self.timeline.end, expected.end)
+        self.assertEqual(self.timeline.errors, expected.errors)
+
+    def test_GIVEN_row_changed_WHEN_update_row_THEN_only_that_row_planned(self):
+        with patch.object(
+            DoRun, "get_row_plan", wraps=self.timeline.script_definition.get_row_plan
+        ) as get_row_plan:
+            self.timeline.update_row(1, loop_row)
+        get_row_plan.assert_called_once()
+
+    def test_GIVEN_zero_field_points_WHEN_logfields_timeline_THEN_magnet_switch_step(self):
+        row = dict(loop_row, start_field="0", stop_field="100", n_fields="3")
+        del row["step_field"]
+        steps = Timeline(DoRunLogFields(), [row], start=0.0).steps
+        self.assertEqual(steps["kind"][0], StepKind.SWITCH)
+        self.assertAlmostEqual(steps["end"][-1], DoRunLogFields().estimate_time(**row), places=6)
+
+
+class TestTimelineWithBeam(unittest.TestCase):
+    def setUp(self):
+        # Beam off for the first two hours of the script
+        schedule = BeamSchedule([0.0, 7200.0], [0.0, nominal_current])
+        get_schedule = patch("timeline.get_beam_schedule", return_value=schedule)
+        get_schedule.start()
+        self.addCleanup(get_schedule.stop)
+
+    def test_GIVEN_beam_off_WHEN_timeline_THEN_counts_wait_for_beam(self):
+        steps = Timeline(DoRun(), rows, start=0.0).steps
+        counts = steps[steps["kind"] == StepKind.COUNT]
+        self.assertGreater(counts["end"][0], 7200.0)
+        self.assertGreater(steps["end"][-1], 7200.0 + DoRun().estimate_time(**loop_row))
+
+    def test_GIVEN_counting_for_time_WHEN_timeline_THEN_beam_not_waited_for(self):
+        row = dict(loop_row, Run_Time_Mins="1")
+        del row["mevents"]
+        end = Timeline(DoRunByTime(), [row], start=0.0).end
+        self.assertAlmostEqual(end, DoRunByTime().estimate_time(**row), places=6)
+
+    def test_GIVEN_row_changed_WHEN_update_row_THEN_later_rows_counted_again(self):
+        beam_timeline = Timeline(DoRun(), rows, start=0.0)
+        beam_timeline.update_row(0, dict(loop_row, mevents="500"))
+        expected = Timeline(DoRun(), beam_timeline.rows, start=0.0)
+        assert_steps_equal(beam_timeline.steps, expected.steps)
+
+
+class TestTimelineExport(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.timeline = Timeline(DoRun(), [loop_row], start=0.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_GIVEN_timeline_WHEN_write_csv_THEN_header_and_a_line_per_step(self):
+        output = io.StringIO()
+        self.timeline.write_csv(output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(lines[0], "row,action,start,end,seconds,temperature,field,mevents")
+        self.assertEqual(len(lines), 1 + len(self.timeline.steps))
+        self.assertTrue(lines[2].startswith("0,count,"))
+
+    def test_GIVEN_timeline_WHEN_write_json_THEN_records_of_steps(self):
+        output = io.StringIO()
+        self.timeline.write_json(output)
+        records = json.loads(output.getvalue())
+        self.assertEqual(records, self.timeline.records())
+        self.assertEqual(records[1]["action"], "count")
+        self.assertEqual(records[1]["mevents"], 5.0)
+
+    def test_GIVEN_script_file_with_rule_breaking_row_WHEN_main_THEN_row_reported(self):
+        path = os.path.join(self.directory, "script.json")
+        with open(path, "w") as script_file:
+            zero_step = dict(loop_row, stop_temperature="5", step_temperature="0")
+            json.dump({"values": [loop_row, zero_step], "global_params": None}, script_file)
+        output = io.StringIO()
+        with patch("sys.stderr", io.StringIO()) as errors:
+            status = timeline.main(["emuloop", path, "--format", "csv"], output)
+        self.assertEqual(status, 1)
+        self.assertIn(
+            "Row 1: Cannot step through temperatures when step is zero", errors.getvalue()
+        )
+        self.assertEqual(len(output.getvalue().splitlines()), 1 + len(self.timeline.steps))
+
+    def test_GIVEN_script_file_WHEN_main_THEN_timeline_printed(self):
+        path = os.path.join(self.directory, "script.json")
+        with open(path, "w") as script_file:
+            json.dump({"values": [loop_row, rows[2]], "global_params": None}, script_file)
+        output = io.StringIO()
+        with patch("sys.stderr", io.StringIO()) as errors:
+            status = timeline.main(
+                ["emuloop", path, "--start", "2026-10-18T09:00", "--format", "json"], output
+            )
+        self.assertEqual(status, 1)
+        self.assertIn("Row 1:", errors.getvalue())
+        records = json.loads(output.getvalue())
+        self.assertEqual(records[0]["start"], "2026-10-18T09:00:00")
+        self.assertEqual(len(records), len(self.timeline.steps))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,207 @@
+import math
+import unittest
+import warnings
+
+from parameterized import parameterized
+
+from emu_default import DoRun as DoRunDefault
+from emu_logfields import DoRun as DoRunLogFields
+from emu_test_by_time import DoRun as DoRunByTime
+from emuloop import DoRun, magnet_devices, magnet_not_applicable
+from emulooptime import DoRun as DoRunTime
+from validation_rules import Axis, Rule, RuleSet, ValidationError, emu_rules, render
+
+valid_row = dict(
+    start_temperature=1.0,
+    stop_temperature=5.0,
+    step_temperature=1.0,
+    start_field=10.0,
+    stop_field=50.0,
+    step_field=10.0,
+    magnet_device="Danfysik",
+)
+
+
+class TestRuleSet(unittest.TestCase):
+    def setUp(self):
+        self.rules = emu_rules(magnet_devices, "Active ZF", magnet_not_applicable)
+
+    def test_GIVEN_valid_row_WHEN_validate_THEN_no_errors(self):
+        self.assertEqual(self.rules.validate(**valid_row), [])
+        self.assertEqual(self.rules.reason(**valid_row), "")
+
+    @parameterized.expand(
+        [
+            (
+                dict(stop_temperature=None),
+                "keep_together",
+                ("start_temperature", "stop_temperature"),
+            ),
+            (dict(start_temperature=math.nan), "not_finite", None),
+            (
+                dict(step_field=math.inf),
+                "not_finite",
+                ("start_field", "stop_field", "step_field"),
+            ),
+            (dict(step_field=0.0), "step_zero", ("step_field",)),
+            (dict(step_temperature=-1.0), "step_negative", ("step_temperature",)),
+            (dict(magnet_device="N/A"), "magnet_unknown", ("magnet_device",)),
+            (dict(magnet_device="Active ZF"), "non_zero_field_with_active_zf", None),
+            (dict(start_field=0.0), "zero_field_without_active_zf", None),
+            (dict(start_field=None, stop_field=None), "kept_field_with_magnet", None),
+        ]
+    )
+    def test_GIVEN_row_breaking_rule_WHEN_validate_THEN_error_with_code_and_fields(
+        self, changes, code, fields
+    ):
+        errors = self.rules.validate(**dict(valid_row, **changes))
+        self.assertEqual([error.code for error in errors], [code])
+        if fields is not None:
+            self.assertEqual(errors[0].fields, fields)
+
+    def test_GIVEN_row_breaking_rules_WHEN_reason_THEN_messages_in_order_of_rules(self):
+        row = dict(valid_row, stop_temperature=None, step_field=0.0, magnet_device="N/A")
+        self.assertEqual(
+            self.rules.reason(**row),
+            "If start temperature or stop temperature is keep, the other must also be keep\n"
+            "Cannot step through fields when step is zero\n"
+            f"Field set but magnet devices N/A not in possible devices "
+            f"{list(magnet_devices.keys())}\n",
+        )
+
+    def test_GIVEN_log_field_rules_WHEN_validate_THEN_log_range_checked_and_zero_field_not(self):
+        rules = DoRunLogFields.rules
+        row = dict(valid_row, start_field=0.0, stop_field=0.5, n_fields=3)
+        del row["step_field"]
+        self.assertEqual([error.code for error in rules.validate(**row)], ["log_from_zero"])
+
+    def test_GIVEN_declared_rule_WHEN_validate_THEN_message_formatted_with_parameters(self):
+        axis = Axis("x", "start_x", "stop_x", "step_x")
+        rules = RuleSet(
+            [axis],
+            [Rule("too_big", ("stop_x",), "x", lambda facts, _: facts.stop > 1, "{stop_x} > 1")],
+        )
+        errors = rules.validate(start_x=0.0, stop_x=2.0, step_x=1.0)
+        self.assertEqual(errors, [ValidationError("too_big", ("stop_x",), "2.0 > 1")])
+        self.assertEqual(render(errors), "2.0 > 1")
+
+    def test_GIVEN_rows_WHEN_reasons_THEN_reason_of_each_row(self):
+        rows = [
+            valid_row,
+            dict(valid_row, stop_temperature=None, step_field=0.0, magnet_device="N/A"),
+            dict(valid_row, start_field=0.0, stop_field=0.0),
+            dict(valid_row, start_field=None, stop_field=None),
+            dict(valid_row, start_field=math.nan, magnet_device="Active ZF"),
+            dict(valid_row, stop_temperature=math.inf, step_field=math.nan),
+        ]
+        columns = {name: [each[name] for each in rows] for name in valid_row}
+        self.assertEqual(
+            self.rules.reasons(**columns), [self.rules.reason(**each) for each in rows]
+        )
+
+    def test_GIVEN_log_scans_with_nan_WHEN_check_columns_THEN_as_each_row_checked(self):
+        rules = DoRunLogFields.rules
+        ends = [(0.0, math.nan), (math.nan, 0.0), (0.0, 0.5), (-1.0, 2.0), (0.0, 5.0)]
+        columns = dict(
+            {name: [valid_row[name]] * len(ends) for name in valid_row if name != "step_field"},
+            start_field=[start for start, _ in ends],
+            stop_field=[stop for _, stop in ends],
+            n_fields=[3] * len(ends),
+        )
+        rows = [
+            {name: values[index] for name, values in columns.items()} for index in range(len(ends))
+        ]
+        self.assertEqual(rules.reasons(**columns), [rules.reason(**each) for each in rows])
+
+    def test_GIVEN_log_scans_of_infinity_and_zero_WHEN_check_columns_THEN_no_runtime_warning(self):
+        rules = DoRunLogFields.rules
+        ends = [(math.inf, 0.0), (0.0, -math.inf), (math.inf, -1.0)]
+        columns = dict(
+            {name: [valid_row[name]] * len(ends) for name in valid_row if name != "step_field"},
+            start_field=[start for start, _ in ends],
+            stop_field=[stop for _, stop in ends],
+            n_fields=[3] * len(ends),
+        )
+        rows = [
+            {name: values[index] for name, values in columns.items()} for index in range(len(ends))
+        ]
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", RuntimeWarning)
+            reasons = rules.reasons(**columns)
+        self.assertEqual(reasons, [rules.reason(**each) for each in rows])
+        self.assertIn("opposite sign", reasons[2])
+
+    def test_GIVEN_rule_without_mask_WHEN_check_columns_THEN_checked_for_each_row(self):
+        axis = Axis("x", "start_x", "stop_x", "step_x")
+        rules = RuleSet(
+            [axis],
+            [Rule("too_big", ("stop_x",), "x", lambda facts, _: facts.stop > 1, "{stop_x} > 1\n")],
+        )
+        columns = dict(start_x=[0.0, 0.0], stop_x=[2.0, 1.0], step_x=[1.0, 1.0])
+        self.assertEqual(rules.check_columns(**columns).tolist(), [[True, False]])
+        self.assertEqual(rules.reasons(**columns), ["2.0 > 1\n", ""])
+
+    def test_GIVEN_rule_of_unknown_axis_WHEN_rule_set_declared_THEN_key_error(self):
+        with self.assertRaises(KeyError):
+            RuleSet([], [Rule("code", (), "x", lambda facts, _: True, "")])
+
+    def test_GIVEN_definition_WHEN_parameters_valid_THEN_reason_of_rules(self):
+        row = {key: str(value) for key, value in valid_row.items()}
+        row.update(custom="None", mevents="1", magnet_device="ZF")
+        self.assertEqual(
+            DoRun().parameters_valid(**row),
+            "Cannot set a non-zero field with the active zero field\n",
+        )
+
+
+class TestDefinitionChecks(unittest.TestCase):
+    @parameterized.expand(
+        [
+            (definition, row)
+            for definition in (DoRun, DoRunTime, DoRunDefault, DoRunLogFields, DoRunByTime)
+            for row in (
+                valid_row,
+                dict(valid_row, start_temperature=None, step_field=0.0),
+                dict(valid_row, stop_field=None, step_temperature=-1.0),
+                dict(valid_row, start_field=None, stop_field=None, magnet_device="N/A"),
+                dict(valid_row, start_field=0.0, stop_field=0.0, magnet_device="Bad"),
+                dict(valid_row, start_field=20.0, stop_field=20.0, magnet_device="Active ZF"),
+                dict(valid_row, start_field=0.0, stop_field=50.0, step_field=-1.0),
+            )
+        ]
+    )
+    def test_GIVEN_row_WHEN_check_methods_THEN_reason_of_rules_in_order(self, definition, row):
+        script_definition = definition()
+        parameters = dict(row)
+        if definition is DoRunLogFields:
+            parameters["n_fields"] = parameters.pop("step_field")
+        temperature = (row["start_temperature"], row["stop_temperature"])
+        field = (row["start_field"], row["stop_field"])
+        reason = (
+            script_definition.check_start_and_stop_valid(*temperature, "temperature")
+            + script_definition.check_start_and_stop_valid(*field, "field")
+            + script_definition.check_step_set_correctly(
+                *temperature, row["step_temperature"], "temperature"
+            )
+            + script_definition.check_step_set_correctly(*field, row["step_field"], "field")
+            + script_definition.check_magnet_selected_correctly(*field, row["magnet_device"])
+            + script_definition.check_if_start_or_stop_field_are_keep_then_magnet_is_na(
+                *field, row["magnet_device"]
+            )
+        )
+        self.assertEqual(reason, script_definition.rules.reason(**parameters))
+
+    def test_GIVEN_scan_of_zero_step_WHEN_check_step_set_correctly_THEN_reason(self):
+        self.assertEqual(
+            DoRunDefault().check_step_set_correctly(1.0, 2.0, 0.0, "field"),
+            "Cannot step through fields when step is zero\n",
+        )
+        self.assertEqual(DoRunDefault().check_step_set_correctly(1.0, 1.0, 0.0, "field"), "")
+
+    def test_GIVEN_unknown_axis_WHEN_check_start_and_stop_valid_THEN_key_error(self):
+        with self.assertRaises(KeyError):
+            DoRun().check_start_and_stop_valid(1.0, None, "pressure")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,408 @@
+import argparse
+import csv
+import importlib
+import json
+import sys
+import time
+from datetime import datetime
+from enum import IntEnum
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Sequence, TextIO, Union
+
+import numpy as np
+
+from beam_rate import get_beam_schedule
+from cast_row import CastRow, cast_row
+from cost_model import CostModel
+from scan_plan import ScanAction, ScanPlan
+
+
+class RowPlan(NamedTuple):
+    """
+    What one row of a script does and how long the instrument takes to do it, as returned by the
+    get_row_plan method of the EMU script definitions.
+    """
+
+    plan: ScanPlan
+    cost_model: CostModel
+    magnet_switches: int = 0
+    count_seconds: Optional[float] = None  # if each run counts for a time rather than for mevents
+
+
+def plan_row(script_definition: Any, row: Union[Mapping[str, str], CastRow]) -> Union[RowPlan, str]:
+    """
+    Plan a row only if it can be cast and keeps the rules of its definition, as a row that breaks
+    them (e.g. one stepping by zero) cannot be planned.
+
+    Parameters:
+      script_definition (ScriptDefinition): the definition of the row, with parameter_casters,
+        rules and a get_row_plan method
+      row (Union[Mapping[str, str], CastRow]): the raw parameters of the row, or the row cast
+
+    Returns:
+      Union[RowPlan, str]: The plan of the row, or why it cannot be planned.
+    """
+    if not isinstance(row, CastRow):
+        row = cast_row(script_definition.parameter_casters, row)
+    if row.reason is not None:
+        return row.reason
+    reason = script_definition.rules.reason(**row.parameters)
+    if reason:
+        return reason
+    try:
+        return script_definition.get_row_plan(row)
+    except (ArithmeticError, ValueError, MemoryError) as error:
+        # e.g. a scan of more points than can be held
+        return f"Cannot plan the row: {error}\n"
+
+
+class StepKind(IntEnum):
+    """
+    What a step of a timeline does.
+    SWITCH means select a different magnet device, the switches of a row are all at its start.
+    SET means ramp and settle the temperature and field to a point.
+    COUNT means do a run at a point.
+    """
+
+    SWITCH = 0
+    SET = 1
+    COUNT = 2
+
+
+# A step of a timeline, the temperature and field are NaN where they are not set and mevents is
+# NaN where a run counts for a time
+step_dtype = np.dtype(
+    [
+        ("row", np.int32),
+        ("kind", np.uint8),
+        ("start", np.float64),
+        ("end", np.float64),
+        ("temperature", np.float64),
+        ("field", np.float64),
+        ("mevents", np.float64),
+    ]
+)
+
+
+def row_steps(row_plan: RowPlan, row: int = 0) -> np.ndarray:
+    """
+    Lay the points of a row out as steps from the start of the row, counting at the event rate of
+    its cost model. A point that is not set and takes no time to reach has no set step.
+
+    Parameters:
+      row_plan (RowPlan): the plan of the row
+      row (int): the index of the row in its script
+
+    Returns:
+      np.ndarray: The steps of the row with dtype step_dtype.
+    """
+    plan, cost_model = row_plan.plan, row_plan.cost_model
+    times = cost_model.point_times(plan, row_plan.count_seconds)
+    # Each point is a set step and a count step, in that order
+    durations = np.stack(
+        (times["ramp"] + times["settle"], times["count"] + times["overhead"]), axis=1
+    ).ravel()
+    setting = (durations[::2] > 0) | (
+        (plan.actions & (ScanAction.SET_TEMPERATURE | ScanAction.SET_FIELD)) != 0
+    )
+    kept = np.stack((setting, (plan.actions & ScanAction.COUNT) != 0), axis=1).ravel()
+    points = np.repeat(np.arange(len(plan)), 2)[kept]
+    kinds = np.tile([StepKind.SET, StepKind.COUNT], len(plan))[kept]
+    durations = durations[kept]
+    switching = row_plan.magnet_switches > 0
+    steps = np.zeros(len(points) + switching, dtype=step_dtype)
+    steps["row"] = row
+    if switching:
+        steps["kind"][0] = StepKind.SWITCH
+        steps["temperature"][0] = steps["field"][0] = steps["mevents"][0] = np.nan
+        durations = np.concatenate(
+            ([row_plan.magnet_switches * cost_model.magnet_switch], durations)
+        )
+    points_steps = steps[int(switching) :]
+    points_steps["kind"] = kinds
+    points_steps["temperature"] = plan.temperatures[points]
+    points_steps["field"] = plan.fields[points]
+    counting = kinds == StepKind.COUNT
+    points_steps["mevents"] = np.where(
+        counting, np.nan if row_plan.count_seconds is not None else plan.mevents[points], 0.0
+    )
+    steps["end"] = np.cumsum(durations)
+    steps["start"] = steps["end"] - durations
+    return steps
+
+
+class Timeline:
+    """
+    The steps a script is projected to take, in order, with the time each starts and ends at.
+
+    The steps of every row are held in one array. The steps of each row from the start of the row
+    are kept, so changing a row only replans that row and moves the steps after it. If there is a
+    beam schedule (see beam_rate) the runs after a changed row are also counted again from the
+    schedule, as how long they take depends on when they start.
+    """
+
+    def __init__(
+        self,
+        script_definition: Any,
+        rows: Sequence[Mapping[str, str]] = (),
+        start: Optional[float] = None,
+    ) -> None:
+        """
+        Parameters:
+          script_definition (ScriptDefinition): the definition of the rows (see plan_row) with its
+            global_params set
+          rows (Sequence[Mapping[str, str]]): the raw parameters of each row
+          start (float): the time the script starts (seconds since the epoch), now if None
+        """
+        self.script_definition = script_definition
+        self.start = time.time() if start is None else start
+        self.rows: List[Mapping[str, str]] = []
+        # Why each row has no steps, or None if it has them
+        self.errors: List[Optional[str]] = []
+        self._row_plans: List[Optional[RowPlan]] = []
+        # The steps of each row timed from the start of the row and from the start of the script
+        self._relative = np.zeros(0, dtype=step_dtype)
+        self._steps = np.zeros(0, dtype=step_dtype)
+        # The index of the first step of each row and the number of steps
+        self._offsets = np.zeros(1, dtype=np.int64)
+        # When each row starts and the script ends
+        self._row_starts = np.array([self.start])
+        for row in rows:
+            self._splice(len(self.rows), 0, row)
+        self._time_from(0)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def steps(self) -> np.ndarray:
+        """
+        Returns:
+          np.ndarray: Every step of the script with dtype step_dtype.
+        """
+        return self._steps
+
+    @property
+    def end(self) -> float:
+        """
+        Returns:
+          float: The time the script is projected to end at (seconds since the epoch).
+        """
+        return float(self._row_starts[-1])
+
+    def row_steps(self, index: int) -> np.ndarray:
+        """
+        Parameters:
+          index (int): the index of the row
+
+        Returns:
+          np.ndarray: The steps of the row with dtype step_dtype.
+        """
+        return self._steps[self._offsets[index] : self._offsets[index + 1]]
+
+    def update_row(self, index: int, row: Mapping[str, str]) -> None:
+        """
+        Parameters:
+          index (int): the index of the row that changed
+          row (Mapping[str, str]): the raw parameters of the row now
+        """
+        self._splice(index, 1, row)
+        self._time_from(index)
+
+    def insert_row(self, index: int, row: Mapping[str, str]) -> None:
+        """
+        Parameters:
+          index (int): the index to insert the row at
+          row (Mapping[str, str]): the raw parameters of the row
+        """
+        self._splice(index, 0, row)
+        self._time_from(index)
+
+    def remove_row(self, index: int) -> None:
+        """
+        Parameters:
+          index (int): the index of the row to remove
+        """
+        self._splice(index, 1)
+        self._time_from(index)
+
+    def _splice(self, index: int, removed: int, row: Optional[Mapping[str, str]] = None) -> None:
+        """
+        Replace removed rows at index with row (if not None), leaving the steps from index on to
+        be timed.
+        """
+        added = [] if row is None else [row]
+        row_plans: List[Optional[RowPlan]] = []
+        errors: List[Optional[str]] = []
+        steps = [np.zeros(0, dtype=step_dtype)]
+        for raw_row in added:
+            row_plan = plan_row(self.script_definition, raw_row)
+            if isinstance(row_plan, str):
+                row_plans.append(None)
+                errors.append(row_plan)
+            else:
+                row_plans.append(row_plan)
+                errors.append(None)
+                steps.append(row_steps(row_plan, index))
+        first, last = self._offsets[index], self._offsets[index + removed]
+        new_steps = np.concatenate(steps)
+        self._relative = np.concatenate((self._relative[:first], new_steps, self._relative[last:]))
+        self._steps = np.concatenate((self._steps[:first], new_steps, self._steps[last:]))
+        # The steps of the rows after the splice move by the rows added less those removed
+        self._relative["row"][first + len(new_steps) :] += len(added) - removed
+        self._steps["row"][first + len(new_steps) :] += len(added) - removed
+        self._offsets = np.concatenate(
+            (
+                self._offsets[: index + 1],
+                [first + len(new_steps)] if added else [],
+                self._offsets[index + removed + 1 :] + len(new_steps) - (last - first),
+            )
+        ).astype(np.int64)
+        self._row_starts = np.concatenate(
+            (self._row_starts[:index], np.zeros(len(added)), self._row_starts[index + removed :])
+        )
+        self.rows[index : index + removed] = added
+        self._row_plans[index : index + removed] = row_plans
+        self.errors[index : index + removed] = errors
+
+    def _time_from(self, index: int) -> None:
+        """
+        Time the steps of the rows from index on, the rows before it have not changed.
+        """
+        self._row_starts[index] = self._row_end(index - 1) if index else self.start
+        first = self._offsets[index]
+        relative, steps = self._relative[first:], self._steps[first:]
+        schedule = get_beam_schedule()
+        if schedule is None or all(
+            row_plan is None or row_plan.count_seconds is not None
+            for row_plan in self._row_plans[index:]
+        ):
+            # Each row takes as long wherever it starts, so moves with the end of the row before
+            has_steps = self._offsets[index + 1 :] > self._offsets[index:-1]
+            durations = np.zeros(len(has_steps))
+            durations[has_steps] = self._relative["end"][self._offsets[index + 1 :][has_steps] - 1]
+            self._row_starts[index + 1 :] = self._row_starts[index] + np.cumsum(durations)
+            row_starts = self._row_starts[relative["row"]]
+            steps["start"] = relative["start"] + row_starts
+            steps["end"] = relative["end"] + row_starts
+            return
+        now = self._row_starts[index]
+        for row in range(index, len(self.rows)):
+            self._row_starts[row] = now
+            row_plan = self._row_plans[row]
+            for step in range(self._offsets[row], self._offsets[row + 1]):
+                self._steps["start"][step] = now
+                if self._steps["kind"][step] == StepKind.COUNT and row_plan.count_seconds is None:
+                    cost_model = row_plan.cost_model
+                    now = float(
+                        schedule.count_end(
+                            now + cost_model.run_overhead,
+                            self._steps["mevents"][step],
+                            cost_model.event_rate,
+                        )
+                    )
+                else:
+                    now += self._relative["end"][step] - self._relative["start"][step]
+                self._steps["end"][step] = now
+        self._row_starts[-1] = now
+
+    def _row_end(self, index: int) -> float:
+        """
+        The time a row ends at, which its steps have been timed to.
+        """
+        if self._offsets[index + 1] > self._offsets[index]:
+            return float(self._steps["end"][self._offsets[index + 1] - 1])
+        return float(self._row_starts[index])
+
+    def records(self) -> List[Dict[str, Union[int, float, str, None]]]:
+        """
+        Returns:
+          List[Dict[str, Union[int, float, str, None]]]: Each step with its times as ISO 8601 local
+            times, its action named and None where it has no temperature, field or mevents.
+        """
+
+        def value(number: float) -> Optional[float]:
+            return None if np.isnan(number) else float(number)
+
+        return [
+            {
+                "row": int(step["row"]),
+                "action": StepKind(step["kind"]).name.lower(),
+                "start": datetime.fromtimestamp(step["start"]).isoformat(timespec="seconds"),
+                "end": datetime.fromtimestamp(step["end"]).isoformat(timespec="seconds"),
+                "seconds": round(float(step["end"] - step["start"]), 3),
+                "temperature": value(step["temperature"]),
+                "field": value(step["field"]),
+                "mevents": value(step["mevents"]),
+            }
+            for step in self._steps
+        ]
+
+    def write_csv(self, output: TextIO) -> None:
+        """
+        Parameters:
+          output (TextIO): the file to write the records of the steps to as CSV
+        """
+        writer = csv.DictWriter(output, fieldnames=list(_record_fields), lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(self.records())
+
+    def write_json(self, output: TextIO) -> None:
+        """
+        Parameters:
+          output (TextIO): the file to write the records of the steps to as a JSON list
+        """
+        json.dump(self.records(), output, indent=2)
+        output.write("\n")
+
+
+_record_fields = ("row", "action", "start", "end", "seconds", "temperature", "field", "mevents")
+
+
+def load_script(path: str) -> Dict[str, Any]:
+    """
+    Load the rows of a script from a CSV file with a header of parameter names, or a JSON file of
+    either a list of rows or an object with the rows as "values" and optionally "global_params".
+
+    Parameters:
+      path (str): the path of the file
+
+    Returns:
+      Dict[str, Any]: The "values" (rows) and "global_params" (None if there are none).
+    """
+    with open(path, newline="") as script_file:
+        if path.lower().endswith(".csv"):
+            return {"values": list(csv.DictReader(script_file)), "global_params": None}
+        script = json.load(script_file)
+    if isinstance(script, list):
+        return {"values": script, "global_params": None}
+    return {"values": script["values"], "global_params": script.get("global_params")}
+
+
+def main(argv: Optional[Sequence[str]] = None, output: TextIO = sys.stdout) -> int:
+    """
+    Print the projected timeline of a script, e.g.
+    python timeline.py emuloop script.json --start 2026-10-18T09:00 --format json
+    """
+    parser = argparse.ArgumentParser(description="Project the timeline of an EMU script.")
+    parser.add_argument("definition", help="the module of the script definition, e.g. emuloop")
+    parser.add_argument("script", help="a CSV or JSON file of the rows of the script")
+    parser.add_argument("--start", help="when the script starts (ISO 8601), now if not given")
+    parser.add_argument("--format", choices=("csv", "json"), default="csv")
+    arguments = parser.parse_args(argv)
+    script = load_script(arguments.script)
+    script_definition = importlib.import_module(arguments.definition).DoRun()
+    script_definition.global_params = script["global_params"]
+    start = datetime.fromisoformat(arguments.start).timestamp() if arguments.start else None
+    timeline = Timeline(script_definition, script["values"], start)
+    for index, error in enumerate(timeline.errors):
+        if error is not None:
+            print(f"Row {index}: {error}", file=sys.stderr)
+    if arguments.format == "csv":
+        timeline.write_csv(output)
+    else:
+        timeline.write_json(output)
+    return 1 if any(error is not None for error in timeline.errors) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,596 @@
+import math
+from typing import (
+    Any,
+    Callable,
+    Container,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+
+
+class ValidationError(NamedTuple):
+    """
+    A reason why the parameters of a row are not valid.
+    """
+
+    code: str  # what kind of error it is, e.g. "step_zero"
+    fields: Tuple[str, ...]  # the names of the parameters at fault
+    message: str  # the reason as shown to the user
+
+    def __str__(self) -> str:
+        return self.message
+
+
+class Axis(NamedTuple):
+    """
+    The parameters a temperature or field is set or scanned with.
+    """
+
+    name: str  # e.g. "temperature", as it appears in messages
+    start: str
+    stop: str
+    step: str
+
+
+class AxisFacts:
+    """
+    What the validation rules need to know about how a row sets an axis, found once for all of
+    them.
+    """
+
+    __slots__ = ("start", "stop", "step", "set", "scan", "keep_mismatch", "start_zero", "stop_zero")
+
+    def __init__(self, start: Optional[float], stop: Optional[float], step: float) -> None:
+        self.start, self.stop, self.step = start, stop, step
+        # Either end may be None for keep
+        self.set = start is not None and stop is not None
+        self.scan = self.set and start != stop
+        self.keep_mismatch = (start is None) != (stop is None)
+        # As np.isclose(value, 0.0), without the cost of numpy on scalars
+        self.start_zero = start is not None and abs(start) <= 1e-8
+        self.stop_zero = stop is not None and abs(stop) <= 1e-8
+
+
+class AxisColumns:
+    """
+    The facts of AxisFacts for many rows at once, as arrays with an element for each row.
+    """
+
+    __slots__ = AxisFacts.__slots__
+
+    def __init__(
+        self,
+        start: Sequence[Optional[float]],
+        stop: Sequence[Optional[float]],
+        step: Sequence[float],
+    ) -> None:
+        # Keep is masked rather than made NaN, as a row may give NaN itself
+        start_kept = np.fromiter((value is None for value in start), bool, len(start))
+        stop_kept = np.fromiter((value is None for value in stop), bool, len(stop))
+        self.start = _floats(start)
+        self.stop = _floats(stop)
+        self.step = _floats(step)
+        self.set = ~start_kept & ~stop_kept
+        self.scan = self.set & (self.start != self.stop)
+        self.keep_mismatch = start_kept != stop_kept
+        self.start_zero = ~start_kept & (np.abs(self.start) <= 1e-8)
+        self.stop_zero = ~stop_kept & (np.abs(self.stop) <= 1e-8)
+
+
+def _floats(values: Sequence[Optional[float]]) -> np.ndarray:
+    return np.array([np.nan if value is None else value for value in values], dtype=float)
+
+
+class Rule(NamedTuple):
+    """
+    A declared check of how a row sets one of its axes. It only needs checking again when one of
+    the parameters it reads changes.
+    """
+
+    code: str
+    fields: Tuple[str, ...]
+    axis: str  # the name of the axis checked
+    # Whether the row breaks the rule, given the facts of the axis and the parameters of the row
+    broken: Callable[[AxisFacts, Mapping[str, Any]], bool]
+    message: str  # the message if it does, formatted with the parameters of the row
+    # The parameters the rule reads, if not all those of its axis along with its fields
+    reads: Optional[Tuple[str, ...]] = None
+    # Which of many rows break the rule, given the facts of the axis and the parameters of the
+    # rows as arrays. If None, broken is checked for each row.
+    mask: Optional[Callable[[AxisColumns, Mapping[str, np.ndarray]], np.ndarray]] = None
+
+
+class Validation(NamedTuple):
+    """
+    The result of checking a row against each rule of a rule set.
+    """
+
+    results: Tuple[Optional[ValidationError], ...]  # for each rule, None if the row keeps it
+
+    @property
+    def errors(self) -> List[ValidationError]:
+        """
+        Returns:
+          List[ValidationError]: The rules the row breaks, in order.
+        """
+        return [error for error in self.results if error is not None]
+
+
+class RuleSet:
+    """
+    The rules a script definition validates its rows with, in the order their messages are shown.
+
+    The rules are compiled once when the set is declared, looking up the axis each checks and
+    which rules read each parameter. Validating a row then works out the facts about its axes
+    (whether each is kept, set once or scanned and whether it is zero) once, and checks every rule
+    against them in a single pass. When some parameters of a row change, only the rules reading
+    them are checked again (see revalidate). Many rows can be checked at once with the masks of
+    the rules (see check_columns).
+    """
+
+    def __init__(self, axes: Sequence[Axis], rules: Sequence[Union[Rule, Sequence[Rule]]]) -> None:
+        """
+        Parameters:
+          axes (Sequence[Axis]): the axes of the rows
+          rules (Sequence[Union[Rule, Sequence[Rule]]]): the rules, or groups of rules as made by
+            the functions of this module
+
+        Raises:
+          KeyError: If a rule checks an axis that is not one of axes.
+        """
+        self.axes = tuple(axes)
+        self.rules: Tuple[Rule, ...] = tuple(
+            rule for group in rules for rule in ((group,) if isinstance(group, Rule) else group)
+        )
+        indices = {axis.name: index for index, axis in enumerate(self.axes)}
+        self._compiled = tuple(
+            (rule.broken, indices[rule.axis], rule.code, rule.fields, rule.message)
+            for rule in self.rules
+        )
+        self._masks = tuple((rule.mask, indices[rule.axis]) for rule in self.rules)
+        # The indices of the rules reading each parameter
+        dependants: Dict[str, List[int]] = {}
+        for index, rule in enumerate(self.rules):
+            axis = self.axes[indices[rule.axis]]
+            reads = rule.reads
+            if reads is None:
+                reads = (axis.start, axis.stop, axis.step) + rule.fields
+            for name in dict.fromkeys(reads):
+                dependants.setdefault(name, []).append(index)
+        self.dependants: Dict[str, Tuple[int, ...]] = {
+            name: tuple(rules) for name, rules in dependants.items()
+        }
+
+    def _axis_facts(self, index: int, parameters: Mapping[str, Any]) -> AxisFacts:
+        axis = self.axes[index]
+        return AxisFacts(parameters[axis.start], parameters[axis.stop], parameters[axis.step])
+
+    def check(self, **parameters: Any) -> Validation:
+        """
+        Parameters:
+          parameters: the cast parameters of a row
+
+        Returns:
+          Validation: Whether the row keeps each rule.
+        """
+        facts = [self._axis_facts(index, parameters) for index in range(len(self.axes))]
+        return Validation(
+            tuple(
+                ValidationError(code, fields, message.format(**parameters))
+                if broken(facts[index], parameters)
+                else None
+                for broken, index, code, fields, message in self._compiled
+            )
+        )
+
+    def revalidate(
+        self, previous: Validation, changed: Iterable[str], **parameters: Any
+    ) -> Validation:
+        """
+        Check a row again after some of its parameters have changed, checking only the rules that
+        read them.
+
+        Parameters:
+          previous (Validation): the result of checking the row before the change
+          changed (Iterable[str]): the names of the parameters that changed
+          parameters: the cast parameters of the row now
+
+        Returns:
+          Validation: Whether the row keeps each rule.
+        """
+        affected = sorted({index for name in changed for index in self.dependants.get(name, ())})
+        if not affected:
+            return previous
+        results = list(previous.results)
+        facts: Dict[int, AxisFacts] = {}
+        for index in affected:
+            broken, axis, code, fields, message = self._compiled[index]
+            if axis not in facts:
+                facts[axis] = self._axis_facts(axis, parameters)
+            results[index] = (
+                ValidationError(code, fields, message.format(**parameters))
+                if broken(facts[axis], parameters)
+                else None
+            )
+        return Validation(tuple(results))
+
+    def validate(self, **parameters: Any) -> List[ValidationError]:
+        """
+        Parameters:
+          parameters: the cast parameters of a row
+
+        Returns:
+          List[ValidationError]: The rules the row breaks, in order.
+        """
+        facts = [self._axis_facts(index, parameters) for index in range(len(self.axes))]
+        return [
+            ValidationError(code, fields, message.format(**parameters))
+            for broken, index, code, fields, message in self._compiled
+            if broken(facts[index], parameters)
+        ]
+
+    def reason(self, **parameters: Any) -> str:
+        """
+        Parameters:
+          parameters: the cast parameters of a row
+
+        Returns:
+          str: An empty string if the row is valid, or the messages of the rules it breaks.
+        """
+        return render(self.validate(**parameters))
+
+    def axis_reason(
+        self,
+        codes: Container[str],
+        axis: str,
+        start: Optional[float],
+        stop: Optional[float],
+        step: float = 0.0,
+        **parameters: Any,
+    ) -> str:
+        """
+        Check some of the rules of one axis, given only the values of that axis (and any other
+        parameters those rules read).
+
+        Parameters:
+          codes (Container[str]): the codes of the rules to check
+          axis (str): the name of the axis, e.g. "temperature"
+          start (float): the value to start the scan with or set once, None if kept
+          stop (float): the value to end the scan with, None if kept
+          step (float): the size of the steps of the scan
+          parameters: the other parameters the rules read, e.g. the magnet device
+
+        Returns:
+          str: An empty string if the axis keeps the rules, or the messages of the rules it breaks.
+
+        Raises:
+          KeyError: If axis is not one of the axes of the rule set.
+        """
+        index = next((index for index, each in enumerate(self.axes) if each.name == axis), None)
+        if index is None:
+            raise KeyError(axis)
+        names = self.axes[index]
+        parameters = dict(parameters, **{names.start: start, names.stop: stop, names.step: step})
+        facts = AxisFacts(start, stop, step)
+        return "".join(
+            message.format(**parameters)
+            for broken, rule_axis, code, _, message in self._compiled
+            if rule_axis == index and code in codes and broken(facts, parameters)
+        )
+
+    def check_columns(self, **columns: Sequence[Any]) -> np.ndarray:
+        """
+        Check many rows at once, working out the facts of each axis for all the rows together and
+        checking each rule against all of them with its mask.
+
+        Parameters:
+          columns: the cast parameters of the rows, each with an element for each row
+
+        Returns:
+          np.ndarray: Whether each row breaks each rule, with a row for each rule in order and a
+            column for each row.
+        """
+        count = len(next(iter(columns.values()), ()))
+        axes = [
+            AxisColumns(columns[axis.start], columns[axis.stop], columns[axis.step])
+            for axis in self.axes
+        ]
+        arrays = {name: np.asarray(values, dtype=object) for name, values in columns.items()}
+        broken = np.zeros((len(self.rules), count), dtype=bool)
+        rows: Optional[List[Dict[str, Any]]] = None
+        for index, (mask, axis) in enumerate(self._masks):
+            if mask is not None:
+                broken[index] = mask(axes[axis], arrays)
+                continue
+            # A rule without a mask is checked a row at a time
+            if rows is None:
+                rows = [
+                    {name: values[row] for name, values in columns.items()} for row in range(count)
+                ]
+            rule = self._compiled[index][0]
+            broken[index] = [rule(self._axis_facts(axis, row), row) for row in rows]
+        return broken
+
+    def reasons(self, **columns: Sequence[Any]) -> List[str]:
+        """
+        Parameters:
+          columns: the cast parameters of the rows, each with an element for each row
+
+        Returns:
+          List[str]: For each row, an empty string if it is valid, or the messages of the rules it
+            breaks as reason gives them.
+        """
+        broken = self.check_columns(**columns)
+        reasons = [""] * broken.shape[1]
+        for row in np.flatnonzero(broken.any(axis=0)):
+            parameters = {name: values[row] for name, values in columns.items()}
+            reasons[row] = "".join(
+                self._compiled[index][4].format(**parameters)
+                for index in np.flatnonzero(broken[:, row])
+            )
+        return reasons
+
+
+def render(errors: Sequence[ValidationError]) -> str:
+    """
+    Parameters:
+      errors (Sequence[ValidationError]): the errors of a row
+
+    Returns:
+      str: The messages of the errors as a single reason, or an empty string if there are none.
+    """
+    return "".join(error.message for error in errors)
+
+
+def _python_max(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    # As max(first, second) for each element, which unlike np.maximum keeps first when either is NaN
+    # unless second is greater
+    return np.where(second > first, second, first)
+
+
+def _escape(text: Any) -> str:
+    # Messages are formatted with the parameters of the row, so any braces of their own are doubled
+    return str(text).replace("{", "{{").replace("}", "}}")
+
+
+def keep_together(axis: Axis) -> Rule:
+    """
+    Start and stop must either both be keep or both be values.
+    """
+    return Rule(
+        "keep_together",
+        (axis.start, axis.stop),
+        axis.name,
+        lambda facts, _: facts.keep_mismatch,
+        _escape(f"If start {axis.name} or stop {axis.name} is keep, the other must also be keep\n"),
+        reads=(axis.start, axis.stop),
+        mask=lambda columns, _: columns.keep_mismatch,
+    )
+
+
+def finite(axis: Axis) -> Rule:
+    """
+    The values set, and the step when scanning, must be finite numbers (not NaN or infinite).
+    """
+    return Rule(
+        "not_finite",
+        (axis.start, axis.stop, axis.step),
+        axis.name,
+        lambda facts, _: (
+            (facts.set and not (math.isfinite(facts.start) and math.isfinite(facts.stop)))
+            or (facts.scan and not math.isfinite(facts.step))
+        ),
+        _escape(f"The {axis.name}s and their step must be finite numbers\n"),
+        mask=lambda columns, _: (
+            (columns.set & ~(np.isfinite(columns.start) & np.isfinite(columns.stop)))
+            | (columns.scan & ~np.isfinite(columns.step))
+        ),
+    )
+
+
+def step_positive(axis: Axis) -> Tuple[Rule, Rule]:
+    """
+    When scanning, the step must be positive and not zero.
+    """
+    return (
+        Rule(
+            "step_zero",
+            (axis.step,),
+            axis.name,
+            lambda facts, _: facts.scan and facts.step == 0.0,
+            _escape(f"Cannot step through {axis.name}s when step is zero\n"),
+            mask=lambda columns, _: columns.scan & (columns.step == 0.0),
+        ),
+        Rule(
+            "step_negative",
+            (axis.step,),
+            axis.name,
+            lambda facts, _: facts.scan and facts.step < 0.0,
+            _escape(f"Step {axis.name} must be positive\n"),
+            mask=lambda columns, _: columns.scan & (columns.step < 0.0),
+        ),
+    )
+
+
+def log_range(axis: Axis, lowest: float) -> Tuple[Rule, Rule]:
+    """
+    When scanning logarithmically, the ends must have the same sign, and a scan from zero must go
+    beyond the lowest value scanned to.
+    """
+    return (
+        Rule(
+            "log_opposite_signs",
+            (axis.start, axis.stop),
+            axis.name,
+            lambda facts, _: facts.scan and facts.start * facts.stop < 0,
+            _escape(f"Cannot logarithmically scan between {axis.name}s of opposite sign\n"),
+            reads=(axis.start, axis.stop),
+            # The signs rather than the product, which is NaN with a warning for infinity and zero
+            mask=lambda columns, _: (
+                columns.scan & (np.sign(columns.start) * np.sign(columns.stop) < 0)
+            ),
+        ),
+        Rule(
+            "log_from_zero",
+            (axis.start, axis.stop),
+            axis.name,
+            lambda facts, _: (
+                facts.scan
+                and (facts.start == 0 or facts.stop == 0)
+                and max(abs(facts.start), abs(facts.stop)) <= lowest
+            ),
+            _escape(f"A logarithmic {axis.name} scan from zero must go beyond {lowest} G\n"),
+            reads=(axis.start, axis.stop),
+            mask=lambda columns, _: (
+                columns.scan
+                & ((columns.start == 0) | (columns.stop == 0))
+                & (_python_max(np.abs(columns.start), np.abs(columns.stop)) <= lowest)
+            ),
+        ),
+    )
+
+
+def magnet_known(axis: Axis, magnet: str, devices: Mapping[str, str]) -> Rule:
+    """
+    When setting the field, the magnet device must be one of devices.
+    """
+    names = frozenset(devices.values())
+    return Rule(
+        "magnet_unknown",
+        (magnet,),
+        axis.name,
+        lambda facts, parameters: facts.set and parameters[magnet] not in names,
+        f"Field set but magnet devices {{{magnet}}} not in possible devices "
+        f"{_escape(list(devices.keys()))}\n",
+        reads=(axis.start, axis.stop, magnet),
+        mask=lambda columns, parameters: (
+            columns.set
+            & np.fromiter(
+                (device not in names for device in parameters[magnet]), bool, columns.set.size
+            )
+        ),
+    )
+
+
+def zero_field_magnet(axis: Axis, magnet: str, active_zf: str) -> Rule:
+    """
+    Only the active zero field can set a field of zero.
+    """
+    return Rule(
+        "zero_field_without_active_zf",
+        (axis.start, axis.stop, magnet),
+        axis.name,
+        lambda facts, parameters: (
+            facts.set and (facts.start_zero or facts.stop_zero) and parameters[magnet] != active_zf
+        ),
+        f"Trying to set a zero field without using the active zero field "
+        f"({{{magnet}}}, {_escape(active_zf)})\n",
+        reads=(axis.start, axis.stop, magnet),
+        mask=lambda columns, parameters: (
+            columns.set
+            & (columns.start_zero | columns.stop_zero)
+            & (parameters[magnet] != active_zf)
+        ),
+    )
+
+
+def non_zero_field_magnet(axis: Axis, magnet: str, active_zf: str) -> Rule:
+    """
+    The active zero field cannot set a field that is not zero.
+    """
+    return Rule(
+        "non_zero_field_with_active_zf",
+        (axis.start, axis.stop, magnet),
+        axis.name,
+        lambda facts, parameters: (
+            facts.set
+            and not (facts.start_zero and facts.stop_zero)
+            and parameters[magnet] == active_zf
+        ),
+        "Cannot set a non-zero field with the active zero field\n",
+        reads=(axis.start, axis.stop, magnet),
+        mask=lambda columns, parameters: (
+            columns.set
+            & ~(columns.start_zero & columns.stop_zero)
+            & (parameters[magnet] == active_zf)
+        ),
+    )
+
+
+def kept_field_magnet(axis: Axis, magnet: str, not_applicable: str) -> Rule:
+    """
+    When the field is kept, the magnet device must be not_applicable.
+    """
+    return Rule(
+        "kept_field_with_magnet",
+        (axis.start, axis.stop, magnet),
+        axis.name,
+        lambda facts, parameters: not facts.set and parameters[magnet] != not_applicable,
+        _escape(
+            f"If {axis.start} or {axis.stop} is keep, then the selected magnet must be "
+            f"{not_applicable}"
+        ),
+        reads=(axis.start, axis.stop, magnet),
+        mask=lambda columns, parameters: ~columns.set & (parameters[magnet] != not_applicable),
+    )
+
+
+# The codes of the rules checking the magnet device selected to set the field
+magnet_selection_codes = (
+    "magnet_unknown",
+    "zero_field_without_active_zf",
+    "non_zero_field_with_active_zf",
+)
+
+
+def emu_rules(
+    magnet_devices: Mapping[str, str],
+    active_zf: str,
+    not_applicable: str,
+    field_step: str = "step_field",
+    zero_field: bool = True,
+    log_fields: Optional[float] = None,
+) -> RuleSet:
+    """
+    The rules of the EMU script definitions, which set or scan a temperature and a field with one
+    of the magnet devices.
+
+    Parameters:
+      magnet_devices (Mapping[str, str]): the magnet devices by their short names
+      active_zf (str): the magnet device that sets zero fields
+      not_applicable (str): the magnet device selected when the field is kept
+      field_step (str): the parameter the field is stepped by
+      zero_field (bool): whether a zero field must be set with the active zero field
+      log_fields (float): if the field is scanned logarithmically, the lowest field scanned to
+
+    Returns:
+      RuleSet: The rules, with the messages parameters_valid has always given.
+    """
+    temperature = Axis("temperature", "start_temperature", "stop_temperature", "step_temperature")
+    field = Axis("field", "start_field", "stop_field", field_step)
+    magnet = "magnet_device"
+    rules: List[Union[Rule, Sequence[Rule]]] = [
+        keep_together(temperature),
+        keep_together(field),
+        finite(temperature),
+        finite(field),
+        step_positive(temperature),
+        step_positive(field),
+    ]
+    if log_fields is not None:
+        rules.append(log_range(field, log_fields))
+    rules.append(magnet_known(field, magnet, magnet_devices))
+    if zero_field:
+        rules.append(zero_field_magnet(field, magnet, active_zf))
+    rules.append(non_zero_field_magnet(field, magnet, active_zf))
+    rules.append(kept_field_magnet(field, magnet, not_applicable))
+    return RuleSet((temperature, field), rules)